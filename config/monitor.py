@@ -14,16 +14,32 @@ from config.response_cache import get_all_cache_stats
 # Blueprint
 monitor_bp = Blueprint('monitor', __name__)
 
+# Stats bổ sung do service đăng ký (vd: message queue của chatbot)
+_stats_providers = {}
+
+
+def register_stats_provider(name, provider):
+    """
+    Đăng ký hàm trả về dict stats, hiển thị trong /api/stats dưới key `name`
+    """
+    _stats_providers[name] = provider
+
 
 @monitor_bp.route('/api/stats')
 def get_stats():
     """
     API endpoint để lấy stats
     """
-    return jsonify({
+    stats = {
         'rate_limits': get_rate_limit_stats(),
         'cache': get_all_cache_stats()
-    })
+    }
+    for name, provider in _stats_providers.items():
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {'error': str(e)}
+    return jsonify(stats)
 
 
 @monitor_bp.route('/monitor')
@@ -1,21 +1,54 @@
 """
 Rate Limiter for Gemini API - Giải quyết quota exceeded
 Tự động throttle requests để không vượt rate limits
+
+Token bucket: mỗi key có 1 bucket (capacity = max_requests, refill
+max_requests / time_window tokens/s). Lock chỉ giữ trong lúc tính toán,
+việc chờ (time.sleep / asyncio.sleep) luôn nằm ngoài lock nên không có
+head-of-line blocking giữa các thread và giữa các key.
+Tự điều chỉnh theo 429 / Retry-After từ upstream.
 """
 import time
+import heapq
+import asyncio
 import threading
-from collections import deque
-from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def parse_retry_after(value):
+    """
+    Parse header Retry-After (số giây hoặc HTTP-date)
+
+    Returns:
+        float | None: Số giây cần chờ
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
 class RateLimiter:
     """
-    Rate limiter với sliding window algorithm
-    Giới hạn số requests trong 1 khoảng thời gian
+    Rate limiter với token bucket algorithm
+    Giới hạn số requests trong 1 khoảng thời gian, cho phép burst tới max_requests
     """
+    # Mỗi lần bị 429, rate giảm còn 1/2 (tối thiểu MIN_RATE_FACTOR rate gốc)
+    BACKOFF_FACTOR = 0.5
+    MIN_RATE_FACTOR = 0.1
+    # Retry-After mặc định khi upstream không gửi header
+    DEFAULT_RETRY_AFTER = 1.0
+
     def __init__(self, max_requests=15, time_window=60):
         """
         Args:
@@ -24,57 +57,187 @@ class RateLimiter:
         """
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests = deque()
+        self.nominal_rate = max_requests / time_window
+        self.rate_factor = 1.0
+        self.tokens = float(max_requests)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._recover_at = 0.0
         self.lock = threading.Lock()
-        
-    def wait_if_needed(self):
+
+        self.acquired = 0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+
+    @property
+    def rate(self):
+        """Tokens/giây hiện tại (sau khi điều chỉnh theo 429)"""
+        return self.nominal_rate * self.rate_factor
+
+    def _refill(self, now):
+        """Cộng token theo thời gian (gọi khi đang giữ lock)"""
+        if self.rate_factor < 1.0 and now >= self._recover_at:
+            # Hồi phục dần: nhân đôi rate sau mỗi time_window không bị 429
+            self.rate_factor = min(1.0, self.rate_factor * 2)
+            self._recover_at = now + self.time_window
+
+        start = max(self.updated_at, self.blocked_until)
+        if now > start:
+            self.tokens = min(float(self.max_requests), self.tokens + (now - start) * self.rate)
+        self.updated_at = max(now, self.updated_at)
+
+    def _wait_time(self, now, tokens=1):
+        """Số giây cần chờ để có đủ tokens (gọi khi đang giữ lock, sau _refill)"""
+        wait = max(0.0, self.blocked_until - now)
+        missing = tokens - self.tokens
+        if missing > 0:
+            wait = max(wait, max(0.0, self.blocked_until - now) + missing / self.rate)
+        return wait
+
+    def ready_at(self):
         """
-        Chờ nếu cần để không vượt rate limit
+        Thời điểm (monotonic) bucket có/đã có đúng 1 token.
+        Giá trị càng nhỏ thì key càng rảnh - dùng làm priority trong heap.
         """
         with self.lock:
-            now = datetime.now()
-            
-            # Xóa các requests cũ ngoài time window
-            while self.requests and (now - self.requests[0]) > timedelta(seconds=self.time_window):
-                self.requests.popleft()
-            
-            # Nếu đã đạt max, chờ cho đến khi request đầu tiên hết hạn
-            if len(self.requests) >= self.max_requests:
-                oldest_request = self.requests[0]
-                wait_time = self.time_window - (now - oldest_request).total_seconds()
-                
-                if wait_time > 0:
-                    logger.warning(f"⏳ Rate limit reached ({len(self.requests)}/{self.max_requests}). Waiting {wait_time:.1f}s...")
-                    time.sleep(wait_time + 0.1)  # +0.1s safety margin
-                    
-                    # Xóa request cũ nhất
-                    self.requests.popleft()
-            
-            # Thêm request mới
-            self.requests.append(datetime.now())
-    
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until + max(0.0, 1 - self.tokens) / self.rate
+            return now + (1 - self.tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        """
+        Lấy token ngay nếu có, không chờ
+
+        Returns:
+            bool: True nếu được phép gửi request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.blocked_until and self.tokens >= tokens:
+                self.tokens -= tokens
+                self.acquired += 1
+                return True
+            return False
+
+    def _reserve_or_wait(self, tokens):
+        """Lấy token hoặc trả về thời gian cần chờ (0 = đã lấy được)"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_time(now, tokens)
+            if wait <= 0:
+                self.tokens -= tokens
+                self.acquired += 1
+            return wait
+
+    def wait_if_needed(self, tokens=1, timeout=None):
+        """
+        Chờ nếu cần để không vượt rate limit (sleep ngoài lock)
+
+        Returns:
+            float: Số giây đã chờ
+        """
+        waited = 0.0
+        while True:
+            wait = self._reserve_or_wait(tokens)
+            if wait <= 0:
+                break
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Rate limit wait {wait:.1f}s exceeds timeout {timeout}s")
+            if waited == 0.0:
+                self.throttled += 1
+                logger.warning(f"⏳ Rate limit reached ({self.max_requests}/{self.time_window}s). Waiting {wait:.1f}s...")
+            time.sleep(wait)
+            waited += wait
+        self.total_wait += waited
+        return waited
+
+    async def acquire(self, tokens=1, timeout=None):
+        """
+        Phiên bản asyncio của wait_if_needed - không block event loop
+
+        Returns:
+            float: Số giây đã chờ
+        """
+        waited = 0.0
+        while True:
+            wait = self._reserve_or_wait(tokens)
+            if wait <= 0:
+                break
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Rate limit wait {wait:.1f}s exceeds timeout {timeout}s")
+            if waited == 0.0:
+                self.throttled += 1
+            await asyncio.sleep(wait)
+            waited += wait
+        self.total_wait += waited
+        return waited
+
+    def on_rate_limited(self, retry_after=None):
+        """
+        Upstream trả về 429: chặn tới hết Retry-After và giảm rate
+        """
+        retry_after = self.DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.rate_factor = max(self.MIN_RATE_FACTOR, self.rate_factor * self.BACKOFF_FACTOR)
+            self._recover_at = self.blocked_until + self.time_window
+            self.rate_limited += 1
+        logger.warning(f"🚦 Upstream 429 - blocked {retry_after:.1f}s, rate now {self.rate * 60:.1f}/min")
+
+    def update_from_response(self, status_code, headers=None):
+        """
+        Điều chỉnh theo response upstream (429 + Retry-After)
+
+        Args:
+            status_code: HTTP status code
+            headers: Response headers (dict-like)
+        """
+        if status_code != 429:
+            return
+        headers = headers or {}
+        retry_after = parse_retry_after(headers.get('retry-after') or headers.get('Retry-After'))
+        self.on_rate_limited(retry_after)
+
     def get_stats(self):
         """Lấy thống kê hiện tại"""
         with self.lock:
-            now = datetime.now()
-            # Xóa requests cũ
-            while self.requests and (now - self.requests[0]) > timedelta(seconds=self.time_window):
-                self.requests.popleft()
-            
+            now = time.monotonic()
+            self._refill(now)
+            blocked_for = max(0.0, self.blocked_until - now)
+            available = 0 if blocked_for > 0 else int(self.tokens)
+            current = self.max_requests - available
+
             return {
-                'current_requests': len(self.requests),
+                'current_requests': current,
                 'max_requests': self.max_requests,
                 'time_window': self.time_window,
-                'available_requests': self.max_requests - len(self.requests),
-                'usage_percentage': (len(self.requests) / self.max_requests) * 100
+                'available_requests': available,
+                'usage_percentage': (current / self.max_requests) * 100,
+                'rate_per_minute': round(self.rate * 60, 2),
+                'blocked_for': round(blocked_for, 2),
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'rate_limited': self.rate_limited,
+                'total_wait_seconds': round(self.total_wait, 2)
             }
 
 
 class MultiKeyRateLimiter:
     """
     Rate limiter cho nhiều API keys
-    Tự động chọn key có available requests
+    Tự động chọn key rảnh nhất - các key nằm trong heap theo thời điểm có token
     """
+    # Sai lệch ready_at (giây) được bỏ qua khi kiểm tra entry trong heap
+    STALE_TOLERANCE = 0.001
+
     def __init__(self, num_keys=4, max_requests_per_key=15, time_window=60):
         """
         Args:
@@ -88,33 +251,104 @@ class MultiKeyRateLimiter:
         ]
         self.current_key_index = 0
         self.lock = threading.Lock()
-    
+        # Heap entries: (ready_at, seq, key_index, version). Entry cũ (version khác) bị bỏ qua
+        self._versions = [0] * num_keys
+        self._seq = 0
+        self._heap = []
+        for i in range(num_keys):
+            self._push(i)
+
+    def _push(self, key_index):
+        """Đưa key vào heap với ready_at hiện tại (gọi khi đang giữ lock)"""
+        self._versions[key_index] += 1
+        self._seq += 1
+        heapq.heappush(self._heap, (self.limiters[key_index].ready_at(), self._seq, key_index, self._versions[key_index]))
+
+    def _peek(self):
+        """Key có ready_at nhỏ nhất, đã kiểm tra lại giá trị thật (gọi khi đang giữ lock)"""
+        while True:
+            ready_at, _, key_index, version = self._heap[0]
+            if version != self._versions[key_index]:
+                heapq.heappop(self._heap)
+                continue
+            actual = self.limiters[key_index].ready_at()
+            # ready_at chỉ có thể tăng ngoài heap (bucket đầy / bị 429) -> push lại giá trị mới
+            if actual > ready_at + self.STALE_TOLERANCE:
+                heapq.heappop(self._heap)
+                self._push(key_index)
+                continue
+            return key_index, actual
+
     def get_best_key(self):
         """
-        Tìm key có ít requests nhất
+        Tìm key rảnh nhất - O(log n)
         Returns: (key_index, limiter)
         """
         with self.lock:
-            # Lấy stats của tất cả keys
-            stats = [(i, limiter.get_stats()) for i, limiter in enumerate(self.limiters)]
-            
-            # Sắp xếp theo available requests (nhiều nhất trước)
-            stats.sort(key=lambda x: x[1]['available_requests'], reverse=True)
-            
-            best_key_index = stats[0][0]
-            return best_key_index, self.limiters[best_key_index]
-    
+            key_index, _ = self._peek()
+            return key_index, self.limiters[key_index]
+
+    def try_acquire_key(self):
+        """
+        Lấy token từ key rảnh nhất, không chờ
+
+        Returns:
+            int | None: key_index, hoặc None nếu mọi key đều hết token
+        """
+        with self.lock:
+            key_index, _ = self._peek()
+            if self.limiters[key_index].try_acquire():
+                self._push(key_index)
+                return key_index
+            return None
+
+    def _acquire_or_wait(self):
+        """Returns: (key_index, 0) nếu lấy được, (None, wait) nếu cần chờ"""
+        with self.lock:
+            key_index, ready_at = self._peek()
+            if self.limiters[key_index].try_acquire():
+                self._push(key_index)
+                return key_index, 0.0
+            return None, max(0.001, ready_at - time.monotonic())
+
     def wait_and_get_key(self):
         """
-        Chờ nếu cần và trả về key index tốt nhất
+        Chờ nếu cần và trả về key index tốt nhất (sleep ngoài lock)
         Returns: key_index (0-3)
         """
-        key_index, limiter = self.get_best_key()
-        limiter.wait_if_needed()
-        
-        logger.debug(f"🔑 Using API Key #{key_index + 1}")
-        return key_index
-    
+        while True:
+            key_index, wait = self._acquire_or_wait()
+            if key_index is not None:
+                logger.debug(f"🔑 Using API Key #{key_index + 1}")
+                return key_index
+            time.sleep(wait)
+
+    async def acquire_key(self):
+        """
+        Phiên bản asyncio của wait_and_get_key
+        Returns: key_index
+        """
+        while True:
+            key_index, wait = self._acquire_or_wait()
+            if key_index is not None:
+                return key_index
+            await asyncio.sleep(wait)
+
+    def report_rate_limited(self, key_index, retry_after=None):
+        """Upstream trả về 429 cho key này"""
+        self.limiters[key_index].on_rate_limited(retry_after)
+        with self.lock:
+            self._push(key_index)
+
+    def update_from_response(self, key_index, status_code, headers=None):
+        """Điều chỉnh key theo response upstream (429 + Retry-After)"""
+        if status_code == 429:
+            headers = headers or {}
+            self.report_rate_limited(
+                key_index,
+                parse_retry_after(headers.get('retry-after') or headers.get('Retry-After'))
+            )
+
     def get_all_stats(self):
         """Lấy stats của tất cả keys"""
         return {
@@ -156,6 +390,16 @@ def wait_for_openai_rate_limit():
     openai_rate_limiter.wait_if_needed()
 
 
+def report_openai_rate_limited(retry_after=None):
+    """
+    Báo OpenAI trả về 429 để limiter tự giảm rate
+
+    Args:
+        retry_after: Giá trị header Retry-After (giây hoặc HTTP-date)
+    """
+    openai_rate_limiter.on_rate_limited(parse_retry_after(retry_after))
+
+
 def get_rate_limit_stats():
     """
     Lấy thống kê rate limit của tất cả services
@@ -2,35 +2,84 @@
 Response Cache cho LLM APIs - Giảm số lượng API calls
 Cache responses để tránh gọi API lặp lại cho cùng 1 prompt
 """
+import gc
 import hashlib
 import json
+import os
 import time
-from typing import Optional, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 import logging
 
+try:
+    from config.semantic_cache import get_semantic_cache_stats
+except ImportError:
+    get_semantic_cache_stats = None
+
+try:
+    from config.tracing import traced, current_span
+except ImportError:
+    def traced(name=None, **attributes):
+        return lambda func: func
+
+    def current_span():
+        return None
+
 logger = logging.getLogger(__name__)
 
 
+class _CacheShard:
+    """
+    Một stripe của ResponseCache: OrderedDict (LRU order) + lock riêng
+    """
+    __slots__ = ('lock', 'items', 'bytes', 'hits', 'misses', 'saves',
+                 'evictions', 'expirations', 'get_ns', 'set_ns')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.get_ns = 0
+        self.set_ns = 0
+
+
 class ResponseCache:
     """
-    In-memory cache với TTL (Time To Live)
+    In-memory LRU cache với TTL (Time To Live) và giới hạn bytes
+
+    - get/set/evict O(1): mỗi shard là một OrderedDict, item cũ nhất ở đầu
+    - Thread-safe với lock striping: key được hash vào 1 trong ``num_shards``
+      shard, mỗi shard có lock riêng nên các thread Flask không chặn nhau
+    - ``max_size`` và ``max_bytes`` được chia đều cho các shard, nên LRU là
+      xấp xỉ theo từng shard (không phải global)
     """
-    def __init__(self, max_size=1000, ttl_seconds=3600):
+    # Overhead ước lượng cho mỗi entry (dict, key, timestamp)
+    ENTRY_OVERHEAD_BYTES = 200
+
+    def __init__(self, max_size=1000, ttl_seconds=3600, max_bytes=None, num_shards=16):
         """
         Args:
             max_size: Số lượng items tối đa trong cache
             ttl_seconds: Thời gian cache hết hạn (default 1 hour)
+            max_bytes: Tổng dung lượng tối đa (bytes, None = không giới hạn)
+            num_shards: Số lock stripe
         """
-        self.cache: Dict[str, Dict[str, Any]] = {}
         self.max_size = max_size
         self.ttl_seconds = ttl_seconds
-        
-        # Statistics
-        self.hits = 0
-        self.misses = 0
-        self.saves = 0
-    
+        self.max_bytes = max_bytes
+
+        num_shards = max(1, min(num_shards, max_size))
+        self._shards = [_CacheShard() for _ in range(num_shards)]
+        self._shard_max_size = max(1, -(-max_size // num_shards))
+        self._shard_max_bytes = -(-max_bytes // num_shards) if max_bytes else None
+
     def _make_key(self, prompt: str, model: str, **kwargs) -> str:
         """
         Tạo cache key từ prompt và params
@@ -50,7 +99,31 @@ class ResponseCache:
         params_str = json.dumps(params, sort_keys=True)
         key = hashlib.sha256(params_str.encode()).hexdigest()[:16]
         return key
-    
+
+    def _shard(self, key: str) -> _CacheShard:
+        return self._shards[int(key[:8], 16) % len(self._shards)]
+
+    @classmethod
+    def _entry_size(cls, response: str) -> int:
+        return len(response.encode('utf-8')) + cls.ENTRY_OVERHEAD_BYTES
+
+    # Legacy stats attributes (tổng hợp từ các shard)
+    @property
+    def hits(self) -> int:
+        return sum(shard.hits for shard in self._shards)
+
+    @property
+    def misses(self) -> int:
+        return sum(shard.misses for shard in self._shards)
+
+    @property
+    def saves(self) -> int:
+        return sum(shard.saves for shard in self._shards)
+
+    def __len__(self) -> int:
+        return sum(len(shard.items) for shard in self._shards)
+
+    @traced('cache.response.get')
     def get(self, prompt: str, model: str, **kwargs) -> Optional[str]:
         """
         Lấy response từ cache
@@ -58,153 +131,400 @@ class ResponseCache:
         Returns:
             str hoặc None nếu không có trong cache hoặc đã hết hạn
         """
+        start = time.perf_counter_ns()
         key = self._make_key(prompt, model, **kwargs)
-        
-        if key in self.cache:
-            item = self.cache[key]
-            
-            # Check TTL
-            if time.time() - item['timestamp'] < self.ttl_seconds:
-                self.hits += 1
-                logger.debug(f"✅ Cache HIT for prompt: {prompt[:50]}...")
-                return item['response']
-            else:
-                # Expired
-                del self.cache[key]
-                logger.debug(f"⏰ Cache EXPIRED for prompt: {prompt[:50]}...")
-        
-        self.misses += 1
-        logger.debug(f"❌ Cache MISS for prompt: {prompt[:50]}...")
-        return None
-    
+        shard = self._shard(key)
+
+        with shard.lock:
+            item = shard.items.get(key)
+            response = None
+
+            if item is not None:
+                # Check TTL
+                if time.time() - item['timestamp'] < self.ttl_seconds:
+                    shard.items.move_to_end(key)
+                    shard.hits += 1
+                    response = item['response']
+                else:
+                    # Expired
+                    del shard.items[key]
+                    shard.bytes -= item['size']
+                    shard.expirations += 1
+
+            if response is None:
+                shard.misses += 1
+            shard.get_ns += time.perf_counter_ns() - start
+
+        active = current_span()
+        if active is not None:
+            active.set_attribute('model', model)
+            active.set_attribute('hit', response is not None)
+
+        if response is not None:
+            logger.debug(f"✅ Cache HIT for prompt: {prompt[:50]}...")
+        else:
+            logger.debug(f"❌ Cache MISS for prompt: {prompt[:50]}...")
+        return response
+
     def set(self, prompt: str, model: str, response: str, **kwargs):
         """
         Lưu response vào cache
         """
+        start = time.perf_counter_ns()
         key = self._make_key(prompt, model, **kwargs)
-        
-        # Check size limit
-        if len(self.cache) >= self.max_size:
-            # Remove oldest item
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k]['timestamp'])
-            del self.cache[oldest_key]
-            logger.debug(f"🗑️ Cache full, removed oldest item")
-        
-        self.cache[key] = {
+        item = {
             'response': response,
             'timestamp': time.time(),
             'prompt': prompt[:100],  # Store short version for debugging
-            'model': model
+            'model': model,
+            'size': self._entry_size(response)
         }
-        
-        self.saves += 1
+        shard = self._shard(key)
+        if not self._fits(item):
+            return
+
+        with shard.lock:
+            self._insert_locked(shard, key, item)
+            shard.saves += 1
+            shard.set_ns += time.perf_counter_ns() - start
+        self._on_set(key, item)
         logger.debug(f"💾 Cached response for prompt: {prompt[:50]}...")
-    
+
+    def _on_set(self, key: str, item: Dict[str, Any]):
+        """Hook sau mỗi set (subclass dùng để persist)"""
+        pass
+
+    def _fits(self, item: Dict[str, Any]) -> bool:
+        """Item có vừa giới hạn bytes của 1 shard không"""
+        if self._shard_max_bytes is not None and item['size'] > self._shard_max_bytes:
+            logger.debug(f"⚠️ Response too large to cache ({item['size']} bytes)")
+            return False
+        return True
+
+    def _insert_locked(self, shard: _CacheShard, key: str, item: Dict[str, Any]):
+        """Insert item và evict LRU items cho đến khi shard vừa giới hạn (giữ shard.lock)"""
+        old = shard.items.pop(key, None)
+        if old is not None:
+            shard.bytes -= old['size']
+
+        shard.items[key] = item
+        shard.bytes += item['size']
+
+        while len(shard.items) > self._shard_max_size or (
+            self._shard_max_bytes is not None and shard.bytes > self._shard_max_bytes
+        ):
+            _, evicted = shard.items.popitem(last=False)
+            shard.bytes -= evicted['size']
+            shard.evictions += 1
+
+    def _put(self, key: str, item: Dict[str, Any]) -> bool:
+        """Insert item đã có sẵn (dùng khi restore từ disk)"""
+        item.setdefault('size', self._entry_size(item['response']))
+        if not self._fits(item):
+            return False
+        shard = self._shard(key)
+        with shard.lock:
+            self._insert_locked(shard, key, item)
+        return True
+
+    def _remove(self, key: str) -> bool:
+        """Xóa 1 key"""
+        shard = self._shard(key)
+        with shard.lock:
+            item = shard.items.pop(key, None)
+            if item is None:
+                return False
+            shard.bytes -= item['size']
+            return True
+
+    def _entries(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Snapshot (key, item) theo thứ tự LRU của từng shard"""
+        entries = []
+        for shard in self._shards:
+            with shard.lock:
+                entries.extend(shard.items.items())
+        return entries
+
     def clear(self):
         """Xóa toàn bộ cache"""
-        self.cache.clear()
+        for shard in self._shards:
+            with shard.lock:
+                shard.items.clear()
+                shard.bytes = 0
         logger.info(f"🗑️ Cache cleared")
-    
+
     def get_stats(self) -> Dict[str, Any]:
         """Lấy thống kê cache"""
-        total_requests = self.hits + self.misses
-        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        totals = dict.fromkeys(
+            ('size', 'bytes', 'hits', 'misses', 'saves', 'evictions', 'expirations', 'get_ns', 'set_ns'), 0
+        )
+        for shard in self._shards:
+            with shard.lock:
+                totals['size'] += len(shard.items)
+                totals['bytes'] += shard.bytes
+                for name in ('hits', 'misses', 'saves', 'evictions', 'expirations', 'get_ns', 'set_ns'):
+                    totals[name] += getattr(shard, name)
+
+        total_requests = totals['hits'] + totals['misses']
+        hit_rate = (totals['hits'] / total_requests * 100) if total_requests > 0 else 0
         
         return {
-            'size': len(self.cache),
+            'size': totals['size'],
             'max_size': self.max_size,
-            'hits': self.hits,
-            'misses': self.misses,
-            'saves': self.saves,
+            'bytes': totals['bytes'],
+            'max_bytes': self.max_bytes,
+            'hits': totals['hits'],
+            'misses': totals['misses'],
+            'saves': totals['saves'],
+            'evictions': totals['evictions'],
+            'expirations': totals['expirations'],
             'hit_rate_percentage': round(hit_rate, 2),
+            'avg_get_latency_us': round(totals['get_ns'] / total_requests / 1000, 2) if total_requests else 0,
+            'avg_set_latency_us': round(totals['set_ns'] / totals['saves'] / 1000, 2) if totals['saves'] else 0,
             'ttl_seconds': self.ttl_seconds
         }
     
     def cleanup_expired(self):
         """Xóa các items đã hết hạn"""
         now = time.time()
-        expired_keys = [
-            key for key, item in self.cache.items()
-            if now - item['timestamp'] >= self.ttl_seconds
-        ]
-        
-        for key in expired_keys:
-            del self.cache[key]
+        removed = 0
+
+        for shard in self._shards:
+            with shard.lock:
+                expired_keys = [
+                    key for key, item in shard.items.items()
+                    if now - item['timestamp'] >= self.ttl_seconds
+                ]
+                for key in expired_keys:
+                    shard.bytes -= shard.items.pop(key)['size']
+                shard.expirations += len(expired_keys)
+                removed += len(expired_keys)
         
-        if expired_keys:
-            logger.info(f"🗑️ Cleaned up {len(expired_keys)} expired cache items")
+        if removed:
+            logger.info(f"🗑️ Cleaned up {removed} expired cache items")
 
 
 class FileBasedCache(ResponseCache):
     """
     Cache lưu vào file để persist qua sessions
+
+    Persist bằng write-ahead log append-only thay vì ghi lại toàn bộ file:
+    - ``llm_responses.wal``: mỗi dòng là 1 record ``{"op": "set"|"del", ...}``
+    - ``llm_responses.snapshot.jsonl``: snapshot sau compaction (dòng đầu là stats)
+
+    Khi khởi động: load snapshot rồi replay WAL. Dòng cuối bị cắt dở do crash
+    được bỏ qua. Compaction chạy khi số record trong WAL vượt quá số item
+    trong cache (tối thiểu ``compact_min_records``), nên chi phí ghi là O(1)
+    amortized cho mỗi set.
     """
-    def __init__(self, cache_dir='cache', **kwargs):
+    WAL_FILE = 'llm_responses.wal'
+    SNAPSHOT_FILE = 'llm_responses.snapshot.jsonl'
+    LEGACY_FILE = 'llm_responses.json'
+
+    def __init__(self, cache_dir='cache', compact_min_records=1000, fsync=False, **kwargs):
+        """
+        Args:
+            cache_dir: Thư mục chứa WAL và snapshot
+            compact_min_records: Số record WAL tối thiểu trước khi compaction
+            fsync: fsync sau mỗi record WAL (bền hơn, chậm hơn)
+        """
         super().__init__(**kwargs)
         self.cache_dir = Path(cache_dir)
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.cache_file = self.cache_dir / 'llm_responses.json'
+        self.wal_file = self.cache_dir / self.WAL_FILE
+        self.snapshot_file = self.cache_dir / self.SNAPSHOT_FILE
+        self.compact_min_records = compact_min_records
+        self.fsync = fsync
+
+        self._wal_lock = threading.Lock()
+        self._wal_records = 0
+        self._wal = None  # mở ở lần ghi đầu tiên: import module không tạo file nào
         
         # Load existing cache
         self._load_cache()
-    
+
+    def _open_wal_locked(self, mode: str = 'a'):
+        """Mở (hoặc truncate với mode='w') file WAL, tạo thư mục nếu cần (giữ _wal_lock)"""
+        if self._wal is not None:
+            self._wal.close()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._wal = open(self.wal_file, mode, encoding='utf-8')
+
     def _load_cache(self):
-        """Load cache từ file"""
-        if self.cache_file.exists():
+        """Load snapshot rồi replay WAL"""
+        legacy_file = self.cache_dir / self.LEGACY_FILE
+        # Tắt GC khi tạo hàng triệu dict, tránh các lượt GC vô ích
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if self.snapshot_file.exists():
+                self._load_snapshot()
+            elif legacy_file.exists():
+                self._load_legacy(legacy_file)
+
+            if self.wal_file.exists():
+                self._replay_wal()
+
+            self._drop_expired()
+            if len(self):
+                logger.info(f"📂 Loaded cache from {self.cache_dir} ({len(self)} items)")
+        except Exception as e:
+            logger.error(f"❌ Failed to load cache: {e}")
+            self.clear()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        if legacy_file.exists():
+            # Chuyển sang định dạng mới một lần
+            self._save_cache()
+            legacy_file.unlink()
+
+    @staticmethod
+    def _read_jsonl(path: Path) -> List[Any]:
+        """
+        Đọc file JSON lines; parse cả file trong 1 lần gọi json.loads
+        (nhanh hơn nhiều so với từng dòng), fallback từng dòng nếu có dòng hỏng
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line for line in f.read().split("\n") if line.strip()]
+        try:
+            return json.loads('[' + ','.join(lines) + ']')
+        except json.JSONDecodeError:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"⚠️ Skipping torn record in {path}")
+            return records
+
+    def _load_snapshot(self):
+        records = self._read_jsonl(self.snapshot_file)
+        if not records:
+            return
+        self._restore_stats(records[0].get('stats', {}))
+        for key, item in records[1:]:
+            self._put(key, item)
+
+    def _load_legacy(self, legacy_file: Path):
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Items lưu theo thứ tự LRU nên insert lại giữ nguyên thứ tự
+        for key, item in data.get('cache', {}).items():
+            self._put(key, item)
+        self._restore_stats(data)
+
+    def _restore_stats(self, stats: Dict[str, Any]):
+        self._shards[0].hits += stats.get('hits', 0)
+        self._shards[0].misses += stats.get('misses', 0)
+        self._shards[0].saves += stats.get('saves', 0)
+
+    def _replay_wal(self):
+        for record in self._read_jsonl(self.wal_file):
+            if record.get('op') == 'set':
+                self._put(record['k'], record['v'])
+            elif record.get('op') == 'del':
+                self._remove(record['k'])
+            self._wal_records += 1
+
+    def _drop_expired(self):
+        """Xóa items hết hạn sau khi load (không tính vào stats)"""
+        now = time.time()
+        for key, item in self._entries():
+            if now - item['timestamp'] >= self.ttl_seconds:
+                self._remove(key)
+
+    def _append(self, record: Dict[str, Any]):
+        """Ghi 1 record vào WAL, compaction nếu WAL đã dài"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._wal_lock:
             try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.cache = data.get('cache', {})
-                    self.hits = data.get('hits', 0)
-                    self.misses = data.get('misses', 0)
-                    self.saves = data.get('saves', 0)
-                    logger.info(f"📂 Loaded cache from {self.cache_file} ({len(self.cache)} items)")
+                if self._wal is None:
+                    self._open_wal_locked()
+                self._wal.write(line)
+                self._wal.flush()
+                if self.fsync:
+                    os.fsync(self._wal.fileno())
+                self._wal_records += 1
             except Exception as e:
-                logger.error(f"❌ Failed to load cache: {e}")
-                self.cache = {}
-    
+                logger.error(f"❌ Failed to append cache WAL: {e}")
+                return
+
+            if self._wal_records >= max(self.compact_min_records, len(self)):
+                self._compact_locked()
+
+    def _on_set(self, key: str, item: Dict[str, Any]):
+        self._append({'op': 'set', 'k': key, 'v': item})
+
+    def delete(self, prompt: str, model: str, **kwargs) -> bool:
+        """Xóa 1 response khỏi cache"""
+        key = self._make_key(prompt, model, **kwargs)
+        removed = self._remove(key)
+        if removed:
+            self._append({'op': 'del', 'k': key})
+        return removed
+
+    def _compact_locked(self):
+        """Ghi snapshot mới và truncate WAL (giữ _wal_lock)"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.snapshot_file.with_suffix('.jsonl.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            stats = {'hits': self.hits, 'misses': self.misses, 'saves': self.saves}
+            f.write(json.dumps({'stats': stats}) + "\n")
+            for key, item in self._entries():
+                f.write(json.dumps([key, item], ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        self._open_wal_locked('w')
+        self._wal_records = 0
+        logger.debug(f"💾 Compacted cache snapshot {self.snapshot_file} ({len(self)} items)")
+
     def _save_cache(self):
-        """Lưu cache vào file"""
+        """Compaction: lưu snapshot và làm rỗng WAL"""
         try:
-            data = {
-                'cache': self.cache,
-                'hits': self.hits,
-                'misses': self.misses,
-                'saves': self.saves
-            }
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.debug(f"💾 Saved cache to {self.cache_file}")
+            with self._wal_lock:
+                self._compact_locked()
         except Exception as e:
             logger.error(f"❌ Failed to save cache: {e}")
-    
-    def set(self, prompt: str, model: str, response: str, **kwargs):
-        """Override set để auto-save"""
-        super().set(prompt, model, response, **kwargs)
-        
-        # Auto-save mỗi 10 saves
-        if self.saves % 10 == 0:
+
+    def clear(self):
+        """Xóa toàn bộ cache (cả trên disk)"""
+        super().clear()
+        if getattr(self, '_wal', None) is not None or self.wal_file.exists() or self.snapshot_file.exists():
             self._save_cache()
 
+    def close(self):
+        """Compaction và đóng WAL"""
+        self._save_cache()
+        with self._wal_lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+
 
 # Global caches
 # Gemini cache - 1 hour TTL
 gemini_cache = ResponseCache(
     max_size=500,
-    ttl_seconds=3600  # 1 hour
+    ttl_seconds=3600,  # 1 hour
+    max_bytes=20 * 1024 * 1024  # 20 MB
 )
 
 # OpenAI cache - 30 minutes TTL
 openai_cache = ResponseCache(
     max_size=300,
-    ttl_seconds=1800  # 30 minutes
+    ttl_seconds=1800,  # 30 minutes
+    max_bytes=10 * 1024 * 1024  # 10 MB
 )
 
 # Chat history cache - longer TTL
 chat_cache = FileBasedCache(
     cache_dir='local_data/cache',
     max_size=1000,
-    ttl_seconds=7200  # 2 hours
+    ttl_seconds=7200,  # 2 hours
+    max_bytes=40 * 1024 * 1024  # 40 MB
 )
 
 
@@ -253,11 +573,14 @@ def get_all_cache_stats() -> Dict[str, Any]:
     """
     Lấy stats của tất cả caches
     """
-    return {
+    stats = {
         'gemini': gemini_cache.get_stats(),
         'openai': openai_cache.get_stats(),
         'chat': chat_cache.get_stats()
     }
+    if get_semantic_cache_stats is not None:
+        stats['semantic'] = get_semantic_cache_stats()
+    return stats
 
 
 def clear_all_caches():
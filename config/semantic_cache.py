@@ -0,0 +1,350 @@
+"""
+Semantic Response Cache cho LLM APIs - tier thứ 2 sau ResponseCache
+Trả lại response cho các câu hỏi diễn đạt khác nhưng cùng ý (embedding similarity)
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from typing import Optional, Dict, Any, Callable, List, Tuple
+import logging
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Chuẩn hóa prompt trước khi embed: NFC, lowercase, bỏ dấu câu, gộp khoảng trắng
+    (giữ dấu tiếng Việt vì nó mang nghĩa)
+    """
+    text = unicodedata.normalize('NFC', prompt or '').lower()
+    text = _PUNCT_RE.sub(' ', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def make_namespace(model: str, **context) -> str:
+    """
+    Tạo namespace từ model và các tham số ảnh hưởng tới câu trả lời
+    (context, language, deep_thinking, custom_prompt, ...)
+    """
+    parts = [model] + [f"{k}={context[k]}" for k in sorted(context)]
+    raw = "|".join(str(p) for p in parts)
+    if len(raw) > 120:
+        raw = f"{model}|{hashlib.sha256(raw.encode()).hexdigest()[:16]}"
+    return raw
+
+
+class _Namespace:
+    """Ma trận embedding (float32, đã normalize) + entries của 1 namespace"""
+    __slots__ = ('vectors', 'entries', 'count', 'next_slot', 'lock',
+                 'lookups', 'hits', 'misses', 'shadow_hits', 'shadow_false_hits', 'stores')
+
+    def __init__(self):
+        self.vectors = None
+        self.entries: List[Optional[Dict[str, Any]]] = []
+        self.count = 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.shadow_hits = 0
+        self.shadow_false_hits = 0
+        self.stores = 0
+
+
+class SemanticCache:
+    """
+    Cache theo độ tương đồng embedding của prompt đã chuẩn hóa
+
+    - Mỗi namespace (model + context) có 1 ma trận embedding riêng, lookup là
+      1 phép nhân ma trận-vector + argmax
+    - Mỗi namespace giữ tối đa ``max_entries_per_namespace`` entries, ghi đè
+      slot cũ nhất (ring buffer)
+    - Shadow mode: lookup vẫn chạy và được đếm nhưng không trả kết quả; sau khi
+      gọi API thật, ``shadow_check`` so sánh response cache với response thật để
+      đếm false hit (``shadow_false_hits``) - dùng để tune ``threshold`` trên
+      traffic thật / replay. Ngoài shadow mode không có số đo false hit
+    """
+
+    def __init__(
+        self,
+        embed_fn: Optional[Callable[[str], Any]] = None,
+        threshold: float = 0.92,
+        ttl_seconds: int = 3600,
+        max_entries_per_namespace: int = 2000,
+        shadow: bool = False,
+        answer_threshold: float = 0.85
+    ):
+        """
+        Args:
+            embed_fn: Hàm text -> vector; None = dùng sentence-transformers
+            threshold: Cosine similarity tối thiểu để tính là hit
+            ttl_seconds: Thời gian entry hết hạn
+            max_entries_per_namespace: Số entries tối đa mỗi namespace
+            shadow: Chỉ đo, không trả response từ cache
+            answer_threshold: Trong shadow mode, similarity giữa response cache và
+                response thật dưới ngưỡng này bị tính là false hit
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries_per_namespace
+        self.shadow = shadow
+        self.answer_threshold = answer_threshold
+
+        self._embed_fn = embed_fn
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+        self.enabled = NUMPY_AVAILABLE
+        if not NUMPY_AVAILABLE:
+            logger.warning("⚠️ numpy not installed. Semantic cache disabled.")
+        elif self._embed_fn is None:
+            self._load_embedding_model()
+
+    def _load_embedding_model(self):
+        """Load sentence embedding model (đa ngôn ngữ, hỗ trợ tiếng Việt)"""
+        try:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+            self._embed_fn = model.encode
+            logger.info("✅ Semantic cache embedding model loaded")
+        except ImportError:
+            logger.warning("⚠️ sentence-transformers not installed. Semantic cache disabled.")
+            self.enabled = False
+        except Exception as e:
+            logger.error(f"Failed to load semantic cache embedding model: {e}")
+            self.enabled = False
+
+    def _embed(self, text: str):
+        vector = np.asarray(self._embed_fn(text), dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        ns = self._namespaces.get(namespace)
+        if ns is None:
+            with self._lock:
+                ns = self._namespaces.setdefault(namespace, _Namespace())
+        return ns
+
+    def _nearest(self, ns: _Namespace, query) -> Tuple[int, float]:
+        """(slot, similarity) của entry gần nhất còn hạn, (-1, 0.0) nếu không có"""
+        if ns.count == 0:
+            return -1, 0.0
+        scores = ns.vectors[:ns.count] @ query
+        best = int(np.argmax(scores))
+        entry = ns.entries[best]
+        if entry is None or time.time() - entry['timestamp'] >= self.ttl_seconds:
+            # Entry gần nhất hết hạn: loại khỏi kết quả rồi thử lại 1 lần
+            scores[best] = -np.inf
+            ns.entries[best] = None
+            ns.vectors[best] = 0.0
+            best = int(np.argmax(scores))
+            entry = ns.entries[best]
+            if entry is None or not np.isfinite(scores[best]) or \
+                    time.time() - entry['timestamp'] >= self.ttl_seconds:
+                return -1, 0.0
+        return best, float(scores[best])
+
+    def get(self, prompt: str, namespace: str) -> Optional[str]:
+        """
+        Tìm response của prompt gần nghĩa nhất trong namespace
+
+        Returns:
+            Response hoặc None (luôn None trong shadow mode)
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            query = self._embed(normalize_prompt(prompt))
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+
+        ns = self._namespace(namespace)
+        with ns.lock:
+            ns.lookups += 1
+            slot, similarity = self._nearest(ns, query)
+            if slot < 0 or similarity < self.threshold:
+                ns.misses += 1
+                return None
+
+            entry = ns.entries[slot]
+            if self.shadow:
+                ns.shadow_hits += 1
+                entry['_shadow_for'] = prompt
+                logger.debug(f"👻 Semantic shadow hit ({similarity:.3f}) for: {prompt[:50]}...")
+                return None
+
+            ns.hits += 1
+            logger.debug(f"✅ Semantic cache HIT ({similarity:.3f}) for: {prompt[:50]}...")
+            return entry['response']
+
+    def set(self, prompt: str, namespace: str, response: str):
+        """Lưu response cho prompt vào namespace"""
+        if not self.enabled or not response:
+            return
+
+        try:
+            vector = self._embed(normalize_prompt(prompt))
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return
+
+        ns = self._namespace(namespace)
+        with ns.lock:
+            if ns.vectors is None:
+                ns.vectors = np.zeros((min(64, self.max_entries), len(vector)), dtype=np.float32)
+            elif ns.vectors.shape[1] != len(vector):
+                logger.warning("Semantic cache embedding dim changed; resetting namespace")
+                ns.vectors = np.zeros((min(64, self.max_entries), len(vector)), dtype=np.float32)
+                ns.entries, ns.count, ns.next_slot = [], 0, 0
+
+            slot = ns.next_slot
+            if slot >= len(ns.vectors):
+                grown = np.zeros((min(len(ns.vectors) * 2, self.max_entries), ns.vectors.shape[1]), dtype=np.float32)
+                grown[:len(ns.vectors)] = ns.vectors
+                ns.vectors = grown
+
+            ns.vectors[slot] = vector
+            entry = {'prompt': prompt[:200], 'response': response, 'timestamp': time.time()}
+            if slot < len(ns.entries):
+                ns.entries[slot] = entry
+            else:
+                ns.entries.append(entry)
+
+            ns.count = max(ns.count, slot + 1)
+            ns.next_slot = (slot + 1) % self.max_entries
+            ns.stores += 1
+
+    def shadow_check(self, prompt: str, namespace: str, actual_response: str) -> Optional[bool]:
+        """
+        Shadow mode: so sánh response mà cache đã định trả với response thật
+
+        Returns:
+            True nếu là false hit, False nếu hit đúng, None nếu không có shadow hit
+        """
+        if not self.enabled or not self.shadow or not actual_response:
+            return None
+
+        ns = self._namespace(namespace)
+        with ns.lock:
+            entry = next(
+                (e for e in ns.entries if e is not None and e.get('_shadow_for') == prompt),
+                None
+            )
+            if entry is None:
+                return None
+            entry.pop('_shadow_for', None)
+            cached_response = entry['response']
+
+        try:
+            similarity = float(self._embed(cached_response) @ self._embed(actual_response))
+        except Exception as e:
+            logger.warning(f"Semantic cache shadow check failed: {e}")
+            return None
+
+        false_hit = similarity < self.answer_threshold
+        if false_hit:
+            with ns.lock:
+                ns.shadow_false_hits += 1
+        return false_hit
+
+    def clear(self):
+        """Xóa toàn bộ cache (giữ metrics)"""
+        with self._lock:
+            for ns in self._namespaces.values():
+                with ns.lock:
+                    ns.vectors = None
+                    ns.entries, ns.count, ns.next_slot = [], 0, 0
+        logger.info("🗑️ Semantic cache cleared")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê tổng và theo namespace (hit rate, false hit rate của shadow mode)"""
+        namespaces = {}
+        totals = dict.fromkeys(('lookups', 'hits', 'misses', 'shadow_hits', 'shadow_false_hits', 'stores', 'size'), 0)
+
+        with self._lock:
+            items = list(self._namespaces.items())
+        for name, ns in items:
+            with ns.lock:
+                stats = {
+                    'lookups': ns.lookups,
+                    'hits': ns.hits,
+                    'misses': ns.misses,
+                    'shadow_hits': ns.shadow_hits,
+                    'shadow_false_hits': ns.shadow_false_hits,
+                    'stores': ns.stores,
+                    'size': sum(1 for e in ns.entries if e is not None)
+                }
+            for key in totals:
+                totals[key] += stats[key]
+            namespaces[name] = stats
+
+        served = totals['hits'] + totals['shadow_hits']
+        return {
+            'enabled': self.enabled,
+            'shadow': self.shadow,
+            'threshold': self.threshold,
+            **totals,
+            'hit_rate_percentage': round(served / totals['lookups'] * 100, 2) if totals['lookups'] else 0,
+            # Chỉ shadow hit mới được so với response thật
+            'shadow_false_hit_rate_percentage': (
+                round(totals['shadow_false_hits'] / totals['shadow_hits'] * 100, 2) if totals['shadow_hits'] else 0
+            ),
+            'namespaces': namespaces
+        }
+
+
+# Global semantic cache (tạo khi cần, bật bằng SEMANTIC_CACHE_ENABLED=true)
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    Lấy semantic cache global, None nếu chưa bật
+
+    Env:
+        SEMANTIC_CACHE_ENABLED: true/false (default false)
+        SEMANTIC_CACHE_THRESHOLD: cosine similarity tối thiểu (default 0.92)
+        SEMANTIC_CACHE_TTL: giây (default 3600)
+        SEMANTIC_CACHE_SHADOW: true = chỉ đo hit/false-hit, không trả từ cache
+    """
+    global _semantic_cache
+
+    if os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() != 'true':
+        return None
+
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(
+                    threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92')),
+                    ttl_seconds=int(os.getenv('SEMANTIC_CACHE_TTL', '3600')),
+                    shadow=os.getenv('SEMANTIC_CACHE_SHADOW', 'false').lower() == 'true'
+                )
+    return _semantic_cache if _semantic_cache.enabled else None
+
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    """Stats của semantic cache (kể cả khi chưa bật)"""
+    if _semantic_cache is None:
+        return {'enabled': False}
+    return _semantic_cache.get_stats()
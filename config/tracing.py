@@ -0,0 +1,395 @@
+"""
+Request Tracing - span nhẹ để biết latency của 1 request nằm ở đâu
+(cache, history, MCP context, provider call, MongoDB, ComfyUI)
+
+- Span được propagate bằng contextvars: hoạt động với thread lẫn asyncio.
+  Thread mới (ThreadPoolExecutor) cần ``wrap_context`` để mang theo trace.
+- Sampling quyết định 1 lần ở root span (env TRACE_SAMPLE_RATE, default 0).
+  Khi tắt, ``span()`` trả về 1 no-op singleton (vài trăm ns).
+- Trace hoàn chỉnh được giữ trong ring buffer (``/debug/traces``) và có thể
+  ghi ra file JSON lines theo định dạng OTLP/JSON (env TRACE_EXPORT_FILE).
+
+Usage:
+    from config.tracing import span, traced
+
+    with span('history.load', conversation_id=cid) as s:
+        turns = load()
+        s.set_attribute('turns', len(turns))
+
+    @traced('mongo.messages.add_message')
+    def add_message(...): ...
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """1 thao tác được đo: tên, thời gian, attributes, lỗi (nếu có)"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start_ns', 'end_ns', '_start_perf', 'error', '_token')
+
+    def __init__(self, trace: 'Trace', name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        if self.end_ns is None:
+            return (time.perf_counter_ns() - self._start_perf) / 1e6
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        """Kết thúc span (dùng trực tiếp cho span không phải context manager)"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.finish(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'span_id': f"{self.span_id:016x}",
+            'parent_id': f"{self.parent_id:016x}" if self.parent_id is not None else None,
+            'name': self.name,
+            'start': self.start_ns / 1e9,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        otlp = {
+            'traceId': f"{self.trace.trace_id:032x}",
+            'spanId': f"{self.span_id:016x}",
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or self.start_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1}
+        }
+        if self.parent_id is not None:
+            otlp['parentSpanId'] = f"{self.parent_id:016x}"
+        return otlp
+
+
+class Trace:
+    """Các span của 1 request; hoàn tất khi root span kết thúc"""
+
+    __slots__ = ('tracer', 'trace_id', 'spans', 'root', '_lock')
+
+    def __init__(self, tracer: 'Tracer'):
+        self.tracer = tracer
+        self.trace_id = random.getrandbits(128)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+        if span is self.root:
+            self.tracer._record(self)
+        elif self.root.end_ns is not None:
+            # Span kết thúc sau root (vd: streaming response)
+            self.tracer._export([span])
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return {
+            'trace_id': f"{self.trace_id:032x}",
+            'name': self.root.name,
+            'start': self.root.start_ns / 1e9,
+            'duration_ms': round(self.root.duration_ms, 3),
+            'error': self.root.error,
+            'spans': [s.to_dict() for s in spans]
+        }
+
+
+class _NoopSpan:
+    """Span khi không sample: mọi thao tác đều bỏ qua"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _UnsampledScope(_NoopSpan):
+    """Root không được sample: đánh dấu context để span con không tự tạo trace mới"""
+
+    __slots__ = ('_token',)
+
+    def __enter__(self):
+        self._token = _current_span.set(_UNSAMPLED)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+_UNSAMPLED = _NoopSpan()
+_current_span: contextvars.ContextVar = contextvars.ContextVar('trace_span', default=None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Tracer:
+    """
+    Sampling + ring buffer các trace gần nhất + exporter file (OTLP/JSON)
+    """
+
+    def __init__(self, sample_rate: float = 0.0, buffer_size: int = 200,
+                 export_path: Optional[str] = None, service_name: str = 'ai-assistant'):
+        """
+        Args:
+            sample_rate: Tỉ lệ request được trace (0 = tắt, 1 = tất cả)
+            buffer_size: Số trace giữ trong ring buffer
+            export_path: File JSON lines (OTLP/JSON), None = không export
+            service_name: service.name trong resource của OTLP
+        """
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._stats = {'sampled': 0, 'unsampled': 0, 'exported': 0, 'export_errors': 0}
+        self._export_path = export_path
+        self._export_queue: Optional[queue.SimpleQueue] = None
+        if export_path:
+            self._export_queue = queue.SimpleQueue()
+            threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True).start()
+
+    def start(self, name: str, attributes: Dict[str, Any], activate: bool = True):
+        """Span mới: con của span hiện tại, hoặc root của trace mới (theo sampling)"""
+        parent = _current_span.get()
+        if parent is None:
+            if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                self._stats['unsampled'] += 1
+                return _UnsampledScope() if activate else NOOP_SPAN
+            self._stats['sampled'] += 1
+            trace = Trace(self)
+            span = trace.root = Span(trace, name, None, attributes)
+            return span
+        if parent is _UNSAMPLED:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent, attributes)
+
+    def _record(self, trace: Trace):
+        self._buffer.append(trace)
+        self._export(trace.spans)
+
+    def _export(self, spans: List[Span]):
+        if self._export_queue is not None:
+            self._export_queue.put(list(spans))
+
+    def _export_loop(self):
+        while True:
+            spans = self._export_queue.get()
+            record = {'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'ai-assistant.tracing'},
+                    'spans': [s.to_otlp() for s in spans]
+                }]
+            }]}
+            try:
+                with open(self._export_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + '\n')
+                self._stats['exported'] += len(spans)
+            except OSError as e:
+                self._stats['export_errors'] += 1
+                logger.warning(f"⚠️ Trace export failed: {e}")
+
+    def recent(self, limit: int = 50, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """Trace gần nhất trước"""
+        traces = [t for t in reversed(list(self._buffer)) if t.root.duration_ms >= min_duration_ms]
+        return [t.to_dict() for t in traces[:limit]]
+
+    def clear(self):
+        self._buffer.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(
+            self._stats,
+            sample_rate=self.sample_rate,
+            buffered=len(self._buffer),
+            buffer_size=self._buffer.maxlen,
+            export_path=self._export_path
+        )
+
+
+_tracer = Tracer(
+    sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0')),
+    buffer_size=int(os.getenv('TRACE_BUFFER_SIZE', '200')),
+    export_path=os.getenv('TRACE_EXPORT_FILE') or None,
+    service_name=os.getenv('TRACE_SERVICE_NAME', 'ai-assistant')
+)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """Thay tracer toàn cục (test / cấu hình lúc khởi động)"""
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+
+def span(name: str, **attributes):
+    """
+    Context manager đo 1 thao tác; trả về span để set_attribute
+    """
+    if _tracer.sample_rate <= 0 and _current_span.get() is None:
+        return NOOP_SPAN
+    return _tracer.start(name, attributes)
+
+
+def start_span(name: str, **attributes):
+    """
+    Span không thành span hiện tại, kết thúc bằng ``.end()``; dùng cho
+    generator (streaming) vì contextvar không thể reset qua các lần yield
+    """
+    if _tracer.sample_rate <= 0 and _current_span.get() is None:
+        return NOOP_SPAN
+    return _tracer.start(name, attributes, activate=False)
+
+
+def traced(name: Optional[str] = None, **attributes):
+    """Decorator: bọc function trong 1 span (default: module.qualname)"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    """Span đang active (None nếu không trace)"""
+    current = _current_span.get()
+    return current if isinstance(current, Span) else None
+
+
+def current_trace_id() -> str:
+    current = current_span()
+    return f"{current.trace.trace_id:032x}" if current is not None else ''
+
+
+def wrap_context(func: Callable) -> Callable:
+    """Mang trace hiện tại sang thread khác (vd: executor.submit(wrap_context(fn)))"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+def get_trace_stats() -> Dict[str, Any]:
+    return _tracer.get_stats()
+
+
+# ============================================================================
+# Flask integration
+# ============================================================================
+
+def register_tracing(app):
+    """
+    Root span cho mỗi request + endpoint /debug/traces
+
+    Usage:
+        from config.tracing import register_tracing
+        register_tracing(app)
+    """
+    from flask import Blueprint, g, jsonify, request
+
+    @app.before_request
+    def _start_request_span():
+        scope = span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+                     method=request.method, path=request.path)
+        g._trace_scope = scope
+        scope.__enter__()
+
+    @app.teardown_request
+    def _end_request_span(exc):
+        scope = g.pop('_trace_scope', None)
+        if scope is not None:
+            try:
+                scope.__exit__(type(exc) if exc else None, exc, None)
+            except ValueError:
+                # Context khác (vd: streaming response): vẫn kết thúc span
+                scope.end(exc)
+
+    tracing_bp = Blueprint('tracing', __name__)
+
+    @tracing_bp.route('/debug/traces')
+    def debug_traces():
+        """Trace gần nhất: ?limit=50&min_ms=0"""
+        limit = request.args.get('limit', 50, type=int)
+        min_ms = request.args.get('min_ms', 0.0, type=float)
+        return jsonify({
+            'stats': get_trace_stats(),
+            'traces': _tracer.recent(limit=limit, min_duration_ms=min_ms)
+        })
+
+    app.register_blueprint(tracing_bp)
+    logger.info(f"Tracing registered at /debug/traces (sample rate {_tracer.sample_rate})")
@@ -0,0 +1,88 @@
+"""
+Benchmark FileBasedCache cold start - WAL + snapshot vs. ghi lại toàn bộ JSON
+
+Với mỗi kích thước N đo:
+- save: thời gian ghi N set (WAL append, compaction amortized) so với
+  legacy ``json.dump(indent=2)`` toàn bộ cache mỗi 10 set (ước lượng bằng
+  N/10 lần dump của cache trung bình N/2 item, tính từ 1 lần dump đo được)
+- load: thời gian khởi tạo cache mới (load snapshot + replay WAL) so với
+  legacy ``json.load`` toàn bộ file
+
+Usage:
+    python scripts/benchmarks/bench_file_cache.py [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from config.response_cache import FileBasedCache  # noqa: E402
+
+
+def bench_wal(n: int, directory: Path, response: str):
+    # Headroom so per-shard LRU bounds do not evict during the run
+    cache = FileBasedCache(cache_dir=str(directory), max_size=2 * n, ttl_seconds=86400)
+    start = time.perf_counter()
+    for i in range(n):
+        cache.set(f"prompt-{i}", "model", response)
+    save_s = time.perf_counter() - start
+    cache._wal.flush()
+
+    start = time.perf_counter()
+    reloaded = FileBasedCache(cache_dir=str(directory), max_size=2 * n, ttl_seconds=86400)
+    load_s = time.perf_counter() - start
+    assert len(reloaded) == n, f"expected {n} items, got {len(reloaded)}"
+    return save_s, load_s
+
+
+def bench_legacy(n: int, directory: Path, response: str):
+    now = time.time()
+    data = {
+        'cache': {
+            f"{i:016x}": {'response': response, 'timestamp': now, 'prompt': f"prompt-{i}", 'model': 'model'}
+            for i in range(n)
+        },
+        'hits': 0, 'misses': 0, 'saves': n
+    }
+    path = directory / 'llm_responses.json'
+
+    start = time.perf_counter()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    one_dump = time.perf_counter() - start
+    # Legacy rewrites the whole file every 10 saves while growing 0 -> N
+    save_s = one_dump * (n / 10) / 2
+
+    start = time.perf_counter()
+    with open(path, 'r', encoding='utf-8') as f:
+        json.load(f)
+    load_s = time.perf_counter() - start
+    return save_s, load_s, one_dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--response-bytes', type=int, default=200)
+    args = parser.parse_args()
+
+    response = 'x' * args.response_bytes
+    print(f"{'N':>10} | {'WAL save':>10} {'WAL load':>10} | {'legacy save*':>13} {'legacy load':>12} {'1 dump':>8}")
+    print('-' * 76)
+
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as wal_dir, tempfile.TemporaryDirectory() as legacy_dir:
+            wal_save, wal_load = bench_wal(n, Path(wal_dir), response)
+            legacy_save, legacy_load, one_dump = bench_legacy(n, Path(legacy_dir), response)
+        print(f"{n:>10,} | {wal_save:>9.2f}s {wal_load:>9.2f}s | {legacy_save:>12.1f}s {legacy_load:>11.2f}s {one_dump:>7.2f}s")
+
+    print("\n* legacy save is extrapolated from one full dump (rewrite every 10 saves)")
+
+
+if __name__ == '__main__':
+    main()
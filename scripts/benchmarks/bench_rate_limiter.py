@@ -0,0 +1,137 @@
+"""
+Load test MultiKeyRateLimiter - so sánh bản cũ (sleep trong lock) với token bucket
+Key #1 bị hết quota (nhiều thread đang chờ), các thread khác dùng key còn rảnh.
+Bản cũ: mọi thread bị kẹt sau thread đang sleep (head-of-line blocking).
+
+Usage:
+    python scripts/benchmarks/bench_rate_limiter.py [--threads 16] [--ops 50]
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from config.rate_limiter import RateLimiter, MultiKeyRateLimiter  # noqa: E402
+
+
+class LegacyRateLimiter:
+    """Thuật toán cũ: sliding window, time.sleep trong khi giữ lock"""
+
+    def __init__(self, max_requests=15, time_window=60):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.requests = deque()
+        self.lock = threading.Lock()
+
+    def wait_if_needed(self):
+        with self.lock:
+            now = datetime.now()
+            while self.requests and (now - self.requests[0]) > timedelta(seconds=self.time_window):
+                self.requests.popleft()
+            if len(self.requests) >= self.max_requests:
+                wait_time = self.time_window - (now - self.requests[0]).total_seconds()
+                if wait_time > 0:
+                    time.sleep(wait_time + 0.1)
+                    self.requests.popleft()
+            self.requests.append(datetime.now())
+
+    def get_stats(self):
+        with self.lock:
+            now = datetime.now()
+            while self.requests and (now - self.requests[0]) > timedelta(seconds=self.time_window):
+                self.requests.popleft()
+            return {'available_requests': self.max_requests - len(self.requests)}
+
+
+class LegacyMultiKeyRateLimiter(MultiKeyRateLimiter):
+    """Thuật toán cũ: get_best_key quét stats mọi key dưới 1 global lock"""
+
+    def __init__(self, num_keys, max_requests_per_key, time_window):
+        self.limiters = [LegacyRateLimiter(max_requests_per_key, time_window) for _ in range(num_keys)]
+        self.lock = threading.Lock()
+
+    def get_best_key(self):
+        with self.lock:
+            stats = [(i, limiter.get_stats()) for i, limiter in enumerate(self.limiters)]
+            stats.sort(key=lambda x: x[1]['available_requests'], reverse=True)
+            return stats[0][0], self.limiters[stats[0][0]]
+
+    def wait_and_get_key(self):
+        key_index, limiter = self.get_best_key()
+        limiter.wait_if_needed()
+        return key_index
+
+
+def run(multi, hot_limiter, threads, ops):
+    """1/4 thread chờ key nóng, phần còn lại đi qua multi-key limiter"""
+    latencies = []
+    lock = threading.Lock()
+
+    def hot_worker():
+        for _ in range(3):
+            hot_limiter.wait_if_needed()
+
+    def worker():
+        local = []
+        for _ in range(ops):
+            start = time.perf_counter()
+            multi.wait_and_get_key()
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    hot = [threading.Thread(target=hot_worker) for _ in range(max(1, threads // 4))]
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in hot:
+        t.start()
+    time.sleep(0.05)
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    for t in hot:
+        t.join()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return elapsed, statistics.median(latencies), p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=50, help='Requests per thread')
+    parser.add_argument('--keys', type=int, default=4)
+    args = parser.parse_args()
+
+    capacity = args.threads * args.ops
+    print(f"🧪 {args.threads} threads x {args.ops} ops, {args.keys} keys; key #1 exhausted (1 req / 2s)\n")
+
+    for name, cls, hot_cls in [
+        ('legacy (sleep in lock)', LegacyMultiKeyRateLimiter, LegacyRateLimiter),
+        ('token bucket + heap', MultiKeyRateLimiter, RateLimiter),
+    ]:
+        multi = cls(args.keys, capacity, 60)
+        # Key #1 is shared with callers that exhausted it
+        hot = hot_cls(1, 2)
+        multi.limiters[0] = hot
+        hot.wait_if_needed()
+        if cls is MultiKeyRateLimiter:
+            with multi.lock:
+                multi._push(0)
+
+        elapsed, p50, p99 = run(multi, hot, args.threads, args.ops)
+        print(f"{name:<24} total {elapsed:6.2f}s   p50 {p50:8.2f} ms   p99 {p99:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
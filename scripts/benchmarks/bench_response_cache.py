@@ -0,0 +1,103 @@
+"""
+Benchmark ResponseCache - so sánh bản cũ (min() eviction) với bản mới (LRU sharded)
+Chạy 16 threads đồng thời get/set với response từ 10 B đến 100 KB
+
+Usage:
+    python scripts/benchmarks/bench_response_cache.py [--threads 16] [--ops 20000]
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from config.response_cache import ResponseCache  # noqa: E402
+
+
+class LegacyResponseCache(ResponseCache):
+    """
+    Thuật toán cũ: dict + min() để tìm item cũ nhất (O(n) mỗi lần set khi đầy),
+    bảo vệ bằng 1 global lock để kết quả không bị race
+    """
+
+    def __init__(self, max_size=1000, ttl_seconds=3600):
+        self.cache = {}
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._global_lock = threading.Lock()
+
+    def get(self, prompt, model, **kwargs):
+        key = self._make_key(prompt, model, **kwargs)
+        with self._global_lock:
+            item = self.cache.get(key)
+            if item and time.time() - item['timestamp'] < self.ttl_seconds:
+                return item['response']
+            return None
+
+    def set(self, prompt, model, response, **kwargs):
+        key = self._make_key(prompt, model, **kwargs)
+        with self._global_lock:
+            if len(self.cache) >= self.max_size:
+                oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k]['timestamp'])
+                del self.cache[oldest_key]
+            self.cache[key] = {'response': response, 'timestamp': time.time()}
+
+
+def _payloads(count):
+    rng = random.Random(42)
+    return ['x' * int(10 ** rng.uniform(1, 5)) for _ in range(count)]
+
+
+def run(cache, threads: int, ops_per_thread: int, key_space: int):
+    payloads = _payloads(256)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(ops_per_thread):
+            n = rng.randrange(key_space)
+            prompt = f"prompt-{n}"
+            if cache.get(prompt, 'model') is None:
+                cache.set(prompt, 'model', payloads[n % len(payloads)])
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, threads * ops_per_thread / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=20000, help='Operations per thread')
+    parser.add_argument('--max-size', type=int, default=5000)
+    parser.add_argument('--key-space', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"🧪 {args.threads} threads x {args.ops} ops, max_size={args.max_size}, keys={args.key_space}\n")
+
+    caches = [
+        ('legacy (dict + min)', LegacyResponseCache(max_size=args.max_size)),
+        ('new (sharded LRU)', ResponseCache(max_size=args.max_size, max_bytes=64 * 1024 * 1024)),
+    ]
+    for name, cache in caches:
+        elapsed, throughput = run(cache, args.threads, args.ops, args.key_space)
+        print(f"{name:<22} {elapsed:8.2f}s  {throughput:12,.0f} ops/s")
+
+    print("\n📊 New cache stats:")
+    for key, value in caches[1][1].get_stats().items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
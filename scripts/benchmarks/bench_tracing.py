@@ -0,0 +1,56 @@
+"""
+Benchmark chi phí tracing - ns cho mỗi span
+
+Đo một "request" gồm 1 root span + --children span con, với:
+- baseline: không có span (vòng lặp rỗng)
+- off: TRACE_SAMPLE_RATE=0 (mặc định production, span trả về NOOP)
+- sampled: sample rate 1.0, mọi span được ghi vào ring buffer
+
+Usage:
+    python scripts/benchmarks/bench_tracing.py [--requests 100000] [--children 5]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from config import tracing  # noqa: E402
+
+
+def run(requests: int, children: int, enabled: bool) -> float:
+    span = tracing.span
+    start = time.perf_counter()
+    for _ in range(requests):
+        if enabled:
+            with span('request'):
+                for _ in range(children):
+                    with span('child', k=1):
+                        pass
+        else:
+            for _ in range(children):
+                pass
+    return (time.perf_counter() - start) * 1e9 / (requests * (children + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--children', type=int, default=5, help='Span con cho mỗi request')
+    args = parser.parse_args()
+
+    print(f"🧪 ns per span, {args.requests:,} requests x {args.children + 1} spans\n")
+    baseline = run(args.requests, args.children, enabled=False)
+    print(f"{'baseline':>9} | {baseline:>8.0f}")
+    for name, rate in (('off', 0.0), ('sampled', 1.0)):
+        previous = tracing.set_tracer(tracing.Tracer(sample_rate=rate))
+        try:
+            print(f"{name:>9} | {run(args.requests, args.children, enabled=True):>8.0f}")
+        finally:
+            tracing.set_tracer(previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Replay traffic qua SemanticCache để tune threshold
+
+Input là file JSON lines, mỗi dòng 1 request đã ghi lại:
+    {"prompt": "...", "model": "grok", "context": "casual", "response": "..."}
+
+Với mỗi threshold, cache chạy ở shadow mode: mỗi request được lookup, sau đó
+response thật được dùng để kiểm tra hit đúng/sai rồi lưu vào cache.
+
+Usage:
+    python scripts/benchmarks/replay_semantic_cache.py traffic.jsonl \\
+        [--thresholds 0.85 0.9 0.92 0.95] [--answer-threshold 0.85]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from config.semantic_cache import SemanticCache, make_namespace  # noqa: E402
+
+
+def load_traffic(path: Path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traffic', type=Path)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.85, 0.9, 0.92, 0.95])
+    parser.add_argument('--answer-threshold', type=float, default=0.85)
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic)
+    print(f"🧪 Replaying {len(traffic)} requests\n")
+
+    # Embedding model được load 1 lần và dùng chung cho mọi threshold
+    embed_fn = SemanticCache(threshold=1.0)._embed_fn
+    if embed_fn is None:
+        sys.exit("sentence-transformers and numpy are required for replay")
+
+    print(f"{'threshold':>10} {'hit rate':>10} {'false hits':>11} {'false-hit rate':>15}")
+    for threshold in args.thresholds:
+        cache = SemanticCache(
+            embed_fn=embed_fn,
+            threshold=threshold,
+            ttl_seconds=10 ** 9,
+            shadow=True,
+            answer_threshold=args.answer_threshold
+        )
+        for req in traffic:
+            namespace = make_namespace(req.get('model', 'unknown'), context=req.get('context', 'casual'))
+            cache.get(req['prompt'], namespace)
+            cache.shadow_check(req['prompt'], namespace, req['response'])
+            cache.set(req['prompt'], namespace, req['response'])
+
+        stats = cache.get_stats()
+        print(f"{threshold:>10.3f} {stats['hit_rate_percentage']:>9.2f}% "
+              f"{stats['shadow_false_hits']:>11} {stats['shadow_false_hit_rate_percentage']:>14.2f}%")
+
+
+if __name__ == '__main__':
+    main()
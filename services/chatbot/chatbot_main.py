@@ -37,8 +37,9 @@ load_dotenv()
 
 # Import rate limiter and cache from root config
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from config.rate_limiter import get_gemini_key_with_rate_limit, wait_for_openai_rate_limit, get_rate_limit_stats
+from config.rate_limiter import get_gemini_key_with_rate_limit, wait_for_openai_rate_limit, report_openai_rate_limited, get_rate_limit_stats
 from config.response_cache import get_cached_response, cache_response, get_all_cache_stats
+from config.semantic_cache import get_semantic_cache, make_namespace
 
 # MongoDB imports - import directly from files to avoid package conflict
 from bson import ObjectId
@@ -113,7 +114,16 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'skylight-ai-assistant-secret-key
 app.static_folder = str(CHATBOT_DIR / 'static')
 
 # Import and register extensions
-from core.extensions import logger, register_monitor, LOCALMODELS_AVAILABLE, model_loader, CLOUD_UPLOAD_ENABLED
+from core.extensions import logger, register_monitor, register_stats_provider, LOCALMODELS_AVAILABLE, model_loader, CLOUD_UPLOAD_ENABLED
+from core.extensions import cache as redis_cache
+from core.http_pool import get_openai_client, get_http_session, provider_slot
+from core.history_service import HistoryService
+from core.message_queue import get_message_queue
+from core.config import MESSAGE_WRITE_BEHIND
+from core.tracing import register_tracing, get_trace_stats
+
+# Turn loader: one aggregation per cache miss, invalidated by MessageDB writes
+history_service = HistoryService(get_db, MessageDB, cache=redis_cache)
 
 # Try to import ImgBBUploader
 ImgBBUploader = None
@@ -125,6 +135,25 @@ except ImportError:
 # Register monitor for health checks
 register_monitor(app)
 
+# Request tracing (TRACE_SAMPLE_RATE > 0) with recent traces at /debug/traces
+register_tracing(app)
+register_stats_provider('tracing', get_trace_stats)
+
+# Per-route latency (chatbot_route_response_time_seconds)
+from utils.metrics import register_route_metrics
+register_route_metrics(app)
+
+# Image generation jobs (/api/image-jobs); the ComfyUI listener starts on first use
+try:
+    from core.image_jobs import get_image_job_stats
+    register_stats_provider('image_jobs', get_image_job_stats)
+except ImportError:
+    pass
+
+# Upload spooling and extraction pool for /chat multipart requests
+from core.uploads import get_upload_processor, get_upload_stats
+register_stats_provider('uploads', get_upload_stats)
+
 # Initialize MongoDB connection
 try:
     mongodb_client.connect()
@@ -134,6 +163,13 @@ except Exception as e:
     MONGODB_ENABLED = False
     logger.warning(f"âš ï¸ MongoDB not available, using session storage: {e}")
 
+# Write-behind persistence: /chat enqueues messages, a background thread batches them
+message_queue = None
+if MONGODB_ENABLED and MESSAGE_WRITE_BEHIND:
+    message_queue = get_message_queue(get_db)
+    message_queue.add_flush_listener(MessageDB.notify_write)
+    register_stats_provider('message_queue', message_queue.get_stats)
+
 # Memory storage path
 MEMORY_DIR = Path(__file__).parent / 'data' / 'memory'
 MEMORY_DIR.mkdir(parents=True, exist_ok=True)
@@ -333,8 +369,8 @@ def get_or_create_conversation(user_id, model='grok-3'):
         return None
 
 
-def save_message_to_db(conversation_id, role, content, metadata=None, images=None, files=None):
-    """Save message to MongoDB"""
+def save_message_to_db(conversation_id, role, content, metadata=None, images=None, files=None, parent_message_id=None):
+    """Save message to MongoDB (assistant replies link to their user message via parent_message_id)"""
     if not MONGODB_ENABLED:
         logger.warning(f"[MONGODB] Skip save - MongoDB disabled")
         return None
@@ -343,14 +379,19 @@ def save_message_to_db(conversation_id, role, content, metadata=None, images=Non
         return None
     
     try:
-        message = MessageDB.add_message(
+        fields = dict(
             conversation_id=str(conversation_id),
             role=role,
             content=content,
             metadata=metadata or {},
             images=images or [],
-            files=files or []
+            files=files or [],
+            parent_message_id=str(parent_message_id) if parent_message_id else None
         )
+        if message_queue is not None:
+            message = message_queue.enqueue(MessageDB.build_message(**fields))
+        else:
+            message = MessageDB.add_message(**fields)
         logger.info(f"âœ… Saved message to DB: {message['_id']}")
         return message
     except Exception as e:
@@ -368,22 +409,7 @@ def load_conversation_history(conversation_id, limit=10):
         return []
     
     try:
-        messages = MessageDB.get_conversation_messages(str(conversation_id), limit=limit)
-        
-        # Convert to conversation history format
-        history = []
-        for msg in messages:
-            if msg['role'] == 'user':
-                user_content = msg['content']
-                # Find corresponding assistant message
-                assistant_msg = next((m for m in messages if m.get('parent_message_id') == msg['_id']), None)
-                if assistant_msg:
-                    history.append({
-                        'user': user_content,
-                        'assistant': assistant_msg['content']
-                    })
-        
-        return history
+        return history_service.get_turns(str(conversation_id), limit=limit)
     except Exception as e:
         logger.error(f"âŒ Error loading conversation history: {e}")
         return []
@@ -407,6 +433,18 @@ def set_active_conversation(conversation_id):
     session['conversation_id'] = str(conversation_id)
 
 
+# Cloud models whose answers may be served from the semantic cache tier
+SEMANTIC_CACHE_MODELS = {'grok', 'openai', 'deepseek', 'deepseek-reasoner', 'qwen', 'bloomvn'}
+
+# Prefixes of the error strings returned by the chat_with_* methods
+_ERROR_PREFIXES = ('❌', 'âŒ', 'Lỗi', 'Error')
+
+
+def _is_error_response(response):
+    """True if a chat_with_* result is an error message rather than an answer"""
+    return not response or not isinstance(response, str) or response.lstrip().startswith(_ERROR_PREFIXES)
+
+
 class ChatbotAgent:
     """Multi-model chatbot agent"""
     
@@ -446,7 +484,8 @@ class ChatbotAgent:
         wait_for_openai_rate_limit()
         
         try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
+            # Shared keep-alive client (connection pool) per provider
+            client = get_openai_client('openai', OPENAI_API_KEY)
             
             # Use custom prompt if provided, otherwise use base prompt
             if custom_prompt and custom_prompt.strip():
@@ -488,12 +527,13 @@ class ChatbotAgent:
             
             messages.append({"role": "user", "content": message})
             
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Rẻ nhất: $0.15/$0.60 per 1M tokens
-                messages=messages,
-                temperature=0.7 if not deep_thinking else 0.5,  # Lower temp for deep thinking
-                max_tokens=2000 if deep_thinking else 1000  # More tokens for deep thinking
-            )
+            with provider_slot('openai'):
+                response = client.chat.completions.create(
+                    model="gpt-4o-mini",  # Rẻ nhất: $0.15/$0.60 per 1M tokens
+                    messages=messages,
+                    temperature=0.7 if not deep_thinking else 0.5,  # Lower temp for deep thinking
+                    max_tokens=2000 if deep_thinking else 1000  # More tokens for deep thinking
+                )
             
             result = response.choices[0].message.content
             
@@ -502,6 +542,10 @@ class ChatbotAgent:
             
             return result
             
+        except openai.RateLimitError as e:
+            # Upstream 429: let the limiter back off per Retry-After
+            report_openai_rate_limited(e.response.headers.get('retry-after') if e.response is not None else None)
+            return f"Lỗi OpenAI: {str(e)}"
         except Exception as e:
             return f"Lỗi OpenAI: {str(e)}"
     
@@ -528,10 +572,7 @@ class ChatbotAgent:
                 system_prompt += "Sá»­ dá»¥ng kiáº¿n thá»©c tá»« Knowledge Base khi phÃ¹ há»£p Ä‘á»ƒ tráº£ lá»i."
             
             # DeepSeek uses OpenAI compatible API
-            client = openai.OpenAI(
-                api_key=DEEPSEEK_API_KEY,
-                base_url="https://api.deepseek.com/v1"
-            )
+            client = get_openai_client('deepseek', DEEPSEEK_API_KEY, "https://api.deepseek.com/v1")
             
             messages = [{"role": "system", "content": system_prompt}]
             
@@ -550,12 +591,13 @@ class ChatbotAgent:
             
             messages.append({"role": "user", "content": message})
             
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                temperature=0.7 if not deep_thinking else 0.5,
-                max_tokens=2000 if deep_thinking else 1000
-            )
+            with provider_slot('deepseek'):
+                response = client.chat.completions.create(
+                    model="deepseek-chat",
+                    messages=messages,
+                    temperature=0.7 if not deep_thinking else 0.5,
+                    max_tokens=2000 if deep_thinking else 1000
+                )
             
             return response.choices[0].message.content
             
@@ -584,10 +626,7 @@ class ChatbotAgent:
                 system_prompt += "\n=== END KNOWLEDGE BASE ===\n"
             
             # DeepSeek R1 uses OpenAI compatible API
-            client = openai.OpenAI(
-                api_key=DEEPSEEK_API_KEY,
-                base_url="https://api.deepseek.com/v1"
-            )
+            client = get_openai_client('deepseek', DEEPSEEK_API_KEY, "https://api.deepseek.com/v1")
             
             messages = [{"role": "system", "content": system_prompt}]
             
@@ -614,13 +653,14 @@ class ChatbotAgent:
                 max_tokens = extra_params.get('max_tokens', max_tokens)
                 top_p = extra_params.get('top_p', top_p)
             
-            response = client.chat.completions.create(
-                model="deepseek-reasoner",  # DeepSeek R1 reasoning model
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p
-            )
+            with provider_slot('deepseek'):
+                response = client.chat.completions.create(
+                    model="deepseek-reasoner",  # DeepSeek R1 reasoning model
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p
+                )
             
             result = response.choices[0].message.content
             
@@ -669,10 +709,7 @@ class ChatbotAgent:
                 system_prompt += "Sá»­ dá»¥ng kiáº¿n thá»©c tá»« Knowledge Base khi phÃ¹ há»£p Ä‘á»ƒ tráº£ lá»i."
             
             # GROK uses OpenAI-compatible API
-            client = openai.OpenAI(
-                api_key=GROK_API_KEY,
-                base_url="https://api.x.ai/v1"
-            )
+            client = get_openai_client('grok', GROK_API_KEY, "https://api.x.ai/v1")
             
             messages = [{"role": "system", "content": system_prompt}]
             
@@ -691,12 +728,13 @@ class ChatbotAgent:
             
             messages.append({"role": "user", "content": message})
             
-            response = client.chat.completions.create(
-                model="grok-3",  # GROK model - Latest version with NSFW support
-                messages=messages,
-                temperature=0.7 if not deep_thinking else 0.5,
-                max_tokens=2000 if deep_thinking else 1000
-            )
+            with provider_slot('grok'):
+                response = client.chat.completions.create(
+                    model="grok-3",  # GROK model - Latest version with NSFW support
+                    messages=messages,
+                    temperature=0.7 if not deep_thinking else 0.5,
+                    max_tokens=2000 if deep_thinking else 1000
+                )
             
             return response.choices[0].message.content
             
@@ -733,12 +771,13 @@ class ChatbotAgent:
                 "max_tokens": 2000 if deep_thinking else 1000
             }
             
-            response = requests.post(
-                "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            with provider_slot('qwen'):
+                response = get_http_session().post(
+                    "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+                    headers=headers,
+                    json=data,
+                    timeout=30
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -780,12 +819,13 @@ class ChatbotAgent:
                 }
             }
             
-            response = requests.post(
-                "https://router.huggingface.co/hf-inference/models/BlossomsAI/BloomVN-8B-chat",
-                headers=headers,
-                json=data,
-                timeout=60  # BloomVN có thể chậm hơn
-            )
+            with provider_slot('bloomvn'):
+                response = get_http_session().post(
+                    "https://router.huggingface.co/hf-inference/models/BlossomsAI/BloomVN-8B-chat",
+                    headers=headers,
+                    json=data,
+                    timeout=60  # BloomVN có thể chậm hơn
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -859,8 +899,9 @@ class ChatbotAgent:
     def chat(self, message, model='grok', context='casual', deep_thinking=False, history=None, memories=None, language='vi', custom_prompt=None, extra_params=None):
         """Main chat method with MongoDB integration"""
         # Save user message to MongoDB
+        user_message = None
         if MONGODB_ENABLED and self.conversation_id and history is None:
-            save_message_to_db(
+            user_message = save_message_to_db(
                 conversation_id=self.conversation_id,
                 role='user',
                 content=message,
@@ -873,9 +914,32 @@ class ChatbotAgent:
                 }
             )
         
+        # Semantic cache tier: only for context-free turns (no history, no memories),
+        # since the cached answer cannot account for earlier turns
+        semantic_cache = None
+        semantic_namespace = None
+        if (model in SEMANTIC_CACHE_MODELS and not history and not memories
+                and not self.conversation_history):
+            semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            semantic_namespace = make_namespace(
+                model,
+                context=context,
+                deep_thinking=deep_thinking,
+                language=language,
+                custom_prompt=custom_prompt or ''
+            )
+            cached = semantic_cache.get(message, semantic_namespace)
+            if cached is not None:
+                logger.info(f"[SEMANTIC CACHE] Hit for {model}")
+        else:
+            cached = None
+        
         # Get response from selected model (with thinking process if deep_thinking enabled)
         thinking_process = None
-        if model == 'grok':
+        if cached is not None:
+            result = cached
+        elif model == 'grok':
             result = self.chat_with_grok(message, context, deep_thinking, history, memories, language, custom_prompt)
         elif model == 'gemini':
             result = self.chat_with_gemini(message, context, deep_thinking, history, memories, language, custom_prompt)
@@ -902,6 +966,10 @@ class ChatbotAgent:
         else:
             response = result
         
+        if semantic_cache is not None and cached is None and not _is_error_response(response):
+            semantic_cache.shadow_check(message, semantic_namespace, response)
+            semantic_cache.set(message, semantic_namespace, response)
+        
         # Only save to conversation history if no custom history provided
         if history is None:
             # Save to in-memory history
@@ -926,7 +994,8 @@ class ChatbotAgent:
                         'deep_thinking': deep_thinking,
                         'finish_reason': 'stop',
                         'thinking_process': thinking_process
-                    }
+                    },
+                    parent_message_id=user_message['_id'] if user_message else None
                 )
         
         return {'response': response, 'thinking_process': thinking_process}
@@ -1196,6 +1265,10 @@ def chat():
     """Chat endpoint - handles both JSON and FormData (with files)"""
     try:
         logger.info(f"[CHAT] Received request - Content-Type: {request.content_type}")
+        upload_processor = get_upload_processor(extract_file_content)
+        # Uploads that outlive the extraction budget are handed to this conversation's next message
+        upload_owner = session.get('conversation_id') or session.get('session_id')
+        file_contents = []
         
         # Check if request has files (FormData) or is JSON
         if request.content_type and 'multipart/form-data' in request.content_type:
@@ -1236,40 +1309,27 @@ def chat():
             except:
                 mcp_selected_files = []
             
-            # Handle uploaded files
+            # Handle uploaded files: spooled to disk, extracted concurrently within a latency budget
             files = request.files.getlist('files')
-            file_contents = []
-            
-            # Process uploaded files with OCR
-            for file in files:
-                if file and file.filename:
-                    try:
-                        file_data = file.read()
-                        filename = file.filename
-                        logger.info(f"[UPLOAD] Processing file: {filename} ({len(file_data)} bytes)")
-                        
-                        success, extracted_text = extract_file_content(file_data, filename)
-                        
-                        if success and extracted_text:
-                            file_contents.append({
-                                "filename": filename,
-                                "content": extracted_text[:10000],  # Limit content
-                                "type": Path(filename).suffix.lower()
-                            })
-                            logger.info(f"[UPLOAD] Extracted {len(extracted_text)} chars from {filename}")
-                        else:
-                            logger.warning(f"[UPLOAD] Could not extract content from {filename}")
-                    except Exception as e:
-                        logger.error(f"[UPLOAD] Error processing {file.filename}: {e}")
             
-            # Inject file contents into message
-            if file_contents:
-                file_context = "\n\n--- UPLOADED FILES ---\n"
-                for fc in file_contents:
-                    file_context += f"\n📄 **{fc['filename']}**:\n```{fc['type'][1:] if fc['type'] else 'text'}\n{fc['content']}\n```\n"
-                file_context += "--- END FILES ---\n\n"
-                message = file_context + message
-                logger.info(f"[UPLOAD] Injected {len(file_contents)} files into message")
+            for extracted in upload_processor.process(files, owner=upload_owner):
+                if extracted.status == 'done':
+                    file_contents.append({
+                        "filename": extracted.filename,
+                        "content": extracted.content[:10000],  # Limit content
+                        "type": extracted.type
+                    })
+                    logger.info(f"[UPLOAD] Extracted {len(extracted.content)} chars from {extracted.filename}"
+                                f"{' (cached)' if extracted.cached else ''}")
+                elif extracted.status == 'pending':
+                    file_contents.append({
+                        "filename": extracted.filename,
+                        "content": "[Content is still being extracted and will be available in the next message]",
+                        "type": extracted.type
+                    })
+                    logger.info(f"[UPLOAD] Extraction of {extracted.filename} still running, continuing without it")
+                else:
+                    logger.warning(f"[UPLOAD] Could not extract content from {extracted.filename}")
         else:
             # JSON request
             data = request.json
@@ -1285,6 +1345,27 @@ def chat():
             memory_ids = data.get('memory_ids', [])
             mcp_selected_files = data.get('mcp_selected_files', [])  # MCP selected files
         
+        # Files from an earlier message whose extraction finished after its budget
+        for extracted in upload_processor.take_finished(upload_owner):
+            if extracted.status == 'done':
+                file_contents.append({
+                    "filename": extracted.filename,
+                    "content": extracted.content[:10000],  # Limit content
+                    "type": extracted.type
+                })
+                logger.info(f"[UPLOAD] Adding {extracted.filename} from an earlier message")
+            else:
+                logger.warning(f"[UPLOAD] Could not extract content from {extracted.filename}")
+        
+        # Inject file contents into message
+        if file_contents:
+            file_context = "\n\n--- UPLOADED FILES ---\n"
+            for fc in file_contents:
+                file_context += f"\n📄 **{fc['filename']}**:\n```{fc['type'][1:] if fc['type'] else 'text'}\n{fc['content']}\n```\n"
+            file_context += "--- END FILES ---\n\n"
+            message = file_context + message
+            logger.info(f"[UPLOAD] Injected {len(file_contents)} files into message")
+        
         # Handle user_id from request (for mobile/web tracking)
         if data.get('user_id'):
             session['user_id'] = data.get('user_id')
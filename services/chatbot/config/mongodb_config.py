@@ -85,6 +85,9 @@ class MongoDBClient:
         db.messages.create_index([("conversation_id", 1)])
         db.messages.create_index([("created_at", -1)])
         db.messages.create_index([("role", 1)])
+        # History loader: user turns of a conversation + $lookup of replies
+        db.messages.create_index([("conversation_id", 1), ("role", 1), ("created_at", -1)])
+        db.messages.create_index([("parent_message_id", 1)])
         
         # Memory indexes
         db.chatbot_memory.create_index([("user_id", 1)])
@@ -16,7 +16,7 @@ import logging
 import sys
 import importlib.util
 from pathlib import Path
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 from datetime import datetime, timedelta
 from bson import ObjectId
 from pymongo import DESCENDING, ASCENDING
@@ -52,6 +52,12 @@ except Exception as e:
     ChatbotCache = None
     logger.warning(f"Cache layer error: {e}")
 
+try:
+    from core.tracing import traced
+except ImportError:
+    def traced(name=None, **attributes):
+        return lambda func: func
+
 
 # ============================================================================
 # CONVERSATION DATABASE OPERATIONS
@@ -209,6 +215,7 @@ class ConversationDB:
         
         # Delete all messages first
         db.messages.delete_many({"conversation_id": ObjectId(conversation_id)})
+        MessageDB.notify_write(conversation_id)
         
         # Delete conversation
         result = db.conversations.delete_one({"_id": ObjectId(conversation_id)})
@@ -267,8 +274,27 @@ class ConversationDB:
 class MessageDB:
     """Database operations for messages collection"""
     
+    # Callbacks run with the conversation_id after every message write
+    # (e.g. HistoryService cache invalidation)
+    _write_listeners: List[Callable[[str], None]] = []
+    
+    @classmethod
+    def add_write_listener(cls, listener: Callable[[str], None]):
+        """Register a callback invoked after messages of a conversation change"""
+        if listener not in cls._write_listeners:
+            cls._write_listeners.append(listener)
+    
+    @classmethod
+    def notify_write(cls, conversation_id):
+        """Run write listeners for a conversation (also used by the write-behind queue)"""
+        for listener in cls._write_listeners:
+            try:
+                listener(str(conversation_id))
+            except Exception as e:
+                logger.warning(f"Message write listener failed: {e}")
+    
     @staticmethod
-    def add_message(
+    def build_message(
         conversation_id: str,
         role: str,
         content: str,
@@ -277,10 +303,9 @@ class MessageDB:
         metadata: Optional[Dict] = None,
         parent_message_id: Optional[str] = None
     ) -> Dict:
-        """Add a new message to conversation"""
-        db = get_db()
-        
-        message = {
+        """Build a message document with a client-side _id (not yet stored)"""
+        return {
+            "_id": ObjectId(),
             "conversation_id": ObjectId(conversation_id),
             "role": role,
             "content": content,
@@ -293,9 +318,25 @@ class MessageDB:
             "is_stopped": False,
             "created_at": datetime.utcnow()
         }
+    
+    @staticmethod
+    @traced('mongo.messages.add_message')
+    def add_message(
+        conversation_id: str,
+        role: str,
+        content: str,
+        images: Optional[List[Dict]] = None,
+        files: Optional[List[Dict]] = None,
+        metadata: Optional[Dict] = None,
+        parent_message_id: Optional[str] = None
+    ) -> Dict:
+        """Add a new message to conversation"""
+        db = get_db()
         
-        result = db.messages.insert_one(message)
-        message["_id"] = result.inserted_id
+        message = MessageDB.build_message(
+            conversation_id, role, content, images, files, metadata, parent_message_id
+        )
+        db.messages.insert_one(message)
         
         # Update conversation
         tokens = metadata.get("tokens", 0) if metadata else 0
@@ -304,16 +345,19 @@ class MessageDB:
         # Invalidate message cache for this conversation
         if CACHE_AVAILABLE:
             ChatbotCache.invalidate_messages(str(conversation_id))
+        MessageDB.notify_write(conversation_id)
         
         return message
     
     @staticmethod
+    @traced('mongo.messages.get_message')
     def get_message(message_id: str) -> Optional[Dict]:
         """Get message by ID"""
         db = get_db()
         return db.messages.find_one({"_id": ObjectId(message_id)})
     
     @staticmethod
+    @traced('mongo.messages.get_conversation_messages')
     def get_conversation_messages(
         conversation_id: str,
         limit: Optional[int] = None
@@ -343,6 +387,7 @@ class MessageDB:
         return result
     
     @staticmethod
+    @traced('mongo.messages.update_message')
     def update_message(
         message_id: str,
         content: str
@@ -367,9 +412,11 @@ class MessageDB:
         }
         
         db.messages.insert_one(new_message)
+        MessageDB.notify_write(original["conversation_id"])
         return True
     
     @staticmethod
+    @traced('mongo.messages.mark_stopped')
     def mark_stopped(message_id: str) -> bool:
         """Mark message as stopped (generation interrupted)"""
         db = get_db()
@@ -382,13 +429,18 @@ class MessageDB:
         return result.modified_count > 0
     
     @staticmethod
+    @traced('mongo.messages.delete_message')
     def delete_message(message_id: str) -> bool:
         """Delete a message"""
         db = get_db()
-        result = db.messages.delete_one({"_id": ObjectId(message_id)})
-        return result.deleted_count > 0
+        deleted = db.messages.find_one_and_delete({"_id": ObjectId(message_id)})
+        if deleted is None:
+            return False
+        MessageDB.notify_write(deleted["conversation_id"])
+        return True
     
     @staticmethod
+    @traced('mongo.messages.get_message_versions')
     def get_message_versions(message_id: str) -> List[Dict]:
         """Get all versions of a message"""
         db = get_db()
@@ -753,6 +805,7 @@ def cleanup_old_data(days: int = 90):
         # Delete messages
         result = db.messages.delete_many({"conversation_id": conv["_id"]})
         deleted_msg += result.deleted_count
+        MessageDB.notify_write(conv["_id"])
         
         # Delete conversation
         db.conversations.delete_one({"_id": conv["_id"]})
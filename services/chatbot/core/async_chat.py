@@ -1,6 +1,7 @@
 """
 Async Chat Module - Asynchronous chat implementations for better I/O performance
 """
+import time
 import asyncio
 import logging
 from typing import Optional, List, Dict, Any, AsyncGenerator
@@ -13,6 +14,7 @@ from core.base_chat import (
     ModelConfig, ModelProvider, ChatContext, ChatResponse,
     ContextWindowManager, RetryConfig
 )
+from core.http_pool import get_async_openai_client, get_aiohttp_session, async_provider_slot
 
 logger = logging.getLogger(__name__)
 
@@ -50,12 +52,13 @@ class AsyncOpenAICompatibleChat:
     
     def __init__(self, config: ModelConfig):
         self.config = config
-        self.client = AsyncOpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url if config.base_url else None
-        )
         self.retry_handler = AsyncRetryHandler()
     
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Pooled keep-alive client for the running event loop"""
+        return get_async_openai_client(self.config.provider.value, self.config.api_key, self.config.base_url)
+    
     async def chat(
         self,
         messages: List[Dict],
@@ -64,12 +67,13 @@ class AsyncOpenAICompatibleChat:
     ) -> str:
         """Execute async chat"""
         async def _call():
-            response = await self.client.chat.completions.create(
-                model=self.config.model_id,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+            async with async_provider_slot(self.config.provider.value):
+                response = await self.client.chat.completions.create(
+                    model=self.config.model_id,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
             return response.choices[0].message.content
         
         return await self.retry_handler.execute_with_retry(_call)
@@ -82,16 +86,17 @@ class AsyncOpenAICompatibleChat:
     ) -> AsyncGenerator[str, None]:
         """Execute async streaming chat"""
         try:
-            stream = await self.client.chat.completions.create(
-                model=self.config.model_id,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            async for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            async with async_provider_slot(self.config.provider.value):
+                stream = await self.client.chat.completions.create(
+                    model=self.config.model_id,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
         except Exception as e:
             logger.error(f"[{self.config.name}] Streaming error: {e}")
             raise
@@ -112,8 +117,8 @@ class AsyncQwenChat:
     ) -> str:
         """Execute async chat"""
         async def _call():
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
+            async with async_provider_slot('qwen'):
+                async with get_aiohttp_session().post(
                     "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
                     headers={
                         "Authorization": f"Bearer {self.config.api_key}",
@@ -141,8 +146,8 @@ class AsyncQwenChat:
         max_tokens: int
     ) -> AsyncGenerator[str, None]:
         """Execute async streaming chat"""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        async with async_provider_slot('qwen'):
+            async with get_aiohttp_session().post(
                 "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {self.config.api_key}",
@@ -205,8 +210,8 @@ class AsyncBloomVNChat:
         async def _call():
             conversation = self._build_conversation(messages)
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
+            async with async_provider_slot('bloomvn'):
+                async with get_aiohttp_session().post(
                     "https://api-inference.huggingface.co/models/BlossomsAI/BloomVN-8B-chat",
                     headers={"Authorization": f"Bearer {self.config.api_key}"},
                     json={
@@ -409,3 +414,58 @@ async def run_multiple_chats(
         for task in tasks
     ]
     return await asyncio.gather(*coroutines)
+
+
+async def compare_models_stream(
+    models: List[str],
+    ctx: ChatContext,
+    agent: AsyncChatbotAgent,
+    prompts_getter
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Fan one prompt out to several models concurrently and stream results as they arrive
+    
+    Yields:
+        {'type': 'chunk', 'model', 'content'} for every chunk of every model, interleaved
+        {'type': 'done', 'model', 'response', 'latency_ms', 'first_chunk_ms', 'error'} when a model
+        finishes; error is None, or the provider error with response holding any partial output
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    start = time.perf_counter()
+    
+    async def run_model(model: str):
+        parts = []
+        first_chunk_ms = None
+        error = None
+        try:
+            async for chunk in agent.chat_stream(model, ctx, prompts_getter):
+                if not chunk:
+                    continue
+                if first_chunk_ms is None:
+                    first_chunk_ms = round((time.perf_counter() - start) * 1000, 1)
+                parts.append(chunk)
+                await events.put({'type': 'chunk', 'model': model, 'content': chunk})
+        except Exception as e:
+            logger.warning(f"[Compare] {model} failed: {e}")
+            error = str(e)
+        finally:
+            await events.put({
+                'type': 'done',
+                'model': model,
+                'response': ''.join(parts),
+                'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+                'first_chunk_ms': first_chunk_ms,
+                'error': error
+            })
+    
+    tasks = [asyncio.create_task(run_model(model)) for model in models]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            event = await events.get()
+            if event['type'] == 'done':
+                remaining -= 1
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
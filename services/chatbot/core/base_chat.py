@@ -2,8 +2,12 @@
 Base Chat Module - Unified chat logic with streaming, retry, and fallback support
 """
 import time
+import json
+import hashlib
 import logging
 import functools
+import threading
+import weakref
 from typing import Optional, List, Dict, Any, Generator, Callable
 from dataclasses import dataclass, field
 from enum import Enum
@@ -11,6 +15,10 @@ from abc import ABC, abstractmethod
 import openai
 import requests
 
+from core.http_pool import get_openai_client, get_http_session, provider_slot
+from core.tracing import span, start_span
+from utils.metrics import model_latency
+
 logger = logging.getLogger(__name__)
 
 
@@ -39,6 +47,7 @@ class ModelConfig:
     timeout: int = 60
     supports_streaming: bool = True
     fallback_model: Optional[str] = None
+    coalesce_requests: bool = True
 
 
 @dataclass
@@ -52,6 +61,8 @@ class ChatContext:
     history: Optional[List[Dict]] = None
     memories: Optional[List[Dict]] = None
     conversation_history: List[Dict] = field(default_factory=list)
+    summarize_dropped: bool = False
+    history_summary: Optional[str] = None
 
 
 @dataclass
@@ -120,7 +131,15 @@ def with_retry(retry_config: Optional[RetryConfig] = None):
 
 
 class ContextWindowManager:
-    """Smart context window management"""
+    """
+    Smart context window management
+
+    Token counts come from per-model tokenizers (tiktoken for OpenAI-style
+    models, HuggingFace tokenizers for open models) with the old
+    chars/1.5 heuristic as fallback. Each history entry caches its count
+    under entry['token_counts'][tokenizer_name], so a message is tokenized
+    once - normally at save time - and the count is persisted with it.
+    """
     
     # Approximate token limits per model
     MODEL_CONTEXT_LIMITS = {
@@ -132,64 +151,442 @@ class ContextWindowManager:
         "default": 8000
     }
     
+    # Tokenizer per model: (kind, name). Unknown models use the heuristic.
+    MODEL_TOKENIZERS = {
+        "gpt-4o-mini": ("tiktoken", "o200k_base"),
+        "grok-3": ("tiktoken", "cl100k_base"),
+        "deepseek-chat": ("hf", "deepseek-ai/DeepSeek-V3"),
+        "qwen-turbo": ("hf", "Qwen/Qwen2.5-7B-Instruct"),
+        "bloomvn": ("hf", "BlossomsAI/BloomVN-8B-chat"),
+    }
+    
+    HEURISTIC_TOKENIZER = "heuristic"
+    
     # Target context usage (leave room for response)
     TARGET_USAGE = 0.7
     
+    # Token budget for the rolling summary of dropped messages
+    SUMMARY_MAX_TOKENS = 300
+    
+    # Seconds before a tokenizer that failed to load is tried again
+    TOKENIZER_RETRY_SECONDS = 60.0
+    
+    _tokenizers: Dict[str, tuple] = {}
+    _tokenizers_lock = threading.Lock()  # guards the dicts only, never held while loading
+    _tokenizer_load_locks: Dict[str, threading.Lock] = {}
+    _tokenizer_failures: Dict[str, float] = {}  # model_id -> monotonic time of the last failed load
+    
     @classmethod
-    def estimate_tokens(cls, text: str) -> int:
-        """Estimate token count (rough approximation)"""
+    def estimate_tokens(cls, text: str, model_id: str = "default") -> int:
+        """Count tokens with the model's tokenizer (heuristic if unavailable)"""
+        if not text:
+            return 0
+        _, count = cls.get_tokenizer(model_id)
+        return count(text)
+    
+    @staticmethod
+    def _heuristic_count(text: str) -> int:
         # Vietnamese and mixed text: ~1.5 chars per token average
         return int(len(text) / 1.5)
     
     @classmethod
-    def get_smart_history(
+    def register_tokenizer(cls, model_id: str, name: str, count: Callable[[str], int]):
+        """Plug in a custom token counter for a model"""
+        with cls._tokenizers_lock:
+            cls._tokenizers[model_id] = (name, count)
+    
+    @classmethod
+    def get_tokenizer(cls, model_id: str) -> tuple:
+        """
+        Get (tokenizer_name, count_fn) for a model, loading it on first use
+        
+        Loads (which may download) run under a per-model lock, so one slow
+        model does not block token counting for the others. A failed load
+        falls back to the heuristic without caching it, and is retried after
+        TOKENIZER_RETRY_SECONDS.
+        """
+        tokenizer = cls._tokenizers.get(model_id)
+        if tokenizer is not None:
+            return tokenizer
+        
+        with cls._tokenizers_lock:
+            load_lock = cls._tokenizer_load_locks.setdefault(model_id, threading.Lock())
+        with load_lock:
+            tokenizer = cls._tokenizers.get(model_id)
+            if tokenizer is not None:
+                return tokenizer
+            failed_at = cls._tokenizer_failures.get(model_id)
+            if failed_at is not None and time.monotonic() - failed_at < cls.TOKENIZER_RETRY_SECONDS:
+                return cls.HEURISTIC_TOKENIZER, cls._heuristic_count
+            try:
+                tokenizer = cls._load_tokenizer(model_id)
+            except Exception as e:
+                logger.warning(f"[Tokens] Tokenizer for {model_id} unavailable ({e}), using heuristic")
+                with cls._tokenizers_lock:
+                    cls._tokenizer_failures[model_id] = time.monotonic()
+                return cls.HEURISTIC_TOKENIZER, cls._heuristic_count
+            with cls._tokenizers_lock:
+                cls._tokenizers[model_id] = tokenizer
+                cls._tokenizer_failures.pop(model_id, None)
+        return tokenizer
+    
+    @classmethod
+    def _load_tokenizer(cls, model_id: str) -> tuple:
+        """Build the model's tokenizer (heuristic for unmapped models); raises if loading fails"""
+        kind, name = cls.MODEL_TOKENIZERS.get(model_id, (None, None))
+        if kind == "tiktoken":
+            import tiktoken
+            encoding = tiktoken.get_encoding(name)
+            return f"tiktoken:{name}", lambda text: len(encoding.encode(text, disallowed_special=()))
+        if kind == "hf":
+            from transformers import AutoTokenizer
+            hf_tokenizer = AutoTokenizer.from_pretrained(name)
+            return f"hf:{name}", lambda text: len(hf_tokenizer.encode(text, add_special_tokens=False))
+        return cls.HEURISTIC_TOKENIZER, cls._heuristic_count
+    
+    @staticmethod
+    def _entry_text(msg: Dict) -> tuple:
+        return msg.get('user', msg.get('content', '')), msg.get('assistant', '')
+    
+    @classmethod
+    def entry_fingerprint(cls, msg: Dict) -> str:
+        """Stable id of a history entry, used to mark where a stored summary ends"""
+        user_content, assistant_content = cls._entry_text(msg)
+        return hashlib.sha1(f"{user_content}\x00{assistant_content}".encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def mark_summarized(cls, conversation_history: List[Dict], fingerprint: Optional[str]) -> int:
+        """
+        Flag entries already folded into a stored summary
+        
+        The summary always covers a prefix of the conversation, so every entry up to
+        the last one matching the fingerprint is covered. If that entry is older than
+        the loaded window, nothing loaded is covered. Returns the number flagged.
+        """
+        if not fingerprint:
+            return 0
+        for i in range(len(conversation_history) - 1, -1, -1):
+            if cls.entry_fingerprint(conversation_history[i]) == fingerprint:
+                for msg in conversation_history[:i + 1]:
+                    msg['summarized'] = True
+                return i + 1
+        return 0
+    
+    @classmethod
+    def count_message_tokens(cls, msg: Dict, model_id: str = "default") -> int:
+        """Token count of a history entry, cached on the entry per tokenizer"""
+        name, count = cls.get_tokenizer(model_id)
+        counts = msg.get('token_counts')
+        if counts and name in counts:
+            return counts[name]
+        
+        user_content, assistant_content = cls._entry_text(msg)
+        tokens = (count(user_content) if user_content else 0) + (count(assistant_content) if assistant_content else 0)
+        if counts is None:
+            counts = msg['token_counts'] = {}
+        counts[name] = tokens
+        return tokens
+    
+    @classmethod
+    def split_history(
         cls,
         conversation_history: List[Dict],
         model_id: str = "default",
         system_prompt: str = "",
         current_message: str = "",
-        max_messages: Optional[int] = None
-    ) -> List[Dict]:
+        max_messages: Optional[int] = None,
+        reserved_tokens: int = 0
+    ) -> tuple:
         """
-        Get conversation history with smart truncation based on:
-        1. Model context limit
-        2. Message recency (recent messages prioritized)
-        3. Message importance (longer messages may be summarized)
+        Split history into (dropped, kept) so that kept is the longest
+        recent suffix fitting the model's budget. Linear in history length.
         """
         if not conversation_history:
-            return []
+            return [], []
         
         context_limit = cls.MODEL_CONTEXT_LIMITS.get(model_id, cls.MODEL_CONTEXT_LIMITS["default"])
         available_tokens = int(context_limit * cls.TARGET_USAGE)
         
         # Reserve tokens for system prompt and current message
-        reserved_tokens = cls.estimate_tokens(system_prompt) + cls.estimate_tokens(current_message) + 500
-        available_tokens -= reserved_tokens
+        available_tokens -= (
+            cls.estimate_tokens(system_prompt, model_id)
+            + cls.estimate_tokens(current_message, model_id)
+            + 500 + reserved_tokens
+        )
         
         if available_tokens <= 0:
-            return []
+            return list(conversation_history), []
         
         # Apply max_messages limit if specified
-        if max_messages:
-            conversation_history = conversation_history[-max_messages:]
+        start = len(conversation_history) - max_messages if max_messages else 0
+        start = max(start, 0)
         
-        # Build history from most recent
-        result = []
+        # Suffix sums over cached counts: walk back from the newest entry
+        cut = len(conversation_history)
         used_tokens = 0
-        
-        for msg in reversed(conversation_history):
-            user_content = msg.get('user', msg.get('content', ''))
-            assistant_content = msg.get('assistant', '')
-            
-            msg_tokens = cls.estimate_tokens(user_content) + cls.estimate_tokens(assistant_content)
-            
+        while cut > start:
+            msg_tokens = cls.count_message_tokens(conversation_history[cut - 1], model_id)
             if used_tokens + msg_tokens > available_tokens:
                 break
-            
-            result.insert(0, msg)
             used_tokens += msg_tokens
+            cut -= 1
         
-        return result
+        return conversation_history[:cut], conversation_history[cut:]
+    
+    @classmethod
+    def get_smart_history(
+        cls,
+        conversation_history: List[Dict],
+        model_id: str = "default",
+        system_prompt: str = "",
+        current_message: str = "",
+        max_messages: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Get conversation history with smart truncation based on:
+        1. Model context limit (real tokenizer counts)
+        2. Message recency (recent messages prioritized)
+        """
+        _, kept = cls.split_history(
+            conversation_history, model_id, system_prompt, current_message, max_messages
+        )
+        return kept
+
+
+class _Flight:
+    """A single in-flight upstream call shared by identical requests"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _StreamFlight:
+    """
+    A single in-flight upstream stream shared by identical requests.
+
+    Chunks are buffered as they arrive so subscribers that join late replay
+    everything emitted so far, then follow the live stream. Whichever
+    subscriber runs out of buffered chunks first pulls the next one from
+    upstream, so the stream keeps flowing even if the first caller stops
+    consuming. SingleFlight counts subscribers and abandon()s the flight
+    when the last one leaves before the end.
+    """
+
+    def __init__(self, source: Generator[str, None, None], on_finish: Callable[[], None]):
+        self._source = source
+        self._on_finish = on_finish
+        self._cond = threading.Condition()
+        self._chunks: List[str] = []
+        self._pumping = False
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self.subscribers = 0  # guarded by the owning SingleFlight's lock
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def subscribe(self, on_leave: Callable[[], None]) -> Generator[str, None, None]:
+        """
+        New subscriber; on_leave runs once when it finishes, is closed, or
+        is garbage collected (including before its first chunk)
+        """
+        left = []
+
+        def leave():
+            if not left:
+                left.append(True)
+                on_leave()
+
+        subscriber = self._follow(leave)
+        weakref.finalize(subscriber, leave)
+        return subscriber
+
+    def abandon(self):
+        """Close the upstream stream; nobody is left to read it"""
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._cond.notify_all()
+        try:
+            self._source.close()
+        except Exception as e:
+            logger.warning(f"[SingleFlight] Closing abandoned stream failed: {e}")
+
+    def _follow(self, leave: Callable[[], None]) -> Generator[str, None, None]:
+        try:
+            yield from self._replay_and_pump()
+        finally:
+            leave()
+
+    def _replay_and_pump(self) -> Generator[str, None, None]:
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done and self._pumping:
+                    self._cond.wait()
+
+                if index < len(self._chunks):
+                    chunk = self._chunks[index]
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    chunk = None
+                    self._pumping = True
+
+            if chunk is not None:
+                index += 1
+                yield chunk
+                continue
+
+            self._pump()
+
+    def _pump(self):
+        """Pull one chunk from upstream (called by exactly one subscriber at a time)"""
+        finished = False
+        try:
+            chunk = next(self._source)
+        except StopIteration:
+            finished = True
+            error = None
+        except BaseException as e:
+            finished = True
+            error = e
+
+        with self._cond:
+            if finished:
+                self._done = True
+                self._error = error
+            else:
+                self._chunks.append(chunk)
+            self._pumping = False
+            self._cond.notify_all()
+
+        if finished:
+            self._on_finish()
+
+
+class SingleFlight:
+    """
+    Request coalescing for identical in-flight LLM calls.
+
+    Concurrent callers with the same key share one upstream call: the first
+    caller (leader) executes it and every other caller waits for and receives
+    the same result or exception. Streams are shared via _StreamFlight.
+    Keys are forgotten as soon as the call finishes, so this never serves
+    stale data - caching is ResponseCache's job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+        self.streams_abandoned = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable key from request parameters"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers with the same key"""
+        with self._lock:
+            flight = self._calls.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._calls[key] = _Flight()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            flight.done.set()
+
+    def stream(self, key: str, fn: Callable[[], Generator[str, None, None]]) -> Generator[str, None, None]:
+        """
+        Share one upstream stream between concurrent callers with the same key
+
+        If every subscriber leaves before the stream ends, the upstream
+        generator is closed and the key forgotten.
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is not None:
+                self.stream_coalesced += 1
+            else:
+                flight = _StreamFlight(fn(), lambda: self._forget_stream(key, flight))
+                self._streams[key] = flight
+                self.stream_leaders += 1
+            flight.subscribers += 1
+        return flight.subscribe(lambda: self._unsubscribe(key, flight))
+
+    def _unsubscribe(self, key: str, flight: _StreamFlight):
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned:
+                # Under the lock, so no new subscriber can join a closing flight
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                self.streams_abandoned += 1
+        if abandoned:
+            flight.abandon()
+
+    def _forget_stream(self, key: str, flight: _StreamFlight):
+        with self._lock:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+        with self._lock:
+            total = self.leaders + self.coalesced
+            stream_total = self.stream_leaders + self.stream_coalesced
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'stream_leaders': self.stream_leaders,
+                'stream_coalesced': self.stream_coalesced,
+                'in_flight': len(self._calls),
+                'streams_in_flight': len(self._streams),
+                'streams_abandoned': self.streams_abandoned,
+                'coalesced_percentage': round(self.coalesced / total * 100, 2) if total > 0 else 0,
+                'stream_coalesced_percentage': round(self.stream_coalesced / stream_total * 100, 2) if stream_total > 0 else 0,
+            }
+
+
+# Shared across all handlers so identical prompts coalesce regardless of which agent sent them
+_single_flight = SingleFlight()
+
+
+def get_coalescing_stats() -> Dict[str, Any]:
+    """Get request coalescing statistics"""
+    return _single_flight.get_stats()
 
 
 class BaseModelChat(ABC):
@@ -228,17 +625,61 @@ class BaseModelChat(ABC):
         
         return system_prompt
     
+    def summarize_history(self, previous_summary: Optional[str], dropped: List[Dict]) -> Optional[str]:
+        """Fold messages that no longer fit the context window into a rolling summary"""
+        transcript = []
+        for msg in dropped:
+            user_content, assistant_content = ContextWindowManager._entry_text(msg)
+            if user_content:
+                transcript.append(f"User: {user_content[:2000]}")
+            if assistant_content:
+                transcript.append(f"Assistant: {assistant_content[:2000]}")
+        
+        prompt = "Update the running summary of this conversation with the new messages. " \
+                 "Keep names, facts, decisions and open questions; be concise."
+        if previous_summary:
+            prompt += f"\n\nCurrent summary:\n{previous_summary}"
+        prompt += "\n\nNew messages:\n" + "\n".join(transcript)
+        
+        try:
+            with span('provider.summarize', **self._span_attributes()):
+                return self._call_api(
+                    [{"role": "user", "content": prompt}],
+                    0.3,
+                    ContextWindowManager.SUMMARY_MAX_TOKENS
+                )
+        except Exception as e:
+            logger.warning(f"[{self.config.name}] History summary failed: {e}")
+            return None
+    
     def build_messages(self, ctx: ChatContext, system_prompt: str) -> List[Dict]:
         """Build message list for API call"""
         messages = [{"role": "system", "content": system_prompt}]
         
         # Get smart history
-        history_to_use = ctx.history if ctx.history else ContextWindowManager.get_smart_history(
-            ctx.conversation_history,
-            model_id=self.config.model_id,
-            system_prompt=system_prompt,
-            current_message=ctx.message
-        )
+        if ctx.history:
+            history_to_use = ctx.history
+        else:
+            dropped, history_to_use = ContextWindowManager.split_history(
+                ctx.conversation_history,
+                model_id=self.config.model_id,
+                system_prompt=system_prompt,
+                current_message=ctx.message,
+                reserved_tokens=ContextWindowManager.SUMMARY_MAX_TOKENS if ctx.summarize_dropped else 0
+            )
+            if dropped and ctx.summarize_dropped:
+                pending = [msg for msg in dropped if not msg.get('summarized')]
+                if pending:
+                    summary = self.summarize_history(ctx.history_summary, pending)
+                    if summary:
+                        ctx.history_summary = summary
+                        for msg in pending:
+                            msg['summarized'] = True
+                if ctx.history_summary:
+                    messages.append({
+                        "role": "system",
+                        "content": f"Summary of the earlier conversation:\n{ctx.history_summary}"
+                    })
         
         for hist in history_to_use:
             if 'role' in hist and 'content' in hist:
@@ -251,6 +692,63 @@ class BaseModelChat(ABC):
         messages.append({"role": "user", "content": ctx.message})
         return messages
     
+    def _flight_key(self, messages: List[Dict], temperature: float, max_tokens: int, stream: bool) -> str:
+        return SingleFlight.make_key(
+            self.config.provider.value, self.config.base_url, self.config.model_id,
+            messages, temperature, max_tokens, stream
+        )
+    
+    def _span_attributes(self) -> Dict[str, Any]:
+        return {'provider': self.config.provider.value, 'model': self.config.name}
+    
+    def _request_api(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """Call the API, sharing the upstream call with identical in-flight requests"""
+        def call():
+            with provider_slot(self.config.provider.value):
+                return self._call_api(messages, temperature, max_tokens)
+        
+        # One span for every _call_api implementation (includes coalescing waits)
+        start = time.perf_counter()
+        with span('provider.call', **self._span_attributes()):
+            if not self.config.coalesce_requests:
+                content = call()
+            else:
+                content = _single_flight.do(self._flight_key(messages, temperature, max_tokens, False), call)
+        model_latency.labels(model=self.config.name, provider=self.config.provider.value).observe(
+            time.perf_counter() - start
+        )
+        return content
+    
+    def _stream_api(self, messages: List[Dict], temperature: float, max_tokens: int) -> Generator[str, None, None]:
+        """Stream from the API; late joiners replay chunks already emitted"""
+        # Started here, inside the request context; chunks may be consumed later
+        stream_span = start_span('provider.stream', **self._span_attributes())
+        if not self.config.coalesce_requests:
+            chunks = self._call_api_stream(messages, temperature, max_tokens)
+        else:
+            chunks = _single_flight.stream(
+                self._flight_key(messages, temperature, max_tokens, True),
+                lambda: self._call_api_stream(messages, temperature, max_tokens)
+            )
+        return self._traced_stream(chunks, stream_span)
+    
+    @staticmethod
+    def _traced_stream(chunks: Generator[str, None, None], stream_span) -> Generator[str, None, None]:
+        error = None
+        count = 0
+        try:
+            for chunk in chunks:
+                count += 1
+                yield chunk
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            stream_span.set_attribute('chunks', count)
+            stream_span.end(error)
+    
     def chat(self, ctx: ChatContext, prompts_getter: Callable, stream: bool = False) -> ChatResponse:
         """Execute chat with retry logic"""
         system_prompt = self.build_system_prompt(ctx, prompts_getter)
@@ -266,9 +764,9 @@ class BaseModelChat(ABC):
             try:
                 if stream and self.config.supports_streaming:
                     # Return generator for streaming
-                    return self._call_api_stream(messages, temperature, max_tokens)
+                    return self._stream_api(messages, temperature, max_tokens)
                 else:
-                    content = self._call_api(messages, temperature, max_tokens)
+                    content = self._request_api(messages, temperature, max_tokens)
                     return ChatResponse(
                         content=content,
                         model=self.config.name,
@@ -310,10 +808,7 @@ class OpenAICompatibleChat(BaseModelChat):
     
     def __init__(self, config: ModelConfig):
         super().__init__(config)
-        self.client = openai.OpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url if config.base_url else None
-        )
+        self.client = get_openai_client(config.provider.value, config.api_key, config.base_url or None)
     
     def _call_api(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
         response = self.client.chat.completions.create(
@@ -341,7 +836,7 @@ class QwenChat(BaseModelChat):
     """Chat implementation for Qwen API"""
     
     def _call_api(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
-        response = requests.post(
+        response = get_http_session().post(
             "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {self.config.api_key}",
@@ -361,7 +856,7 @@ class QwenChat(BaseModelChat):
         raise Exception(f"Qwen API error: {response.status_code}")
     
     def _call_api_stream(self, messages: List[Dict], temperature: float, max_tokens: int) -> Generator[str, None, None]:
-        response = requests.post(
+        response = get_http_session().post(
             "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {self.config.api_key}",
@@ -417,7 +912,7 @@ class BloomVNChat(BaseModelChat):
     def _call_api(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
         conversation = self._build_conversation(messages)
         
-        response = requests.post(
+        response = get_http_session().post(
             "https://api-inference.huggingface.co/models/BlossomsAI/BloomVN-8B-chat",
             headers={"Authorization": f"Bearer {self.config.api_key}"},
             json={
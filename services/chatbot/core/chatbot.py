@@ -291,8 +291,9 @@ class ChatbotAgent:
              history=None, memories=None, language='vi', custom_prompt=None):
         """Main chat method"""
         # Save user message to MongoDB
+        user_message = None
         if MONGODB_ENABLED and self.conversation_id and history is None:
-            save_message_to_db(
+            user_message = save_message_to_db(
                 conversation_id=self.conversation_id,
                 role='user',
                 content=message,
@@ -337,7 +338,8 @@ class ChatbotAgent:
                     conversation_id=self.conversation_id,
                     role='assistant',
                     content=response,
-                    metadata={'model': model, 'thinking_process': thinking_process}
+                    metadata={'model': model, 'thinking_process': thinking_process},
+                    parent_message_id=user_message['_id'] if user_message else None
                 )
         
         return {'response': response, 'thinking_process': thinking_process}
@@ -18,7 +18,7 @@ if str(CHATBOT_DIR) not in sys.path:
 from core.config import (
     OPENAI_API_KEY, DEEPSEEK_API_KEY, GROK_API_KEY,
     QWEN_API_KEY, HUGGINGFACE_API_KEY,
-    SYSTEM_PROMPTS, get_system_prompts
+    SYSTEM_PROMPTS, get_system_prompts, HISTORY_SUMMARY_ENABLED
 )
 from core.extensions import (
     MONGODB_ENABLED, LOCALMODELS_AVAILABLE, model_loader,
@@ -27,6 +27,7 @@ from core.extensions import (
 )
 from core.db_helpers import (
     load_conversation_history, save_message_to_db,
+    load_history_summary, save_history_summary,
     get_user_id_from_session, set_active_conversation
 )
 from core.base_chat import (
@@ -160,6 +161,7 @@ class ChatbotAgent:
     
     def __init__(self, conversation_id=None):
         self.conversation_history: List[Dict] = []
+        self.history_summary: Optional[str] = None
         self.current_model = 'grok'
         self.conversation_id = conversation_id
         self.registry = get_model_registry()
@@ -167,6 +169,24 @@ class ChatbotAgent:
         
         if MONGODB_ENABLED and conversation_id:
             self.conversation_history = load_conversation_history(conversation_id)
+            stored = load_history_summary(conversation_id)
+            if stored:
+                self.history_summary = stored.get('text')
+                ContextWindowManager.mark_summarized(self.conversation_history, stored.get('through'))
+    
+    def _update_summary(self, ctx: ChatContext):
+        """Keep the rolling summary from a finished request and persist it when it changed"""
+        if not ctx.history_summary or ctx.history_summary == self.history_summary:
+            return
+        self.history_summary = ctx.history_summary
+        
+        if MONGODB_ENABLED and self.conversation_id:
+            covered = [msg for msg in self.conversation_history if msg.get('summarized')]
+            save_history_summary(
+                self.conversation_id,
+                self.history_summary,
+                ContextWindowManager.entry_fingerprint(covered[-1]) if covered else None
+            )
     
     def _build_context(
         self,
@@ -187,7 +207,9 @@ class ChatbotAgent:
             custom_prompt=custom_prompt,
             history=history,
             memories=memories,
-            conversation_history=self.conversation_history
+            conversation_history=self.conversation_history,
+            summarize_dropped=HISTORY_SUMMARY_ENABLED,
+            history_summary=self.history_summary
         )
     
     def _chat_with_model(
@@ -233,6 +255,7 @@ class ChatbotAgent:
         
         # Execute chat
         result = handler.chat(ctx, get_system_prompts, stream=stream)
+        self._update_summary(ctx)
         
         # Cache successful non-streaming responses
         if not stream and isinstance(result, ChatResponse) and result.success:
@@ -268,8 +291,9 @@ class ChatbotAgent:
         ctx = self._build_context(message, context, deep_thinking, history, memories, language, custom_prompt)
         
         # Save user message if using MongoDB
+        user_message = None
         if MONGODB_ENABLED and self.conversation_id and history is None:
-            save_message_to_db(
+            user_message = save_message_to_db(
                 conversation_id=self.conversation_id,
                 role='user',
                 content=message,
@@ -293,7 +317,8 @@ class ChatbotAgent:
                     yield chunk
                 
                 # Save to history
-                self._save_to_history(message, response.content, model, history)
+                self._save_to_history(message, response.content, model, history,
+                                      parent_message_id=user_message['_id'] if user_message else None)
             return
         
         # Stream the response
@@ -302,9 +327,11 @@ class ChatbotAgent:
             for chunk in handler.chat(ctx, get_system_prompts, stream=True):
                 full_response += chunk
                 yield chunk
+            self._update_summary(ctx)
             
             # Save to history after streaming completes
-            self._save_to_history(message, full_response, model, history)
+            self._save_to_history(message, full_response, model, history,
+                                  parent_message_id=user_message['_id'] if user_message else None)
             
         except Exception as e:
             logger.error(f"[{model}] Streaming error: {e}")
@@ -316,23 +343,33 @@ class ChatbotAgent:
         response: str,
         model: str,
         history: Optional[List[Dict]] = None,
-        thinking_process: Optional[str] = None
+        thinking_process: Optional[str] = None,
+        parent_message_id: Optional[str] = None
     ):
-        """Save message and response to history"""
+        """Save message and response to history (reply linked to the user message)"""
         if history is None:
-            self.conversation_history.append({
+            entry = {
                 'user': message,
                 'assistant': response,
                 'timestamp': datetime.now().isoformat(),
                 'model': model
-            })
+            }
+            # Count tokens once at save time; the count is cached on the entry
+            config = self.registry.get_config(model)
+            ContextWindowManager.count_message_tokens(entry, config.model_id if config else 'default')
+            self.conversation_history.append(entry)
             
             if MONGODB_ENABLED and self.conversation_id:
                 save_message_to_db(
                     conversation_id=self.conversation_id,
                     role='assistant',
                     content=response,
-                    metadata={'model': model, 'thinking_process': thinking_process}
+                    metadata={
+                        'model': model,
+                        'thinking_process': thinking_process,
+                        'token_counts': entry['token_counts']
+                    },
+                    parent_message_id=parent_message_id
                 )
     
     def chat(
@@ -371,8 +408,9 @@ class ChatbotAgent:
         ctx = self._build_context(message, context, deep_thinking, history, memories, language, custom_prompt)
         
         # Save user message
+        user_message = None
         if MONGODB_ENABLED and self.conversation_id and history is None:
-            save_message_to_db(
+            user_message = save_message_to_db(
                 conversation_id=self.conversation_id,
                 role='user',
                 content=message,
@@ -398,7 +436,8 @@ class ChatbotAgent:
                 result_text = f"❌ Error: {response.error}"
             
             # Save to history
-            self._save_to_history(message, result_text, response.model, history, response.thinking_process)
+            self._save_to_history(message, result_text, response.model, history, response.thinking_process,
+                                  parent_message_id=user_message['_id'] if user_message else None)
             
             return {
                 'response': result_text,
@@ -503,6 +542,7 @@ class ChatbotAgent:
     def clear_history(self):
         """Clear conversation history"""
         self.conversation_history = []
+        self.history_summary = None
         
         if MONGODB_ENABLED and self.conversation_id:
             try:
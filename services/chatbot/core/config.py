@@ -31,6 +31,9 @@ GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 # Stable Diffusion
 SD_API_URL = os.getenv('SD_API_URL', 'http://127.0.0.1:7861')
 
+# Context window: fold messages that no longer fit into a rolling summary
+HISTORY_SUMMARY_ENABLED = os.getenv('HISTORY_SUMMARY_ENABLED', 'false').lower() == 'true'
+
 # Storage paths
 MEMORY_DIR = CHATBOT_DIR / 'data' / 'memory'
 MEMORY_DIR.mkdir(parents=True, exist_ok=True)
@@ -38,6 +41,13 @@ MEMORY_DIR.mkdir(parents=True, exist_ok=True)
 IMAGE_STORAGE_DIR = CHATBOT_DIR / 'Storage' / 'Image_Gen'
 IMAGE_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Write-behind message persistence (batched MongoDB writes off the /chat path)
+MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'true').lower() == 'true'
+MESSAGE_QUEUE_BATCH_SIZE = int(os.getenv('MESSAGE_QUEUE_BATCH_SIZE', '100'))
+MESSAGE_QUEUE_FLUSH_INTERVAL = float(os.getenv('MESSAGE_QUEUE_FLUSH_INTERVAL', '0.5'))
+MESSAGE_QUEUE_MAX_DEPTH = int(os.getenv('MESSAGE_QUEUE_MAX_DEPTH', '5000'))
+MESSAGE_JOURNAL_PATH = CHATBOT_DIR / 'data' / 'message_journal.jsonl'
+
 # System prompts (Vietnamese)
 SYSTEM_PROMPTS_VI = {
     'psychological': """Bạn là một trợ lý tâm lý chuyên nghiệp, thân thiện và đầy empathy.
@@ -12,8 +12,22 @@ if str(CHATBOT_DIR) not in sys.path:
     sys.path.insert(0, str(CHATBOT_DIR))
 
 from core.extensions import (
-    MONGODB_ENABLED, ConversationDB, MessageDB, MemoryDB
+    MONGODB_ENABLED, ConversationDB, MessageDB, MemoryDB, get_db, cache,
+    register_stats_provider
 )
+from core.config import MESSAGE_WRITE_BEHIND
+from core.history_service import HistoryService
+from core.message_queue import get_message_queue
+
+# Turn loader: one aggregation per cache miss, invalidated by MessageDB writes
+history_service = HistoryService(get_db, MessageDB, cache=cache)
+
+# Write-behind persistence shared with chatbot_main (one queue per process)
+message_queue = None
+if MONGODB_ENABLED and MESSAGE_WRITE_BEHIND:
+    message_queue = get_message_queue(get_db)
+    message_queue.add_flush_listener(MessageDB.notify_write)
+    register_stats_provider('message_queue', message_queue.get_stats)
 
 
 def get_user_id_from_session():
@@ -59,42 +73,57 @@ def load_conversation_history(conversation_id):
         return []
     
     try:
-        messages = MessageDB.get_messages(str(conversation_id), limit=50)
-        
-        history = []
-        temp_user = None
-        
-        for msg in messages:
-            if msg.get('role') == 'user':
-                temp_user = msg.get('content', '')
-            elif msg.get('role') == 'assistant' and temp_user:
-                history.append({
-                    'user': temp_user,
-                    'assistant': msg.get('content', ''),
-                    'timestamp': msg.get('created_at', ''),
-                    'model': msg.get('metadata', {}).get('model', 'unknown')
-                })
-                temp_user = None
-        
-        return history
+        return history_service.get_turns(str(conversation_id), limit=50)
         
     except Exception as e:
         logging.error(f"Error loading history: {e}")
         return []
 
 
-def save_message_to_db(conversation_id, role, content, metadata=None):
-    """Save message to MongoDB"""
+def load_history_summary(conversation_id):
+    """Load the rolling summary stored on the conversation ({'text', 'through'} or None)"""
+    if not MONGODB_ENABLED:
+        return None
+    
+    try:
+        conversation = ConversationDB.get_conversation(str(conversation_id))
+        return (conversation or {}).get('history_summary')
+    except Exception as e:
+        logging.error(f"Error loading history summary: {e}")
+        return None
+
+
+def save_history_summary(conversation_id, summary, through=None):
+    """Store the rolling summary with the conversation (through = fingerprint of the last covered turn)"""
+    if not MONGODB_ENABLED:
+        return False
+    
+    try:
+        return ConversationDB.update_conversation(
+            str(conversation_id),
+            {'history_summary': {'text': summary, 'through': through}}
+        )
+    except Exception as e:
+        logging.error(f"Error saving history summary: {e}")
+        return False
+
+
+def save_message_to_db(conversation_id, role, content, metadata=None, parent_message_id=None):
+    """Save message to MongoDB (assistant replies link to their user message via parent_message_id)"""
     if not MONGODB_ENABLED:
         return None
     
     try:
-        return MessageDB.create_message(
+        fields = dict(
             conversation_id=str(conversation_id),
             role=role,
             content=content,
-            metadata=metadata or {}
+            metadata=metadata or {},
+            parent_message_id=str(parent_message_id) if parent_message_id else None
         )
+        if message_queue is not None:
+            return message_queue.enqueue(MessageDB.build_message(**fields))
+        return MessageDB.add_message(**fields)
     except Exception as e:
         logging.error(f"Error saving message: {e}")
         return None
@@ -0,0 +1,31 @@
+"""
+Database optimizer utilities for core modules
+
+database/utils/optimizer.py is standalone, but importing it through the
+``database`` package pulls in the optional cache layer, so it is loaded by
+path here (same approach as core.extensions for the MongoDB modules).
+"""
+import importlib.util
+import sys
+
+from .config import CHATBOT_DIR
+
+_MODULE_NAME = 'chatbot_db_optimizer'
+
+
+def _load_optimizer():
+    if _MODULE_NAME in sys.modules:
+        return sys.modules[_MODULE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        _MODULE_NAME, CHATBOT_DIR / 'database' / 'utils' / 'optimizer.py'
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[_MODULE_NAME] = module
+    return module
+
+
+_optimizer = _load_optimizer()
+QueryOptimizer = _optimizer.QueryOptimizer
+BulkOperations = _optimizer.BulkOperations
+IndexManager = _optimizer.IndexManager
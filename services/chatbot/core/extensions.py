@@ -62,6 +62,7 @@ get_all_cache_stats = _response_cache_module.get_all_cache_stats
 # Load monitor
 _monitor_module = _load_root_config_module('root_monitor', 'monitor.py')
 register_monitor = _monitor_module.register_monitor
+register_stats_provider = _monitor_module.register_stats_provider
 
 
 # Load MongoDB config
@@ -0,0 +1,221 @@
+"""
+Conversation history service
+
+Loads a conversation's turns as ready-to-send {user, assistant} pairs with a
+single aggregation: the latest user messages joined to their replies through
+``$lookup`` on ``parent_message_id``. Results are cached per conversation in
+Redis (CacheManager) and invalidated by MessageDB writes.
+
+Replies stored before ``parent_message_id`` existed never join; conversations
+with such gaps are paired the old way, each assistant message answering the
+user message before it.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .db_optimizer import QueryOptimizer
+from .tracing import current_span, traced
+
+logger = logging.getLogger(__name__)
+
+HISTORY_CACHE_TTL = 1800      # seconds
+HISTORY_CACHE_TURNS = 50      # turns kept in the cached view
+
+
+def _object_id(value):
+    try:
+        from bson import ObjectId
+        return ObjectId(str(value))
+    except Exception:
+        return value
+
+
+def _timestamp(value) -> str:
+    return value.isoformat() if isinstance(value, datetime) else (value or '')
+
+
+class HistoryService:
+    """Single-query turn loader with a per-conversation Redis cache"""
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        message_db=None,
+        cache=None,
+        ttl: int = HISTORY_CACHE_TTL,
+        max_cached_turns: int = HISTORY_CACHE_TURNS
+    ):
+        """
+        Args:
+            get_db: Returns the MongoDB database
+            message_db: MessageDB class; its writes invalidate the cache
+            cache: CacheManager (optional, skipped when disabled)
+            ttl: Cache TTL in seconds
+            max_cached_turns: Turns fetched and cached per conversation
+        """
+        self.get_db = get_db
+        self.cache = cache
+        self.ttl = ttl
+        self.max_cached_turns = max_cached_turns
+        self.stats = {
+            'hits': 0, 'misses': 0, 'queries': 0, 'invalidations': 0, 'legacy_loads': 0
+        }
+        # Write generation per conversation: a write racing with a cache fill
+        # must not let the fill store the pre-write view
+        self._generations: Dict[str, int] = {}
+        if message_db is not None:
+            message_db.add_write_listener(self.invalidate)
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self.cache is not None and getattr(self.cache, 'enabled', False)
+
+    @staticmethod
+    def cache_key(conversation_id: str) -> str:
+        return f"history:{conversation_id}:turns"
+
+    @staticmethod
+    def build_pipeline(conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Aggregation returning the last `limit` user messages with their replies"""
+        return [
+            {'$match': {
+                'conversation_id': _object_id(conversation_id),
+                'role': 'user',
+                'is_edited': {'$ne': True}
+            }},
+            {'$sort': {'created_at': -1}},
+            {'$limit': limit},
+            *QueryOptimizer.build_lookup_pipeline(
+                from_collection='messages',
+                local_field='_id',
+                foreign_field='parent_message_id',
+                as_field='replies'
+            ),
+            {'$project': {
+                'content': 1,
+                'created_at': 1,
+                'replies.role': 1,
+                'replies.content': 1,
+                'replies.metadata': 1,
+                'replies.created_at': 1
+            }},
+            {'$sort': {'created_at': 1}}
+        ]
+
+    @staticmethod
+    def _replies(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [r for r in doc.get('replies') or [] if r.get('role') == 'assistant']
+
+    @staticmethod
+    def _make_turn(user_content: str, reply: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = reply.get('metadata') or {}
+        turn = {
+            'user': user_content,
+            'assistant': reply.get('content', ''),
+            'timestamp': _timestamp(reply.get('created_at')),
+            'model': metadata.get('model', 'unknown')
+        }
+        if metadata.get('token_counts'):
+            turn['token_counts'] = dict(metadata['token_counts'])
+        return turn
+
+    @classmethod
+    def to_turn(cls, doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Convert a joined user message into a turn (None if unanswered)"""
+        replies = cls._replies(doc)
+        if not replies:
+            return None
+        reply = max(replies, key=lambda r: r.get('created_at') or datetime.min)
+        return cls._make_turn(doc.get('content', ''), reply)
+
+    @classmethod
+    def pair_sequential(cls, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Pair chronologically ordered messages into turns
+
+        Replies with a ``parent_message_id`` go to that user message (latest
+        wins); replies without one answer the preceding unanswered user message.
+        """
+        users: List[Dict[str, Any]] = []
+        by_id: Dict[Any, Dict[str, Any]] = {}
+        waiting: Optional[Dict[str, Any]] = None
+        for msg in messages:
+            if msg.get('is_edited'):
+                continue
+            if msg.get('role') == 'user':
+                waiting = {'content': msg.get('content', ''), 'reply': None}
+                users.append(waiting)
+                by_id[msg.get('_id')] = waiting
+            elif msg.get('role') == 'assistant':
+                parent = msg.get('parent_message_id')
+                target = by_id.get(parent) if parent is not None else waiting
+                if target is None:
+                    continue
+                target['reply'] = msg
+                if target is waiting:
+                    waiting = None
+        return [cls._make_turn(u['content'], u['reply']) for u in users if u['reply']]
+
+    def query_legacy_turns(self, conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Sequential pairing over the latest messages (no parent links needed)"""
+        self.stats['legacy_loads'] += 1
+        cursor = self.get_db().messages.find(
+            {
+                'conversation_id': _object_id(conversation_id),
+                'role': {'$in': ['user', 'assistant']},
+                'is_edited': {'$ne': True}
+            },
+            {'role': 1, 'content': 1, 'metadata': 1, 'created_at': 1, 'parent_message_id': 1}
+        ).sort('created_at', -1).limit(2 * (limit + 1))
+        messages = list(cursor)[::-1]
+        return self.pair_sequential(messages)[-limit:]
+
+    def query_turns(self, conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Run the aggregation (one round trip)"""
+        self.stats['queries'] += 1
+        # +1: the newest user message is usually still waiting for its reply
+        docs = list(self.get_db().messages.aggregate(
+            self.build_pipeline(conversation_id, limit + 1)
+        ))
+        # An older question with no joined reply means replies saved without
+        # parent_message_id (written before the field existed)
+        if any(not self._replies(doc) for doc in docs[:-1]):
+            return self.query_legacy_turns(conversation_id, limit)
+        return [turn for turn in map(self.to_turn, docs) if turn][-limit:]
+
+    @traced('history.load')
+    def get_turns(self, conversation_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Last `limit` turns of a conversation, oldest first"""
+        conversation_id = str(conversation_id)
+        if limit <= 0:
+            return []
+        if not self.cache_enabled or limit > self.max_cached_turns:
+            return self.query_turns(conversation_id, limit)
+
+        key = self.cache_key(conversation_id)
+        cached = self.cache.get(key)
+        active = current_span()
+        if active is not None:
+            active.set_attribute('cache_hit', cached is not None)
+        if cached is not None:
+            self.stats['hits'] += 1
+            return cached[-limit:]
+
+        self.stats['misses'] += 1
+        generation = self._generations.get(conversation_id, 0)
+        turns = self.query_turns(conversation_id, self.max_cached_turns)
+        if self._generations.get(conversation_id, 0) == generation:
+            self.cache.set(key, turns, ttl=self.ttl)
+        return turns[-limit:]
+
+    def invalidate(self, conversation_id: str):
+        """Drop the cached view (called on every message write)"""
+        conversation_id = str(conversation_id)
+        self.stats['invalidations'] += 1
+        self._generations[conversation_id] = self._generations.get(conversation_id, 0) + 1
+        if self.cache_enabled:
+            self.cache.delete(self.cache_key(conversation_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, cache_enabled=self.cache_enabled)
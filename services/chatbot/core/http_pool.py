@@ -0,0 +1,271 @@
+"""
+HTTP Pool Module - Shared keep-alive connection pools and per-provider concurrency limits
+
+Provider SDK clients and HTTP sessions are created once per (provider, key,
+base_url) and reused, instead of opening a new TCP/TLS connection on every
+request. HTTP/2 is used for httpx-based clients when the `h2` package is
+installed. Async clients are bound to the event loop that created them, so
+they are pooled per loop.
+"""
+import os
+import queue
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Iterator
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = HTTPX_AVAILABLE
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+
+# Keep-alive pool size per provider client
+POOL_MAX_CONNECTIONS = int(os.getenv('PROVIDER_POOL_MAX_CONNECTIONS', '32'))
+POOL_MAX_KEEPALIVE = int(os.getenv('PROVIDER_POOL_MAX_KEEPALIVE', '16'))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('PROVIDER_POOL_KEEPALIVE_EXPIRY', '60'))
+
+# Max concurrent upstream requests per provider key (0 = unbounded)
+DEFAULT_PROVIDER_CONCURRENCY = int(os.getenv('PROVIDER_MAX_CONCURRENCY', '8'))
+PROVIDER_CONCURRENCY = {
+    'openai': int(os.getenv('OPENAI_MAX_CONCURRENCY', DEFAULT_PROVIDER_CONCURRENCY)),
+    'deepseek': int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', DEFAULT_PROVIDER_CONCURRENCY)),
+    'grok': int(os.getenv('GROK_MAX_CONCURRENCY', DEFAULT_PROVIDER_CONCURRENCY)),
+    'qwen': int(os.getenv('QWEN_MAX_CONCURRENCY', DEFAULT_PROVIDER_CONCURRENCY)),
+    'bloomvn': int(os.getenv('BLOOMVN_MAX_CONCURRENCY', 4)),
+}
+
+_lock = threading.Lock()
+_sync_clients: Dict[tuple, Any] = {}
+_http_session: Optional[requests.Session] = None
+_sync_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+# Per event loop: {'clients': {...}, 'aiohttp': session, 'slots': {...}}
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _concurrency_limit(provider: str) -> int:
+    return PROVIDER_CONCURRENCY.get(provider, DEFAULT_PROVIDER_CONCURRENCY)
+
+
+def _httpx_limits():
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+    )
+
+
+# ============================================================================
+# Sync clients (Flask request threads)
+# ============================================================================
+
+def get_openai_client(provider: str, api_key: str, base_url: Optional[str] = None) -> openai.OpenAI:
+    """Get the shared, pooled OpenAI-compatible client for a provider key"""
+    key = (provider, api_key, base_url)
+    client = _sync_clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            kwargs = {'api_key': api_key, 'base_url': base_url or None}
+            if HTTPX_AVAILABLE:
+                kwargs['http_client'] = httpx.Client(http2=HTTP2_AVAILABLE, limits=_httpx_limits())
+            client = _sync_clients[key] = openai.OpenAI(**kwargs)
+            logger.info(f"[HTTPPool] Created {provider} client (http2={HTTP2_AVAILABLE})")
+    return client
+
+
+def get_http_session() -> requests.Session:
+    """Get the shared keep-alive requests session for plain HTTP providers"""
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+
+    with _lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAX_CONNECTIONS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+    return _http_session
+
+
+@contextmanager
+def provider_slot(provider: str):
+    """Bound the number of concurrent sync upstream requests for a provider"""
+    limit = _concurrency_limit(provider)
+    if limit <= 0:
+        yield
+        return
+
+    slot = _sync_slots.get(provider)
+    if slot is None:
+        with _lock:
+            slot = _sync_slots.setdefault(provider, threading.BoundedSemaphore(limit))
+
+    with slot:
+        yield
+
+
+# ============================================================================
+# Async clients (pooled per event loop)
+# ============================================================================
+
+def _state_for_loop() -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        with _lock:
+            state = _loop_state.get(loop)
+            if state is None:
+                state = _loop_state[loop] = {'clients': {}, 'aiohttp': None, 'slots': {}}
+    return state
+
+
+def get_async_openai_client(provider: str, api_key: str, base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+    """Get the pooled AsyncOpenAI client for a provider key on the running loop"""
+    clients = _state_for_loop()['clients']
+    key = (provider, api_key, base_url)
+    client = clients.get(key)
+    if client is None:
+        kwargs = {'api_key': api_key, 'base_url': base_url or None}
+        if HTTPX_AVAILABLE:
+            kwargs['http_client'] = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=_httpx_limits())
+        client = clients[key] = openai.AsyncOpenAI(**kwargs)
+    return client
+
+
+def get_aiohttp_session():
+    """Get the keep-alive aiohttp session for the running loop"""
+    state = _state_for_loop()
+    session = state['aiohttp']
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_MAX_CONNECTIONS,
+            keepalive_timeout=POOL_KEEPALIVE_EXPIRY
+        )
+        session = state['aiohttp'] = aiohttp.ClientSession(connector=connector)
+    return session
+
+
+@asynccontextmanager
+async def async_provider_slot(provider: str):
+    """Bound the number of concurrent async upstream requests for a provider"""
+    limit = _concurrency_limit(provider)
+    if limit <= 0:
+        yield
+        return
+
+    slots = _state_for_loop()['slots']
+    slot = slots.get(provider)
+    if slot is None:
+        slot = slots[provider] = asyncio.Semaphore(limit)
+
+    async with slot:
+        yield
+
+
+async def close_async_clients():
+    """Close pooled async clients of the running loop (call before the loop stops)"""
+    loop = asyncio.get_running_loop()
+    state = _loop_state.pop(loop, None)
+    if not state:
+        return
+    for client in state['clients'].values():
+        await client.close()
+    if state['aiohttp'] is not None and not state['aiohttp'].closed:
+        await state['aiohttp'].close()
+
+
+# ============================================================================
+# Shared background event loop (keeps async pools alive across requests)
+# ============================================================================
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_STREAM_END = object()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Get the long-lived event loop that runs async provider calls for sync code"""
+    global _background_loop
+    if _background_loop is not None:
+        return _background_loop
+
+    with _lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='provider-io-loop', daemon=True)
+            thread.start()
+            _background_loop = loop
+    return _background_loop
+
+
+def run_coroutine(coro, timeout: Optional[float] = None):
+    """Run a coroutine on the background loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result(timeout)
+
+
+def iterate_async(agen: AsyncIterator) -> Iterator:
+    """
+    Consume an async generator from sync code, yielding items as they arrive.
+    Closing the returned generator cancels the async side.
+    """
+    items: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+            raise
+        finally:
+            items.put(_STREAM_END)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_background_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get connection pool statistics"""
+    return {
+        'http2': HTTP2_AVAILABLE,
+        'sync_clients': len(_sync_clients),
+        'event_loops': len(_loop_state),
+        'concurrency_limits': dict(PROVIDER_CONCURRENCY),
+    }
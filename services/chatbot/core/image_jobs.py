@@ -0,0 +1,530 @@
+"""
+Image generation jobs
+
+ComfyUIClient.generate_image holds a Flask worker for the whole render: it
+polls /history/{id} once a second for up to 300 s and then downloads the
+result, so a few concurrent generations exhaust the worker pool. Jobs move
+that work off the request path:
+
+- submit() returns a job id at once; the job waits in a priority lane
+  ('interactive' before 'batch'), FIFO within a lane
+- a dispatcher on the shared provider I/O loop sends at most max_running
+  prompts to ComfyUI, and at most per_user_running per user
+- one websocket listener on ComfyUI's /ws stream receives progress and
+  completion for every prompt; outputs are then fetched once from /history
+  and /view with the pooled aiohttp session
+- after a reconnect (and for prompts silent for poll_interval) running
+  prompts are reconciled against /history, so a missed message is not lost
+- finished jobs stay available for result_ttl seconds; events() streams
+  progress as SSE frames
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from .http_pool import AIOHTTP_AVAILABLE, get_aiohttp_session, get_background_loop
+from .streaming import KEEPALIVE_SECONDS, StreamEvent
+
+if AIOHTTP_AVAILABLE:
+    import aiohttp
+
+logger = logging.getLogger(__name__)
+
+LANES = ('interactive', 'batch')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, ERROR, CANCELLED)
+
+# Unknown prompt completions remembered (a completion can beat the /prompt response)
+EARLY_EVENTS_MAX = 256
+
+
+class JobLimitError(Exception):
+    """The user already has the maximum number of pending jobs"""
+
+
+@dataclass(eq=False)
+class ImageJob:
+    """One generation request and its result"""
+    id: str
+    user_id: str
+    kind: str
+    params: Dict[str, Any]
+    lane: str = 'interactive'
+    state: str = QUEUED
+    prompt_id: Optional[str] = None
+    progress: float = 0.0
+    image: Optional[bytes] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    updated_at: float = field(default_factory=time.monotonic)
+    version: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'lane': self.lane,
+            'state': self.state,
+            'progress': round(self.progress, 3),
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'has_image': self.image is not None,
+        }
+
+
+class ImageJobQueue:
+    """Priority lanes and per-user limits in front of one ComfyUI server"""
+
+    def __init__(
+        self,
+        client,
+        max_running: int = 2,
+        per_user_running: int = 1,
+        max_queued_per_user: int = 5,
+        job_timeout: float = 300.0,
+        result_ttl: float = 600.0,
+        poll_interval: float = 15.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        """
+        Args:
+            client: ComfyUIClient (builds workflows, gives api_url/ws_url)
+            max_running: Prompts submitted to ComfyUI at the same time
+            per_user_running: Prompts one user may have in ComfyUI at once
+            max_queued_per_user: Unfinished jobs per user before submit is refused
+            job_timeout: Seconds a prompt may run before the job fails
+            result_ttl: Seconds a finished job (and its image) is kept
+            poll_interval: Silence after which a running prompt is checked in /history
+            loop: Event loop to run on (default: the shared provider I/O loop)
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("aiohttp is required for image jobs")
+        self.client = client
+        self.client_id = uuid.uuid4().hex
+        self.max_running = max_running
+        self.per_user_running = per_user_running
+        self.max_queued_per_user = max_queued_per_user
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.loop = loop or get_background_loop()
+
+        self._jobs: Dict[str, ImageJob] = {}
+        self._lanes: Dict[str, Deque[ImageJob]] = {lane: deque() for lane in LANES}
+        self._by_prompt: Dict[str, ImageJob] = {}
+        self._early: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._fetching: set = set()
+        self._running = 0
+        self._running_per_user: Dict[str, int] = {}
+        self._executing_prompt: Optional[str] = None
+        self._cond = threading.Condition()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0,
+                       'rejected': 0, 'reconnects': 0, 'reconciled': 0}
+
+        self._closed = False
+        self._tasks: List[asyncio.Future] = []
+        self._connected: Optional[asyncio.Event] = None
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(10)
+
+    # ------------------------------------------------------------------
+    # Public API (any thread)
+    # ------------------------------------------------------------------
+
+    def submit(self, user_id: str, params: Dict[str, Any], kind: str = 'txt2img',
+               lane: str = 'interactive') -> ImageJob:
+        """Queue a job and return at once"""
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane '{lane}', expected one of {LANES}")
+        if kind not in ('txt2img', 'img2img'):
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job = ImageJob(id=uuid.uuid4().hex, user_id=str(user_id), kind=kind, params=params, lane=lane)
+        with self._cond:
+            pending = sum(1 for j in self._jobs.values() if j.user_id == job.user_id and not j.finished)
+            if pending >= self.max_queued_per_user:
+                self._stats['rejected'] += 1
+                raise JobLimitError(f"Too many pending image jobs ({pending}/{self.max_queued_per_user})")
+            self._jobs[job.id] = job
+            self._lanes[lane].append(job)
+            self._stats['submitted'] += 1
+        self.loop.call_soon_threadsafe(self._dispatch)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImageJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: ImageJob) -> Optional[int]:
+        """Jobs ahead of a queued job (higher lanes included), None once it started"""
+        with self._cond:
+            if job.state != QUEUED:
+                return None
+            ahead = 0
+            for lane in LANES:
+                if lane == job.lane:
+                    return ahead + list(self._lanes[lane]).index(job)
+                ahead += len(self._lanes[lane])
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        asyncio.run_coroutine_threadsafe(self._cancel(job), self.loop).result(10)
+        return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[ImageJob]:
+        """Block until the job finishes (for callers that still want a sync result)"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and not job.finished:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return job
+
+    def events(self, job_id: str) -> Iterator[str]:
+        """SSE frames: 'state' on every change, then 'complete' or 'error'"""
+        job = self.get(job_id)
+        if job is None:
+            yield StreamEvent(event="error", data=json.dumps({"error": "Job not found"})).format()
+            return
+        seen = -1
+        while True:
+            with self._cond:
+                if job.version == seen and not job.finished:
+                    self._cond.wait(KEEPALIVE_SECONDS)
+                if job.version == seen and not job.finished:
+                    snapshot = None
+                else:
+                    seen = job.version
+                    snapshot = job.to_dict()
+            if snapshot is None:
+                yield ": keepalive\n\n"
+                continue
+            if snapshot['state'] == QUEUED:
+                snapshot['position'] = self.position(job)
+            event = {DONE: 'complete', ERROR: 'error', CANCELLED: 'error'}.get(snapshot['state'], 'state')
+            yield StreamEvent(event=event, data=json.dumps(snapshot), id=str(seen)).format()
+            if event != 'state':
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                'queued': {lane: len(jobs) for lane, jobs in self._lanes.items()},
+                'running': self._running,
+                'jobs': len(self._jobs),
+                'connected': bool(self._connected and self._connected.is_set()),
+            }
+
+    def close(self, timeout: float = 5.0):
+        """Stop the listener and watchdog"""
+        if self._closed:
+            return
+        self._closed = True
+
+        async def stop():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(timeout)
+
+    # ------------------------------------------------------------------
+    # Event loop side
+    # ------------------------------------------------------------------
+
+    async def _start(self):
+        self._connected = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._listen()), asyncio.ensure_future(self._watchdog())]
+
+    def _update(self, job: ImageJob, **changes):
+        with self._cond:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            job.version += 1
+            job.updated_at = time.monotonic()
+            self._cond.notify_all()
+
+    def _dispatch(self):
+        """Start queued jobs while there are free slots (lane order, FIFO, per-user cap)"""
+        started = []
+        with self._cond:
+            for lane in LANES:
+                queue = self._lanes[lane]
+                for job in list(queue):
+                    if self._running >= self.max_running:
+                        break
+                    if self._running_per_user.get(job.user_id, 0) >= self.per_user_running:
+                        continue
+                    queue.remove(job)
+                    self._running += 1
+                    self._running_per_user[job.user_id] = self._running_per_user.get(job.user_id, 0) + 1
+                    job.state = RUNNING
+                    job.started_at = time.time()
+                    started.append(job)
+        for job in started:
+            self._update(job)
+            asyncio.ensure_future(self._run(job))
+
+    def _release(self, job: ImageJob):
+        with self._cond:
+            self._running -= 1
+            count = self._running_per_user.get(job.user_id, 1) - 1
+            if count:
+                self._running_per_user[job.user_id] = count
+            else:
+                self._running_per_user.pop(job.user_id, None)
+        if job.prompt_id:
+            self._by_prompt.pop(job.prompt_id, None)
+        self._dispatch()
+
+    def _finish(self, job: ImageJob, state: str, **changes):
+        if job.finished:
+            return
+        self._update(job, state=state, finished_at=time.time(), **changes)
+        self._stats[{DONE: 'completed', ERROR: 'failed', CANCELLED: 'cancelled'}[state]] += 1
+        self._release(job)
+
+    async def _run(self, job: ImageJob):
+        """Build the workflow and submit it; completion arrives over the websocket"""
+        try:
+            build = (self.client.build_img2img_workflow if job.kind == 'img2img'
+                     else self.client.build_txt2img_workflow)
+            # Model lookup and img2img upload are blocking client calls
+            workflow = await asyncio.get_running_loop().run_in_executor(None, lambda: build(**job.params))
+            if job.finished:
+                return
+            # Listen before queueing so no event for this prompt is missed
+            await asyncio.wait_for(self._connected.wait(), timeout=10)
+            session = get_aiohttp_session()
+            async with session.post(f"{self.client.api_url}/prompt",
+                                    json={'prompt': workflow, 'client_id': self.client_id},
+                                    timeout=aiohttp.ClientTimeout(total=30)) as response:
+                body = await response.json(content_type=None)
+                if response.status != 200 or 'prompt_id' not in body:
+                    raise RuntimeError(f"ComfyUI rejected prompt: {body.get('error', response.status)}")
+            prompt_id = body['prompt_id']
+            if job.finished:  # cancelled while the prompt was being queued
+                await self._post('/queue', {'delete': [prompt_id]})
+                return
+            self._by_prompt[prompt_id] = job
+            self._update(job, prompt_id=prompt_id)
+            early = self._early.pop(prompt_id, None)
+            if early is not None:
+                await self._on_message(early)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[ImageJobs] Job {job.id} failed to start: {e}")
+            self._finish(job, ERROR, error=str(e) or type(e).__name__)
+
+    async def _cancel(self, job: ImageJob):
+        with self._cond:
+            if job.state == QUEUED:
+                self._lanes[job.lane].remove(job)
+                job.state = CANCELLED
+                job.finished_at = time.time()
+                self._stats['cancelled'] += 1
+                job.version += 1
+                self._cond.notify_all()
+                return
+        await self._remove_prompt(job)
+        self._finish(job, CANCELLED)
+    
+    async def _remove_prompt(self, job: ImageJob):
+        """Drop the job's prompt from ComfyUI's queue, interrupting it if it is executing"""
+        if not job.prompt_id:
+            return
+        try:
+            await self._post('/queue', {'delete': [job.prompt_id]})
+            # /interrupt stops whatever is executing, so only when it is this prompt
+            if self._executing_prompt == job.prompt_id:
+                await self._post('/interrupt', {'prompt_id': job.prompt_id})
+        except aiohttp.ClientError as e:
+            logger.warning(f"[ImageJobs] Removing {job.prompt_id} from ComfyUI failed: {e}")
+
+    async def _post(self, path: str, payload: Dict[str, Any]):
+        """POST a control request to ComfyUI, releasing the connection to the pool"""
+        async with get_aiohttp_session().post(f"{self.client.api_url}{path}", json=payload,
+                                              timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 200:
+                logger.warning(f"[ImageJobs] ComfyUI {path} returned {response.status}")
+
+    async def _listen(self):
+        """Keep one websocket open to ComfyUI, reconnecting with backoff"""
+        backoff = 0.5
+        url = f"{self.client.ws_url}?clientId={self.client_id}"
+        while not self._closed:
+            try:
+                async with get_aiohttp_session().ws_connect(url, heartbeat=30) as ws:
+                    self._connected.set()
+                    backoff = 0.5
+                    await self._reconcile(list(self._by_prompt.values()))
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            await self._on_message(json.loads(msg.data))
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+                        # BINARY frames are live previews
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[ImageJobs] ComfyUI websocket error: {e}")
+            if self._connected.is_set():
+                self._stats['reconnects'] += 1
+            self._connected.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _on_message(self, message: Dict[str, Any]):
+        kind = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if kind == 'executing':
+            self._executing_prompt = prompt_id if data.get('node') is not None else None
+        if not prompt_id:
+            return
+        job = self._by_prompt.get(prompt_id)
+        finished = kind == 'execution_success' or (kind == 'executing' and data.get('node') is None)
+        if job is None:
+            if finished or kind in ('execution_error', 'execution_interrupted'):
+                self._early[prompt_id] = message
+                while len(self._early) > EARLY_EVENTS_MAX:
+                    self._early.popitem(last=False)
+            return
+        if kind == 'progress' and data.get('max'):
+            self._update(job, progress=data['value'] / data['max'])
+        elif finished:
+            await self._complete(job)
+        elif kind == 'execution_error':
+            self._finish(job, ERROR, error=data.get('exception_message') or 'ComfyUI execution error')
+        elif kind == 'execution_interrupted':
+            self._finish(job, CANCELLED)
+        else:
+            self._update(job)
+
+    async def _fetch_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        session = get_aiohttp_session()
+        async with session.get(f"{self.client.api_url}/history/{prompt_id}",
+                               timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 200:
+                return None
+            return (await response.json(content_type=None)).get(prompt_id)
+
+    async def _complete(self, job: ImageJob, entry: Optional[Dict[str, Any]] = None):
+        """Fetch outputs once the prompt finished"""
+        if job.finished or job.id in self._fetching:
+            return
+        self._fetching.add(job.id)
+        try:
+            entry = entry or await self._fetch_history(job.prompt_id)
+            images = self.client.image_params((entry or {}).get('outputs', {}))
+            if not images:
+                raise RuntimeError('ComfyUI returned no image')
+            session = get_aiohttp_session()
+            async with session.get(f"{self.client.api_url}/view", params=images[0],
+                                   timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"Image download failed ({response.status})")
+                image = await response.read()
+            self._finish(job, DONE, image=image, progress=1.0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[ImageJobs] Fetching result of {job.prompt_id} failed: {e}")
+            self._finish(job, ERROR, error=str(e))
+        finally:
+            self._fetching.discard(job.id)
+
+    async def _reconcile(self, jobs: List[ImageJob]):
+        """Complete prompts whose finish message was missed"""
+        for job in jobs:
+            if job.finished or not job.prompt_id:
+                continue
+            try:
+                entry = await self._fetch_history(job.prompt_id)
+            except Exception as e:
+                logger.warning(f"[ImageJobs] History check for {job.prompt_id} failed: {e}")
+                continue
+            if not entry:
+                continue
+            status = (entry.get('status') or {}).get('status_str')
+            self._stats['reconciled'] += 1
+            if status == 'error':
+                self._finish(job, ERROR, error='ComfyUI execution error')
+            else:
+                await self._complete(job, entry)
+
+    async def _watchdog(self):
+        """Time out stuck prompts, check silent ones in /history, drop expired results"""
+        interval = min(self.poll_interval, 5.0)
+        while not self._closed:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            running = [job for job in list(self._by_prompt.values()) if not job.finished]
+            for job in running:
+                if job.started_at and time.time() - job.started_at > self.job_timeout:
+                    # Otherwise ComfyUI keeps rendering after the slot is handed on
+                    await self._remove_prompt(job)
+                    self._finish(job, ERROR, error='Generation timeout')
+            silent = [job for job in running if not job.finished and now - job.updated_at >= self.poll_interval]
+            if silent:
+                await self._reconcile(silent)
+            with self._cond:
+                expired = [job_id for job_id, job in self._jobs.items()
+                           if job.finished and time.time() - job.finished_at > self.result_ttl]
+                for job_id in expired:
+                    del self._jobs[job_id]
+
+
+_queue: Optional[ImageJobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_image_job_queue(client_factory: Optional[Callable[[], Any]] = None) -> ImageJobQueue:
+    """Shared job queue for the configured ComfyUI server"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if client_factory is None:
+                    from src.utils.comfyui_client import get_comfyui_client as client_factory
+                _queue = ImageJobQueue(
+                    client_factory(),
+                    max_running=int(os.getenv('IMAGE_JOBS_MAX_RUNNING', '2')),
+                    per_user_running=int(os.getenv('IMAGE_JOBS_PER_USER_RUNNING', '1')),
+                    max_queued_per_user=int(os.getenv('IMAGE_JOBS_MAX_QUEUED_PER_USER', '5')),
+                    job_timeout=float(os.getenv('IMAGE_JOBS_TIMEOUT', '300')),
+                    result_ttl=float(os.getenv('IMAGE_JOBS_RESULT_TTL', '600')),
+                )
+    return _queue
+
+
+def get_image_job_stats() -> Dict[str, Any]:
+    """Stats for the performance dashboard (empty until the queue is used)"""
+    return _queue.get_stats() if _queue is not None else {}
@@ -1,13 +1,28 @@
 """
 Image Storage Service
 Upload images to ImgBB and save metadata to MongoDB/Firebase
+
+store_generated_image goes through a content-addressed store: the image is
+written locally under its SHA-256 and the call returns at once, while the
+cloud sinks replicate in the background (ImgBB first, then MongoDB and
+Firebase concurrently since their records carry the ImgBB URL). Storing
+bytes that were already replicated does not upload them again.
 """
 import os
 import base64
+import hashlib
+import json
+import tempfile
+import threading
+import time
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
-from typing import Optional, Dict, Any
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, List
+
+from .config import IMAGE_STORAGE_DIR
 
 logger = logging.getLogger(__name__)
 
@@ -150,59 +165,379 @@ def save_to_firebase(image_data: Dict[str, Any]) -> Optional[str]:
         return None
 
 
+# ============================================================================
+# Content-addressed store
+# ============================================================================
+
+BLOB = 'blob'
+RECORD = 'record'
+
+
+class ImageSink:
+    """
+    A replication target. ``put`` returns a reference (URL or document id)
+    and raises on failure; it must be idempotent per digest since failed or
+    timed-out attempts are retried.
+    
+    Stage BLOB sinks receive the image; stage RECORD sinks run afterwards
+    and receive the URLs the BLOB sinks returned. While a BLOB sink is
+    configured but has not returned a URL, RECORD sinks stay pending; they
+    are written again whenever the manifest URL or owner list changes.
+    """
+    
+    name = 'sink'
+    stage = RECORD
+    
+    def __init__(self, timeout: float = 30.0, retries: int = 2):
+        self.timeout = timeout
+        self.retries = retries
+    
+    def available(self) -> bool:
+        return True
+    
+    def put(self, record: Dict[str, Any]) -> Optional[str]:
+        raise NotImplementedError
+
+
+class ImgBBSink(ImageSink):
+    name = 'imgbb'
+    stage = BLOB
+    
+    def available(self) -> bool:
+        return bool(IMGBB_API_KEY)
+    
+    def put(self, record: Dict[str, Any]) -> Optional[str]:
+        url = upload_to_imgbb(record['image_base64'], name=f"img_{record['sha256'][:16]}")
+        if not url:
+            raise RuntimeError('ImgBB upload failed')
+        return url
+
+
+class MongoSink(ImageSink):
+    name = 'mongodb'
+    
+    def available(self) -> bool:
+        return images_collection is not None
+    
+    def put(self, record: Dict[str, Any]) -> Optional[str]:
+        # Upsert on the digest: a retried write never creates a duplicate
+        images_collection.update_one(
+            {'sha256': record['sha256']},
+            {'$set': {'url': record.get('url')},
+             '$addToSet': {'owners': {'$each': record.get('owners', [])}},
+             '$setOnInsert': {**record['metadata'], 'sha256': record['sha256'], 'created_at': datetime.utcnow()}},
+            upsert=True
+        )
+        doc = images_collection.find_one({'sha256': record['sha256']}, {'_id': 1})
+        return str(doc['_id']) if doc else None
+
+
+class FirebaseSink(ImageSink):
+    name = 'firebase'
+    
+    def available(self) -> bool:
+        return firebase_db is not None
+    
+    def put(self, record: Dict[str, Any]) -> Optional[str]:
+        doc_ref = firebase_db.collection('generated_images').document(record['sha256'])
+        doc = {**record['metadata'], 'url': record.get('url'), 'sha256': record['sha256']}
+        if record.get('owners'):
+            doc['owners'] = firestore.ArrayUnion(record['owners'])
+        # merge=True keeps the rest of the document; created_at is set once
+        if not doc_ref.get().exists:
+            doc['created_at'] = datetime.utcnow()
+        doc_ref.set(doc, merge=True)
+        return record['sha256']
+
+
+def default_sinks() -> List[ImageSink]:
+    """Cloud sinks that are configured in this environment"""
+    return [sink for sink in (ImgBBSink(), MongoSink(), FirebaseSink()) if sink.available()]
+
+
+def _decode_image(image: Any) -> bytes:
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if 'base64,' in image:
+        image = image.split('base64,')[1]
+    return base64.b64decode(image)
+
+
+class ContentAddressedImageStore:
+    """
+    Images keyed by SHA-256 under ``root/<aa>/<digest>.png`` with a
+    ``<digest>.json`` manifest holding each sink's reference.
+    
+    put() writes the file (once per digest) and returns; replication to the
+    sinks runs on a background pool. Each sink call is bounded by the sink's
+    timeout and retried with backoff. A digest whose sinks all succeeded is
+    never sent again; one with failed sinks retries just those on the next
+    put().
+    """
+    
+    def __init__(self, root: Path, sinks: Optional[List[ImageSink]] = None,
+                 max_replications: int = 8, max_sink_calls: int = 16, backoff: float = 0.5):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.sinks = default_sinks() if sinks is None else list(sinks)
+        self.backoff = backoff
+        self._replicators = ThreadPoolExecutor(max_workers=max_replications, thread_name_prefix='image-replicate')
+        self._sink_pool = ThreadPoolExecutor(max_workers=max_sink_calls, thread_name_prefix='image-sink')
+        self._inflight: Dict[str, Any] = {}
+        self._callbacks: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'deduplicated': 0, 'replicated': 0, 'sink_errors': 0, 'sink_retries': 0}
+    
+    def _paths(self, digest: str):
+        folder = self.root / digest[:2]
+        return folder / f"{digest}.png", folder / f"{digest}.json"
+    
+    def _read_manifest(self, digest: str) -> Optional[Dict[str, Any]]:
+        _, manifest_path = self._paths(digest)
+        try:
+            return json.loads(manifest_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+    
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        _, manifest_path = self._paths(manifest['sha256'])
+        self._atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, default=str).encode('utf-8'))
+    
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    
+    def _pending_sinks(self, manifest: Dict[str, Any]) -> List[ImageSink]:
+        done = manifest.get('sinks', {})
+        pending = []
+        for sink in self.sinks:
+            result = done.get(sink.name, {})
+            # A record written before the URL was known (or with an older one,
+            # or before another owner uploaded the same bytes) is stale
+            stale = sink.stage == RECORD and (
+                result.get('url') != manifest.get('url')
+                or result.get('owners', []) != manifest.get('owners', [])
+            )
+            if result.get('status') != 'ok' or stale:
+                pending.append(sink)
+        return pending
+    
+    def put(self, image: Any, metadata: Optional[Dict[str, Any]] = None,
+            on_replicated: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Store image bytes (or base64) locally and schedule replication
+        
+        Returns the manifest: sha256, local_path, sink references known so
+        far and whether the bytes were already stored. ``metadata`` is kept
+        from the first put; the session_id of every put is added to
+        ``owners`` and passed on to the RECORD sinks.
+        """
+        data = _decode_image(image)
+        digest = hashlib.sha256(data).hexdigest()
+        image_path, _ = self._paths(digest)
+        owner = (metadata or {}).get('session_id')
+        
+        with self._lock:
+            manifest = self._read_manifest(digest)
+            deduplicated = manifest is not None
+            if manifest is None:
+                if not image_path.exists():
+                    self._atomic_write(image_path, data)
+                manifest = {
+                    'sha256': digest,
+                    'local_path': str(image_path),
+                    'size': len(data),
+                    'metadata': metadata or {},
+                    'owners': [owner] if owner else [],
+                    'sinks': {},
+                    'created_at': datetime.now().isoformat(),
+                }
+                self._write_manifest(manifest)
+                self._stats['stored'] += 1
+            else:
+                self._stats['deduplicated'] += 1
+                if owner and owner not in manifest.setdefault('owners', []):
+                    manifest['owners'].append(owner)
+                    self._write_manifest(manifest)
+            
+            pending = self._pending_sinks(manifest)
+            if pending:
+                if on_replicated:
+                    self._callbacks.setdefault(digest, []).append(on_replicated)
+                if digest not in self._inflight:
+                    self._inflight[digest] = self._replicators.submit(self._replicate, digest, data, pending)
+        
+        if not pending and on_replicated:
+            on_replicated(manifest)
+        return {**manifest, 'deduplicated': deduplicated,
+                'replication': 'pending' if pending else 'complete'}
+    
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._read_manifest(digest)
+    
+    def wait(self, digest: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until the digest's replication finished (tests, benchmarks, CLI)"""
+        future = self._inflight.get(digest)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except FutureTimeout:
+                pass
+        return self.get(digest)
+    
+    def _call_sink(self, sink: ImageSink, record: Dict[str, Any]) -> Dict[str, Any]:
+        attempts = sink.retries + 1
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                self._stats['sink_retries'] += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            future = self._sink_pool.submit(sink.put, record)
+            try:
+                return {'status': 'ok', 'ref': future.result(timeout=sink.timeout), 'attempts': attempt + 1}
+            except FutureTimeout:
+                error = f"timeout after {sink.timeout}s"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            logger.warning(f"[ImageStorage] {sink.name} attempt {attempt + 1}/{attempts} failed: {error}")
+        self._stats['sink_errors'] += 1
+        return {'status': 'error', 'error': error, 'attempts': attempts}
+    
+    def _run_stage(self, sinks: List[ImageSink], record: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Call every sink of a stage concurrently"""
+        if len(sinks) == 1:
+            return {sinks[0].name: self._call_sink(sinks[0], record)}
+        with ThreadPoolExecutor(max_workers=len(sinks)) as stage:
+            futures = {sink.name: stage.submit(self._call_sink, sink, record) for sink in sinks}
+            return {name: future.result() for name, future in futures.items()}
+    
+    def _replicate(self, digest: str, data: bytes, pending: List[ImageSink]):
+        manifest = None
+        try:
+            manifest = self.get(digest)
+            record = {
+                'sha256': digest,
+                'image_base64': base64.b64encode(data).decode('ascii'),
+                'metadata': manifest.get('metadata', {}),
+                'owners': list(manifest.get('owners', [])),
+                'url': manifest.get('url'),
+            }
+            for stage in (BLOB, RECORD):
+                sinks = [sink for sink in pending if sink.stage == stage]
+                if not sinks:
+                    continue
+                if stage == RECORD and not record['url'] and any(s.stage == BLOB for s in self.sinks):
+                    # No URL yet: records wait for the next put() instead of storing url=None
+                    results = {sink.name: {'status': 'waiting', 'error': 'no blob URL yet'} for sink in sinks}
+                else:
+                    results = self._run_stage(sinks, record)
+                    if stage == RECORD:
+                        for result in results.values():
+                            if record['url']:
+                                result['url'] = record['url']
+                            if record['owners']:
+                                result['owners'] = record['owners']
+                with self._lock:
+                    manifest = self._read_manifest(digest)
+                    manifest['sinks'].update(results)
+                    for name, result in results.items():
+                        if result['status'] == 'ok':
+                            manifest[f"{name}_ref"] = result['ref']
+                            if stage == BLOB and not manifest.get('url'):
+                                manifest['url'] = result['ref']
+                    self._write_manifest(manifest)
+                record['url'] = manifest.get('url')
+            self._stats['replicated'] += 1
+        except Exception as e:
+            logger.error(f"[ImageStorage] Replication of {digest[:12]} failed: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(digest, None)
+                callbacks = self._callbacks.pop(digest, [])
+        for callback in callbacks:
+            try:
+                callback(manifest or self.get(digest))
+            except Exception as e:
+                logger.warning(f"[ImageStorage] on_replicated callback failed: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'inflight': len(self._inflight), 'sinks': [sink.name for sink in self.sinks]}
+    
+    def close(self, wait: bool = True):
+        self._replicators.shutdown(wait=wait)
+        self._sink_pool.shutdown(wait=wait)
+
+
+_store: Optional[ContentAddressedImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ContentAddressedImageStore:
+    """Shared store under IMAGE_STORAGE_DIR/cas with the configured cloud sinks"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ContentAddressedImageStore(
+                    Path(os.getenv('IMAGE_CAS_DIR', str(IMAGE_STORAGE_DIR / 'cas'))),
+                    max_replications=int(os.getenv('IMAGE_REPLICATION_WORKERS', '8')),
+                    max_sink_calls=int(os.getenv('IMAGE_SINK_WORKERS', '16')),
+                )
+    return _store
+
+
 def store_generated_image(
     image_base64: str,
     prompt: str,
     negative_prompt: str = "",
-    metadata: Dict[str, Any] = None
+    metadata: Dict[str, Any] = None,
+    on_replicated: Optional[Callable[[Dict[str, Any]], None]] = None
 ) -> Dict[str, Any]:
     """
-    Store generated image to ImgBB and save metadata to databases
+    Store generated image locally and replicate it to ImgBB/MongoDB/Firebase
+    
+    Returns once the image is on local disk. ``imgbb_url`` and the database
+    ids are only filled in when these bytes were replicated before; pass
+    ``on_replicated`` to receive the manifest once replication finishes.
     
     Args:
         image_base64: Base64 encoded image
         prompt: Generation prompt
         negative_prompt: Negative prompt
         metadata: Additional metadata
+        on_replicated: Called with the manifest after background replication
         
     Returns:
         Dictionary with storage results
     """
-    result = {
-        'success': False,
-        'imgbb_url': None,
-        'mongodb_id': None,
-        'firebase_id': None
-    }
-    
-    # Upload to ImgBB
-    imgbb_url = upload_to_imgbb(image_base64)
-    if imgbb_url:
-        result['imgbb_url'] = imgbb_url
-        result['success'] = True
-    
-    # Prepare metadata
     image_metadata = {
-        'url': imgbb_url,
         'prompt': prompt,
         'negative_prompt': negative_prompt,
         'source': 'comfyui',
         **(metadata or {})
     }
-    
-    # Save to MongoDB
-    if imgbb_url:
-        mongo_id = save_to_mongodb(image_metadata.copy())
-        if mongo_id:
-            result['mongodb_id'] = mongo_id
-    
-    # Save to Firebase
-    if imgbb_url:
-        firebase_id = save_to_firebase(image_metadata.copy())
-        if firebase_id:
-            result['firebase_id'] = firebase_id
-    
-    logger.info(f"[ImageStorage] Storage result: {result}")
+    manifest = get_image_store().put(image_base64, image_metadata, on_replicated=on_replicated)
+    result = {
+        'success': True,
+        'sha256': manifest['sha256'],
+        'local_path': manifest['local_path'],
+        'deduplicated': manifest['deduplicated'],
+        'replication': manifest['replication'],
+        'imgbb_url': manifest.get('imgbb_ref'),
+        'mongodb_id': manifest.get('mongodb_ref'),
+        'firebase_id': manifest.get('firebase_ref')
+    }
+    logger.info(f"[ImageStorage] Stored {manifest['sha256'][:12]} "
+                f"(dedup={manifest['deduplicated']}, replication={manifest['replication']})")
     return result
 
 
@@ -0,0 +1,424 @@
+"""
+Write-behind message persistence
+
+/chat used to store every message synchronously (insert_one + an update_one
+on the conversation), so MongoDB latency was part of the response time.
+Messages are now queued in-process with a client-side _id and written by a
+background thread:
+
+- one insert_many per flush plus one $inc per conversation (BulkOperations)
+- flush when batch_size messages are queued or every flush_interval seconds
+- backpressure: enqueue blocks up to block_timeout while max_depth is reached
+- if MongoDB is down, batches are appended (fsync'd) to a local JSONL journal
+  and replayed once MongoDB is back; replays skip _ids that were already
+  inserted, so a batch is never stored or counted twice
+- worker processes share the journal: appends and the rotate+replay run
+  under an exclusive lock on ``<journal>.lock``, so only one process
+  replays a given journal and no append lands in a file being replayed
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .db_optimizer import BulkOperations
+
+logger = logging.getLogger(__name__)
+
+try:
+    from bson import json_util
+except ImportError:  # pymongo missing: MongoDB (and this queue) is disabled
+    json_util = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, the thread lock is enough
+    fcntl = None
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class WriteBehindQueue:
+    """Batches message inserts and conversation counters off the request path"""
+
+    LATENCY_SAMPLES = 256
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        journal_path: Path,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_depth: int = 5000,
+        block_timeout: float = 2.0,
+        retry_interval: float = 5.0,
+        start: bool = True
+    ):
+        """
+        Args:
+            get_db: Returns the MongoDB database
+            journal_path: JSONL file used while MongoDB is unavailable
+            batch_size: Queue depth that triggers an immediate flush
+            flush_interval: Max seconds a message waits before being flushed
+            max_depth: Queue depth at which enqueue blocks (backpressure)
+            block_timeout: Max seconds enqueue blocks before journaling directly
+            retry_interval: Seconds to wait before retrying MongoDB after a failure
+            start: Start the background flusher thread
+        """
+        self.get_db = get_db
+        self.journal_path = Path(journal_path)
+        self.replay_path = self.journal_path.with_name(self.journal_path.name + '.replay')
+        self.lock_path = self.journal_path.with_name(self.journal_path.name + '.lock')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.block_timeout = block_timeout
+        self.retry_interval = retry_interval
+
+        self._pending = deque()
+        self._pending_incs: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._journal_lock = threading.RLock()
+        self._lock_file = None  # open while this process holds the journal file lock
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._flush_listeners: List[Callable[[str], None]] = []
+        self._retry_at = 0.0
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'batches': 0,
+            'failures': 0,
+            'journaled': 0,
+            'replayed': 0,
+            'duplicates_skipped': 0,
+            'backpressure_waits': 0,
+            'overflowed': 0,
+        }
+        if start:
+            self.start()
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def add_flush_listener(self, listener: Callable[[str], None]):
+        """Register a callback run with each conversation_id written by a flush"""
+        if listener not in self._flush_listeners:
+            self._flush_listeners.append(listener)
+
+    def enqueue(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a message document (must carry its _id); returns it unchanged"""
+        with self._cond:
+            if len(self._pending) >= self.max_depth:
+                self.stats['backpressure_waits'] += 1
+                self._cond.notify_all()
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._pending) >= self.max_depth:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if len(self._pending) < self.max_depth:
+                self._pending.append(message)
+                self.stats['enqueued'] += 1
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+                return message
+            self.stats['overflowed'] += 1
+
+        # Flusher is stalled: persist to the journal rather than drop the turn
+        self._journal([{'message': message}])
+        return message
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the background flusher (replays any journal left from a previous run)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='message-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopped
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[WriteBehind] Flush error: {e}")
+            if stopping:
+                return
+
+    def flush(self) -> int:
+        """Write everything queued so far; returns the number of messages taken"""
+        with self._flush_lock:
+            with self._cond:
+                messages = list(self._pending)
+                self._pending.clear()
+                incs, self._pending_incs = self._pending_incs, []
+                self._cond.notify_all()
+            ok = self._flush_batch(messages, incs) if (messages or incs) else True
+            if ok and self.has_journal() and time.monotonic() >= self._retry_at:
+                self._replay_journal()
+            return len(messages)
+
+    def _flush_batch(self, messages: List[Dict[str, Any]], incs: List[Dict[str, Any]],
+                     replaying: bool = False) -> bool:
+        """Insert messages + apply counters; on failure the remainder goes to the journal"""
+        entries = [{'message': m} for m in messages] + [{'inc': i} for i in incs]
+        if time.monotonic() < self._retry_at:
+            self._journal(entries, count=not replaying)
+            return False
+
+        start = time.perf_counter()
+        try:
+            db = self.get_db()
+            inserted, failed = self._insert_messages(db, messages)
+        except Exception as e:
+            return self._on_failure(e, entries, replaying)
+
+        incs = self._merge_incs(list(incs) + [self._message_inc(m) for m in inserted])
+        try:
+            self._apply_incs(db, incs)
+        except Exception as e:
+            return self._on_failure(e, [{'message': m} for m in failed] + [{'inc': i} for i in incs], replaying)
+
+        self._latencies.append((time.perf_counter() - start) * 1000)
+        self.stats['flushed'] += len(inserted)
+        self.stats['batches'] += 1
+        if failed:
+            self._on_failure(RuntimeError(f"{len(failed)} messages rejected"), [{'message': m} for m in failed], replaying)
+
+        for conversation_id in {str(m['conversation_id']) for m in inserted}:
+            for listener in self._flush_listeners:
+                try:
+                    listener(conversation_id)
+                except Exception as e:
+                    logger.warning(f"[WriteBehind] Flush listener failed: {e}")
+        return not failed
+
+    def _insert_messages(self, db, messages):
+        """insert_many; returns (inserted, failed) with already-stored _ids skipped"""
+        if not messages:
+            return [], []
+        bulk = BulkOperations(db.messages, batch_size=len(messages), skip_duplicates=True)
+        for message in messages:
+            bulk.add_insert(message)
+        try:
+            bulk.flush_inserts()
+        except Exception as e:
+            # Unordered insert: documents without a write error were stored
+            errors = getattr(e, 'details', None) and e.details.get('writeErrors')
+            if not errors:
+                raise
+            rejected = {err['index'] for err in errors if err.get('code') != 11000}
+            duplicates = {messages[err['index']]['_id'] for err in errors if err.get('code') == 11000}
+            self.stats['duplicates_skipped'] += len(duplicates)
+            inserted = [m for i, m in enumerate(messages) if i not in rejected and m['_id'] not in duplicates]
+            return inserted, [messages[i] for i in sorted(rejected)]
+
+        skipped = {doc['_id'] for doc in bulk.skipped_duplicates}
+        self.stats['duplicates_skipped'] += len(skipped)
+        return [m for m in messages if m['_id'] not in skipped], []
+
+    @staticmethod
+    def _message_inc(message: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = message.get('metadata') or {}
+        return {
+            'conversation_id': message['conversation_id'],
+            'messages': 1,
+            'tokens': metadata.get('tokens', 0) or 0,
+            'updated_at': message.get('created_at'),
+        }
+
+    @staticmethod
+    def _merge_incs(incs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for inc in incs:
+            key = str(inc['conversation_id'])
+            if key not in merged:
+                merged[key] = dict(inc)
+                continue
+            current = merged[key]
+            current['messages'] += inc['messages']
+            current['tokens'] += inc['tokens']
+            if inc.get('updated_at') and (not current.get('updated_at') or inc['updated_at'] > current['updated_at']):
+                current['updated_at'] = inc['updated_at']
+        return list(merged.values())
+
+    def _apply_incs(self, db, incs: List[Dict[str, Any]]):
+        if not incs:
+            return
+        bulk = BulkOperations(db.conversations, batch_size=len(incs))
+        for inc in incs:
+            update = {'$inc': {'total_messages': inc['messages'], 'total_tokens': inc['tokens']}}
+            if inc.get('updated_at'):
+                update['$max'] = {'updated_at': inc['updated_at']}
+            bulk.add_update({'_id': inc['conversation_id']}, update)
+        bulk.flush_updates()
+
+    def _on_failure(self, error: Exception, entries: List[Dict[str, Any]], replaying: bool = False) -> bool:
+        self.stats['failures'] += 1
+        self._retry_at = time.monotonic() + self.retry_interval
+        logger.warning(f"[WriteBehind] MongoDB write failed ({error}); journaling {len(entries)} entries")
+        self._journal(entries, count=not replaying)
+        return False
+
+    # ------------------------------------------------------------------
+    # Durable journal
+    # ------------------------------------------------------------------
+
+    def has_journal(self) -> bool:
+        return self.journal_path.exists() or self.replay_path.exists()
+
+    @contextmanager
+    def _locked_journal(self):
+        """Thread lock + exclusive file lock shared by every process using this journal (re-entrant)"""
+        with self._journal_lock:
+            if self._lock_file is not None or fcntl is None:
+                yield
+                return
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            self._lock_file = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+            finally:
+                lock_file, self._lock_file = self._lock_file, None
+                lock_file.close()  # releases the flock
+
+    def _journal(self, entries: List[Dict[str, Any]], count: bool = True):
+        if not entries:
+            return
+        try:
+            with self._locked_journal():
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    for entry in entries:
+                        f.write(json_util.dumps(entry) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            if count:
+                self.stats['journaled'] += sum(1 for e in entries if 'message' in e)
+        except Exception as e:
+            # Keep the entries in memory; the next flush retries them
+            logger.error(f"[WriteBehind] Journal write failed: {e}")
+            with self._cond:
+                self._pending.extendleft(reversed([e['message'] for e in entries if 'message' in e]))
+                self._pending_incs.extend(e['inc'] for e in entries if 'inc' in e)
+
+    def _replay_journal(self) -> int:
+        """
+        Move the journal aside and write it back through the normal flush path
+
+        The file lock is held until the replay file is gone, so a second
+        process finds nothing to replay instead of applying the same
+        counter increments again. Entries that fail again are re-journaled
+        (re-entrantly) into the main journal.
+        """
+        with self._locked_journal():
+            if not self.replay_path.exists():
+                if not self.journal_path.exists():
+                    return 0
+                os.replace(self.journal_path, self.replay_path)
+            return self._replay_file()
+
+    def _replay_file(self) -> int:
+        messages, incs = [], []
+        with open(self.replay_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json_util.loads(line)
+                except ValueError:
+                    logger.warning("[WriteBehind] Skipping truncated journal line")
+                    continue
+                if 'message' in entry:
+                    messages.append(entry['message'])
+                elif 'inc' in entry:
+                    incs.append(entry['inc'])
+
+        logger.info(f"[WriteBehind] Replaying {len(messages)} journaled messages")
+        # Whatever fails again is re-journaled by _flush_batch, so the replay file can go
+        if self._flush_batch(messages, incs, replaying=True):
+            self.stats['replayed'] += len(messages)
+        self.replay_path.unlink()
+        return len(messages)
+
+    # ------------------------------------------------------------------
+    # Lifecycle / metrics
+    # ------------------------------------------------------------------
+
+    def close(self, timeout: float = 10.0):
+        """Stop the flusher after a final flush"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if self._thread is None or not self._thread.is_alive():
+            self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        with self._cond:
+            depth = len(self._pending)
+        return {
+            **self.stats,
+            'queue_depth': depth,
+            'max_depth': self.max_depth,
+            'batch_size': self.batch_size,
+            'flush_latency_ms': {
+                'p50': round(_percentile(latencies, 50), 2),
+                'p99': round(_percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2) if latencies else 0.0,
+            },
+            'journal_pending': self.has_journal(),
+            'mongo_backoff': time.monotonic() < self._retry_at,
+        }
+
+
+_queue: Optional[WriteBehindQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_message_queue(get_db: Callable[[], Any]) -> WriteBehindQueue:
+    """Process-wide queue (chatbot_main and core.db_helpers share one journal)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            from .config import (
+                MESSAGE_JOURNAL_PATH, MESSAGE_QUEUE_BATCH_SIZE,
+                MESSAGE_QUEUE_FLUSH_INTERVAL, MESSAGE_QUEUE_MAX_DEPTH
+            )
+            _queue = WriteBehindQueue(
+                get_db,
+                MESSAGE_JOURNAL_PATH,
+                batch_size=MESSAGE_QUEUE_BATCH_SIZE,
+                flush_interval=MESSAGE_QUEUE_FLUSH_INTERVAL,
+                max_depth=MESSAGE_QUEUE_MAX_DEPTH
+            )
+        return _queue
+
+
+def get_message_queue_stats() -> Dict[str, Any]:
+    """Stats of the process-wide queue (empty if write-behind is not in use)"""
+    return _queue.get_stats() if _queue is not None else {}
@@ -3,12 +3,37 @@ Streaming Chat Module - SSE (Server-Sent Events) support for real-time responses
 """
 import json
 import logging
-from typing import Generator, Optional, Dict, Any, Callable
-from flask import Response, stream_with_context
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Generator, Iterable, Iterator, List, Optional, Dict, Any, Callable, Tuple
+from flask import Response, copy_current_request_context, has_request_context
 from dataclasses import dataclass
 
+from .tracing import wrap_context
+from utils.metrics import stream_inter_token, stream_ttft
+
 logger = logging.getLogger(__name__)
 
+# Coalescing budget: deltas are merged into one frame until either limit is hit
+COALESCE_MAX_CHARS = int(os.getenv('SSE_COALESCE_MAX_CHARS', '64'))
+COALESCE_MAX_DELAY_MS = float(os.getenv('SSE_COALESCE_MAX_DELAY_MS', '50'))
+# Finished streams stay replayable for this long
+REPLAY_TTL_SECONDS = float(os.getenv('SSE_REPLAY_TTL_SECONDS', '60'))
+REPLAY_MAX_STREAMS = int(os.getenv('SSE_REPLAY_MAX_STREAMS', '1000'))
+KEEPALIVE_SECONDS = 15.0
+RECONNECT_MS = 1000
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Allow-Origin': '*',
+}
+
 
 @dataclass
 class StreamEvent:
@@ -36,50 +61,237 @@ class StreamEvent:
         return '\n'.join(lines) + '\n'
 
 
+def parse_event_id(event_id: Optional[str]) -> Tuple[Optional[str], int]:
+    """Split a ``<stream_id>-<seq>`` event id (as sent in Last-Event-ID)"""
+    stream_id, _, seq = (event_id or '').strip().rpartition('-')
+    if not stream_id or not seq.isdigit():
+        return None, 0
+    return stream_id, int(seq)
+
+
+class StreamSession:
+    """
+    One producer stream with a replay buffer.
+    
+    The producer pushes provider deltas; they are coalesced into ``chunk``
+    frames once COALESCE_MAX_CHARS or COALESCE_MAX_DELAY_MS is reached (the
+    first delta is sent at once to keep time-to-first-token low). Readers
+    waiting for frames also flush a pending buffer whose delay has expired,
+    so a stalled provider cannot hold text back.
+    
+    Every frame gets id ``<stream_id>-<seq>``; a reconnecting client resumes
+    with ``events(after=seq)``.
+    """
+    
+    def __init__(self, stream_id: str, max_chars: int = COALESCE_MAX_CHARS,
+                 max_delay_ms: float = COALESCE_MAX_DELAY_MS):
+        self.stream_id = stream_id
+        self.max_chars = max_chars
+        self.max_delay = max_delay_ms / 1000
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.chunk_count = 0
+        self._frames: List[str] = []
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._pending_since = 0.0
+        self._cond = threading.Condition()
+    
+    @property
+    def text(self) -> str:
+        """Full response so far"""
+        with self._cond:
+            return ''.join(self._parts)
+    
+    def publish(self, event: str, payload: Dict[str, Any], retry: Optional[int] = None):
+        """Append a non-chunk event (pending text is flushed first to keep order)"""
+        with self._cond:
+            self._flush_locked()
+            self._append_locked(event, payload, retry)
+    
+    def push(self, delta: str):
+        """Add a provider delta"""
+        if not delta:
+            return
+        now = time.monotonic()
+        with self._cond:
+            if not self._pending:
+                self._pending_since = now
+            self._pending.append(delta)
+            self._parts.append(delta)
+            self._pending_chars += len(delta)
+            if (self.chunk_count == 0 or self._pending_chars >= self.max_chars
+                    or now - self._pending_since >= self.max_delay):
+                self._flush_locked()
+    
+    def flush(self):
+        """Send pending text now"""
+        with self._cond:
+            self._flush_locked()
+    
+    def finish(self, event: str, payload: Dict[str, Any]):
+        """Flush, append the final event and wake every reader"""
+        with self._cond:
+            self._flush_locked()
+            self._append_locked(event, payload)
+            self.done = True
+            self.finished_at = time.monotonic()
+    
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self.chunk_count += 1
+        content = ''.join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self._append_locked('chunk', {'content': content, 'chunk_index': self.chunk_count})
+    
+    def _append_locked(self, event: str, payload: Dict[str, Any], retry: Optional[int] = None):
+        event_id = f"{self.stream_id}-{len(self._frames) + 1}"
+        self._frames.append(StreamEvent(event=event, data=json.dumps(payload), id=event_id, retry=retry).format())
+        self._cond.notify_all()
+    
+    def events(self, after: int = 0) -> Iterator[str]:
+        """Formatted frames with seq > ``after``, following the stream until it ends"""
+        seq = after
+        while True:
+            with self._cond:
+                while seq >= len(self._frames) and not self.done:
+                    timeout = KEEPALIVE_SECONDS
+                    if self._pending:
+                        timeout = self._pending_since + self.max_delay - time.monotonic()
+                        if timeout <= 0:
+                            self._flush_locked()
+                            continue
+                    if not self._cond.wait(timeout) and not self._pending:
+                        break
+                frames = self._frames[seq:]
+                finished = self.done
+            if not frames and not finished:
+                yield ": keepalive\n\n"
+                continue
+            for frame in frames:
+                yield frame
+            seq += len(frames)
+            if finished and seq >= len(self._frames):
+                return
+
+
+class StreamRegistry:
+    """Live and recently finished streams, kept for Last-Event-ID resume"""
+    
+    def __init__(self, ttl_seconds: float = REPLAY_TTL_SECONDS, max_streams: int = REPLAY_MAX_STREAMS):
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max_streams
+        self._sessions: "OrderedDict[str, StreamSession]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def create(self, **kwargs) -> StreamSession:
+        session = StreamSession(uuid.uuid4().hex, **kwargs)
+        with self._lock:
+            self._sweep_locked()
+            self._sessions[session.stream_id] = session
+        return session
+    
+    def get(self, stream_id: str) -> Optional[StreamSession]:
+        with self._lock:
+            self._sweep_locked()
+            return self._sessions.get(stream_id)
+    
+    def _sweep_locked(self):
+        now = time.monotonic()
+        for stream_id, session in list(self._sessions.items()):
+            expired = session.done and now - session.finished_at > self.ttl_seconds
+            if expired or (len(self._sessions) >= self.max_streams and session.done):
+                del self._sessions[stream_id]
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+stream_registry = StreamRegistry()
+
+
 class StreamingChatHandler:
     """Handles streaming chat responses via SSE"""
     
     @staticmethod
-    def create_sse_response(generator: Generator[str, None, None]) -> Response:
-        """Create a Flask SSE response from a generator"""
+    def start_stream(
+        generator: Iterable[str],
+        model: str = "unknown",
+        metadata: Optional[Dict[str, Any]] = None,
+        complete: Optional[Dict[str, Any]] = None,
+        registry: Optional[StreamRegistry] = None
+    ) -> StreamSession:
+        """
+        Run ``generator`` in a producer thread feeding a replayable session.
         
-        def generate_events():
+        The provider stream keeps going if the client disconnects, so the
+        response is still completed (and saved) and a reconnect can resume.
+        TTFT and inter-token gaps are recorded per model.
+        """
+        session = (registry or stream_registry).create()
+        started = time.monotonic()
+        
+        def produce():
+            ttft = None
+            last = started
             try:
-                # Send initial event
-                yield StreamEvent(event="start", data=json.dumps({"status": "started"})).format()
-                
-                full_response = ""
+                session.publish("metadata", {**(metadata or {}), "stream_id": session.stream_id},
+                                retry=RECONNECT_MS)
                 for chunk in generator:
-                    if chunk:
-                        full_response += chunk
-                        yield StreamEvent(
-                            event="chunk",
-                            data=json.dumps({"content": chunk})
-                        ).format()
-                
-                # Send completion event
-                yield StreamEvent(
-                    event="done",
-                    data=json.dumps({"status": "complete", "full_response": full_response})
-                ).format()
-                
+                    if not chunk:
+                        continue
+                    now = time.monotonic()
+                    if ttft is None:
+                        ttft = now - started
+                        stream_ttft.labels(model=model).observe(ttft)
+                    else:
+                        stream_inter_token.labels(model=model).observe(now - last)
+                    last = now
+                    session.push(chunk)
+                session.flush()
+                session.finish("complete", {
+                    **(complete or {}),
+                    "model": model,
+                    "total_chunks": session.chunk_count,
+                    "length": len(session.text),
+                    "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+                    "timestamp": datetime.now().isoformat(),
+                })
             except Exception as e:
-                logger.error(f"[SSE] Error during streaming: {e}")
-                yield StreamEvent(
-                    event="error",
-                    data=json.dumps({"error": str(e)})
-                ).format()
+                logger.error(f"[SSE] Streaming error: {e}")
+                session.finish("error", {"error": str(e), "model": model})
         
-        return Response(
-            stream_with_context(generate_events()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
-                'Access-Control-Allow-Origin': '*',
-            }
-        )
+        if has_request_context():
+            produce = copy_current_request_context(produce)
+        threading.Thread(target=wrap_context(produce), name=f"sse-{session.stream_id[:8]}",
+                         daemon=True).start()
+        return session
+    
+    @staticmethod
+    def sse_response(events: Iterable[str], status: int = 200) -> Response:
+        """Wrap formatted frames in a text/event-stream response"""
+        return Response(events, mimetype='text/event-stream', status=status, headers=SSE_HEADERS)
+    
+    @staticmethod
+    def resume_response(last_event_id: Optional[str], registry: Optional[StreamRegistry] = None) -> Response:
+        """Replay a stream after ``Last-Event-ID`` and follow it live"""
+        stream_id, seq = parse_event_id(last_event_id)
+        session = (registry or stream_registry).get(stream_id) if stream_id else None
+        if session is None:
+            return StreamingChatHandler.sse_response(
+                StreamEvent(event="error", data=json.dumps({"error": "Stream not found or expired"})).format(),
+                status=404
+            )
+        return StreamingChatHandler.sse_response(session.events(after=seq))
+    
+    @staticmethod
+    def create_sse_response(generator: Generator[str, None, None]) -> Response:
+        """Create a Flask SSE response from a generator"""
+        session = StreamingChatHandler.start_stream(generator, metadata={"status": "started"})
+        return StreamingChatHandler.sse_response(session.events())
     
     @staticmethod
     def create_json_stream_response(
@@ -89,66 +301,18 @@ class StreamingChatHandler:
         deep_thinking: bool
     ) -> Response:
         """Create SSE response with metadata"""
-        
-        def generate_events():
-            try:
-                # Send metadata first
-                yield StreamEvent(
-                    event="metadata",
-                    data=json.dumps({
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "streaming": True
-                    })
-                ).format()
-                
-                full_response = ""
-                chunk_count = 0
-                
-                for chunk in generator:
-                    if chunk:
-                        full_response += chunk
-                        chunk_count += 1
-                        yield StreamEvent(
-                            event="chunk",
-                            data=json.dumps({
-                                "content": chunk,
-                                "chunk_index": chunk_count
-                            })
-                        ).format()
-                
-                # Send final event with complete response
-                yield StreamEvent(
-                    event="complete",
-                    data=json.dumps({
-                        "response": full_response,
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "total_chunks": chunk_count
-                    })
-                ).format()
-                
-            except GeneratorExit:
-                logger.info("[SSE] Client disconnected")
-            except Exception as e:
-                logger.error(f"[SSE] Streaming error: {e}")
-                yield StreamEvent(
-                    event="error",
-                    data=json.dumps({"error": str(e), "model": model})
-                ).format()
-        
-        return Response(
-            stream_with_context(generate_events()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
-                'Access-Control-Allow-Origin': '*',
-            }
+        session = StreamingChatHandler.start_stream(
+            generator,
+            model=model,
+            metadata={
+                "model": model,
+                "context": context,
+                "deep_thinking": deep_thinking,
+                "streaming": True
+            },
+            complete={"context": context, "deep_thinking": deep_thinking}
         )
+        return StreamingChatHandler.sse_response(session.events())
 
 
 def stream_chat_response(
@@ -166,18 +330,18 @@ def stream_chat_response(
         on_complete: Callback when streaming completes
         on_error: Callback on error
     """
-    full_response = ""
+    parts: List[str] = []
     
     try:
         for chunk in chat_generator:
             if chunk:
-                full_response += chunk
+                parts.append(chunk)
                 if on_chunk:
                     on_chunk(chunk)
                 yield chunk
         
         if on_complete:
-            on_complete(full_response)
+            on_complete(''.join(parts))
             
     except Exception as e:
         if on_error:
@@ -0,0 +1,44 @@
+"""
+Request tracing for chatbot modules
+
+The tracer lives in the root config/tracing.py so the shared ResponseCache
+and the chatbot record into the same traces. chatbot_main imports the root
+``config`` package, in which case that module is reused; otherwise it is
+loaded by path (same approach as core.db_optimizer) and also registered as
+``config.tracing`` so root modules imported later share the same tracer.
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+from .config import ROOT_DIR
+
+_MODULE_NAME = 'root_tracing'
+_MODULE_PATH = (ROOT_DIR / 'config' / 'tracing.py').resolve()
+
+
+def _load_tracing():
+    for name in ('config.tracing', _MODULE_NAME):
+        module = sys.modules.get(name)
+        if module is not None and Path(module.__file__).resolve() == _MODULE_PATH:
+            return module
+    spec = importlib.util.spec_from_file_location(_MODULE_NAME, _MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[_MODULE_NAME] = module
+    sys.modules.setdefault('config.tracing', module)
+    spec.loader.exec_module(module)
+    return module
+
+
+_tracing = _load_tracing()
+span = _tracing.span
+start_span = _tracing.start_span
+traced = _tracing.traced
+current_span = _tracing.current_span
+current_trace_id = _tracing.current_trace_id
+wrap_context = _tracing.wrap_context
+get_tracer = _tracing.get_tracer
+set_tracer = _tracing.set_tracer
+get_trace_stats = _tracing.get_trace_stats
+register_tracing = _tracing.register_tracing
+Tracer = _tracing.Tracer
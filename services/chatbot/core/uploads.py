@@ -0,0 +1,321 @@
+"""
+Upload handling for /chat multipart requests
+
+The old path called ``file.read()`` on every upload and then ran
+extract_file_content on each file in turn before the LLM call, so three
+20 MB PDFs meant 60 MB resident and the sum of their OCR times up front.
+UploadProcessor instead:
+
+- spools each upload to a temp file in fixed-size chunks, computing its
+  SHA-256 on the way (the request stream is never held in memory whole)
+- hands the spooled file to a bounded extraction pool as soon as it is on
+  disk, so OCR of the first file overlaps spooling of the next
+- caches extracted text by (SHA-256, extension); the same document attached
+  again, or twice in one request, is extracted once
+- waits at most ``budget`` seconds: files still being extracted come back as
+  'pending' and keep running; when the caller names an ``owner`` (the
+  conversation), take_finished(owner) hands their text to its next message
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .tracing import span, wrap_context
+
+logger = logging.getLogger(__name__)
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+Extractor = Callable[[bytes, str], Tuple[bool, str]]
+
+
+@dataclass
+class SpooledUpload:
+    """An upload copied to disk; ``path`` is removed once it is extracted"""
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.filename).suffix.lower()
+
+
+@dataclass
+class ExtractedFile:
+    """Extraction outcome for one upload: status is 'done', 'pending' or 'failed'"""
+    filename: str
+    sha256: str
+    size: int
+    type: str
+    status: str
+    content: str = ""
+    cached: bool = False
+
+
+def spool_upload(stream: BinaryIO, filename: str, directory: Optional[str] = None,
+                 chunk_size: int = SPOOL_CHUNK_SIZE) -> SpooledUpload:
+    """Copy ``stream`` to a temp file chunk by chunk, hashing as it goes"""
+    digest = hashlib.sha256()
+    size = 0
+    fd, name = tempfile.mkstemp(prefix='upload-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(name)
+        raise
+    return SpooledUpload(filename=filename, path=Path(name), size=size, sha256=digest.hexdigest())
+
+
+class ExtractionCache:
+    """Thread-safe LRU of extracted text, bounded by total characters"""
+
+    def __init__(self, max_chars: int = 50_000_000):
+        self.max_chars = max_chars
+        self._entries: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key: Tuple[str, str], text: str) -> None:
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._chars -= len(previous)
+            self._entries[key] = text
+            self._chars += len(text)
+            while self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UploadProcessor:
+    """Spools uploads and extracts their text concurrently, cached by content hash"""
+
+    MAX_DEFERRED_OWNERS = 1024
+
+    def __init__(
+        self,
+        extract: Extractor,
+        max_workers: int = 4,
+        budget: float = 10.0,
+        cache: Optional[ExtractionCache] = None,
+        spool_dir: Optional[str] = None,
+    ):
+        self.extract = extract
+        self.budget = budget
+        self.cache = cache if cache is not None else ExtractionCache()
+        self.spool_dir = spool_dir
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload-extract')
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        # owner -> uploads that missed the budget, oldest owners evicted first
+        self._deferred: 'OrderedDict[str, List[Tuple[ExtractedFile, Future]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'files': 0,
+            'bytes': 0,
+            'cache_hits': 0,
+            'joined': 0,
+            'extractions': 0,
+            'failures': 0,
+            'pending_at_budget': 0,
+            'deferred_delivered': 0,
+        }
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def _run_extract(self, key: Tuple[str, str], upload: SpooledUpload) -> Tuple[bool, str]:
+        with span('upload.extract', type=upload.suffix, bytes=upload.size):
+            try:
+                success, text = self.extract(upload.path.read_bytes(), upload.filename)
+            finally:
+                upload.path.unlink(missing_ok=True)
+        if success and text:
+            self.cache.set(key, text)
+        else:
+            self._count('failures')
+        return success, text
+
+    def _finished(self, key: Tuple[str, str], future: Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if future.exception() is not None:
+            self._count('failures')
+            logger.error(f"[UPLOAD] Extraction failed for {key[0][:12]}: {future.exception()}")
+
+    def submit(self, upload: SpooledUpload) -> Tuple[Future, bool]:
+        """Start extracting a spooled upload; returns (future, cached)"""
+        key = (upload.sha256, upload.suffix)
+        joined = False
+        with self._lock:
+            text = self.cache.get(key)
+            future = self._inflight.get(key) if text is None else None
+            if text is not None:
+                self._stats['cache_hits'] += 1
+            elif future is not None:
+                joined = True
+                self._stats['joined'] += 1
+            else:
+                future = self._pool.submit(wrap_context(self._run_extract), key, upload)
+                self._inflight[key] = future
+                self._stats['extractions'] += 1
+        if text is not None or joined:
+            # Same bytes are cached or already being extracted from another spool file
+            upload.path.unlink(missing_ok=True)
+        if text is not None:
+            future = Future()
+            future.set_result((True, text))
+            return future, True
+        if not joined:
+            future.add_done_callback(lambda f: self._finished(key, f))
+        return future, False
+
+    def process(self, files: Iterable[Any], budget: Optional[float] = None,
+                owner: Optional[str] = None) -> List[ExtractedFile]:
+        """
+        Spool and extract Werkzeug FileStorage objects
+
+        Returns one ExtractedFile per non-empty upload, in upload order, after
+        every extraction finished or ``budget`` seconds (default self.budget)
+        passed, whichever comes first. With an ``owner``, uploads still
+        pending are kept for take_finished(owner).
+        """
+        budget = self.budget if budget is None else budget
+        submitted = []
+        with span('upload.process') as current:
+            for file in files:
+                if not file or not file.filename:
+                    continue
+                try:
+                    upload = spool_upload(file.stream, file.filename, self.spool_dir)
+                except Exception as e:
+                    logger.error(f"[UPLOAD] Error spooling {file.filename}: {e}")
+                    continue
+                self._count('files')
+                self._count('bytes', upload.size)
+                logger.info(f"[UPLOAD] Spooled {upload.filename} ({upload.size} bytes, sha256 {upload.sha256[:12]})")
+                future, cached = self.submit(upload)
+                submitted.append((upload, future, cached))
+
+            futures = [future for _, future, _ in submitted]
+            _, not_done = wait(futures, timeout=budget) if futures else (set(), set())
+            if not_done:
+                self._count('pending_at_budget', len(not_done))
+            current.set_attribute('files', len(submitted))
+            current.set_attribute('pending', len(not_done))
+
+        results = []
+        for upload, future, cached in submitted:
+            result = ExtractedFile(
+                filename=upload.filename, sha256=upload.sha256, size=upload.size,
+                type=upload.suffix, status='pending', cached=cached,
+            )
+            if future.done():
+                self._resolve(result, future)
+            elif owner:
+                self._defer(owner, replace(result), future)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _resolve(result: ExtractedFile, future: Future) -> None:
+        success, text = (False, "") if future.exception() else future.result()
+        result.status = 'done' if success and text else 'failed'
+        result.content = text if success else ""
+
+    def _defer(self, owner: str, result: ExtractedFile, future: Future) -> None:
+        with self._lock:
+            self._deferred.setdefault(owner, []).append((result, future))
+            self._deferred.move_to_end(owner)
+            while len(self._deferred) > self.MAX_DEFERRED_OWNERS:
+                self._deferred.popitem(last=False)
+
+    def take_finished(self, owner: Optional[str]) -> List[ExtractedFile]:
+        """
+        Uploads of ``owner`` that were pending at the budget and have finished since
+
+        Each is returned once, with status 'done' or 'failed'; ones still
+        running stay deferred.
+        """
+        if not owner:
+            return []
+        with self._lock:
+            entries = self._deferred.pop(owner, [])
+            still_running = [(result, future) for result, future in entries if not future.done()]
+            if still_running:
+                self._deferred[owner] = still_running
+        finished = []
+        for result, future in entries:
+            if future.done():
+                self._resolve(result, future)
+                finished.append(result)
+        if finished:
+            self._count('deferred_delivered', len(finished))
+        return finished
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['inflight'] = len(self._inflight)
+            stats['deferred'] = sum(len(entries) for entries in self._deferred.values())
+        stats['cached'] = len(self.cache)
+        return stats
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_processor: Optional[UploadProcessor] = None
+_processor_lock = threading.Lock()
+
+
+def get_upload_processor(extract: Optional[Extractor] = None) -> UploadProcessor:
+    """Shared processor; ``extract`` is only used when it is first created"""
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                if extract is None:
+                    from src.ocr_integration import extract_file_content as extract
+                _processor = UploadProcessor(
+                    extract,
+                    max_workers=int(os.getenv('UPLOAD_EXTRACT_WORKERS', '4')),
+                    budget=float(os.getenv('UPLOAD_EXTRACT_BUDGET_SECONDS', '10')),
+                    cache=ExtractionCache(int(os.getenv('UPLOAD_CACHE_MAX_CHARS', '50000000'))),
+                    spool_dir=os.getenv('UPLOAD_SPOOL_DIR') or None,
+                )
+    return _processor
+
+
+def get_upload_stats() -> Dict[str, Any]:
+    """Stats for the performance dashboard (empty until an upload is processed)"""
+    return _processor.get_stats() if _processor is not None else {}
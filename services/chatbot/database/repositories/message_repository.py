@@ -18,6 +18,18 @@ logger = logging.getLogger(__name__)
 class MessageRepository(BaseRepository):
     """Repository for message management"""
     
+    def __init__(self, db, text_index=None):
+        """
+        Initialize repository.
+        
+        Args:
+            db: MongoDB database instance
+            text_index: Optional ``TextIndex`` (src/utils/text_index.py) kept
+                in sync on add/edit and used by ``search_messages``
+        """
+        super().__init__(db)
+        self.text_index = text_index
+    
     @property
     def collection_name(self) -> str:
         return 'messages'
@@ -89,7 +101,12 @@ class MessageRepository(BaseRepository):
             'edit_history': []
         }
         
-        return self.create(message)
+        created = self.create(message)
+        
+        if self.text_index is not None:
+            self.text_index.add(str(created['_id']), content, conversation_id)
+        
+        return created
     
     def edit_message(
         self,
@@ -122,7 +139,7 @@ class MessageRepository(BaseRepository):
             }
             
             # Update with history
-            return self.collection.find_one_and_update(
+            updated = self.collection.find_one_and_update(
                 {'_id': self._parse_id(message_id)},
                 {
                     '$set': {
@@ -135,6 +152,15 @@ class MessageRepository(BaseRepository):
                 return_document=True
             )
             
+            if self.text_index is not None and updated:
+                self.text_index.add(
+                    str(message_id),
+                    new_content,
+                    current.get('conversation_id', '')
+                )
+            
+            return updated
+            
         except Exception as e:
             logger.error(f"Error editing message: {e}")
             raise
@@ -250,6 +276,9 @@ class MessageRepository(BaseRepository):
         Returns:
             Count of deleted messages
         """
+        if self.text_index is not None:
+            self.text_index.delete_conversation(conversation_id)
+        
         return self.delete_many({'conversation_id': conversation_id})
     
     def search_messages(
@@ -261,6 +290,9 @@ class MessageRepository(BaseRepository):
         """
         Search messages by content.
         
+        Uses the inverted text index (BM25-ranked) when one is attached,
+        otherwise falls back to a case-insensitive regex scan.
+        
         Args:
             conversation_id: Conversation ID
             query: Search query
@@ -269,6 +301,26 @@ class MessageRepository(BaseRepository):
         Returns:
             Matching messages
         """
+        if self.text_index is not None:
+            hits = self.text_index.search(
+                query,
+                limit=limit,
+                conversation_ids={conversation_id}
+            )
+            if not hits:
+                return []
+            
+            ids = [hit['doc_id'] for hit in hits]
+            object_ids = [self._parse_id(doc_id) for doc_id in ids]
+            docs = {
+                str(doc['_id']): doc
+                for doc in self.get_many(
+                    query={'_id': {'$in': object_ids}},
+                    limit=len(object_ids)
+                )
+            }
+            return [docs[doc_id] for doc_id in ids if doc_id in docs]
+        
         return self.get_many(
             query={
                 'conversation_id': conversation_id,
@@ -12,6 +12,7 @@ import logging
 import json
 import zlib
 import hashlib
+import uuid
 from typing import Dict, Any, List, Optional, Callable
 from functools import wraps
 from datetime import datetime
@@ -68,8 +69,11 @@ class RedisPipeline:
     Reduces network round trips.
     """
     
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, encode: Callable[[Any], Any] = None,
+                 decode: Callable[[Any], Any] = None):
         self.client = redis_client
+        self.encode = encode or (lambda value: json.dumps(value, default=str))
+        self.decode = decode or json.loads
         self._operations = []
     
     def set(self, key: str, value: Any, ttl: int = None):
@@ -99,9 +103,9 @@ class RedisPipeline:
                 if op[0] == 'set':
                     _, key, value, ttl = op
                     if ttl:
-                        pipe.setex(key, ttl, json.dumps(value, default=str))
+                        pipe.setex(key, ttl, self.encode(value))
                     else:
-                        pipe.set(key, json.dumps(value, default=str))
+                        pipe.set(key, self.encode(value))
                 elif op[0] == 'get':
                     pipe.get(op[1])
                 elif op[0] == 'delete':
@@ -114,7 +118,7 @@ class RedisPipeline:
             op_idx = 0
             for result in results:
                 if self._operations[op_idx][0] == 'get' and result:
-                    parsed.append(json.loads(result))
+                    parsed.append(self.decode(result))
                 else:
                     parsed.append(result)
                 op_idx += 1
@@ -212,6 +216,11 @@ class CacheKeyBuilder:
         """Build query result cache key"""
         return cls.build("query", query_hash)
     
+    @classmethod
+    def tag(cls, kind: str, value: str) -> str:
+        """Build tag set key (e.g. tag('user', 'u1') -> chatbot:tag:user:u1)"""
+        return cls.build("tag", kind, value)
+    
     @classmethod
     def hash_query(cls, query: Dict[str, Any]) -> str:
         """Generate hash for query dict"""
@@ -222,25 +231,108 @@ class CacheKeyBuilder:
 class CacheInvalidator:
     """
     Utilities for cache invalidation patterns.
+    
+    Keys registered with tag() are removed through their tag set (RENAME,
+    then SSCAN + pipelined UNLINK); ad-hoc patterns use incremental SCAN.
+    KEYS is never used since it blocks Redis for the whole keyspace walk.
     """
     
+    SCAN_COUNT = 1000
+    DELETE_CHUNK = 500
+    
+    # KEYS = tag sets, ARGV = key, ttl; sets only ever extend their TTL
+    TAG_LUA = """
+local ttl = tonumber(ARGV[2])
+for i = 1, #KEYS do
+    redis.call('SADD', KEYS[i], ARGV[1])
+    if ttl > 0 and redis.call('TTL', KEYS[i]) < ttl then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+return #KEYS
+"""
+    
     def __init__(self, cache_client):
         self.cache = cache_client
+        self._tag_script = None
+    
+    def tag(self, key: str, *tags: str, ttl: int = None):
+        """Register key under tag sets (tags from CacheKeyBuilder.tag)"""
+        try:
+            if self._tag_script is None:
+                self._tag_script = self.cache.register_script(self.TAG_LUA)
+            self._tag_script(keys=list(tags), args=[key, ttl or 0])
+        except Exception as e:
+            logger.warning(f"Cache tagging failed: {e}")
     
-    def invalidate_pattern(self, pattern: str):
-        """Invalidate all keys matching pattern (Redis only)"""
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Delete every key registered under the given tag sets
+        
+        Each set is renamed first so keys tagged during the sweep land in a
+        fresh set; the renamed copy is streamed with SSCAN into UNLINK chunks.
+        """
+        deleted = 0
+        for tag in tags:
+            draining = f"{tag}:invalidating:{uuid.uuid4().hex}"
+            try:
+                self.cache.rename(tag, draining)
+            except Exception as e:
+                if 'no such key' not in str(e).lower():
+                    logger.warning(f"Tag invalidation failed for {tag}: {e}")
+                continue
+            
+            try:
+                deleted += self._unlink_chunks(
+                    self.cache.sscan_iter(draining, count=self.SCAN_COUNT)
+                )
+                self.cache.unlink(draining)
+            except Exception as e:
+                logger.warning(f"Tag invalidation failed for {tag}: {e}")
+        return deleted
+    
+    def invalidate_pattern(self, pattern: str) -> int:
+        """Invalidate all keys matching pattern (Redis only, non-blocking SCAN)"""
         try:
-            if hasattr(self.cache, 'keys'):
-                keys = self.cache.keys(pattern)
-                if keys:
-                    self.cache.delete(*keys)
-                    logger.debug(f"Invalidated {len(keys)} keys matching {pattern}")
+            if hasattr(self.cache, 'scan_iter'):
+                deleted = self._unlink_chunks(self.cache.scan_iter(match=pattern, count=self.SCAN_COUNT))
+                logger.debug(f"Invalidated {deleted} keys matching {pattern}")
+                return deleted
         except Exception as e:
             logger.warning(f"Pattern invalidation failed: {e}")
+        return 0
+    
+    def _unlink_chunks(self, keys) -> int:
+        deleted = 0
+        chunk = []
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) >= self.DELETE_CHUNK:
+                deleted += self._unlink(chunk)
+                chunk = []
+        if chunk:
+            deleted += self._unlink(chunk)
+        return deleted
+    
+    def _unlink(self, keys: List[str]) -> int:
+        pipe = self.cache.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        return sum(pipe.execute())
+    
+    def invalidate_user(self, user_id: str) -> int:
+        """
+        Invalidate all cache for a user
+        
+        Tagged keys go through the user's tag set; keys written under
+        chatbot:user:{id}:* without a tag are still swept by pattern.
+        """
+        deleted = self.invalidate_tags(CacheKeyBuilder.tag("user", user_id))
+        deleted += self.invalidate_pattern(f"{CacheKeyBuilder.build('user', user_id)}:*")
+        return deleted
     
-    def invalidate_user(self, user_id: str):
-        """Invalidate all cache for a user"""
-        self.invalidate_pattern(f"{CacheKeyBuilder.PREFIX}:user:{user_id}:*")
+    def invalidate_model(self, model: str) -> int:
+        """Invalidate all cache for a model"""
+        return self.invalidate_tags(CacheKeyBuilder.tag("model", model))
     
     def invalidate_conversation(self, conversation_id: str):
         """Invalidate all cache for a conversation"""
@@ -254,6 +346,8 @@ class CacheInvalidator:
                 self.cache.delete(key)
             except:
                 pass
+        
+        self.invalidate_tags(CacheKeyBuilder.tag("conv", conversation_id))
 
 
 class MemoryLimiter:
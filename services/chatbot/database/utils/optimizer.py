@@ -128,9 +128,18 @@ class BulkOperations:
     Utilities for bulk database operations.
     """
     
-    def __init__(self, collection, batch_size: int = 1000):
+    def __init__(self, collection, batch_size: int = 1000, skip_duplicates: bool = False):
+        """
+        Args:
+            collection: Target collection
+            batch_size: Auto-flush threshold
+            skip_duplicates: Treat duplicate _id errors as already written
+                (idempotent retries of documents with client-assigned _id)
+        """
         self.collection = collection
         self.batch_size = batch_size
+        self.skip_duplicates = skip_duplicates
+        self.skipped_duplicates: List[Dict[str, Any]] = []
         self._insert_buffer = []
         self._update_buffer = []
     
@@ -161,6 +170,13 @@ class BulkOperations:
             self._insert_buffer.clear()
             return count
         except Exception as e:
+            errors = getattr(e, 'details', None) and e.details.get('writeErrors')
+            if self.skip_duplicates and errors and all(err.get('code') == 11000 for err in errors):
+                self.skipped_duplicates.extend(self._insert_buffer[err['index']] for err in errors)
+                count = e.details.get('nInserted', len(self._insert_buffer) - len(errors))
+                logger.debug(f"Bulk inserted {count} documents ({len(errors)} already present)")
+                self._insert_buffer.clear()
+                return count
             logger.error(f"Bulk insert error: {e}")
             raise
     
@@ -172,8 +188,9 @@ class BulkOperations:
         try:
             from pymongo import UpdateOne
             
+            # Plain field dicts are $set; operator documents ($inc, ...) pass through
             operations = [
-                UpdateOne(filter_q, {'$set': update})
+                UpdateOne(filter_q, update if all(k.startswith('$') for k in update) else {'$set': update})
                 for filter_q, update in self._update_buffer
             ]
             
@@ -405,6 +422,8 @@ class IndexManager:
         'messages': [
             {'keys': [('conversation_id', 1), ('created_at', 1)], 'name': 'idx_conv_created'},
             {'keys': [('conversation_id', 1), ('is_deleted', 1)], 'name': 'idx_conv_deleted'},
+            {'keys': [('conversation_id', 1), ('role', 1), ('created_at', -1)], 'name': 'idx_conv_role_created'},
+            {'keys': [('parent_message_id', 1)], 'name': 'idx_parent'},
         ],
         'memories': [
             {'keys': [('user_id', 1), ('importance', -1)], 'name': 'idx_user_importance'},
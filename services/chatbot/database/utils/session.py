@@ -224,6 +224,19 @@ def get_mongodb_database(db_name: str = None) -> Optional[Database]:
 class RepositoryFactory:
     """Factory for creating repository instances"""
     
+    _text_index = None
+    
+    @classmethod
+    def get_text_index(cls):
+        """Get the shared message TextIndex (enabled by MESSAGE_TEXT_INDEX_DIR)"""
+        index_dir = os.getenv('MESSAGE_TEXT_INDEX_DIR')
+        if not index_dir:
+            return None
+        if cls._text_index is None:
+            from src.utils.text_index import TextIndex
+            cls._text_index = TextIndex(index_dir)
+        return cls._text_index
+    
     @staticmethod
     def get_conversation_repository():
         """Get ConversationRepository instance"""
@@ -240,7 +253,7 @@ class RepositoryFactory:
         db = DatabaseSession().get_database()
         if db is None:
             raise ConnectionError("Database not available")
-        return MessageRepository(db)
+        return MessageRepository(db, text_index=RepositoryFactory.get_text_index())
     
     @staticmethod
     def get_memory_repository():
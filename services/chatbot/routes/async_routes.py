@@ -4,7 +4,6 @@ Requires Flask with async support or use with Quart/FastAPI
 """
 import json
 import uuid
-import asyncio
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -18,9 +17,10 @@ if str(CHATBOT_DIR) not in sys.path:
 
 from core.config import MEMORY_DIR, OPENAI_API_KEY, DEEPSEEK_API_KEY, GROK_API_KEY, QWEN_API_KEY, HUGGINGFACE_API_KEY, get_system_prompts
 from core.extensions import logger
-from core.streaming import StreamEvent
+from core.streaming import StreamEvent, StreamingChatHandler
 from core.base_chat import ModelConfig, ModelProvider, ChatContext
-from core.async_chat import AsyncChatbotAgent
+from core.async_chat import AsyncChatbotAgent, compare_models_stream
+from core.http_pool import run_coroutine, iterate_async
 
 # Check MCP availability
 MCP_AVAILABLE = False
@@ -95,21 +95,13 @@ def get_async_agent() -> AsyncChatbotAgent:
 
 
 def run_async(coro):
-    """Run async coroutine in sync context"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    """
+    Run async coroutine in sync context
     
-    if loop.is_running():
-        # If loop is already running (e.g., in Jupyter), create new thread
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(asyncio.run, coro)
-            return future.result()
-    else:
-        return loop.run_until_complete(coro)
+    Runs on the shared background event loop so pooled keep-alive
+    connections are reused across requests.
+    """
+    return run_coroutine(coro)
 
 
 @async_bp.route('/chat/async', methods=['POST'])
@@ -269,74 +261,20 @@ def chat_async_stream():
         
         agent = get_async_agent()
         
-        def generate_stream():
-            try:
-                # Send metadata
-                yield StreamEvent(
-                    event="metadata",
-                    data=json.dumps({
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "async": True,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                ).format()
-                
-                full_response = ""
-                chunk_count = 0
-                
-                # Run async generator in sync context
-                async def get_chunks():
-                    chunks = []
-                    async for chunk in agent.chat_stream(model, ctx, get_system_prompts):
-                        chunks.append(chunk)
-                    return chunks
-                
-                chunks = run_async(get_chunks())
-                
-                for chunk in chunks:
-                    if chunk:
-                        full_response += chunk
-                        chunk_count += 1
-                        yield StreamEvent(
-                            event="chunk",
-                            data=json.dumps({
-                                "content": chunk,
-                                "chunk_index": chunk_count
-                            })
-                        ).format()
-                
-                # Send complete event
-                yield StreamEvent(
-                    event="complete",
-                    data=json.dumps({
-                        "response": full_response,
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "total_chunks": chunk_count,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                ).format()
-                
-            except Exception as e:
-                logger.error(f"[Async SSE] Error: {e}")
-                yield StreamEvent(
-                    event="error",
-                    data=json.dumps({"error": str(e)})
-                ).format()
-        
-        return Response(
-            generate_stream(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
-                'Access-Control-Allow-Origin': '*',
-            }
+        # Forward chunks from the async generator through a replayable session
+        stream = StreamingChatHandler.start_stream(
+            iterate_async(agent.chat_stream(model, ctx, get_system_prompts)),
+            model=model,
+            metadata={
+                "model": model,
+                "context": context,
+                "deep_thinking": deep_thinking,
+                "async": True,
+                "timestamp": datetime.now().isoformat()
+            },
+            complete={"context": context, "deep_thinking": deep_thinking}
         )
+        return StreamingChatHandler.sse_response(stream.events())
         
     except Exception as e:
         logger.error(f"[Async Stream] Error: {e}")
@@ -410,3 +348,95 @@ def chat_batch():
     except Exception as e:
         logger.error(f"[Batch] Error: {e}")
         return {'error': str(e)}, 500
+
+
+@async_bp.route('/chat/compare', methods=['POST'])
+def chat_compare():
+    """
+    Compare models - fan one prompt out to several models concurrently (SSE)
+    
+    Request Body:
+        - message: User message (required)
+        - models: List of models to compare (default: all available, max 5)
+        - context, deep_thinking, language, custom_prompt: as /chat/async
+    
+    Events:
+        - metadata: models being compared
+        - chunk: {"model", "content"} as each model streams
+        - model_complete: {"model", "response", "latency_ms", "first_chunk_ms", "error"}
+        - complete: all models finished
+    """
+    data = request.json or {}
+    message = data.get('message', '')
+    
+    if not message:
+        return Response(
+            StreamEvent(event="error", data=json.dumps({"error": "Empty message"})).format(),
+            mimetype='text/event-stream',
+            status=400
+        )
+    
+    agent = get_async_agent()
+    models = data.get('models') or list(agent.config_map.keys())
+    models = [m for m in models if m in agent.config_map][:5]
+    
+    if not models:
+        return Response(
+            StreamEvent(event="error", data=json.dumps({"error": "No available models to compare"})).format(),
+            mimetype='text/event-stream',
+            status=400
+        )
+    
+    ctx = ChatContext(
+        message=message,
+        context=data.get('context', 'casual'),
+        deep_thinking=data.get('deep_thinking', False),
+        language=data.get('language', 'vi'),
+        custom_prompt=data.get('custom_prompt', ''),
+        conversation_history=[]
+    )
+    
+    def generate_stream():
+        try:
+            yield StreamEvent(
+                event="metadata",
+                data=json.dumps({"models": models, "timestamp": datetime.now().isoformat()})
+            ).format()
+            
+            results = {}
+            for event in iterate_async(compare_models_stream(models, ctx, agent, get_system_prompts)):
+                if event['type'] == 'chunk':
+                    yield StreamEvent(
+                        event="chunk",
+                        data=json.dumps({"model": event['model'], "content": event['content']})
+                    ).format()
+                else:
+                    results[event['model']] = event
+                    yield StreamEvent(
+                        event="model_complete",
+                        data=json.dumps({k: v for k, v in event.items() if k != 'type'})
+                    ).format()
+            
+            yield StreamEvent(
+                event="complete",
+                data=json.dumps({
+                    "models": models,
+                    "latency_ms": {m: r['latency_ms'] for m, r in results.items()},
+                    "timestamp": datetime.now().isoformat()
+                })
+            ).format()
+            
+        except Exception as e:
+            logger.error(f"[Compare SSE] Error: {e}")
+            yield StreamEvent(event="error", data=json.dumps({"error": str(e)})).format()
+    
+    return Response(
+        generate_stream(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        }
+    )
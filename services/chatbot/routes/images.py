@@ -8,6 +8,7 @@ import sys
 import json
 import base64
 import re
+import threading
 import uuid
 from datetime import datetime
 from pathlib import Path
@@ -24,6 +25,19 @@ from core.extensions import logger
 
 images_bp = Blueprint('images', __name__)
 
+# Cloud URLs are filled into the metadata files from replication threads
+_metadata_lock = threading.Lock()
+
+
+def _set_cloud_url(metadata_file: Path, url: str):
+    """Record a cloud URL in an image's metadata file (read-modify-write)"""
+    with _metadata_lock:
+        saved = json.loads(metadata_file.read_text(encoding='utf-8'))
+        if saved.get('cloud_url') == url:
+            return
+        saved['cloud_url'] = url
+        metadata_file.write_text(json.dumps(saved, ensure_ascii=False, indent=2), encoding='utf-8')
+
 
 def get_session_id():
     """Get or create a unique session ID for privacy filtering"""
@@ -64,7 +78,24 @@ def save_image():
         # Add session_id to metadata for cloud storage
         metadata['session_id'] = session_id
         
-        # Upload to cloud (ImgBB + MongoDB/Firebase)
+        # Save metadata with session_id before replication can report a URL
+        metadata_file = IMAGE_STORAGE_DIR / f"generated_{timestamp}.json"
+        with open(metadata_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'filename': filename,
+                'created_at': datetime.now().isoformat(),
+                'cloud_url': None,
+                'session_id': session_id,  # Track session for privacy
+                'metadata': metadata
+            }, f, ensure_ascii=False, indent=2)
+        
+        def record_cloud_url(manifest):
+            # Replication finishes after the response; fill in the URL then
+            url = manifest.get('imgbb_ref')
+            if url:
+                _set_cloud_url(metadata_file, url)
+        
+        # Upload to cloud (ImgBB + MongoDB/Firebase) in the background
         cloud_url = None
         try:
             from core.image_storage import store_generated_image
@@ -72,24 +103,16 @@ def save_image():
                 image_base64=image_base64,
                 prompt=metadata.get('prompt', ''),
                 negative_prompt=metadata.get('negative_prompt', ''),
-                metadata=metadata
+                metadata=metadata,
+                on_replicated=record_cloud_url
             )
             if storage_result.get('success'):
                 cloud_url = storage_result.get('imgbb_url')
+                if cloud_url:
+                    _set_cloud_url(metadata_file, cloud_url)
         except Exception as e:
             logger.warning(f"[SaveImage] Cloud upload failed: {e}")
         
-        # Save metadata with session_id
-        metadata_file = IMAGE_STORAGE_DIR / f"generated_{timestamp}.json"
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'filename': filename,
-                'created_at': datetime.now().isoformat(),
-                'cloud_url': cloud_url,
-                'session_id': session_id,  # Track session for privacy
-                'metadata': metadata
-            }, f, ensure_ascii=False, indent=2)
-        
         image_url = f"/storage/images/{filename}"
         
         return jsonify({
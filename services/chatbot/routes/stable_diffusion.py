@@ -5,9 +5,10 @@ import os
 import sys
 import json
 import base64
+import uuid
 from datetime import datetime
 from pathlib import Path
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, request, jsonify, session
 import logging
 
 # Setup path
@@ -274,6 +275,27 @@ def sd_vaes():
 # IMAGE GENERATION
 # ============================================================================
 
+def _text2img_params(data):
+    """ComfyUI parameters - preset values as defaults, request values override"""
+    preset_id = data.get('preset', data.get('style', None))
+    preset_config = {}
+    
+    if preset_id and PRESETS_AVAILABLE:
+        preset_config = get_preset(preset_id) or {}
+        logger.info(f"[TEXT2IMG] Using preset: {preset_id}")
+    
+    return {
+        'prompt': data.get('prompt', ''),
+        'negative_prompt': data.get('negative_prompt') or preset_config.get('negative_prompt', 'bad quality, blurry, distorted'),
+        'width': int(data.get('width') or preset_config.get('width', 1024)),
+        'height': int(data.get('height') or preset_config.get('height', 1024)),
+        'steps': int(data.get('steps') or preset_config.get('steps', 20)),
+        'cfg_scale': float(data.get('cfg_scale') or preset_config.get('cfg_scale', 7.0)),
+        'seed': int(data.get('seed') or -1),
+        'model': data.get('model') or preset_config.get('model', None)
+    }
+
+
 @sd_bp.route('/api/generate-image', methods=['POST'])
 @sd_bp.route('/sd-api/text2img', methods=['POST'])
 def generate_image():
@@ -296,26 +318,7 @@ def generate_image():
             return jsonify({'error': 'Prompt is required'}), 400
         
         save_to_storage = data.get('save_to_storage', False)
-        
-        # Check if using preset
-        preset_id = data.get('preset', data.get('style', None))
-        preset_config = {}
-        
-        if preset_id and PRESETS_AVAILABLE:
-            preset_config = get_preset(preset_id) or {}
-            logger.info(f"[TEXT2IMG] Using preset: {preset_id}")
-        
-        # ComfyUI parameters - preset values as defaults, request values override
-        params = {
-            'prompt': prompt,
-            'negative_prompt': data.get('negative_prompt') or preset_config.get('negative_prompt', 'bad quality, blurry, distorted'),
-            'width': int(data.get('width') or preset_config.get('width', 1024)),
-            'height': int(data.get('height') or preset_config.get('height', 1024)),
-            'steps': int(data.get('steps') or preset_config.get('steps', 20)),
-            'cfg_scale': float(data.get('cfg_scale') or preset_config.get('cfg_scale', 7.0)),
-            'seed': int(data.get('seed') or -1),
-            'model': data.get('model') or preset_config.get('model', None)
-        }
+        params = _text2img_params(data)
         
         logger.info(f"[TEXT2IMG] Generating with model: {params.get('model')}, prompt: {prompt[:50]}...")
         
@@ -441,6 +444,129 @@ def img2img():
         return jsonify({'error': 'Failed to process img2img request'}), 500
 
 
+# ============================================================================
+# IMAGE JOBS (non-blocking generation)
+# ============================================================================
+
+def _job_owner():
+    """Jobs are limited per user; anonymous users are told apart by session"""
+    user_id = get_user_id_from_session()
+    if user_id == 'anonymous':
+        if 'session_id' not in session:
+            session['session_id'] = str(uuid.uuid4())
+        user_id = f"session:{session['session_id']}"
+    return user_id
+
+
+def _owned_job(job_id):
+    from core.image_jobs import get_image_job_queue
+    
+    queue = get_image_job_queue()
+    job = queue.get(job_id)
+    if job is None or job.user_id != _job_owner():
+        return queue, None
+    return queue, job
+
+
+@sd_bp.route('/api/image-jobs', methods=['POST'])
+def submit_image_job():
+    """
+    Queue a text2img/img2img job and return its id at once (202)
+    
+    Body: the /api/generate-image fields (or /api/img2img with kind='img2img'),
+    plus lane='interactive'|'batch'. Follow progress on
+    /api/image-jobs/<id>/events (SSE) or poll /api/image-jobs/<id>.
+    """
+    try:
+        from core.image_jobs import JobLimitError, get_image_job_queue
+        
+        data = request.json or {}
+        if not data.get('prompt'):
+            return jsonify({'error': 'Prompt is required'}), 400
+        
+        kind = data.get('kind', 'txt2img')
+        if kind == 'img2img':
+            if not data.get('image'):
+                return jsonify({'error': 'Image is required'}), 400
+            params = {
+                'init_images': [data['image']],
+                'prompt': data['prompt'],
+                'negative_prompt': data.get('negative_prompt') or 'bad quality, blurry',
+                'denoising_strength': float(data.get('denoising_strength') or 0.8),
+                'width': int(data.get('width') or 512),
+                'height': int(data.get('height') or 512),
+                'steps': int(data.get('steps') or 30),
+                'cfg_scale': float(data.get('cfg_scale') or 7.0),
+                'seed': int(data.get('seed') or -1),
+                'sampler_name': data.get('sampler_name') or 'euler'
+            }
+        else:
+            params = _text2img_params(data)
+        
+        queue = get_image_job_queue()
+        try:
+            job = queue.submit(_job_owner(), params, kind=kind, lane=data.get('lane', 'interactive'))
+        except JobLimitError as e:
+            return jsonify({'error': str(e)}), 429
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({**job.to_dict(), 'position': queue.position(job)}), 202
+        
+    except Exception as e:
+        logger.error(f"[IMAGE JOBS] Submit error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@sd_bp.route('/api/image-jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """Job state; ``?include_image=1`` adds the base64 result once done"""
+    queue, job = _owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    result = {**job.to_dict(), 'position': queue.position(job)}
+    if job.image is not None and request.args.get('include_image'):
+        result['image'] = base64.b64encode(job.image).decode('utf-8')
+    return jsonify(result)
+
+
+@sd_bp.route('/api/image-jobs/<job_id>/image', methods=['GET'])
+def get_image_job_result(job_id):
+    """Generated image bytes (404 until the job is done)"""
+    _, job = _owned_job(job_id)
+    if job is None or job.image is None:
+        return jsonify({'error': 'Image not available'}), 404
+    return Response(job.image, mimetype='image/png', headers={'Cache-Control': 'private, max-age=600'})
+
+
+@sd_bp.route('/api/image-jobs/<job_id>/events', methods=['GET'])
+def stream_image_job(job_id):
+    """SSE: 'state' events with progress, then 'complete' or 'error'"""
+    from core.streaming import StreamingChatHandler
+    
+    queue, job = _owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return StreamingChatHandler.sse_response(queue.events(job.id))
+
+
+@sd_bp.route('/api/image-jobs/<job_id>', methods=['DELETE'])
+def cancel_image_job(job_id):
+    """Cancel a queued or running job"""
+    queue, job = _owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'cancelled': queue.cancel(job.id), **job.to_dict()})
+
+
+@sd_bp.route('/api/image-jobs/stats', methods=['GET'])
+def image_job_stats():
+    """Queue depth per lane, running prompts and listener state"""
+    from core.image_jobs import get_image_job_stats
+    return jsonify(get_image_job_stats())
+
+
 # ============================================================================
 # PROMPT GENERATION
 # ============================================================================
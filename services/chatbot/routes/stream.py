@@ -48,10 +48,13 @@ def chat_stream():
     
     Returns:
         SSE stream with events:
-        - metadata: Initial metadata about the request
-        - chunk: Response chunks as they arrive
-        - complete: Final event with full response
+        - metadata: Initial metadata about the request (includes stream_id)
+        - chunk: Coalesced response chunks as they arrive
+        - complete: Final event with totals and TTFT (clients join the chunks)
         - error: Error event if something fails
+    
+    Every event has an id; after a disconnect, resume with
+    GET /chat/stream/resume and the ``Last-Event-ID`` header.
     """
     try:
         # Parse request
@@ -116,78 +119,29 @@ def chat_stream():
                     except Exception as e:
                         logger.error(f"Error loading memory {mem_id}: {e}")
         
-        # Create streaming generator
-        def generate_stream():
-            try:
-                # Send metadata
-                yield StreamEvent(
-                    event="metadata",
-                    data=json.dumps({
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "streaming": True,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                ).format()
-                
-                full_response = ""
-                chunk_count = 0
-                
-                # Get streaming response from chatbot
-                for chunk in chatbot.chat_stream(
-                    message=message,
-                    model=model,
-                    context=context,
-                    deep_thinking=deep_thinking,
-                    history=history,
-                    memories=memories if memories else None,
-                    language=language,
-                    custom_prompt=custom_prompt
-                ):
-                    if chunk:
-                        full_response += chunk
-                        chunk_count += 1
-                        yield StreamEvent(
-                            event="chunk",
-                            data=json.dumps({
-                                "content": chunk,
-                                "chunk_index": chunk_count
-                            })
-                        ).format()
-                
-                # Send complete event
-                yield StreamEvent(
-                    event="complete",
-                    data=json.dumps({
-                        "response": full_response,
-                        "model": model,
-                        "context": context,
-                        "deep_thinking": deep_thinking,
-                        "total_chunks": chunk_count,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                ).format()
-                
-            except GeneratorExit:
-                logger.info("[SSE] Client disconnected")
-            except Exception as e:
-                logger.error(f"[SSE] Streaming error: {e}")
-                yield StreamEvent(
-                    event="error",
-                    data=json.dumps({"error": str(e)})
-                ).format()
-        
-        return Response(
-            generate_stream(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',
-                'Access-Control-Allow-Origin': '*',
-            }
+        # Stream through a replayable session (survives client reconnects)
+        stream = StreamingChatHandler.start_stream(
+            chatbot.chat_stream(
+                message=message,
+                model=model,
+                context=context,
+                deep_thinking=deep_thinking,
+                history=history,
+                memories=memories if memories else None,
+                language=language,
+                custom_prompt=custom_prompt
+            ),
+            model=model,
+            metadata={
+                "model": model,
+                "context": context,
+                "deep_thinking": deep_thinking,
+                "streaming": True,
+                "timestamp": datetime.now().isoformat()
+            },
+            complete={"context": context, "deep_thinking": deep_thinking}
         )
+        return StreamingChatHandler.sse_response(stream.events())
         
     except Exception as e:
         logger.error(f"[Stream] Error: {e}")
@@ -198,6 +152,19 @@ def chat_stream():
         )
 
 
+@stream_bp.route('/chat/stream/resume', methods=['GET'])
+def chat_stream_resume():
+    """
+    Resume a stream after a disconnect
+    
+    Replays the events after ``Last-Event-ID`` (header, or ``last_event_id``
+    query param for clients that cannot set headers) and then follows the
+    stream live. Finished streams stay replayable for SSE_REPLAY_TTL_SECONDS.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return StreamingChatHandler.resume_response(last_event_id)
+
+
 @stream_bp.route('/chat/stream/models', methods=['GET'])
 def list_streaming_models():
     """List models that support streaming"""
@@ -0,0 +1,130 @@
+"""
+Benchmark cache invalidation against a large keyspace (default 1M keys)
+
+Deletes one user's entries (--target keys) three ways while a reader thread
+issues GETs, and reports wall time plus the reader's worst GET latency:
+
+    keys : KEYS user-pattern + DEL (the old delete_pattern, blocks Redis)
+    scan : CacheManager.delete_pattern (SCAN + pipelined UNLINK chunks)
+    tags : CacheManager.invalidate_tags (SSCAN of the tag set + UNLINK)
+
+Without --redis-url the numbers come from fakeredis (in-process, single
+global lock), which exaggerates absolute times; its SCAN also re-walks the
+whole keyspace per cursor step, so 'scan' is far slower there than on a real
+server (skip it with --methods keys,tags). Use a real server for
+representative latencies.
+
+Usage:
+    python scripts/bench_cache_invalidation.py [--keys 1000000] [--target 1000]
+                                               [--methods keys,scan,tags]
+                                               [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.utils import cache_manager  # noqa: E402
+
+
+def open_cache(redis_url):
+    if redis_url:
+        cache = cache_manager.CacheManager(redis_url)
+        if not cache.enabled:
+            sys.exit(f"Redis unavailable at {redis_url}")
+        cache.redis_client.flushdb()
+        return cache
+    import fakeredis
+    server = fakeredis.FakeServer()
+
+    def from_url(url, decode_responses=False, **kwargs):
+        return fakeredis.FakeRedis(server=server, decode_responses=decode_responses)
+
+    with patch.object(cache_manager.redis, 'from_url', from_url):
+        return cache_manager.CacheManager('redis://fakeredis')
+
+
+def seed_background(cache, count, batch=10000):
+    pipe = cache.redis_client.pipeline(transaction=False)
+    for i in range(count):
+        pipe.set(f"ai_response:bg{i}", 'x', ex=3600)
+        if i % batch == batch - 1:
+            pipe.execute()
+    pipe.execute()
+
+
+def seed_target(cache, target):
+    for i in range(target):
+        cache.set(f"user:bench:{i}", 'x', ttl=3600, tags=cache.make_tags(user_id='bench'))
+
+
+def keys_delete(cache):
+    keys = cache.redis_client.keys('user:bench:*')
+    return cache.redis_client.delete(*keys) if keys else 0
+
+
+class Reader(threading.Thread):
+    """Issues GETs in a loop and records their latencies"""
+
+    def __init__(self, cache):
+        super().__init__(daemon=True)
+        self.client = cache.redis_client
+        self.latencies = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            self.client.get('ai_response:bg0')
+            self.latencies.append((time.perf_counter() - start) * 1000)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def measure(cache, method, target):
+    seed_target(cache, target)
+    reader = Reader(cache)
+    reader.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    deleted = method()
+    elapsed = (time.perf_counter() - start) * 1000
+    time.sleep(0.05)
+    reader.stop()
+    assert deleted == target, f"deleted {deleted}, expected {target}"
+    return elapsed, max(reader.latencies), statistics.median(reader.latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=1_000_000, help='Background keys in the keyspace')
+    parser.add_argument('--target', type=int, default=1000, help='Keys deleted per run')
+    parser.add_argument('--methods', default='keys,scan,tags')
+    parser.add_argument('--redis-url', default=None, help='Real Redis (database is FLUSHED; default: fakeredis)')
+    args = parser.parse_args()
+
+    cache = open_cache(args.redis_url)
+    backend = 'redis' if args.redis_url else 'fakeredis'
+    print(f"🧪 seeding {args.keys:,} keys, backend={backend} ...")
+    seed_background(cache, args.keys)
+
+    methods = {
+        'keys': lambda: keys_delete(cache),
+        'scan': lambda: cache.delete_pattern('user:bench:*'),
+        'tags': lambda: cache.invalidate_tags('user:bench'),
+    }
+    print(f"\n{'method':>6} | {'delete ms':>10} | {'GET max ms':>10} {'GET p50 ms':>10}")
+    for name in args.methods.split(','):
+        elapsed, worst, median = measure(cache, methods[name], args.target)
+        print(f"{name:>6} | {elapsed:>10.1f} | {worst:>10.2f} {median:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
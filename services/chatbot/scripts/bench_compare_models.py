@@ -0,0 +1,130 @@
+"""
+Benchmark 3-model fan-out: sequential sync path vs pooled concurrent compare mode
+
+Starts a local OpenAI-compatible mock server (per-model latency, streamed
+chunks) and measures end-to-end latency of asking N models the same prompt:
+
+  sequential : new openai.OpenAI client per call, models called one after
+               another (what /chat did before)
+  fan-out    : pooled AsyncOpenAI clients on the shared background loop,
+               compare_models_stream (what /chat/compare does)
+
+Usage:
+    python scripts/bench_compare_models.py [--iterations 50] [--latency 0.3,0.5,0.8]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+import openai
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.base_chat import ModelConfig, ModelProvider, ChatContext  # noqa: E402
+from core.async_chat import AsyncChatbotAgent, compare_models_stream  # noqa: E402
+from core.http_pool import iterate_async  # noqa: E402
+
+MODELS = [('openai', ModelProvider.OPENAI), ('deepseek', ModelProvider.DEEPSEEK), ('grok', ModelProvider.GROK)]
+CHUNKS = 20
+
+
+def start_mock_server(latencies, port):
+    """OpenAI-compatible /v1/chat/completions with per-model latency and jitter"""
+
+    async def completions(request):
+        body = await request.json()
+        model = body['model']
+        base = latencies[model]
+        delay = random.uniform(base * 0.8, base * 1.2)
+        words = [f"{model}-{i} " for i in range(CHUNKS)]
+
+        if not body.get('stream'):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                'id': 'cmpl', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)}, 'finish_reason': 'stop'}]
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for word in words:
+            await asyncio.sleep(delay / CHUNKS)
+            chunk = {
+                'id': 'cmpl', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', completions)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def run_sequential(base_url, prompt):
+    for name, _ in MODELS:
+        client = openai.OpenAI(api_key='bench', base_url=base_url)
+        client.chat.completions.create(model=name, messages=[{'role': 'user', 'content': prompt}], max_tokens=100)
+        client.close()
+
+
+def run_fan_out(agent, prompt):
+    ctx = ChatContext(message=prompt, custom_prompt='You are a benchmark.')
+    for _ in iterate_async(compare_models_stream([name for name, _ in MODELS], ctx, agent, None)):
+        pass
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def measure(fn, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(f"benchmark prompt {i}")
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', default='0.3,0.5,0.8', help='Mock latency (s) per model, comma separated')
+    parser.add_argument('--port', type=int, default=18931)
+    args = parser.parse_args()
+
+    latencies = dict(zip([name for name, _ in MODELS], map(float, args.latency.split(','))))
+    start_mock_server(latencies, args.port)
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+
+    agent = AsyncChatbotAgent({
+        name: ModelConfig(name=name, provider=provider, api_key='bench', base_url=base_url, model_id=name)
+        for name, provider in MODELS
+    })
+
+    print(f"🧪 {len(MODELS)}-model fan-out, {args.iterations} iterations, latency={latencies}\n")
+    results = [
+        ('sequential (sync)', measure(lambda p: run_sequential(base_url, p), args.iterations)),
+        ('fan-out (pooled)', measure(lambda p: run_fan_out(agent, p), args.iterations)),
+    ]
+    print(f"{'path':<20} {'p50 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+    for name, timings in results:
+        print(f"{name:<20} {percentile(timings, 50):10.1f} {percentile(timings, 99):10.1f} {statistics.mean(timings):10.1f}")
+
+
+if __name__ == '__main__':
+    main()
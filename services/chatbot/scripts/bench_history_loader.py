@@ -0,0 +1,142 @@
+"""
+Benchmark conversation history loading at 10 / 100 / 1000 turns
+
+  pairing (CPU only, data already fetched):
+    legacy    : for each user message scan all messages for its reply
+                (what load_conversation_history did), O(n^2)
+    turns     : HistoryService.to_turn over the $lookup-joined documents, O(n)
+  end to end:
+    legacy    : find() every message + legacy pairing
+    aggregate : HistoryService single aggregation (cache miss)
+    cached    : HistoryService served from the per-conversation cache
+
+Without --mongo-uri the end-to-end numbers come from mongomock, whose
+$lookup is an unindexed nested loop; use a real server (the loader relies
+on the parent_message_id index) for representative aggregate timings.
+
+Usage:
+    python scripts/bench_history_loader.py [--turns 10,100,1000] [--iterations 20]
+                                           [--mongo-uri mongodb://localhost:27017]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import mongomock
+from bson import ObjectId
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.history_service import HistoryService  # noqa: E402
+
+
+class DictCache:
+    """In-process CacheManager stand-in (JSON encoded like Redis)"""
+
+    enabled = True
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return json.loads(self.data[key]) if key in self.data else None
+
+    def set(self, key, value, ttl=3600):
+        self.data[key] = json.dumps(value)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def seed(db, turns):
+    conversation_id = ObjectId()
+    start = datetime(2024, 1, 1)
+    docs = []
+    for i in range(turns):
+        user_id = ObjectId()
+        docs.append({'_id': user_id, 'conversation_id': conversation_id, 'role': 'user',
+                     'content': f'question {i}', 'parent_message_id': None,
+                     'created_at': start + timedelta(seconds=2 * i), 'metadata': {}})
+        docs.append({'conversation_id': conversation_id, 'role': 'assistant',
+                     'content': f'answer {i}', 'parent_message_id': user_id,
+                     'created_at': start + timedelta(seconds=2 * i + 1), 'metadata': {'model': 'grok'}})
+    db.messages.insert_many(docs)
+    return str(conversation_id)
+
+
+def legacy_pair(messages):
+    history = []
+    for msg in messages:
+        if msg['role'] == 'user':
+            assistant_msg = next((m for m in messages if m.get('parent_message_id') == msg['_id']), None)
+            if assistant_msg:
+                history.append({'user': msg['content'], 'assistant': assistant_msg['content']})
+    return history
+
+
+def legacy_load(db, conversation_id):
+    messages = list(db.messages.find({'conversation_id': ObjectId(conversation_id)}).sort('created_at', 1))
+    return legacy_pair(messages)
+
+
+def measure(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def open_db(mongo_uri, turns):
+    if not mongo_uri:
+        return mongomock.MongoClient().bench
+    import pymongo
+    db = pymongo.MongoClient(mongo_uri)[f'bench_history_{turns}']
+    db.messages.drop()
+    db.messages.create_index([('conversation_id', 1), ('role', 1), ('created_at', -1)])
+    db.messages.create_index([('parent_message_id', 1)])
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', default='10,100,1000')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--mongo-uri', default=None, help='Real MongoDB for end-to-end timings (default: mongomock)')
+    args = parser.parse_args()
+
+    backend = 'mongodb' if args.mongo_uri else 'mongomock'
+    print(f"🧪 median of {args.iterations} runs, backend={backend}\n")
+    print(f"{'turns':>6} | {'pair legacy':>11} {'pair turns':>11} | "
+          f"{'e2e legacy':>11} {'e2e aggregate':>14} {'e2e cached':>11}   (ms)")
+    for turns in map(int, args.turns.split(',')):
+        db = open_db(args.mongo_uri, turns)
+        conversation_id = seed(db, turns)
+        service = HistoryService(lambda: db, cache=DictCache(), max_cached_turns=turns)
+        uncached = HistoryService(lambda: db)
+
+        assert legacy_load(db, conversation_id) == [
+            {'user': t['user'], 'assistant': t['assistant']}
+            for t in uncached.get_turns(conversation_id, limit=turns)
+        ]
+
+        messages = list(db.messages.find({'conversation_id': ObjectId(conversation_id)}).sort('created_at', 1))
+        joined = list(db.messages.aggregate(HistoryService.build_pipeline(conversation_id, turns)))
+        pair_legacy = measure(lambda: legacy_pair(messages), args.iterations)
+        pair_turns = measure(lambda: [HistoryService.to_turn(doc) for doc in joined], args.iterations)
+
+        e2e_legacy = measure(lambda: legacy_load(db, conversation_id), args.iterations)
+        e2e_aggregate = measure(lambda: uncached.get_turns(conversation_id, limit=turns), args.iterations)
+        service.get_turns(conversation_id, limit=turns)
+        e2e_cached = measure(lambda: service.get_turns(conversation_id, limit=turns), args.iterations)
+        print(f"{turns:>6} | {pair_legacy:>11.2f} {pair_turns:>11.2f} | "
+              f"{e2e_legacy:>11.2f} {e2e_aggregate:>14.2f} {e2e_cached:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
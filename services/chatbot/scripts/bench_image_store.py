@@ -0,0 +1,146 @@
+"""
+Benchmark image storage: sequential in-request uploads vs the content-addressed store
+
+Mock sinks stand in for the cloud services (latency in ms, optional failure
+rate):
+
+    imgbb    : blob upload          (--imgbb-ms, default 400)
+    mongodb  : metadata insert      (--mongo-ms, default 30)
+    firebase : metadata insert      (--firebase-ms, default 80)
+
+    legacy : ImgBB, then MongoDB, then Firebase inside the request
+             (old store_generated_image)
+    store  : ContentAddressedImageStore.put (local write, background
+             replication, SHA-256 dedup)
+
+--dup is the share of images that repeat an earlier one (same seed/prompt).
+Reports request latency and the time until every image is replicated.
+
+Usage:
+    python scripts/bench_image_store.py [--images 200] [--dup 0.3] [--fail 0.0]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.image_storage import BLOB, RECORD, ContentAddressedImageStore, ImageSink  # noqa: E402
+
+
+class MockSink(ImageSink):
+    """Sleeps for the configured latency; fails with probability fail_rate"""
+
+    def __init__(self, name, stage, latency_ms, fail_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.stage = stage
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(name)
+
+    def put(self, record):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.fail_rate
+        time.sleep(self.latency)
+        if fail:
+            raise RuntimeError(f"{self.name} error")
+        return f"{self.name}:{record['sha256'][:12]}"
+
+
+def make_sinks(args):
+    return [
+        MockSink('imgbb', BLOB, args.imgbb_ms, args.fail),
+        MockSink('mongodb', RECORD, args.mongo_ms, args.fail),
+        MockSink('firebase', RECORD, args.firebase_ms, args.fail),
+    ]
+
+
+def make_images(count, dup, rng):
+    images = []
+    for i in range(count):
+        if images and rng.random() < dup:
+            images.append(rng.choice(images))
+        else:
+            images.append(os.urandom(32 * 1024))
+    return images
+
+
+def legacy(images, sinks, concurrency):
+    imgbb, mongo, firebase = sinks
+
+    def request(image):
+        start = time.perf_counter()
+        record = {'sha256': str(id(image)), 'image_base64': '', 'metadata': {}}
+        for sink in (imgbb, mongo, firebase):
+            try:
+                sink.put(record)
+            except RuntimeError:
+                pass
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(request, images))
+    return latencies, time.perf_counter() - start
+
+
+def cas(images, sinks, concurrency, root):
+    store = ContentAddressedImageStore(root, sinks, backoff=0.05)
+
+    def request(image):
+        start = time.perf_counter()
+        digest = store.put(image)['sha256']
+        return time.perf_counter() - start, digest
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(request, images))
+    for _, digest in results:
+        store.wait(digest)
+    total = time.perf_counter() - start
+    store.close()
+    return [latency for latency, _ in results], total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--dup', type=float, default=0.3, help='Share of repeated images')
+    parser.add_argument('--fail', type=float, default=0.0, help='Failure rate of every sink call')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent requests')
+    parser.add_argument('--imgbb-ms', type=float, default=400)
+    parser.add_argument('--mongo-ms', type=float, default=30)
+    parser.add_argument('--firebase-ms', type=float, default=80)
+    args = parser.parse_args()
+
+    images = make_images(args.images, args.dup, random.Random(42))
+    print(f"🧪 {args.images} images ({len(set(images))} unique), {args.concurrency} concurrent requests\n")
+    print(f"{'mode':>6} | {'req p50 ms':>10} {'req p95 ms':>10} | {'total s':>7} {'img/s':>6} | sink calls")
+
+    for name in ('legacy', 'store'):
+        sinks = make_sinks(args)
+        with tempfile.TemporaryDirectory() as root:
+            if name == 'legacy':
+                latencies, total = legacy(images, sinks, args.concurrency)
+            else:
+                latencies, total = cas(images, sinks, args.concurrency, Path(root))
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+        calls = ' '.join(f"{sink.name}={sink.calls}" for sink in sinks)
+        print(f"{name:>6} | {p50:>10.1f} {p95:>10.1f} | {total:>7.2f} {len(images) / total:>6.1f} | {calls}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark metric overhead: ns per observation at 1 / 8 / 32 threads
+
+    legacy    : global lock + scan of every bucket (the old Histogram)
+    histogram : per-thread shard + bisect (utils.metrics.Histogram)
+    summary   : per-thread QuantileSketch (utils.metrics.Summary)
+    counter   : per-thread shard (utils.metrics.Counter)
+
+Every thread records --ops observations; the figure is wall time divided
+by the total number of observations.
+
+Usage:
+    python scripts/bench_metrics.py [--threads 1,8,32] [--ops 100000]
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from utils.metrics import Counter, Histogram, Summary  # noqa: E402
+
+
+class LegacyHistogram:
+    """Histogram.observe before sharding"""
+
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._count = 0
+        self._sum = 0.0
+        self._bucket_counts = {b: 0 for b in buckets}
+        self._bucket_counts[float('inf')] = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            for bucket in self.buckets:
+                if value <= bucket:
+                    self._bucket_counts[bucket] += 1
+            self._bucket_counts[float('inf')] += 1
+
+
+def run(record, threads, values):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for value in values:
+            record(value)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    return (time.perf_counter() - start) * 1e9 / (threads * len(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', default='1,8,32')
+    parser.add_argument('--ops', type=int, default=100000, help='Observations per thread')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    values = [rng.lognormvariate(-2, 1.5) for _ in range(args.ops)]
+    print(f"🧪 ns per observation, {args.ops:,} observations per thread\n")
+    print(f"{'threads':>7} | {'legacy':>8} {'histogram':>10} {'summary':>8} {'counter':>8}")
+    for threads in map(int, args.threads.split(',')):
+        counter = Counter('bench_total')
+        timings = [
+            run(LegacyHistogram().observe, threads, values),
+            run(Histogram('bench_seconds').observe, threads, values),
+            run(Summary('bench_quantiles').observe, threads, values),
+            run(lambda _: counter.inc(), threads, values),
+        ]
+        print(f"{threads:>7} | " + " ".join(f"{t:>{w}.0f}" for t, w in zip(timings, (8, 10, 8, 8))))
+
+
+if __name__ == '__main__':
+    main()
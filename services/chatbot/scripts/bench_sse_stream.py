@@ -0,0 +1,62 @@
+"""
+Benchmark SSE framing: one frame per delta vs coalesced StreamSession
+
+    legacy    : ``full_response += chunk``, one frame per delta, full text
+                re-sent in the final event (the old create_sse_response)
+    coalesced : StreamingChatHandler.start_stream (list buffer, size/time
+                coalescing, no full-text resend)
+
+Reports frames, bytes on the wire and CPU time for --deltas provider deltas
+of --size characters each.
+
+Usage:
+    python scripts/bench_sse_stream.py [--deltas 5000] [--size 4]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.streaming import StreamEvent, StreamRegistry, StreamingChatHandler  # noqa: E402
+
+
+def legacy(deltas):
+    full_response = ""
+    yield StreamEvent(event="start", data=json.dumps({"status": "started"})).format()
+    for chunk in deltas:
+        full_response += chunk
+        yield StreamEvent(event="chunk", data=json.dumps({"content": chunk})).format()
+    yield StreamEvent(event="done", data=json.dumps({"status": "complete", "full_response": full_response})).format()
+
+
+def coalesced(deltas):
+    session = StreamingChatHandler.start_stream(iter(deltas), model='bench', registry=StreamRegistry())
+    return session.events()
+
+
+def measure(frames_fn, deltas):
+    start = time.perf_counter()
+    frames = list(frames_fn(deltas))
+    elapsed = (time.perf_counter() - start) * 1000
+    return len(frames), sum(len(f.encode('utf-8')) for f in frames), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--deltas', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=4, help='Characters per delta')
+    args = parser.parse_args()
+
+    deltas = [('xin chào ' * args.size)[:args.size] for _ in range(args.deltas)]
+    print(f"🧪 {args.deltas:,} deltas of {args.size} chars\n")
+    print(f"{'mode':>9} | {'frames':>7} {'bytes':>9} {'ms':>7}")
+    for name, fn in (('legacy', legacy), ('coalesced', coalesced)):
+        frames, size, elapsed = measure(fn, deltas)
+        print(f"{name:>9} | {frames:>7} {size:>9,} {elapsed:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
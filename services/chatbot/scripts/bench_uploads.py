@@ -0,0 +1,96 @@
+"""
+Benchmark /chat upload handling: read-all + serial OCR vs UploadProcessor
+
+A mock extractor sleeps --ocr-ms per file (stands in for the OCR service).
+
+    legacy    : ``file.read()`` for every upload, then extract_file_content
+                one file after another (the old multipart branch)
+    processor : UploadProcessor.process (chunked spooling with SHA-256,
+                bounded extraction pool, cache by content hash)
+
+Each mode handles the same request twice; the second request re-attaches the
+same files. Reports wall time and peak Python heap (tracemalloc) per request.
+
+Usage:
+    python scripts/bench_uploads.py [--files 3] [--size-mb 20] [--ocr-ms 2000]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+from core.uploads import UploadProcessor  # noqa: E402
+
+
+class DiskUpload(FileStorage):
+    """FileStorage over a file on disk, like Werkzeug's spooled form parts"""
+
+    def __init__(self, path):
+        super().__init__(stream=open(path, 'rb'), filename=Path(path).name)
+
+
+def make_extract(ocr_ms):
+    def extract(data, filename):
+        time.sleep(ocr_ms / 1000)
+        return True, f"{filename}: {len(data)} bytes"
+    return extract
+
+
+def legacy(paths, extract, processor=None):
+    results = []
+    for file in [DiskUpload(p) for p in paths]:
+        data = file.read()
+        results.append(extract(data, file.filename))
+    return results
+
+
+def spooled(paths, extract, processor):
+    return processor.process([DiskUpload(p) for p in paths])
+
+
+def measure(fn, paths, extract, processor):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(paths, extract, processor)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--size-mb', type=float, default=20)
+    parser.add_argument('--ocr-ms', type=float, default=2000, help='Mock extraction time per file')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = []
+        for i in range(args.files):
+            path = Path(root) / f"doc{i}.pdf"
+            path.write_bytes(os.urandom(int(args.size_mb * 1024 * 1024)))
+            paths.append(path)
+
+        print(f"🧪 {args.files} files x {args.size_mb:g} MB, {args.ocr_ms:g} ms OCR each\n")
+        print(f"{'mode':>9} | {'request':>7} | {'s':>6} {'peak MB':>8}")
+        extract = make_extract(args.ocr_ms)
+        for name, fn in (('legacy', legacy), ('processor', spooled)):
+            processor = UploadProcessor(extract, max_workers=args.workers, budget=60, spool_dir=root)
+            for request in ('first', 'repeat'):
+                elapsed, peak = measure(fn, paths, extract, processor)
+                print(f"{name:>9} | {request:>7} | {elapsed:>6.2f} {peak:>8.1f}")
+            processor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 """
 Redis Cache Manager - Performance Optimization
 Implements intelligent caching for AI responses, API calls, and static data
+
+Two tiers: a small in-process LRU (L1, seconds-long TTL) in front of Redis
+(L2). Workers keep their L1 coherent through Redis pub/sub invalidation
+messages; values above CacheCompressor.COMPRESSION_THRESHOLD are stored
+zlib-compressed.
 """
 
 try:
@@ -10,17 +15,106 @@ except ImportError:
     REDIS_AVAILABLE = False
     redis = None
 
+import copy
 import json
 import hashlib
+import importlib.util
 import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
-from typing import Optional, Any, Dict
+from pathlib import Path
+from typing import Optional, Any, Dict, Iterable, List, Tuple
 from functools import wraps
 import os
+import uuid
 
 logger = logging.getLogger(__name__)
 
 
+def _load_cache_optimizer():
+    """
+    database/utils/cache_optimizer.py is standalone, but importing it through
+    the ``database`` package pulls in the optional cache layer: load by path
+    """
+    name = 'chatbot_cache_optimizer'
+    if name not in sys.modules:
+        path = Path(__file__).resolve().parents[2] / 'database' / 'utils' / 'cache_optimizer.py'
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+    return sys.modules[name]
+
+
+_cache_optimizer = _load_cache_optimizer()
+CacheCompressor = _cache_optimizer.CacheCompressor
+RedisPipeline = _cache_optimizer.RedisPipeline
+
+_MISSING = object()
+
+
+class NearCache:
+    """
+    Bounded in-process LRU with per-entry TTL (the L1 tier)
+    
+    Values are deep-copied in and out, so callers may mutate what they get
+    (e.g. the turns base_chat annotates) without touching the cached entry
+    or other callers. Every invalidation bumps a version so a fill that
+    raced with it is dropped.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+    
+    def get(self, key: str) -> Any:
+        """Return the value or _MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            value = entry[1]
+        return copy.deepcopy(value)
+    
+    def set(self, key: str, value: Any, ttl: float, version: int):
+        """Store unless an invalidation happened since `version` was read"""
+        ttl = min(ttl, self.ttl)
+        if version != self.version or ttl <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def delete(self, keys: Iterable[str]):
+        with self._lock:
+            self.version += 1
+            for key in keys:
+                self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class CacheManager:
     """
     Intelligent caching system using Redis
@@ -32,13 +126,49 @@ class CacheManager:
     - Automatic cache invalidation
     """
     
-    def __init__(self, redis_url: str = None):
+    TAG_PREFIX = 'tag:'
+    INVALIDATION_CHANNEL = 'cache:invalidate'
+    SCAN_COUNT = 1000     # SCAN/SSCAN hint per round trip
+    DELETE_CHUNK = 500    # keys per pipelined UNLINK
+    PRUNE_SAMPLE = 3      # random tag members checked (and dropped if expired) per tagged SET
+    
+    # KEYS[1] = cache key, KEYS[2..] = tag sets; ARGV = value, ttl. Tag sets
+    # only ever extend their TTL so they outlive every member. The script
+    # touches declared keys only (Redis Cluster); expired members are pruned
+    # by the caller from a SRANDMEMBER sample of PRUNE_SAMPLE per write, so a
+    # tag that is never invalidated stays close to its live key count (at
+    # equilibrium fewer than 1/sample of members are dead).
+    TAGGED_SET_LUA = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+local ttl = tonumber(ARGV[2])
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    if redis.call('TTL', KEYS[i]) < ttl then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+return 1
+"""
+    
+    def __init__(
+        self,
+        redis_url: str = None,
+        l1_max_entries: int = None,
+        l1_ttl: float = None
+    ):
         """
         Initialize Redis connection
         
         Args:
             redis_url: Redis connection URL (default: from env or localhost)
+            l1_max_entries: In-process L1 size, 0 disables it (env CACHE_L1_MAX_ENTRIES, default 1024)
+            l1_ttl: Max seconds a value stays in L1 (env CACHE_L1_TTL, default 5)
         """
+        self.stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'compressed_writes': 0}
+        self.near_cache = None
+        self._instance_id = uuid.uuid4().hex
+        self._subscriber = None
+        
         if not REDIS_AVAILABLE:
             self.enabled = False
             logger.warning("⚠️ Redis package not installed. Caching disabled.")
@@ -53,14 +183,82 @@ class CacheManager:
                 socket_connect_timeout=5,
                 socket_timeout=5
             )
+            # Values may be zlib-compressed: read/write them as bytes
+            self.value_client = redis.from_url(
+                self.redis_url,
+                decode_responses=False,
+                socket_connect_timeout=5,
+                socket_timeout=5
+            )
             # Test connection
             self.redis_client.ping()
+            self._set_tagged = self.value_client.register_script(self.TAGGED_SET_LUA)
             self.enabled = True
             logger.info(f"✅ Redis connected: {self.redis_url}")
         except Exception as e:
             logger.warning(f"⚠️ Redis unavailable: {e}. Caching disabled.")
             self.redis_client = None
             self.enabled = False
+            return
+        
+        if l1_max_entries is None:
+            l1_max_entries = int(os.getenv('CACHE_L1_MAX_ENTRIES', '1024'))
+        if l1_ttl is None:
+            l1_ttl = float(os.getenv('CACHE_L1_TTL', '5'))
+        if l1_max_entries > 0 and l1_ttl > 0:
+            self.near_cache = NearCache(l1_max_entries, l1_ttl)
+            self._subscribe()
+    
+    # ============================================================================
+    # L1 COHERENCE (pub/sub)
+    # ============================================================================
+    
+    def _subscribe(self):
+        """Listen for other workers' invalidations in a daemon thread"""
+        try:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.INVALIDATION_CHANNEL: self._on_invalidation})
+            self._subscriber = pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=self._on_subscriber_error
+            )
+        except Exception as e:
+            # Without invalidations L1 could serve stale values: disable it
+            logger.warning(f"⚠️ Cache invalidation channel unavailable: {e}. L1 cache disabled.")
+            self.near_cache = None
+    
+    def _on_invalidation(self, message: Dict):
+        try:
+            payload = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if payload.get('sender') == self._instance_id or self.near_cache is None:
+            return
+        if payload.get('all'):
+            self.near_cache.clear()
+        else:
+            self.near_cache.delete(payload.get('keys', []))
+    
+    def _on_subscriber_error(self, error, pubsub, thread):
+        logger.warning(f"⚠️ Cache invalidation listener stopped: {error}. L1 cache disabled.")
+        near_cache, self.near_cache = self.near_cache, None
+        if near_cache is not None:
+            near_cache.clear()
+        thread.stop()
+    
+    def _invalidation_message(self, keys: List[str] = None) -> str:
+        if keys is None:
+            return json.dumps({'sender': self._instance_id, 'all': True})
+        return json.dumps({'sender': self._instance_id, 'keys': list(keys)})
+    
+    def _evict_local(self, keys: List[str]):
+        if self.near_cache is not None:
+            self.near_cache.delete(keys)
+    
+    def close(self):
+        """Stop the invalidation listener"""
+        if self._subscriber is not None:
+            self._subscriber.stop()
+            self._subscriber = None
     
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """
@@ -84,9 +282,21 @@ class CacheManager:
         
         return f"{prefix}:{key_hash}"
     
+    @staticmethod
+    def _decode(value: Optional[bytes]) -> Any:
+        if value is None:
+            return None
+        return CacheCompressor.decompress(value)
+    
+    def _encode(self, value: Any) -> bytes:
+        payload = CacheCompressor.compress(value)
+        if payload.startswith(b'ZLIB:'):
+            self.stats['compressed_writes'] += 1
+        return payload
+    
     def get(self, key: str) -> Optional[Any]:
         """
-        Get value from cache
+        Get value from cache (L1, then Redis)
         
         Args:
             key: Cache key
@@ -97,19 +307,72 @@ class CacheManager:
         if not self.enabled:
             return None
         
+        near_cache = self.near_cache
+        if near_cache is not None:
+            value = near_cache.get(key)
+            if value is not _MISSING:
+                self.stats['l1_hits'] += 1
+                return value
+            version = near_cache.version
+        
         try:
-            value = self.redis_client.get(key)
-            if value:
+            raw = self.value_client.get(key)
+            if raw:
                 logger.debug(f"🎯 Cache HIT: {key}")
-                return json.loads(value)
+                self.stats['l2_hits'] += 1
+                value = self._decode(raw)
+                if near_cache is not None:
+                    near_cache.set(key, value, near_cache.ttl, version)
+                return value
             else:
                 logger.debug(f"❌ Cache MISS: {key}")
+                self.stats['misses'] += 1
                 return None
         except Exception as e:
             logger.error(f"Cache get error: {e}")
             return None
     
-    def set(self, key: str, value: Any, ttl: int = 3600) -> bool:
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Get several values: L1 first, the rest with a single MGET
+        
+        Returns:
+            dict: key -> value for the keys found
+        """
+        if not self.enabled or not keys:
+            return {}
+        
+        found = {}
+        missing = []
+        near_cache = self.near_cache
+        for key in keys:
+            value = near_cache.get(key) if near_cache is not None else _MISSING
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                self.stats['l1_hits'] += 1
+                found[key] = value
+        if not missing:
+            return found
+        
+        version = near_cache.version if near_cache is not None else 0
+        try:
+            raws = self.value_client.mget(missing)
+        except Exception as e:
+            logger.error(f"Cache mget error: {e}")
+            return found
+        
+        for key, raw in zip(missing, raws):
+            if not raw:
+                self.stats['misses'] += 1
+                continue
+            self.stats['l2_hits'] += 1
+            found[key] = self._decode(raw)
+            if near_cache is not None:
+                near_cache.set(key, found[key], near_cache.ttl, version)
+        return found
+    
+    def set(self, key: str, value: Any, ttl: int = 3600, tags: Optional[Iterable[str]] = None) -> bool:
         """
         Set value in cache
         
@@ -117,6 +380,7 @@ class CacheManager:
             key: Cache key
             value: Value to cache
             ttl: Time to live in seconds (default: 1 hour)
+            tags: Tags to index the key under (see make_tags / invalidate_tags)
         
         Returns:
             bool: Success status
@@ -125,21 +389,60 @@ class CacheManager:
             return False
         
         try:
-            value_json = json.dumps(value)
-            self.redis_client.setex(key, ttl, value_json)
+            payload = self._encode(value)
+            pipe = self.value_client.pipeline(transaction=False)
+            tag_keys = [self.TAG_PREFIX + tag for tag in tags or ()]
+            if tag_keys:
+                # SET + SADD to each tag set in one atomic script call
+                self._set_tagged(keys=[key] + tag_keys, args=[payload, ttl], client=pipe)
+                for tag_key in tag_keys:
+                    pipe.srandmember(tag_key, self.PRUNE_SAMPLE)
+            else:
+                pipe.setex(key, ttl, payload)
+            if self.near_cache is not None:
+                pipe.publish(self.INVALIDATION_CHANNEL, self._invalidation_message([key]))
+            results = pipe.execute()
+            self._evict_local([key])
+            if tag_keys:
+                self._prune_sampled(key, dict(zip(tag_keys, results[1:1 + len(tag_keys)])))
             logger.debug(f"💾 Cache SET: {key} (TTL: {ttl}s)")
             return True
         except Exception as e:
             logger.error(f"Cache set error: {e}")
             return False
     
+    def set_many(self, values: Dict[str, Any], ttl: int = 3600) -> bool:
+        """
+        Set several values in one pipelined round trip
+        
+        Args:
+            values: key -> value
+            ttl: Time to live in seconds (default: 1 hour)
+        """
+        if not self.enabled or not values:
+            return False
+        
+        try:
+            with RedisPipeline(self.value_client, encode=self._encode) as pipe:
+                for key, value in values.items():
+                    pipe.set(key, value, ttl)
+            keys = list(values)
+            self._evict_local(keys)
+            if self.near_cache is not None:
+                self.redis_client.publish(self.INVALIDATION_CHANNEL, self._invalidation_message(keys))
+            logger.debug(f"💾 Cache SET many: {len(keys)} keys (TTL: {ttl}s)")
+            return True
+        except Exception as e:
+            logger.error(f"Cache set many error: {e}")
+            return False
+    
     def delete(self, key: str) -> bool:
         """Delete key from cache"""
         if not self.enabled:
             return False
         
         try:
-            self.redis_client.delete(key)
+            self._unlink([key])
             logger.debug(f"🗑️ Cache DELETE: {key}")
             return True
         except Exception as e:
@@ -150,6 +453,10 @@ class CacheManager:
         """
         Delete all keys matching pattern
         
+        Uses incremental SCAN (never KEYS, which blocks the whole server) and
+        deletes in pipelined UNLINK chunks. Prefer invalidate_tags for keys
+        written with tags; this walks the whole keyspace.
+        
         Args:
             pattern: Key pattern (e.g., 'chat:*', 'session:user123:*')
         
@@ -160,16 +467,162 @@ class CacheManager:
             return 0
         
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                deleted = self.redis_client.delete(*keys)
+            deleted = self._unlink_chunks(
+                self.redis_client.scan_iter(match=pattern, count=self.SCAN_COUNT)
+            )
+            if deleted:
                 logger.info(f"🗑️ Cache DELETE pattern '{pattern}': {deleted} keys")
-                return deleted
-            return 0
+            return deleted
         except Exception as e:
             logger.error(f"Cache delete pattern error: {e}")
             return 0
     
+    # ============================================================================
+    # TAG-BASED INVALIDATION
+    # ============================================================================
+    
+    @staticmethod
+    def make_tags(user_id: str = None, conversation_id: str = None, model: str = None) -> List[str]:
+        """
+        Build the standard tags for a cache entry
+        
+        Returns:
+            list: e.g. ['user:u1', 'conv:c1', 'model:grok']
+        """
+        tags = []
+        if user_id:
+            tags.append(f"user:{user_id}")
+        if conversation_id:
+            tags.append(f"conv:{conversation_id}")
+        if model:
+            tags.append(f"model:{model}")
+        return tags
+    
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Delete every key registered under the given tags
+        
+        The tag set is renamed first so keys tagged concurrently land in a
+        fresh set, then its members are read with SSCAN and removed in
+        pipelined UNLINK chunks of DELETE_CHUNK keys.
+        
+        Returns:
+            int: Number of keys deleted
+        """
+        if not self.enabled:
+            return 0
+        
+        deleted = 0
+        for tag in tags:
+            tag_key = self.TAG_PREFIX + tag
+            draining = f"{tag_key}:invalidating:{uuid.uuid4().hex}"
+            try:
+                self.redis_client.rename(tag_key, draining)
+            except redis.ResponseError:
+                continue  # no keys under this tag
+            except Exception as e:
+                logger.error(f"Cache invalidate tag error: {e}")
+                continue
+            
+            try:
+                deleted += self._unlink_chunks(
+                    self.redis_client.sscan_iter(draining, count=self.SCAN_COUNT)
+                )
+                self.redis_client.unlink(draining)
+            except Exception as e:
+                logger.error(f"Cache invalidate tag error: {e}")
+        
+        if deleted:
+            logger.info(f"🗑️ Cache INVALIDATE tags {list(tags)}: {deleted} keys")
+        return deleted
+    
+    def prune_tags(self, *tags: str) -> int:
+        """
+        Remove members whose keys no longer exist from the given tag sets
+        
+        Writes already prune a few random members each; this sweeps a whole
+        set with SSCAN (e.g. from a periodic maintenance job), checking
+        members with pipelined EXISTS in chunks of DELETE_CHUNK.
+        
+        Returns:
+            int: Number of members removed
+        """
+        if not self.enabled:
+            return 0
+        
+        removed = 0
+        for tag in tags:
+            tag_key = self.TAG_PREFIX + tag
+            try:
+                chunk = []
+                for member in self.redis_client.sscan_iter(tag_key, count=self.SCAN_COUNT):
+                    chunk.append(member)
+                    if len(chunk) >= self.DELETE_CHUNK:
+                        removed += self._remove_dead_members(tag_key, chunk)
+                        chunk = []
+                if chunk:
+                    removed += self._remove_dead_members(tag_key, chunk)
+            except Exception as e:
+                logger.error(f"Cache prune tag error: {e}")
+        return removed
+    
+    def _prune_sampled(self, key: str, samples: Dict[str, List]) -> int:
+        """SREM sampled tag members whose keys have expired (best effort)"""
+        written = key.encode()
+        samples = {
+            tag_key: [m for m in members if m not in (key, written)]
+            for tag_key, members in samples.items()
+        }
+        members = list({m for sampled in samples.values() for m in sampled})
+        if not members:
+            return 0
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for member in members:
+                pipe.exists(member)
+            dead = {m for m, exists in zip(members, pipe.execute()) if not exists}
+            if not dead:
+                return 0
+            pipe = self.redis_client.pipeline(transaction=False)
+            for tag_key, sampled in samples.items():
+                stale = [m for m in sampled if m in dead]
+                if stale:
+                    pipe.srem(tag_key, *stale)
+            return sum(pipe.execute())
+        except Exception as e:
+            logger.warning(f"Cache tag prune error: {e}")
+            return 0
+    
+    def _remove_dead_members(self, tag_key: str, members: List[str]) -> int:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for member in members:
+            pipe.exists(member)
+        dead = [member for member, exists in zip(members, pipe.execute()) if not exists]
+        return self.redis_client.srem(tag_key, *dead) if dead else 0
+    
+    def _unlink_chunks(self, keys: Iterable[str]) -> int:
+        """UNLINK keys in pipelined chunks (one round trip per chunk)"""
+        deleted = 0
+        chunk = []
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) >= self.DELETE_CHUNK:
+                deleted += self._unlink(chunk)
+                chunk = []
+        if chunk:
+            deleted += self._unlink(chunk)
+        return deleted
+    
+    def _unlink(self, keys: List[str]) -> int:
+        """UNLINK keys and tell the other workers to drop them from L1"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        if self.near_cache is not None:
+            pipe.publish(self.INVALIDATION_CHANNEL, self._invalidation_message(keys))
+        deleted = pipe.execute()[0]
+        self._evict_local(keys)
+        return deleted
+    
     def cache_response(self, ttl: int = 3600):
         """
         Decorator to cache function responses
@@ -214,7 +667,8 @@ class CacheManager:
         message: str,
         context: str,
         response: str,
-        ttl: int = 3600
+        ttl: int = 3600,
+        user_id: str = None
     ) -> bool:
         """
         Cache AI model response
@@ -225,12 +679,21 @@ class CacheManager:
             context: Context mode
             response: AI response
             ttl: Cache duration (default: 1 hour)
+            user_id: Also tag the entry with the user (optional)
         
         Returns:
             bool: Success status
         """
         key = self._generate_key('ai_response', model, message, context)
-        return self.set(key, response, ttl)
+        return self.set(key, response, ttl, tags=self.make_tags(user_id=user_id, model=model))
+    
+    def invalidate_model(self, model: str) -> int:
+        """Invalidate all cached responses of a model"""
+        return self.invalidate_tags(*self.make_tags(model=model))
+    
+    def invalidate_user(self, user_id: str) -> int:
+        """Invalidate all cache entries tagged with a user"""
+        return self.invalidate_tags(*self.make_tags(user_id=user_id))
     
     def get_ai_response(self, model: str, message: str, context: str) -> Optional[str]:
         """Get cached AI response"""
@@ -266,7 +729,7 @@ class CacheManager:
             ttl: Cache duration (default: 30 minutes)
         """
         key = f"session:{session_id}:history"
-        return self.set(key, history, ttl)
+        return self.set(key, history, ttl, tags=self.make_tags(conversation_id=session_id))
     
     def get_session_history(self, session_id: str) -> Optional[list]:
         """Get cached session history"""
@@ -274,9 +737,10 @@ class CacheManager:
         return self.get(key)
     
     def invalidate_session(self, session_id: str) -> int:
-        """Invalidate all cache for a session"""
-        pattern = f"session:{session_id}:*"
-        return self.delete_pattern(pattern)
+        """Invalidate all cache for a session (tagged entries + session:{id}:* keys)"""
+        deleted = self.invalidate_tags(*self.make_tags(conversation_id=session_id))
+        # session:{id}:history and any other untagged per-session key
+        return deleted + self.delete_pattern(f"session:{session_id}:*")
     
     def cache_file_analysis(
         self,
@@ -328,12 +792,34 @@ class CacheManager:
                 'hit_rate': self._calculate_hit_rate(info),
                 'memory_used': memory.get('used_memory_human', 'N/A'),
                 'total_keys': self.redis_client.dbsize(),
-                'connected_clients': info.get('connected_clients', 0)
+                'connected_clients': info.get('connected_clients', 0),
+                'tiers': self.get_tier_stats()
             }
         except Exception as e:
             logger.error(f"Error getting cache stats: {e}")
             return {'enabled': True, 'error': str(e)}
     
+    def get_tier_stats(self) -> Dict:
+        """
+        L1 / L2 hit rates of this process
+        
+        l1_hit_rate is over all lookups, l2_hit_rate over the lookups that
+        missed L1 and went to Redis.
+        """
+        l1_hits = self.stats['l1_hits']
+        l2_lookups = self.stats['l2_hits'] + self.stats['misses']
+        return {
+            'l1_enabled': self.near_cache is not None,
+            'l1_entries': len(self.near_cache) if self.near_cache is not None else 0,
+            'l1_hit_rate': self._calculate_hit_rate({
+                'keyspace_hits': l1_hits, 'keyspace_misses': l2_lookups
+            }),
+            'l2_hit_rate': self._calculate_hit_rate({
+                'keyspace_hits': self.stats['l2_hits'], 'keyspace_misses': self.stats['misses']
+            }),
+            **self.stats
+        }
+    
     def _calculate_hit_rate(self, info: Dict) -> float:
         """Calculate cache hit rate percentage"""
         hits = info.get('keyspace_hits', 0)
@@ -352,6 +838,9 @@ class CacheManager:
         
         try:
             self.redis_client.flushdb()
+            if self.near_cache is not None:
+                self.near_cache.clear()
+                self.redis_client.publish(self.INVALIDATION_CHANNEL, self._invalidation_message())
             logger.warning("🗑️ All cache cleared!")
             return True
         except Exception as e:
@@ -12,6 +12,12 @@ import base64
 from typing import Optional, Dict, List, Any
 import logging
 
+try:
+    from core.tracing import traced
+except ImportError:
+    def traced(name=None, **attributes):
+        return lambda func: func
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,6 +28,11 @@ class ComfyUIClient:
         """Initialize ComfyUI Client"""
         self.api_url = (api_url or os.getenv('COMFYUI_URL', 'http://localhost:8189')).rstrip('/')
         self.client_id = str(uuid.uuid4())
+    
+    @property
+    def ws_url(self) -> str:
+        """Websocket endpoint for ComfyUI's event stream"""
+        return self.api_url.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1) + '/ws'
         
     def check_health(self) -> bool:
         """Check if ComfyUI is running"""
@@ -138,6 +149,7 @@ class ComfyUIClient:
         except:
             return False
     
+    @traced('comfyui.img2img')
     def img2img(
         self,
         init_images: List[str],
@@ -159,103 +171,10 @@ class ComfyUIClient:
             if not init_images or not init_images[0]:
                 return {'error': 'No input image provided'}
             
-            # Get model
-            model = self.get_current_model()
-            if model == "No model loaded":
-                model = "animagine-xl-3.1.safetensors"
-            
-            # Random seed if -1
-            if seed == -1:
-                seed = int(time.time() * 1000) % (2**32)
-            
-            # Decode base64 image and upload to ComfyUI
-            image_data = init_images[0]
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Upload image to ComfyUI
-            image_bytes = base64.b64decode(image_data)
-            upload_result = self._upload_image(image_bytes)
-            if not upload_result:
-                return {'error': 'Failed to upload image to ComfyUI'}
-            
-            input_image_name = upload_result.get('name')
-            
-            # Img2Img workflow with image scaling to ensure compatible dimensions
-            workflow = {
-                "1": {
-                    "class_type": "LoadImage",
-                    "inputs": {
-                        "image": input_image_name
-                    }
-                },
-                "1b": {
-                    "class_type": "ImageScale",
-                    "inputs": {
-                        "image": ["1", 0],
-                        "upscale_method": "lanczos",
-                        "width": width,
-                        "height": height,
-                        "crop": "center"
-                    }
-                },
-                "2": {
-                    "class_type": "CheckpointLoaderSimple",
-                    "inputs": {
-                        "ckpt_name": model
-                    }
-                },
-                "3": {
-                    "class_type": "VAEEncode",
-                    "inputs": {
-                        "pixels": ["1b", 0],
-                        "vae": ["2", 2]
-                    }
-                },
-                "4": {
-                    "class_type": "CLIPTextEncode",
-                    "inputs": {
-                        "clip": ["2", 1],
-                        "text": prompt
-                    }
-                },
-                "5": {
-                    "class_type": "CLIPTextEncode",
-                    "inputs": {
-                        "clip": ["2", 1],
-                        "text": negative_prompt
-                    }
-                },
-                "6": {
-                    "class_type": "KSampler",
-                    "inputs": {
-                        "cfg": cfg_scale,
-                        "denoise": denoising_strength,
-                        "latent_image": ["3", 0],
-                        "model": ["2", 0],
-                        "negative": ["5", 0],
-                        "positive": ["4", 0],
-                        "sampler_name": sampler_name if sampler_name in self.get_samplers() else "euler",
-                        "scheduler": "normal",
-                        "seed": seed,
-                        "steps": steps
-                    }
-                },
-                "7": {
-                    "class_type": "VAEDecode",
-                    "inputs": {
-                        "samples": ["6", 0],
-                        "vae": ["2", 2]
-                    }
-                },
-                "8": {
-                    "class_type": "SaveImage",
-                    "inputs": {
-                        "filename_prefix": "ComfyUI_img2img",
-                        "images": ["7", 0]
-                    }
-                }
-            }
+            workflow = self.build_img2img_workflow(
+                init_images, prompt, negative_prompt, denoising_strength,
+                width, height, steps, cfg_scale, seed, sampler_name
+            )
             
             # Queue the prompt
             prompt_id = self._queue_prompt(workflow)
@@ -280,6 +199,122 @@ class ComfyUIClient:
             logger.error(f"Error in img2img: {e}")
             return {'error': str(e)}
     
+    def build_img2img_workflow(
+        self,
+        init_images: List[str],
+        prompt: str,
+        negative_prompt: str = "bad quality, blurry",
+        denoising_strength: float = 0.7,
+        width: int = 512,
+        height: int = 512,
+        steps: int = 20,
+        cfg_scale: float = 7.0,
+        seed: int = -1,
+        sampler_name: str = "euler",
+        **kwargs
+    ) -> Dict:
+        """Upload the input image and build the img2img workflow"""
+        # Get model
+        model = self.get_current_model()
+        if model == "No model loaded":
+            model = "animagine-xl-3.1.safetensors"
+        
+        # Random seed if -1
+        if seed == -1:
+            seed = int(time.time() * 1000) % (2**32)
+        
+        # Decode base64 image and upload to ComfyUI
+        image_data = init_images[0]
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        
+        # Upload image to ComfyUI
+        image_bytes = base64.b64decode(image_data)
+        upload_result = self._upload_image(image_bytes)
+        if not upload_result:
+            raise ValueError('Failed to upload image to ComfyUI')
+        
+        input_image_name = upload_result.get('name')
+        
+        # Img2Img workflow with image scaling to ensure compatible dimensions
+        workflow = {
+            "1": {
+                "class_type": "LoadImage",
+                "inputs": {
+                    "image": input_image_name
+                }
+            },
+            "1b": {
+                "class_type": "ImageScale",
+                "inputs": {
+                    "image": ["1", 0],
+                    "upscale_method": "lanczos",
+                    "width": width,
+                    "height": height,
+                    "crop": "center"
+                }
+            },
+            "2": {
+                "class_type": "CheckpointLoaderSimple",
+                "inputs": {
+                    "ckpt_name": model
+                }
+            },
+            "3": {
+                "class_type": "VAEEncode",
+                "inputs": {
+                    "pixels": ["1b", 0],
+                    "vae": ["2", 2]
+                }
+            },
+            "4": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["2", 1],
+                    "text": prompt
+                }
+            },
+            "5": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["2", 1],
+                    "text": negative_prompt
+                }
+            },
+            "6": {
+                "class_type": "KSampler",
+                "inputs": {
+                    "cfg": cfg_scale,
+                    "denoise": denoising_strength,
+                    "latent_image": ["3", 0],
+                    "model": ["2", 0],
+                    "negative": ["5", 0],
+                    "positive": ["4", 0],
+                    "sampler_name": sampler_name if sampler_name in self.get_samplers() else "euler",
+                    "scheduler": "normal",
+                    "seed": seed,
+                    "steps": steps
+                }
+            },
+            "7": {
+                "class_type": "VAEDecode",
+                "inputs": {
+                    "samples": ["6", 0],
+                    "vae": ["2", 2]
+                }
+            },
+            "8": {
+                "class_type": "SaveImage",
+                "inputs": {
+                    "filename_prefix": "ComfyUI_img2img",
+                    "images": ["7", 0]
+                }
+            }
+        }
+        
+        return workflow
+    
+    @traced('comfyui.upload_image')
     def _upload_image(self, image_bytes: bytes, filename: str = None) -> Optional[Dict]:
         """Upload image to ComfyUI input folder"""
         try:
@@ -303,6 +338,7 @@ class ComfyUIClient:
             logger.error(f"Error uploading image: {e}")
             return None
     
+    @traced('comfyui.generate_image')
     def generate_image(
         self,
         prompt: str,
@@ -317,83 +353,16 @@ class ComfyUIClient:
         """
         Generate image using ComfyUI
         
+        Blocks until the image is ready; use core.image_jobs to generate
+        without holding the calling thread.
+        
         Returns:
             Image bytes or None if failed
         """
         try:
-            # Get model if not specified, or validate provided model
-            if not model or model in self.BROKEN_MODELS:
-                # Use known working model
-                model = self.get_current_model()
-                if model == "No model loaded":
-                    model = "animagine-xl-3.1.safetensors"
-            
-            logger.info(f"Using model: {model}")
-            
-            # Random seed if -1
-            if seed == -1:
-                seed = int(time.time() * 1000) % (2**32)
-            
-            # ComfyUI workflow
-            workflow = {
-                "3": {
-                    "class_type": "KSampler",
-                    "inputs": {
-                        "cfg": cfg_scale,
-                        "denoise": 1,
-                        "latent_image": ["5", 0],
-                        "model": ["4", 0],
-                        "negative": ["7", 0],
-                        "positive": ["6", 0],
-                        "sampler_name": "euler",
-                        "scheduler": "normal",
-                        "seed": seed,
-                        "steps": steps
-                    }
-                },
-                "4": {
-                    "class_type": "CheckpointLoaderSimple",
-                    "inputs": {
-                        "ckpt_name": model
-                    }
-                },
-                "5": {
-                    "class_type": "EmptyLatentImage",
-                    "inputs": {
-                        "batch_size": 1,
-                        "height": height,
-                        "width": width
-                    }
-                },
-                "6": {
-                    "class_type": "CLIPTextEncode",
-                    "inputs": {
-                        "clip": ["4", 1],
-                        "text": prompt
-                    }
-                },
-                "7": {
-                    "class_type": "CLIPTextEncode",
-                    "inputs": {
-                        "clip": ["4", 1],
-                        "text": negative_prompt
-                    }
-                },
-                "8": {
-                    "class_type": "VAEDecode",
-                    "inputs": {
-                        "samples": ["3", 0],
-                        "vae": ["4", 2]
-                    }
-                },
-                "9": {
-                    "class_type": "SaveImage",
-                    "inputs": {
-                        "filename_prefix": "ComfyUI",
-                        "images": ["8", 0]
-                    }
-                }
-            }
+            workflow = self.build_txt2img_workflow(
+                prompt, negative_prompt, width, height, steps, cfg_scale, seed, model
+            )
             
             # Queue the prompt
             prompt_id = self._queue_prompt(workflow)
@@ -413,6 +382,95 @@ class ComfyUIClient:
             logger.error(f"Error generating image: {e}")
             return None
     
+    def build_txt2img_workflow(
+        self,
+        prompt: str,
+        negative_prompt: str = "bad quality, blurry, distorted, ugly, worst quality",
+        width: int = 1024,
+        height: int = 1024,
+        steps: int = 20,
+        cfg_scale: float = 7.0,
+        seed: int = -1,
+        model: str = None
+    ) -> Dict:
+        """Build the text-to-image workflow (resolves model and random seed)"""
+        # Get model if not specified, or validate provided model
+        if not model or model in self.BROKEN_MODELS:
+            # Use known working model
+            model = self.get_current_model()
+            if model == "No model loaded":
+                model = "animagine-xl-3.1.safetensors"
+        
+        logger.info(f"Using model: {model}")
+        
+        # Random seed if -1
+        if seed == -1:
+            seed = int(time.time() * 1000) % (2**32)
+        
+        # ComfyUI workflow
+        workflow = {
+            "3": {
+                "class_type": "KSampler",
+                "inputs": {
+                    "cfg": cfg_scale,
+                    "denoise": 1,
+                    "latent_image": ["5", 0],
+                    "model": ["4", 0],
+                    "negative": ["7", 0],
+                    "positive": ["6", 0],
+                    "sampler_name": "euler",
+                    "scheduler": "normal",
+                    "seed": seed,
+                    "steps": steps
+                }
+            },
+            "4": {
+                "class_type": "CheckpointLoaderSimple",
+                "inputs": {
+                    "ckpt_name": model
+                }
+            },
+            "5": {
+                "class_type": "EmptyLatentImage",
+                "inputs": {
+                    "batch_size": 1,
+                    "height": height,
+                    "width": width
+                }
+            },
+            "6": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": prompt
+                }
+            },
+            "7": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": negative_prompt
+                }
+            },
+            "8": {
+                "class_type": "VAEDecode",
+                "inputs": {
+                    "samples": ["3", 0],
+                    "vae": ["4", 2]
+                }
+            },
+            "9": {
+                "class_type": "SaveImage",
+                "inputs": {
+                    "filename_prefix": "ComfyUI",
+                    "images": ["8", 0]
+                }
+            }
+        }
+        
+        return workflow
+    
+    @traced('comfyui.queue_prompt')
     def _queue_prompt(self, workflow: Dict) -> Optional[str]:
         """Queue a prompt and return prompt_id"""
         try:
@@ -432,6 +490,7 @@ class ComfyUIClient:
             logger.error(f"Error queuing prompt: {e}")
             return None
     
+    @traced('comfyui.wait_for_prompt')
     def _wait_for_prompt(self, prompt_id: str, timeout: int = 300) -> Optional[Dict]:
         """Wait for prompt to complete"""
         start_time = time.time()
@@ -449,30 +508,32 @@ class ComfyUIClient:
         
         return None
     
+    @staticmethod
+    def image_params(outputs: Dict) -> List[Dict[str, str]]:
+        """/view query params for every image in a prompt's outputs"""
+        return [
+            {
+                'filename': image_info.get('filename'),
+                'subfolder': image_info.get('subfolder', ''),
+                'type': image_info.get('type', 'output')
+            }
+            for output in outputs.values()
+            for image_info in output.get('images', [])
+        ]
+    
+    @traced('comfyui.get_image')
     def _get_image(self, outputs: Dict) -> Optional[bytes]:
         """Get image from outputs"""
         try:
-            for node_id, output in outputs.items():
-                if 'images' in output:
-                    for image_info in output['images']:
-                        filename = image_info.get('filename')
-                        subfolder = image_info.get('subfolder', '')
-                        folder_type = image_info.get('type', 'output')
-                        
-                        params = {
-                            'filename': filename,
-                            'subfolder': subfolder,
-                            'type': folder_type
-                        }
-                        
-                        response = requests.get(
-                            f"{self.api_url}/view",
-                            params=params,
-                            timeout=30
-                        )
-                        
-                        if response.status_code == 200:
-                            return response.content
+            for params in self.image_params(outputs):
+                response = requests.get(
+                    f"{self.api_url}/view",
+                    params=params,
+                    timeout=30
+                )
+                
+                if response.status_code == 200:
+                    return response.content
             return None
         except Exception as e:
             logger.error(f"Error getting image: {e}")
@@ -11,7 +11,8 @@ from pathlib import Path
 from datetime import datetime
 import hashlib
 
-import numpy as np
+from .embedding_index import EmbeddingIndex
+from .text_index import TextIndex
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +59,16 @@ class ConversationManager:
         self.index_file = Path(self.storage_path) / "conversations_index.json"
         self.conversations_index = self._load_index()
         
+        # Vector index for semantic search
+        self.embedding_index = None
+        if self.enable_embeddings:
+            self._load_embedding_index()
+        
+        # Inverted index for full-text search
+        self.text_index = TextIndex(os.path.join(self.storage_path, "text_index"))
+        if len(self.text_index) == 0 and self.conversations_index:
+            self.rebuild_text_index()
+        
         logger.info(f"✅ ConversationManager initialized with {len(self.conversations_index)} conversations")
     
     def _load_embedding_model(self):
@@ -79,6 +90,59 @@ class ConversationManager:
             self.enable_embeddings = False
             self.embedding_model = None
     
+    def _load_embedding_index(self):
+        """Load the persistent embedding index, building it on first use"""
+        self.embedding_index = EmbeddingIndex(
+            os.path.join(self.storage_path, "embedding_index")
+        )
+        
+        for conv_id, info in self.conversations_index.items():
+            self.embedding_index.set_tags(conv_id, info.get('tags', []))
+        
+        if len(self.embedding_index) == 0 and self.conversations_index:
+            self.rebuild_embedding_index()
+    
+    def rebuild_embedding_index(self):
+        """Rebuild the embedding index from embeddings stored in conversation files"""
+        if self.embedding_index is None:
+            return
+        
+        for conv_id in self.conversations_index:
+            conversation = self.get_conversation(conv_id)
+            if conversation:
+                self._index_messages(conv_id, conversation['messages'])
+        
+        logger.info(f"✅ Embedding index rebuilt with {len(self.embedding_index)} messages")
+    
+    def rebuild_text_index(self):
+        """Rebuild the full-text index from conversation files"""
+        for conv_id in self.conversations_index:
+            conversation = self.get_conversation(conv_id)
+            if conversation:
+                for msg in conversation['messages']:
+                    self._index_text(conv_id, msg)
+        
+        self.text_index.flush()
+        logger.info(f"✅ Text index rebuilt with {len(self.text_index)} messages")
+    
+    def _index_text(self, conversation_id: str, message: Dict):
+        """Add a message to the full-text index"""
+        self.text_index.add(
+            f"{conversation_id}:{message['id']}",
+            message.get('content', ''),
+            conversation_id
+        )
+    
+    def _index_messages(self, conversation_id: str, messages: List[Dict]):
+        """Append messages that carry an embedding to the vector index"""
+        items = [
+            (msg['id'], msg['embedding'])
+            for msg in messages
+            if msg.get('embedding') and msg.get('id')
+        ]
+        if items:
+            self.embedding_index.add_many(conversation_id, items)
+    
     def _load_index(self) -> Dict:
         """Load conversation index"""
         if self.index_file.exists():
@@ -144,6 +208,9 @@ class ConversationManager:
         }
         self._save_index()
         
+        if self.embedding_index is not None:
+            self.embedding_index.set_tags(conversation_id, tags)
+        
         logger.info(f"✅ Created conversation: {conversation_id}")
         return conversation_id
     
@@ -184,6 +251,9 @@ class ConversationManager:
             })
             self._save_index()
         
+        if self.embedding_index is not None and 'tags' in updates:
+            self.embedding_index.set_tags(conversation_id, conversation.get('tags', []))
+        
         return True
     
     def delete_conversation(self, conversation_id: str) -> bool:
@@ -197,6 +267,10 @@ class ConversationManager:
                 del self.conversations_index[conversation_id]
                 self._save_index()
             
+            if self.embedding_index is not None:
+                self.embedding_index.delete_conversation(conversation_id)
+            self.text_index.delete_conversation(conversation_id)
+            
             logger.info(f"✅ Deleted conversation: {conversation_id}")
             return True
         
@@ -236,12 +310,14 @@ class ConversationManager:
         }
         
         conversation['messages'].append(message)
+        self._index_text(conversation_id, message)
         
         # Generate embedding for semantic search
         if self.enable_embeddings and self.embedding_model:
             try:
                 embedding = self.embedding_model.encode(content)
                 message['embedding'] = embedding.tolist()
+                self.embedding_index.add(conversation_id, message['id'], embedding)
             except Exception as e:
                 logger.warning(f"Failed to generate embedding: {e}")
         
@@ -302,6 +378,11 @@ class ConversationManager:
         self.update_conversation(branch_id, branch)
         self.update_conversation(source_conversation_id, source)
         
+        if self.embedding_index is not None:
+            self._index_messages(branch_id, branch['messages'])
+        for msg in branch['messages']:
+            self._index_text(branch_id, msg)
+        
         logger.info(f"✅ Created branch: {branch_id} from {source_conversation_id}")
         return branch_id
     
@@ -338,51 +419,51 @@ class ConversationManager:
             # Generate query embedding
             query_embedding = self.embedding_model.encode(query)
             
-            # Search all conversations
-            results = []
+            # One matrix product over the whole index
+            hits = self.embedding_index.search(
+                query_embedding,
+                top_k=top_k,
+                filter_tags=filter_tags
+            )
             
-            for conv_id in self.conversations_index:
-                # Filter by tags if specified
-                if filter_tags:
-                    conv_tags = self.conversations_index[conv_id].get('tags', [])
-                    if not any(tag in conv_tags for tag in filter_tags):
-                        continue
-                
-                conversation = self.get_conversation(conv_id)
-                if not conversation:
-                    continue
-                
-                # Calculate similarity for each message
-                for message in conversation['messages']:
-                    if 'embedding' in message:
-                        message_embedding = np.array(message['embedding'])
-                        similarity = self._cosine_similarity(
-                            query_embedding,
-                            message_embedding
-                        )
-                        
-                        results.append({
-                            'conversation_id': conv_id,
-                            'conversation_title': conversation['title'],
-                            'message': message,
-                            'similarity': float(similarity)
-                        })
-            
-            # Sort by similarity
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            return results[:top_k]
+            return self._resolve_hits(hits)
         
         except Exception as e:
             logger.error(f"Semantic search failed: {e}")
             return []
     
-    def _cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Calculate cosine similarity"""
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        return dot_product / (norm1 * norm2) if norm1 > 0 and norm2 > 0 else 0.0
+    def _resolve_hits(
+        self,
+        hits: List[Tuple[str, str, float]],
+        score_key: str = 'similarity',
+        **extra
+    ) -> List[Dict]:
+        """Load the messages behind index hits, reading each conversation once"""
+        messages_by_conv = {}
+        results = []
+        
+        for conv_id, message_id, similarity in hits:
+            if conv_id not in messages_by_conv:
+                conversation = self.get_conversation(conv_id)
+                messages_by_conv[conv_id] = (
+                    conversation,
+                    {msg.get('id'): msg for msg in conversation['messages']} if conversation else {}
+                )
+            
+            conversation, messages = messages_by_conv[conv_id]
+            message = messages.get(message_id)
+            if not message:
+                continue
+            
+            results.append({
+                'conversation_id': conv_id,
+                'conversation_title': conversation['title'],
+                'message': message,
+                score_key: similarity,
+                **extra
+            })
+        
+        return results
     
     # =========================================================================
     # FULL-TEXT SEARCH
@@ -403,34 +484,26 @@ class ConversationManager:
             filter_tags: Filter by tags
         
         Returns:
-            List of matching messages
+            List of matching messages, BM25-ranked. Quoted phrases must
+            match exactly; diacritics are ignored ("ha noi" finds "Hà Nội").
         """
-        query_lower = query.lower()
-        results = []
+        conversation_ids = None
+        if filter_tags:
+            conversation_ids = {
+                conv_id for conv_id, info in self.conversations_index.items()
+                if any(tag in info.get('tags', []) for tag in filter_tags)
+            }
         
-        for conv_id in self.conversations_index:
-            # Filter by tags
-            if filter_tags:
-                conv_tags = self.conversations_index[conv_id].get('tags', [])
-                if not any(tag in conv_tags for tag in filter_tags):
-                    continue
-            
-            conversation = self.get_conversation(conv_id)
-            if not conversation:
-                continue
-            
-            # Search in messages
-            for message in conversation['messages']:
-                content = message['content'].lower()
-                if query_lower in content:
-                    results.append({
-                        'conversation_id': conv_id,
-                        'conversation_title': conversation['title'],
-                        'message': message,
-                        'match_type': 'full_text'
-                    })
-        
-        return results[:limit]
+        hits = self.text_index.search(query, limit=limit, conversation_ids=conversation_ids)
+        
+        return self._resolve_hits(
+            [
+                (hit['conversation_id'], hit['doc_id'].rsplit(':', 1)[1], hit['score'])
+                for hit in hits
+            ],
+            score_key='score',
+            match_type='full_text'
+        )
     
     # =========================================================================
     # AUTO-TAGGING
@@ -506,44 +579,29 @@ Return ONLY a JSON array of tags, e.g.: ["technology", "python", "tutorial"]
         Returns:
             List of related conversations
         """
-        if not self.enable_embeddings:
+        if not self.enable_embeddings or self.embedding_index is None:
             return []
         
-        conversation = self.get_conversation(conversation_id)
-        if not conversation or not conversation['messages']:
+        # Use first few messages as query, straight from the index
+        query_vector = self.embedding_index.conversation_vector(conversation_id, max_messages=3)
+        if query_vector is None:
             return []
         
-        # Use first few messages as query
-        query_text = " ".join([
-            msg['content']
-            for msg in conversation['messages'][:3]
-        ])
-        
-        # Search (excluding self)
-        results = self.semantic_search(query_text, top_k=top_k + 5)
-        
-        # Group by conversation and exclude self
-        seen_conversations = set()
-        related = []
-        
-        for result in results:
-            conv_id = result['conversation_id']
-            
-            if conv_id == conversation_id:
-                continue
-            
-            if conv_id not in seen_conversations:
-                seen_conversations.add(conv_id)
-                related.append({
-                    'conversation_id': conv_id,
-                    'conversation_title': result['conversation_title'],
-                    'similarity': result['similarity']
-                })
-            
-            if len(related) >= top_k:
-                break
+        # Search (excluding self), one best-message score per conversation
+        matches = self.embedding_index.search_conversations(
+            query_vector,
+            top_k=top_k,
+            exclude_conversation=conversation_id
+        )
         
-        return related
+        return [
+            {
+                'conversation_id': conv_id,
+                'conversation_title': self.conversations_index.get(conv_id, {}).get('title', ''),
+                'similarity': similarity
+            }
+            for conv_id, similarity in matches
+        ]
     
     # =========================================================================
     # EXPORT
@@ -0,0 +1,458 @@
+"""
+Embedding Index - Vector search for conversation messages
+Persistent, memory-mapped float32 matrix with incremental append and tombstones
+"""
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingIndex:
+    """
+    Incrementally updated embedding index backed by a memory-mapped matrix
+
+    Layout on disk (inside ``index_dir``):
+    - ``vectors.f32``: contiguous float32 matrix, one L2-normalized row per message
+    - ``id_map.jsonl``: one ``[conversation_id, message_id]`` line per row (append-only)
+    - ``tombstones.jsonl``: one ``[conversation_id, row_count]`` line per delete;
+      rows of the conversation before ``row_count`` are dead (append-only)
+    - ``meta.json``: embedding dimension
+
+    Rows are never moved on delete; a conversation is tombstoned by flipping
+    its slot in ``_conv_alive`` so every row pointing at it is masked out.
+    Re-adding a deleted conversation gives it a fresh slot, so only the new
+    rows are live. Call ``compact()`` to physically drop tombstoned rows.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    ID_MAP_FILE = "id_map.jsonl"
+    TOMBSTONES_FILE = "tombstones.jsonl"
+    META_FILE = "meta.json"
+
+    def __init__(self, index_dir: str, initial_capacity: int = 1024):
+        """
+        Initialize (or load) the index
+
+        Args:
+            index_dir: Directory holding the index files
+            initial_capacity: Number of rows to preallocate on first write
+        """
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.initial_capacity = max(1, initial_capacity)
+
+        self._lock = threading.RLock()
+        self._reset_state()
+        self._load()
+
+    def _reset_state(self):
+        """Reset all in-memory state"""
+        self.dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._count = 0
+
+        # Row -> conversation slot / message id
+        self._row_slots = np.zeros(0, dtype=np.int32)
+        self._row_message_ids: List[str] = []
+
+        # Conversation slot bookkeeping
+        self._slot_conv_ids: List[str] = []
+        self._conv_slots: Dict[str, int] = {}
+        self._conv_rows: Dict[str, List[int]] = {}
+        self._conv_alive = np.zeros(0, dtype=bool)
+
+        # tag -> boolean mask over conversation slots
+        self._tag_masks: Dict[str, np.ndarray] = {}
+        self._conv_tags: Dict[str, List[str]] = {}
+
+    # =========================================================================
+    # PERSISTENCE
+    # =========================================================================
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.index_dir / self.VECTORS_FILE
+
+    @property
+    def _id_map_path(self) -> Path:
+        return self.index_dir / self.ID_MAP_FILE
+
+    @property
+    def _tombstones_path(self) -> Path:
+        return self.index_dir / self.TOMBSTONES_FILE
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.index_dir / self.META_FILE
+
+    def _load(self):
+        """Load index files from disk, if present"""
+        if not self._meta_path.exists():
+            return
+
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            self.dim = int(json.load(f)['dim'])
+
+        entries = []
+        if self._id_map_path.exists():
+            with open(self._id_map_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entries.append(json.loads(line))
+
+        row_bytes = self.dim * 4
+        file_rows = self._vectors_path.stat().st_size // row_bytes if self._vectors_path.exists() else 0
+
+        # A crash between the vector write and the id map append leaves extra
+        # rows in the matrix; the id map is the source of truth.
+        if len(entries) > file_rows:
+            logger.warning(
+                f"⚠️ Embedding index id map has {len(entries)} rows but matrix has {file_rows}; truncating"
+            )
+            entries = entries[:file_rows]
+
+        if file_rows:
+            self._capacity = file_rows
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode='r+', shape=(self._capacity, self.dim)
+            )
+
+        # Tombstones apply at the row count they were written at, so rows
+        # re-added after a delete land in a fresh, live slot
+        tombstones = []
+        if self._tombstones_path.exists():
+            with open(self._tombstones_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        if isinstance(record, str):  # legacy: conversation ID only
+                            record = [record, len(entries)]
+                        tombstones.append((min(int(record[1]), len(entries)), record[0]))
+        tombstones.sort(key=lambda t: t[0])
+
+        self._row_slots = np.zeros(max(self._capacity, 1), dtype=np.int32)
+        pending = 0
+        for row, (conv_id, message_id) in enumerate(entries):
+            while pending < len(tombstones) and tombstones[pending][0] <= row:
+                self._kill_slot(tombstones[pending][1])
+                pending += 1
+            self._register_row(conv_id, message_id)
+        for _, conv_id in tombstones[pending:]:
+            self._kill_slot(conv_id)
+
+        logger.info(f"✅ Embedding index loaded: {self._count} rows, dim={self.dim}")
+
+    def _init_storage(self, dim: int):
+        """Create the matrix file for the first vector"""
+        self.dim = dim
+        self._capacity = self.initial_capacity
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float32, mode='w+', shape=(self._capacity, dim)
+        )
+        self._row_slots = np.zeros(self._capacity, dtype=np.int32)
+        with open(self._meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': dim}, f)
+
+    def _ensure_capacity(self, rows_needed: int):
+        """Grow the memory-mapped matrix (doubling) to fit ``rows_needed`` rows"""
+        if rows_needed <= self._capacity:
+            return
+
+        new_capacity = max(self._capacity * 2, rows_needed)
+        self._vectors.flush()
+        self._vectors = None
+
+        with open(self._vectors_path, 'r+b') as f:
+            f.truncate(new_capacity * self.dim * 4)
+
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float32, mode='r+', shape=(new_capacity, self.dim)
+        )
+        self._capacity = new_capacity
+        self._row_slots = self._grow(self._row_slots, new_capacity)
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int) -> np.ndarray:
+        """Return ``array`` zero-padded to at least ``size`` elements"""
+        if len(array) >= size:
+            return array
+        grown = np.zeros(max(size, len(array) * 2), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    # =========================================================================
+    # BOOKKEEPING
+    # =========================================================================
+
+    def _slot_for(self, conversation_id: str) -> int:
+        """Get (or allocate) the slot of a conversation; a deleted one gets a fresh slot"""
+        slot = self._conv_slots.get(conversation_id)
+        if slot is None or not self._conv_alive[slot]:
+            slot = len(self._slot_conv_ids)
+            self._slot_conv_ids.append(conversation_id)
+            self._conv_slots[conversation_id] = slot
+            self._conv_rows[conversation_id] = []
+            self._conv_alive = self._grow(self._conv_alive, slot + 1)
+            self._conv_alive[slot] = True
+            for tag, mask in self._tag_masks.items():
+                self._tag_masks[tag] = self._grow(mask, slot + 1)
+            for tag in self._conv_tags.get(conversation_id, []):
+                self._tag_mask(tag)[slot] = True
+        return slot
+
+    def _register_row(self, conversation_id: str, message_id: str) -> int:
+        """Register a row in the in-memory maps and return its index"""
+        row = self._count
+        slot = self._slot_for(conversation_id)
+        self._row_slots = self._grow(self._row_slots, row + 1)
+        self._row_slots[row] = slot
+        self._row_message_ids.append(message_id)
+        self._conv_rows.setdefault(conversation_id, []).append(row)
+        self._count += 1
+        return row
+
+    def _kill_slot(self, conversation_id: str) -> bool:
+        """Mark the current slot of a conversation dead; returns False if it was not live"""
+        slot = self._conv_slots.get(conversation_id)
+        if slot is None or not self._conv_alive[slot]:
+            return False
+        self._conv_alive[slot] = False
+        for mask in self._tag_masks.values():
+            if slot < len(mask):
+                mask[slot] = False
+        return True
+
+    def _tag_mask(self, tag: str) -> np.ndarray:
+        mask = self._tag_masks.get(tag)
+        if mask is None:
+            mask = np.zeros(max(len(self._conv_alive), 1), dtype=bool)
+            self._tag_masks[tag] = mask
+        return mask
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    # =========================================================================
+    # WRITES
+    # =========================================================================
+
+    def add(self, conversation_id: str, message_id: str, vector: Sequence[float]):
+        """Append one message embedding"""
+        self.add_many(conversation_id, [(message_id, vector)])
+
+    def add_many(self, conversation_id: str, items: Iterable[Tuple[str, Sequence[float]]]):
+        """
+        Append several message embeddings of one conversation
+
+        Args:
+            conversation_id: Conversation ID
+            items: Iterable of (message_id, vector)
+        """
+        items = list(items)
+        if not items:
+            return
+
+        matrix = self._normalize(np.asarray([vec for _, vec in items], dtype=np.float32))
+
+        with self._lock:
+            if self.dim is None:
+                self._init_storage(matrix.shape[1])
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {matrix.shape[1]} != index dim {self.dim}")
+
+            start = self._count
+            self._ensure_capacity(start + len(items))
+            self._vectors[start:start + len(items)] = matrix
+            self._vectors.flush()
+
+            with open(self._id_map_path, 'a', encoding='utf-8') as f:
+                for message_id, _ in items:
+                    self._register_row(conversation_id, message_id)
+                    f.write(json.dumps([conversation_id, message_id], ensure_ascii=False) + "\n")
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """
+        Tombstone all rows of a conversation
+
+        Its tags are kept, so rows added for it later match the same filters.
+        """
+        with self._lock:
+            if not self._kill_slot(conversation_id):
+                return False
+
+            with open(self._tombstones_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps([conversation_id, self._count], ensure_ascii=False) + "\n")
+            return True
+
+    def set_tags(self, conversation_id: str, tags: Optional[List[str]]):
+        """Update the tag bitmasks for a conversation"""
+        tags = list(tags or [])
+        with self._lock:
+            old_tags = self._conv_tags.get(conversation_id, [])
+            self._conv_tags[conversation_id] = tags
+
+            slot = self._conv_slots.get(conversation_id)
+            if slot is None:
+                # Applied when the first row of the conversation is added
+                return
+
+            for tag in old_tags:
+                if tag in self._tag_masks:
+                    self._tag_masks[tag][slot] = False
+            for tag in tags:
+                self._tag_mask(tag)[slot] = True
+
+    def compact(self):
+        """Rewrite the index without tombstoned rows"""
+        with self._lock:
+            if self.dim is None:
+                return
+
+            n = self._count
+            live_rows = np.flatnonzero(self._conv_alive[self._row_slots[:n]])
+            vectors = np.array(self._vectors[live_rows]) if len(live_rows) else np.zeros((0, self.dim), dtype=np.float32)
+            entries = [
+                (self._slot_conv_ids[self._row_slots[row]], self._row_message_ids[row])
+                for row in live_rows
+            ]
+            conv_tags = dict(self._conv_tags)
+
+            self._vectors = None
+            for path in (self._vectors_path, self._id_map_path, self._tombstones_path, self._meta_path):
+                if path.exists():
+                    path.unlink()
+
+            self._reset_state()
+            self._conv_tags = conv_tags
+
+            grouped: Dict[str, List[Tuple[str, np.ndarray]]] = {}
+            for (conv_id, message_id), vec in zip(entries, vectors):
+                grouped.setdefault(conv_id, []).append((message_id, vec))
+            for conv_id, items in grouped.items():
+                self.add_many(conv_id, items)
+
+            logger.info(f"✅ Embedding index compacted: {n} -> {self._count} rows")
+
+    # =========================================================================
+    # QUERIES
+    # =========================================================================
+
+    def __len__(self) -> int:
+        """Number of live rows"""
+        with self._lock:
+            if not self._count:
+                return 0
+            return int(self._conv_alive[self._row_slots[:self._count]].sum())
+
+    def conversation_vector(self, conversation_id: str, max_messages: int = 3) -> Optional[np.ndarray]:
+        """Mean embedding of the first messages of a conversation"""
+        with self._lock:
+            rows = self._conv_rows.get(conversation_id)
+            slot = self._conv_slots.get(conversation_id)
+            if not rows or slot is None or not self._conv_alive[slot]:
+                return None
+            return np.asarray(self._vectors[rows[:max_messages]]).mean(axis=0)
+
+    def _scores(
+        self,
+        query_vector: Sequence[float],
+        filter_tags: Optional[List[str]] = None,
+        exclude_conversation: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score every live row against the query in one matrix product
+
+        Returns:
+            (scores, row_slots) with masked-out rows scored ``-inf``
+        """
+        n = self._count
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32))
+        row_slots = self._row_slots[:n]
+
+        conv_mask = self._conv_alive.copy()
+        if filter_tags:
+            tag_mask = np.zeros_like(conv_mask)
+            for tag in filter_tags:
+                mask = self._tag_masks.get(tag)
+                if mask is not None:
+                    tag_mask[:len(mask)] |= mask[:len(tag_mask)]
+            conv_mask &= tag_mask
+        if exclude_conversation is not None:
+            slot = self._conv_slots.get(exclude_conversation)
+            if slot is not None:
+                conv_mask[slot] = False
+
+        scores = np.asarray(self._vectors[:n] @ query)
+        scores[~conv_mask[row_slots]] = -np.inf
+        return scores, row_slots
+
+    @staticmethod
+    def _top_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the ``top_k`` finite scores, best first"""
+        k = min(top_k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates])][:k]
+
+    def search(
+        self,
+        query_vector: Sequence[float],
+        top_k: int = 10,
+        filter_tags: Optional[List[str]] = None,
+        exclude_conversation: Optional[str] = None
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Top-k messages by cosine similarity
+
+        Returns:
+            List of (conversation_id, message_id, similarity), best first
+        """
+        with self._lock:
+            if not self._count or top_k <= 0:
+                return []
+            scores, row_slots = self._scores(query_vector, filter_tags, exclude_conversation)
+            return [
+                (self._slot_conv_ids[row_slots[row]], self._row_message_ids[row], float(scores[row]))
+                for row in self._top_indices(scores, top_k)
+            ]
+
+    def search_conversations(
+        self,
+        query_vector: Sequence[float],
+        top_k: int = 5,
+        filter_tags: Optional[List[str]] = None,
+        exclude_conversation: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Top-k conversations, each scored by its best-matching message
+
+        Returns:
+            List of (conversation_id, similarity), best first
+        """
+        with self._lock:
+            if not self._count or top_k <= 0:
+                return []
+            scores, row_slots = self._scores(query_vector, filter_tags, exclude_conversation)
+            best = np.full(len(self._slot_conv_ids), -np.inf, dtype=np.float32)
+            np.maximum.at(best, row_slots, scores)
+            return [
+                (self._slot_conv_ids[slot], float(best[slot]))
+                for slot in self._top_indices(best, top_k)
+            ]
@@ -14,6 +14,12 @@ import os
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 
+try:
+    from core.tracing import traced
+except ImportError:
+    def traced(name=None, **attributes):
+        return lambda func: func
+
 logger = logging.getLogger(__name__)
 
 
@@ -261,6 +267,7 @@ class MCPClient:
             logger.error(f"❌ Error reading file: {sanitize_for_log(str(type(e).__name__))}")
             return {"error": "Failed to read file"}
     
+    @traced('mcp.get_code_context')
     def get_code_context(self, user_message: str, selected_files: list = None) -> Optional[str]:
         """
         Tạo context từ code files để enhance AI response
@@ -20,7 +20,8 @@ def chat_with_cache_and_db(
     deep_thinking: bool = False,
     history: list = None,
     memories: list = None,
-    session_id: str = None
+    session_id: str = None,
+    user_id: str = None
 ) -> str:
     """
     Enhanced chat method with caching and database logging
@@ -34,6 +35,7 @@ def chat_with_cache_and_db(
         history: Conversation history
         memories: Memory context
         session_id: Session ID for database logging
+        user_id: Tags the cached response for invalidate_user (default: session user)
     
     Returns:
         AI response
@@ -52,7 +54,10 @@ def chat_with_cache_and_db(
     
     # Cache response (if not using custom history/memories)
     if cache and cache.enabled and history is None and memories is None:
-        cache.cache_ai_response(model, message, context, response, ttl=3600)
+        cache.cache_ai_response(
+            model, message, context, response, ttl=3600,
+            user_id=user_id or session.get('user_id')
+        )
         logger.info(f"💾 Cached response for {model}")
     
     # Log to database
@@ -265,7 +270,8 @@ def chat():
         deep_thinking,
         history,
         memories,
-        session_id
+        session_id,
+        user_id=session.get('user_id')
     )
     
     # ... rest of code ...
@@ -0,0 +1,584 @@
+"""
+Text Index - Inverted index for chat history full-text search
+BM25 ranking, phrase queries and Vietnamese diacritic folding
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# TOKENIZATION
+# =============================================================================
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+
+
+def fold_diacritics(text: str) -> str:
+    """
+    Lowercase and strip diacritics ("Hà Nội" -> "ha noi")
+
+    Vietnamese "đ" has no decomposition, so it is mapped explicitly.
+    """
+    text = text.lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into diacritic-folded tokens"""
+    return _TOKEN_RE.findall(fold_diacritics(text or ''))
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    Parse a query into terms and quoted phrases
+
+    Returns:
+        (terms, phrases) where terms includes the phrase tokens
+    """
+    phrases = [tokenize(p) for p in _PHRASE_RE.findall(query)]
+    phrases = [p for p in phrases if p]
+    terms = tokenize(_PHRASE_RE.sub(' ', query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return list(dict.fromkeys(terms)), phrases
+
+
+# =============================================================================
+# VARINT ENCODING
+# =============================================================================
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_postings(postings: List[Tuple[int, List[int]]]) -> bytes:
+    """Encode [(docnum, positions)] sorted by docnum as delta varints"""
+    out = bytearray()
+    _write_varint(out, len(postings))
+    last_doc = 0
+    for docnum, positions in postings:
+        _write_varint(out, docnum - last_doc)
+        last_doc = docnum
+        _write_varint(out, len(positions))
+        last_pos = 0
+        for pos in positions:
+            _write_varint(out, pos - last_pos)
+            last_pos = pos
+    return bytes(out)
+
+
+def _decode_postings(data, offset: int) -> List[Tuple[int, List[int]]]:
+    count, pos = _read_varint(data, offset)
+    postings = []
+    docnum = 0
+    for _ in range(count):
+        delta, pos = _read_varint(data, pos)
+        docnum += delta
+        tf, pos = _read_varint(data, pos)
+        positions = []
+        last = 0
+        for _ in range(tf):
+            delta, pos = _read_varint(data, pos)
+            last += delta
+            positions.append(last)
+        postings.append((docnum, positions))
+    return postings
+
+
+# =============================================================================
+# SEGMENTS
+# =============================================================================
+
+class _Segment:
+    """
+    Immutable on-disk segment
+
+    ``<name>.post`` holds the varint posting lists back to back;
+    ``<name>.meta.json`` holds the term dictionary (term -> [offset, df])
+    and the doc table ([doc_id, conversation_id, length] per docnum).
+    """
+
+    def __init__(self, directory: Path, name: str):
+        self.name = name
+        with open(directory / f"{name}.meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.terms: Dict[str, List[int]] = meta['terms']
+        self.docs: List[List] = meta['docs']
+        self.doc_numbers: Dict[str, int] = {doc[0]: i for i, doc in enumerate(self.docs)}
+        with open(directory / f"{name}.post", 'rb') as f:
+            self.data = f.read()
+        self.deleted: Set[int] = set()
+
+    @staticmethod
+    def write(directory: Path, name: str, docs: List[Tuple[str, str, int]],
+              terms: Dict[str, List[Tuple[int, List[int]]]]):
+        """Write a segment from docs and per-term postings"""
+        blob = bytearray()
+        term_table = {}
+        for term in sorted(terms):
+            postings = terms[term]
+            term_table[term] = [len(blob), len(postings)]
+            blob.extend(_encode_postings(postings))
+
+        tmp_post = directory / f"{name}.post.tmp"
+        tmp_meta = directory / f"{name}.meta.json.tmp"
+        with open(tmp_post, 'wb') as f:
+            f.write(blob)
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({'terms': term_table, 'docs': [list(d) for d in docs]}, f, ensure_ascii=False)
+        os.replace(tmp_post, directory / f"{name}.post")
+        os.replace(tmp_meta, directory / f"{name}.meta.json")
+
+    def postings(self, term: str) -> List[Tuple[int, List[int]]]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        return _decode_postings(self.data, entry[0])
+
+    def live_docs(self) -> Iterable[Tuple[int, List]]:
+        for docnum, doc in enumerate(self.docs):
+            if docnum not in self.deleted:
+                yield docnum, doc
+
+    def remove_files(self, directory: Path):
+        for suffix in (".post", ".meta.json"):
+            path = directory / f"{self.name}{suffix}"
+            if path.exists():
+                path.unlink()
+
+
+class TextIndex:
+    """
+    Inverted index (token -> posting list of message ids)
+
+    New documents go to an in-memory memtable, journaled to ``memtable.log``
+    so a restart replays them. When the memtable reaches ``flush_threshold``
+    documents it is written out as an immutable segment; segments are merged
+    in a background thread once there are more than ``max_segments``.
+    Edits and deletes mark the old copy deleted (``deletes.jsonl``) and are
+    dropped physically on merge.
+    """
+
+    MANIFEST_FILE = "segments.json"
+    MEMTABLE_LOG = "memtable.log"
+    DELETES_FILE = "deletes.jsonl"
+
+    def __init__(
+        self,
+        index_dir: str,
+        flush_threshold: int = 10000,
+        max_segments: int = 8,
+        k1: float = 1.2,
+        b: float = 0.75
+    ):
+        """
+        Initialize (or load) the index
+
+        Args:
+            index_dir: Directory holding the segment files
+            flush_threshold: Memtable size (documents) that triggers a flush
+            max_segments: Segment count that triggers a background merge
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_threshold = flush_threshold
+        self.max_segments = max_segments
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+
+        self._segments: List[_Segment] = []
+        self._next_segment = 0
+
+        # Memtable: doc_id -> (conversation_id, length, {term: positions})
+        self._mem_docs: Dict[str, Tuple[str, int, Dict[str, List[int]]]] = {}
+        self._mem_terms: Dict[str, Dict[str, List[int]]] = {}
+
+        self._conv_docs: Dict[str, Set[str]] = {}
+        self._total_docs = 0
+        self._total_length = 0
+
+        self._load()
+
+    # =========================================================================
+    # PERSISTENCE
+    # =========================================================================
+
+    def _load(self):
+        """Load manifest, segments, deletes and replay the memtable log"""
+        manifest_path = self.index_dir / self.MANIFEST_FILE
+        if manifest_path.exists():
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self._next_segment = manifest['next_segment']
+            for name in manifest['segments']:
+                self._segments.append(_Segment(self.index_dir, name))
+
+        deletes_path = self.index_dir / self.DELETES_FILE
+        if deletes_path.exists():
+            by_name = {seg.name: seg for seg in self._segments}
+            with open(deletes_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        name, docnum = json.loads(line)
+                        if name in by_name:
+                            by_name[name].deleted.add(docnum)
+
+        for segment in self._segments:
+            for _, (doc_id, conv_id, length) in segment.live_docs():
+                self._conv_docs.setdefault(conv_id, set()).add(doc_id)
+                self._total_docs += 1
+                self._total_length += length
+
+        log_path = self.index_dir / self.MEMTABLE_LOG
+        if log_path.exists():
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        op = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final write after a crash
+                        break
+                    if op[0] == 'add':
+                        self._apply_add(op[1], op[2], op[3])
+                    elif op[0] == 'del':
+                        self._apply_delete(op[1], log=False)
+
+        logger.info(f"✅ Text index loaded: {self._total_docs} docs in {len(self._segments)} segments")
+
+    def _save_manifest(self):
+        manifest_path = self.index_dir / self.MANIFEST_FILE
+        tmp_path = manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'next_segment': self._next_segment,
+                'segments': [seg.name for seg in self._segments]
+            }, f)
+        os.replace(tmp_path, manifest_path)
+
+    def _rewrite_deletes(self):
+        """Rewrite the deletes file for the current segment set"""
+        deletes_path = self.index_dir / self.DELETES_FILE
+        tmp_path = deletes_path.with_suffix('.jsonl.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for segment in self._segments:
+                for docnum in sorted(segment.deleted):
+                    f.write(json.dumps([segment.name, docnum]) + "\n")
+        os.replace(tmp_path, deletes_path)
+
+    def _journal(self, op: List):
+        with open(self.index_dir / self.MEMTABLE_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+
+    # =========================================================================
+    # WRITES
+    # =========================================================================
+
+    def _apply_add(self, doc_id: str, conversation_id: str, text: str):
+        self._apply_delete(doc_id, log=True)
+
+        positions: Dict[str, List[int]] = {}
+        tokens = tokenize(text)
+        for pos, token in enumerate(tokens):
+            positions.setdefault(token, []).append(pos)
+
+        self._mem_docs[doc_id] = (conversation_id, len(tokens), positions)
+        for term, term_positions in positions.items():
+            self._mem_terms.setdefault(term, {})[doc_id] = term_positions
+
+        self._conv_docs.setdefault(conversation_id, set()).add(doc_id)
+        self._total_docs += 1
+        self._total_length += len(tokens)
+
+    def _apply_delete(self, doc_id: str, log: bool) -> bool:
+        """Remove the live copy of a document from the memtable or a segment"""
+        found = False
+
+        entry = self._mem_docs.pop(doc_id, None)
+        if entry is not None:
+            conv_id, length, positions = entry
+            for term in positions:
+                postings = self._mem_terms.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._mem_terms[term]
+            found = True
+        else:
+            for segment in self._segments:
+                docnum = segment.doc_numbers.get(doc_id)
+                if docnum is None or docnum in segment.deleted:
+                    continue
+                segment.deleted.add(docnum)
+                _, conv_id, length = segment.docs[docnum]
+                if log:
+                    with open(self.index_dir / self.DELETES_FILE, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps([segment.name, docnum]) + "\n")
+                found = True
+                break
+
+        if found:
+            docs = self._conv_docs.get(conv_id)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self._conv_docs[conv_id]
+            self._total_docs -= 1
+            self._total_length -= length
+        return found
+
+    def add(self, doc_id: str, text: str, conversation_id: str = ''):
+        """
+        Index (or re-index) a document
+
+        Args:
+            doc_id: Unique document ID (message ID)
+            text: Document text
+            conversation_id: Owning conversation, used for filtering
+        """
+        with self._lock:
+            self._journal(['add', doc_id, conversation_id, text])
+            self._apply_add(doc_id, conversation_id, text)
+
+            if len(self._mem_docs) >= self.flush_threshold:
+                self.flush()
+
+    def delete(self, doc_id: str) -> bool:
+        """Remove a document"""
+        with self._lock:
+            self._journal(['del', doc_id])
+            return self._apply_delete(doc_id, log=True)
+
+    def delete_conversation(self, conversation_id: str) -> int:
+        """Remove every document of a conversation"""
+        with self._lock:
+            doc_ids = list(self._conv_docs.get(conversation_id, ()))
+            for doc_id in doc_ids:
+                self.delete(doc_id)
+            return len(doc_ids)
+
+    def flush(self):
+        """Write the memtable out as a new segment"""
+        with self._lock:
+            if not self._mem_docs:
+                return
+
+            doc_ids = list(self._mem_docs)
+            docnums = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            docs = [(doc_id, self._mem_docs[doc_id][0], self._mem_docs[doc_id][1]) for doc_id in doc_ids]
+            terms = {
+                term: sorted((docnums[doc_id], positions) for doc_id, positions in postings.items())
+                for term, postings in self._mem_terms.items()
+            }
+
+            name = f"seg_{self._next_segment:06d}"
+            self._next_segment += 1
+            _Segment.write(self.index_dir, name, docs, terms)
+
+            self._segments.append(_Segment(self.index_dir, name))
+            self._save_manifest()
+
+            self._mem_docs = {}
+            self._mem_terms = {}
+            open(self.index_dir / self.MEMTABLE_LOG, 'w').close()
+
+            logger.debug(f"Text index flushed segment {name} ({len(docs)} docs)")
+
+            if len(self._segments) > self.max_segments:
+                self.merge_async()
+
+    def merge_async(self) -> bool:
+        """Merge all segments in a background thread (no-op if one is running)"""
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return False
+        self._merge_thread = threading.Thread(target=self.merge, name="text-index-merge", daemon=True)
+        self._merge_thread.start()
+        return True
+
+    def merge(self):
+        """Merge the current segments into one, dropping deleted documents"""
+        with self._lock:
+            sources = list(self._segments)
+            if len(sources) < 2:
+                return
+            snapshot = {seg.name: set(seg.deleted) for seg in sources}
+            name = f"seg_{self._next_segment:06d}"
+            self._next_segment += 1
+
+        # Heavy lifting happens outside the lock; sources are immutable.
+        docs: List[Tuple[str, str, int]] = []
+        remap: Dict[Tuple[str, int], int] = {}
+        for segment in sources:
+            deleted = snapshot[segment.name]
+            for docnum, (doc_id, conv_id, length) in enumerate(segment.docs):
+                if docnum not in deleted:
+                    remap[(segment.name, docnum)] = len(docs)
+                    docs.append((doc_id, conv_id, length))
+
+        terms: Dict[str, List[Tuple[int, List[int]]]] = {}
+        for segment in sources:
+            for term in segment.terms:
+                for docnum, positions in segment.postings(term):
+                    new_docnum = remap.get((segment.name, docnum))
+                    if new_docnum is not None:
+                        terms.setdefault(term, []).append((new_docnum, positions))
+        for postings in terms.values():
+            postings.sort()
+
+        _Segment.write(self.index_dir, name, docs, terms)
+        merged = _Segment(self.index_dir, name)
+
+        with self._lock:
+            # Carry over deletes that landed while merging
+            for segment in sources:
+                for docnum in segment.deleted - snapshot[segment.name]:
+                    new_docnum = remap.get((segment.name, docnum))
+                    if new_docnum is not None:
+                        merged.deleted.add(new_docnum)
+
+            source_names = {seg.name for seg in sources}
+            self._segments = [merged] + [seg for seg in self._segments if seg.name not in source_names]
+            self._save_manifest()
+            self._rewrite_deletes()
+
+        for segment in sources:
+            segment.remove_files(self.index_dir)
+
+        logger.info(f"✅ Text index merged {len(sources)} segments into {name} ({len(docs)} docs)")
+
+    # =========================================================================
+    # QUERIES
+    # =========================================================================
+
+    def __len__(self) -> int:
+        return self._total_docs
+
+    def _collect(self, term: str) -> List[Tuple[str, str, int, List[int]]]:
+        """Live postings of a term as (doc_id, conversation_id, length, positions)"""
+        results = []
+        for segment in self._segments:
+            for docnum, positions in segment.postings(term):
+                if docnum not in segment.deleted:
+                    doc_id, conv_id, length = segment.docs[docnum]
+                    results.append((doc_id, conv_id, length, positions))
+        for doc_id, positions in self._mem_terms.get(term, {}).items():
+            conv_id, length, _ = self._mem_docs[doc_id]
+            results.append((doc_id, conv_id, length, positions))
+        return results
+
+    @staticmethod
+    def _has_phrase(doc_positions: Dict[str, List[int]], phrase: List[str]) -> bool:
+        first = doc_positions.get(phrase[0])
+        if not first:
+            return False
+        rest = [set(doc_positions.get(term, ())) for term in phrase[1:]]
+        return any(
+            all(start + offset + 1 in positions for offset, positions in enumerate(rest))
+            for start in first
+        )
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        conversation_ids: Optional[Set[str]] = None
+    ) -> List[Dict]:
+        """
+        BM25-ranked search
+
+        Quoted parts of the query ("...") must match as exact phrases;
+        the remaining terms are ranked but optional.
+
+        Args:
+            query: Search query
+            limit: Max results
+            conversation_ids: Restrict results to these conversations
+
+        Returns:
+            List of {'doc_id', 'conversation_id', 'score'}, best first
+        """
+        terms, phrases = parse_query(query)
+        if not terms or limit <= 0:
+            return []
+
+        with self._lock:
+            n_docs = max(self._total_docs, 1)
+            avg_length = (self._total_length / n_docs) or 1.0
+
+            scores: Dict[str, float] = {}
+            doc_convs: Dict[str, str] = {}
+            doc_positions: Dict[str, Dict[str, List[int]]] = {}
+
+            for term in terms:
+                postings = self._collect(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, conv_id, length, positions in postings:
+                    if conversation_ids is not None and conv_id not in conversation_ids:
+                        continue
+                    tf = len(positions)
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+                    doc_convs[doc_id] = conv_id
+                    if phrases:
+                        doc_positions.setdefault(doc_id, {})[term] = positions
+
+        if phrases:
+            scores = {
+                doc_id: score for doc_id, score in scores.items()
+                if all(self._has_phrase(doc_positions[doc_id], phrase) for phrase in phrases)
+            }
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            {'doc_id': doc_id, 'conversation_id': doc_convs[doc_id], 'score': score}
+            for doc_id, score in top
+        ]
+
+    def get_statistics(self) -> Dict:
+        """Get index statistics"""
+        with self._lock:
+            return {
+                'documents': self._total_docs,
+                'segments': len(self._segments),
+                'memtable_documents': len(self._mem_docs),
+                'terms_in_memtable': len(self._mem_terms),
+                'merging': self._merge_thread is not None and self._merge_thread.is_alive()
+            }
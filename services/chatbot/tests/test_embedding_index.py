@@ -0,0 +1,101 @@
+"""
+Embedding Index Tests
+
+Tests for the memory-mapped vector index behind semantic search.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+class TestEmbeddingIndex:
+    """Test EmbeddingIndex functionality"""
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        """Create an index with a few messages"""
+        from src.utils.embedding_index import EmbeddingIndex
+
+        index = EmbeddingIndex(str(tmp_path / "index"), initial_capacity=2)
+        index.set_tags('conv_a', ['python'])
+        index.set_tags('conv_b', ['cooking'])
+        index.add_many('conv_a', [('a1', [1.0, 0.0, 0.0]), ('a2', [0.9, 0.1, 0.0])])
+        index.add_many('conv_b', [('b1', [0.0, 1.0, 0.0])])
+        index.add('conv_c', 'c1', [0.7, 0.7, 0.0])
+        return index
+
+    def test_search_returns_top_k_in_order(self, index):
+        """Test that search ranks by cosine similarity"""
+        hits = index.search([1.0, 0.0, 0.0], top_k=2)
+
+        assert [(conv, msg) for conv, msg, _ in hits] == [('conv_a', 'a1'), ('conv_a', 'a2')]
+        assert hits[0][2] == pytest.approx(1.0)
+
+    def test_tag_filter(self, index):
+        """Test that tag filters restrict results to tagged conversations"""
+        hits = index.search([1.0, 0.0, 0.0], top_k=10, filter_tags=['cooking'])
+
+        assert [conv for conv, _, _ in hits] == ['conv_b']
+
+    def test_retag_updates_mask(self, index):
+        """Test that changing tags moves a conversation between filters"""
+        index.set_tags('conv_a', ['cooking'])
+
+        hits = index.search([1.0, 0.0, 0.0], top_k=10, filter_tags=['python'])
+        assert hits == []
+
+    def test_delete_tombstones_rows(self, index):
+        """Test that deleted conversations disappear from results"""
+        assert index.delete_conversation('conv_a') is True
+
+        hits = index.search([1.0, 0.0, 0.0], top_k=10)
+        assert 'conv_a' not in {conv for conv, _, _ in hits}
+        assert len(index) == 2
+
+    def test_search_conversations_excludes_source(self, index):
+        """Test conversation-level search groups by conversation"""
+        query = index.conversation_vector('conv_a')
+        matches = index.search_conversations(query, top_k=5, exclude_conversation='conv_a')
+
+        assert [conv for conv, _ in matches] == ['conv_c', 'conv_b']
+
+    def test_persists_across_reload(self, index, tmp_path):
+        """Test that rows and tombstones survive a reload"""
+        from src.utils.embedding_index import EmbeddingIndex
+
+        index.delete_conversation('conv_b')
+        reloaded = EmbeddingIndex(str(tmp_path / "index"))
+
+        assert len(reloaded) == 3
+        hits = reloaded.search([0.0, 1.0, 0.0], top_k=10)
+        assert 'conv_b' not in {conv for conv, _, _ in hits}
+
+    def test_compact_drops_tombstoned_rows(self, index, tmp_path):
+        """Test that compaction keeps live rows and tags"""
+        from src.utils.embedding_index import EmbeddingIndex
+
+        index.delete_conversation('conv_a')
+        index.compact()
+
+        assert index._count == 2
+        assert [conv for conv, _, _ in index.search([0.0, 1.0, 0.0], top_k=1, filter_tags=['cooking'])] == ['conv_b']
+        assert len(EmbeddingIndex(str(tmp_path / "index"))) == 2
+
+    def test_readd_after_delete_keeps_old_rows_dead(self, index, tmp_path):
+        """Test a re-added conversation gets only its new rows back, with its tags, across reloads"""
+        from src.utils.embedding_index import EmbeddingIndex
+
+        index.delete_conversation('conv_a')
+        index.add('conv_a', 'a3', [1.0, 0.0, 0.0])
+
+        reloaded = EmbeddingIndex(str(tmp_path / "index"))
+        reloaded.set_tags('conv_a', ['python'])  # tags are re-applied by the manager on load
+        for idx in (index, reloaded):
+            hits = idx.search([1.0, 0.0, 0.0], top_k=10, filter_tags=['python'])
+            assert [(conv, msg) for conv, msg, _ in hits] == [('conv_a', 'a3')]
+            assert len(idx) == 3
+
+        index.add('conv_a', 'a4', [0.9, 0.1, 0.0])
+        reloaded = EmbeddingIndex(str(tmp_path / "index"))
+        assert {msg for conv, msg, _ in reloaded.search([1.0, 0.0, 0.0], top_k=10) if conv == 'conv_a'} == {'a3', 'a4'}
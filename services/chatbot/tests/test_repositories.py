@@ -214,6 +214,53 @@ class TestMessageRepository:
         # Should be reversed to chronological order
         assert result[0]['content'] == 'First'
         assert result[2]['content'] == 'Third'
+    
+    def test_search_messages_with_text_index_returns_documents(self, mock_db, tmp_path):
+        """Test indexed search matches string doc ids against ObjectId _ids"""
+        from bson import ObjectId
+        from database.repositories.message_repository import MessageRepository
+        from src.utils.text_index import TextIndex
+        
+        stored = {}
+        
+        def insert_one(doc):
+            stored[doc['_id']] = dict(doc)
+            return MagicMock(inserted_id=doc['_id'])
+        
+        def find(query, projection=None):
+            wanted = query['_id']['$in']
+            cursor = MagicMock()
+            cursor.sort.return_value = cursor
+            cursor.skip.return_value = cursor
+            cursor.limit.return_value = cursor
+            cursor.__iter__ = Mock(return_value=iter(
+                [stored[_id] for _id in wanted if _id in stored]
+            ))
+            return cursor
+        
+        mock_db['messages'].insert_one.side_effect = insert_one
+        mock_db['messages'].find.side_effect = find
+        
+        index = TextIndex(str(tmp_path))
+        repo = MessageRepository(mock_db, text_index=index)
+        
+        # Messages written by config/mongodb_helpers carry ObjectId _ids
+        legacy = {'_id': ObjectId(), 'conversation_id': 'conv123',
+                  'role': 'user', 'content': 'Where is the deployment guide?'}
+        stored[legacy['_id']] = legacy
+        index.add(str(legacy['_id']), legacy['content'], 'conv123')
+        
+        repo.add_message('conv123', 'assistant', 'The guide lives in docs/')
+        repo.add_message('conv123', 'user', 'Thanks!')
+        
+        result = repo.search_messages('conv123', 'guide')
+        
+        assert {msg['content'] for msg in result} == {
+            'Where is the deployment guide?',
+            'The guide lives in docs/',
+        }
+        in_ids = mock_db['messages'].find.call_args[0][0]['_id']['$in']
+        assert legacy['_id'] in in_ids
 
 
 class TestMemoryRepository:
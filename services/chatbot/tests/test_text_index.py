@@ -0,0 +1,104 @@
+"""
+Text Index Tests
+
+Tests for the inverted index behind full-text message search.
+"""
+
+import pytest
+
+
+class TestTokenizer:
+    """Test Vietnamese-aware tokenization"""
+
+    def test_diacritics_are_folded(self):
+        """Test that accents and đ are folded to ASCII"""
+        from src.utils.text_index import tokenize
+
+        assert tokenize("Hà Nội đẹp lắm!") == ['ha', 'noi', 'dep', 'lam']
+
+    def test_parse_query_phrases(self):
+        """Test that quoted phrases are extracted"""
+        from src.utils.text_index import parse_query
+
+        terms, phrases = parse_query('python "list comprehension"')
+
+        assert phrases == [['list', 'comprehension']]
+        assert terms == ['python', 'list', 'comprehension']
+
+
+class TestTextIndex:
+    """Test TextIndex functionality"""
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        """Create an index with a few messages"""
+        from src.utils.text_index import TextIndex
+
+        index = TextIndex(str(tmp_path / "index"), flush_threshold=2, max_segments=100)
+        index.add('m1', 'Thời tiết Hà Nội hôm nay thế nào?', 'conv_a')
+        index.add('m2', 'Python list comprehension example', 'conv_a')
+        index.add('m3', 'A list of python comprehension tips for python users', 'conv_b')
+        return index
+
+    def test_search_folds_diacritics(self, index):
+        """Test that unaccented queries match accented text"""
+        hits = index.search('ha noi')
+
+        assert [hit['doc_id'] for hit in hits] == ['m1']
+
+    def test_bm25_ranks_by_term_frequency(self, index):
+        """Test BM25 ranking prefers documents with more query terms"""
+        hits = index.search('python')
+
+        assert {hit['doc_id'] for hit in hits} == {'m2', 'm3'}
+        assert hits[0]['score'] >= hits[1]['score']
+
+    def test_phrase_query(self, index):
+        """Test that phrases require adjacent tokens"""
+        hits = index.search('"list comprehension"')
+
+        assert [hit['doc_id'] for hit in hits] == ['m2']
+
+    def test_conversation_filter(self, index):
+        """Test restricting results to conversations"""
+        hits = index.search('python', conversation_ids={'conv_b'})
+
+        assert [hit['doc_id'] for hit in hits] == ['m3']
+
+    def test_edit_replaces_document(self, index):
+        """Test that re-adding a document replaces the old text"""
+        index.add('m2', 'Rust ownership rules', 'conv_a')
+
+        assert 'm2' not in {hit['doc_id'] for hit in index.search('python')}
+        assert [hit['doc_id'] for hit in index.search('rust')] == ['m2']
+        assert len(index) == 3
+
+    def test_delete_conversation(self, index):
+        """Test deleting every document of a conversation"""
+        assert index.delete_conversation('conv_a') == 2
+
+        assert [hit['doc_id'] for hit in index.search('python')] == ['m3']
+
+    def test_reload_replays_segments_and_memtable(self, index, tmp_path):
+        """Test that flushed segments, deletes and the memtable log survive a reload"""
+        from src.utils.text_index import TextIndex
+
+        index.delete('m1')
+        reloaded = TextIndex(str(tmp_path / "index"))
+
+        assert len(reloaded) == 2
+        assert reloaded.search('ha noi') == []
+        assert {hit['doc_id'] for hit in reloaded.search('python')} == {'m2', 'm3'}
+
+    def test_merge_drops_deleted_documents(self, index, tmp_path):
+        """Test merging segments keeps live documents only"""
+        from src.utils.text_index import TextIndex
+
+        index.add('m4', 'another python note', 'conv_b')
+        index.delete('m2')
+        index.flush()
+        index.merge()
+
+        assert index.get_statistics()['segments'] == 1
+        reloaded = TextIndex(str(tmp_path / "index"))
+        assert {hit['doc_id'] for hit in reloaded.search('python')} == {'m3', 'm4'}
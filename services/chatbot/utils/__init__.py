@@ -29,6 +29,8 @@ from .metrics import (
     Counter,
     Gauge,
     Histogram,
+    Summary,
+    QuantileSketch,
     MetricsRegistry,
     registry,
     # Pre-defined metrics
@@ -48,10 +50,15 @@ from .metrics import (
     db_query_time,
     ai_response_time,
     cache_operation_time,
+    route_response_time,
+    model_latency,
+    stream_ttft,
+    stream_inter_token,
     # Functions
     get_all_metrics,
     get_prometheus_metrics,
     create_metrics_blueprint,
+    register_route_metrics,
     track_time,
     count_calls,
     track_errors
@@ -78,11 +85,14 @@ __all__ = [
     'Counter',
     'Gauge',
     'Histogram',
+    'Summary',
+    'QuantileSketch',
     'MetricsRegistry',
     'registry',
     'get_all_metrics',
     'get_prometheus_metrics',
     'create_metrics_blueprint',
+    'register_route_metrics',
     'track_time',
     'count_calls',
     'track_errors',
@@ -104,4 +114,8 @@ __all__ = [
     'db_query_time',
     'ai_response_time',
     'cache_operation_time',
+    'route_response_time',
+    'model_latency',
+    'stream_ttft',
+    'stream_inter_token',
 ]
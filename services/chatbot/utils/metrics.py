@@ -5,10 +5,12 @@ Provides metrics collection for monitoring and observability.
 Supports Prometheus-compatible metrics export.
 """
 
+import math
 import time
 import threading
+from bisect import bisect_left
 from datetime import datetime
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, Iterable, List, Tuple
 from functools import wraps
 from collections import defaultdict
 import logging
@@ -16,46 +18,240 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class Counter:
+# ============================================================================
+# Building blocks
+# ============================================================================
+
+class _Shards:
+    """
+    Per-thread shards of one metric.
+    
+    Each thread only writes its own shard, so the hot path takes no lock (the
+    GIL keeps each update atomic); readers merge every shard on scrape. Shards
+    of threads that have exited are folded into a retired shard whenever a new
+    thread registers or a reader scrapes, so memory follows the number of live
+    threads even when nothing scrapes.
+    """
+    
+    def __init__(self, factory: Callable[[], Any], fold: Callable[[Any, Any], None]):
+        self._factory = factory
+        self._fold = fold
+        self._local = threading.local()
+        self._live: List[Tuple[threading.Thread, Any]] = []
+        self._retired = factory()
+        self._lock = threading.Lock()
+    
+    def local(self):
+        """This thread's shard"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._factory()
+            with self._lock:
+                self._retire_dead_locked()
+                self._live.append((threading.current_thread(), shard))
+            return shard
+    
+    def _retire_dead_locked(self):
+        live = []
+        for thread, shard in self._live:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._fold(self._retired, shard)
+        self._live = live
+    
+    def all(self) -> List[Any]:
+        """Every shard, folding those of finished threads first"""
+        with self._lock:
+            self._retire_dead_locked()
+            return [self._retired] + [shard for _, shard in self._live]
+    
+    def reset(self, clear: Callable[[Any], None]):
+        with self._lock:
+            clear(self._retired)
+            for _, shard in self._live:
+                clear(shard)
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch with bounded memory (DDSketch).
+    
+    Values fall into logarithmically spaced bins, so every reported quantile
+    is within ``relative_accuracy`` of the exact one. Beyond ``max_bins`` the
+    lowest bins are collapsed, which only degrades the smallest quantiles.
+    """
+    
+    __slots__ = ('relative_accuracy', 'max_bins', '_gamma', '_log_gamma', 'bins', 'zero_count', 'count')
+    
+    MIN_VALUE = 1e-9  # values below this are counted as zero
+    
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+    
+    def add(self, value: float):
+        """Record a value"""
+        self.count += 1
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        bins = self.bins
+        bins[index] = bins.get(index, 0) + 1
+        if len(bins) > self.max_bins:
+            self._collapse()
+    
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[target] += self.bins.pop(index)
+    
+    def merge(self, other: 'QuantileSketch'):
+        """Add another sketch (same relative accuracy) into this one"""
+        for index, count in other.bins.copy().items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+    
+    def quantile(self, q: float) -> float:
+        """Estimated q-quantile (0 <= q <= 1), 0.0 when empty"""
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        bins = self.bins.copy()
+        index = 0
+        for index in sorted(bins):
+            seen += bins[index]
+            if seen > rank:
+                break
+        return 2 * self._gamma ** index / (self._gamma + 1)
+    
+    def clear(self):
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    """Prometheus label set, e.g. {model="grok",le="0.5"}"""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Labeled:
+    """
+    Label support: ``metric.labels(model="grok").observe(1.2)``.
+    
+    A metric declared with labelnames is only a parent; every label
+    combination gets its own child series.
+    """
+    
+    def _init_labels(self, labelnames: Iterable[str]):
+        self.labelnames = tuple(labelnames)
+        self.label_values: Tuple[str, ...] = ()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._children_lock = threading.Lock()
+    
+    def labels(self, **labels):
+        """Child metric for one label combination"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._make_child()
+                    child.label_values = key
+                    self._children[key] = child
+        return child
+    
+    def series(self) -> List[Tuple[Tuple[Tuple[str, str], ...], Any]]:
+        """(label pairs, metric) for every exported series"""
+        if not self.labelnames:
+            return [((), self)]
+        return [
+            (tuple(zip(self.labelnames, key)), child)
+            for key, child in list(self._children.items())
+        ]
+    
+    def _reset_children(self):
+        for child in list(self._children.values()):
+            child.reset()
+
+
+# ============================================================================
+# Metric types
+# ============================================================================
+
+class Counter(_Labeled):
     """
     A simple counter metric.
-    Thread-safe implementation.
+    Thread-safe implementation, sharded per thread (no lock on inc).
     """
     
-    def __init__(self, name: str, description: str = ""):
+    def __init__(self, name: str, description: str = "", labelnames: Iterable[str] = ()):
         self.name = name
         self.description = description
-        self._value = 0
-        self._lock = threading.Lock()
+        self._init_labels(labelnames)
+        self._shards = _Shards(lambda: [0], self._fold)
+    
+    def _make_child(self):
+        return Counter(self.name, self.description)
+    
+    @staticmethod
+    def _fold(into, shard):
+        into[0] += shard[0]
     
     def inc(self, amount: int = 1):
         """Increment the counter"""
-        with self._lock:
-            self._value += amount
+        self._shards.local()[0] += amount
     
     def get(self) -> int:
         """Get current value"""
-        with self._lock:
-            return self._value
+        return sum(shard[0] for shard in self._shards.all())
     
     def reset(self):
         """Reset counter to 0"""
-        with self._lock:
-            self._value = 0
+        self._shards.reset(lambda shard: shard.__setitem__(0, 0))
+        self._reset_children()
 
 
-class Gauge:
+class Gauge(_Labeled):
     """
     A gauge metric that can go up and down.
     Thread-safe implementation.
     """
     
-    def __init__(self, name: str, description: str = ""):
+    def __init__(self, name: str, description: str = "", labelnames: Iterable[str] = ()):
         self.name = name
         self.description = description
+        self._init_labels(labelnames)
         self._value = 0.0
         self._lock = threading.Lock()
     
+    def _make_child(self):
+        return Gauge(self.name, self.description)
+    
     def set(self, value: float):
         """Set gauge value"""
         with self._lock:
@@ -77,51 +273,147 @@ class Gauge:
             return self._value
 
 
-class Histogram:
+class _HistogramShard:
+    __slots__ = ('counts', 'sum')
+    
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram(_Labeled):
     """
     A histogram metric for measuring distributions.
     Tracks count, sum, and bucket distributions.
+    
+    Observations go to a per-thread shard: one bisect for the bucket and two
+    increments, no lock. Cumulative bucket counts are built on read.
     """
     
     DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
     
-    def __init__(self, name: str, description: str = "", buckets: tuple = None):
+    def __init__(self, name: str, description: str = "", buckets: tuple = None,
+                 labelnames: Iterable[str] = ()):
         self.name = name
         self.description = description
-        self.buckets = buckets or self.DEFAULT_BUCKETS
-        self._count = 0
-        self._sum = 0.0
-        self._bucket_counts = {b: 0 for b in self.buckets}
-        self._bucket_counts[float('inf')] = 0
-        self._lock = threading.Lock()
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+        self._init_labels(labelnames)
+        size = len(self.buckets) + 1  # last slot: +Inf
+        self._shards = _Shards(lambda: _HistogramShard(size), self._fold)
+    
+    def _make_child(self):
+        return Histogram(self.name, self.description, self.buckets)
+    
+    @staticmethod
+    def _fold(into, shard):
+        for i, count in enumerate(shard.counts):
+            into.counts[i] += count
+        into.sum += shard.sum
+    
+    @staticmethod
+    def _clear(shard):
+        shard.counts = [0] * len(shard.counts)
+        shard.sum = 0.0
     
     def observe(self, value: float):
         """Record an observation"""
-        with self._lock:
-            self._count += 1
-            self._sum += value
-            for bucket in self.buckets:
-                if value <= bucket:
-                    self._bucket_counts[bucket] += 1
-            self._bucket_counts[float('inf')] += 1
+        shard = self._shards.local()
+        shard.counts[bisect_left(self.buckets, value)] += 1
+        shard.sum += value
     
     def get(self) -> Dict[str, Any]:
         """Get histogram data"""
-        with self._lock:
-            return {
-                "count": self._count,
-                "sum": self._sum,
-                "avg": self._sum / self._count if self._count > 0 else 0,
-                "buckets": dict(self._bucket_counts)
-            }
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in self._shards.all():
+            for i, count in enumerate(list(shard.counts)):
+                counts[i] += count
+            total += shard.sum
+        
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {
+            "count": cumulative,
+            "sum": total,
+            "avg": total / cumulative if cumulative > 0 else 0,
+            "buckets": buckets
+        }
     
     def reset(self):
         """Reset histogram"""
-        with self._lock:
-            self._count = 0
-            self._sum = 0.0
-            self._bucket_counts = {b: 0 for b in self.buckets}
-            self._bucket_counts[float('inf')] = 0
+        self._shards.reset(self._clear)
+        self._reset_children()
+
+
+class _SummaryShard:
+    __slots__ = ('sketch', 'sum')
+    
+    def __init__(self, relative_accuracy: float, max_bins: int):
+        self.sketch = QuantileSketch(relative_accuracy, max_bins)
+        self.sum = 0.0
+
+
+class Summary(_Labeled):
+    """
+    Streaming quantiles (p50/p95/p99 by default) with bounded memory.
+    
+    Each thread feeds its own QuantileSketch; sketches are merged on read.
+    """
+    
+    DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self, name: str, description: str = "", quantiles: tuple = None,
+                 labelnames: Iterable[str] = (), relative_accuracy: float = 0.01,
+                 max_bins: int = 2048):
+        self.name = name
+        self.description = description
+        self.quantiles = tuple(quantiles or self.DEFAULT_QUANTILES)
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._init_labels(labelnames)
+        self._shards = _Shards(lambda: _SummaryShard(relative_accuracy, max_bins), self._fold)
+    
+    def _make_child(self):
+        return Summary(self.name, self.description, self.quantiles,
+                       relative_accuracy=self.relative_accuracy, max_bins=self.max_bins)
+    
+    @staticmethod
+    def _fold(into, shard):
+        into.sketch.merge(shard.sketch)
+        into.sum += shard.sum
+    
+    @staticmethod
+    def _clear(shard):
+        shard.sketch.clear()
+        shard.sum = 0.0
+    
+    def observe(self, value: float):
+        """Record an observation"""
+        shard = self._shards.local()
+        shard.sketch.add(value)
+        shard.sum += value
+    
+    def get(self) -> Dict[str, Any]:
+        """Get count, sum and quantiles"""
+        merged = QuantileSketch(self.relative_accuracy, self.max_bins)
+        total = 0.0
+        for shard in self._shards.all():
+            merged.merge(shard.sketch)
+            total += shard.sum
+        return {
+            "count": merged.count,
+            "sum": total,
+            "avg": total / merged.count if merged.count > 0 else 0,
+            "quantiles": {q: merged.quantile(q) for q in self.quantiles}
+        }
+    
+    def reset(self):
+        """Reset summary"""
+        self._shards.reset(self._clear)
+        self._reset_children()
 
 
 class MetricsRegistry:
@@ -132,6 +424,8 @@ class MetricsRegistry:
     
     _instance = None
     
+    TYPES = ((Counter, "counter"), (Gauge, "gauge"), (Histogram, "histogram"), (Summary, "summary"))
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -147,16 +441,32 @@ class MetricsRegistry:
         """Get a metric by name"""
         return self._metrics.get(name)
     
+    @classmethod
+    def _type(cls, metric) -> Optional[str]:
+        for metric_class, name in cls.TYPES:
+            if isinstance(metric, metric_class):
+                return name
+        return None
+    
+    @staticmethod
+    def _data(metric) -> Dict[str, Any]:
+        data = metric.get()
+        return data if isinstance(data, dict) else {"value": data}
+    
     def all(self) -> Dict[str, Any]:
         """Get all metrics as dict"""
         result = {}
         for name, metric in self._metrics.items():
-            if isinstance(metric, Counter):
-                result[name] = {"type": "counter", "value": metric.get()}
-            elif isinstance(metric, Gauge):
-                result[name] = {"type": "gauge", "value": metric.get()}
-            elif isinstance(metric, Histogram):
-                result[name] = {"type": "histogram", **metric.get()}
+            metric_type = self._type(metric)
+            if metric_type is None:
+                continue
+            if metric.labelnames:
+                result[name] = {"type": metric_type, "series": [
+                    {"labels": dict(labels), **self._data(child)}
+                    for labels, child in metric.series()
+                ]}
+            else:
+                result[name] = {"type": metric_type, **self._data(metric)}
         return result
     
     def prometheus_format(self) -> str:
@@ -164,27 +474,27 @@ class MetricsRegistry:
         lines = []
         
         for name, metric in self._metrics.items():
-            if isinstance(metric, Counter):
-                lines.append(f"# HELP {name} {metric.description}")
-                lines.append(f"# TYPE {name} counter")
-                lines.append(f"{name} {metric.get()}")
-            
-            elif isinstance(metric, Gauge):
-                lines.append(f"# HELP {name} {metric.description}")
-                lines.append(f"# TYPE {name} gauge")
-                lines.append(f"{name} {metric.get()}")
+            metric_type = self._type(metric)
+            if metric_type is None:
+                continue
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric_type}")
             
-            elif isinstance(metric, Histogram):
-                data = metric.get()
-                lines.append(f"# HELP {name} {metric.description}")
-                lines.append(f"# TYPE {name} histogram")
-                for bucket, count in data["buckets"].items():
-                    if bucket == float('inf'):
-                        lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
-                    else:
-                        lines.append(f'{name}_bucket{{le="{bucket}"}} {count}')
-                lines.append(f"{name}_sum {data['sum']}")
-                lines.append(f"{name}_count {data['count']}")
+            for labels, series in metric.series():
+                if metric_type in ("counter", "gauge"):
+                    lines.append(f"{name}{_format_labels(labels)} {series.get()}")
+                    continue
+                
+                data = series.get()
+                if metric_type == "histogram":
+                    for bucket, count in data["buckets"].items():
+                        le = "+Inf" if bucket == float('inf') else str(bucket)
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {count}")
+                else:
+                    for q, value in data["quantiles"].items():
+                        lines.append(f"{name}{_format_labels(labels + (('quantile', str(q)),))} {value}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {data['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {data['count']}")
         
         return "\n".join(lines)
 
@@ -219,12 +529,24 @@ db_query_time = Histogram("chatbot_db_query_time_seconds", "Database query time
 ai_response_time = Histogram("chatbot_ai_response_time_seconds", "AI model response time")
 cache_operation_time = Histogram("chatbot_cache_operation_time_seconds", "Cache operation time")
 
+# Labeled
+route_response_time = Histogram("chatbot_route_response_time_seconds", "Response time per route",
+                                labelnames=("route",))
+model_latency = Summary("chatbot_model_latency_seconds", "AI latency quantiles per model and provider",
+                        labelnames=("model", "provider"))
+stream_ttft = Summary("chatbot_stream_ttft_seconds", "Time to first token per model",
+                     labelnames=("model",))
+stream_inter_token = Histogram("chatbot_stream_inter_token_seconds", "Gap between streamed deltas per model",
+                               buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+                               labelnames=("model",))
+
 # Register all metrics
 for metric in [
     conversations_created, messages_sent, messages_received,
     cache_hits, cache_misses, db_queries, errors_total, api_requests,
     active_conversations, active_users, cache_size, db_connections,
-    response_time, db_query_time, ai_response_time, cache_operation_time
+    response_time, db_query_time, ai_response_time, cache_operation_time,
+    route_response_time, model_latency, stream_ttft, stream_inter_token
 ]:
     registry.register(metric)
 
@@ -233,8 +555,8 @@ for metric in [
 # Decorators for automatic metrics collection
 # ============================================================================
 
-def track_time(histogram: Histogram):
-    """Decorator to track function execution time"""
+def track_time(histogram):
+    """Decorator to track function execution time (Histogram or Summary)"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -308,6 +630,26 @@ def create_metrics_blueprint():
         return None
 
 
+def register_route_metrics(app):
+    """Observe route_response_time for every request, labeled by URL rule"""
+    from flask import g, request
+    
+    @app.before_request
+    def _start_route_timer():
+        g._metrics_start = time.perf_counter()
+    
+    @app.after_request
+    def _observe_route_time(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            # The URL rule keeps label cardinality bounded (no ids in paths)
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            route_response_time.labels(route=route).observe(time.perf_counter() - start)
+        return response
+    
+    return app
+
+
 # ============================================================================
 # Utility functions
 # ============================================================================
@@ -1,71 +1,41 @@
 """
 Rate Limiter Utility
 Implement rate limiting for API requests
+
+Limits are backed by the shared limiter in src.utils.rate_limiter: Redis
+(RATE_LIMIT_REDIS_URL / REDIS_URL) when available so every gateway worker
+enforces the same quota, in-memory otherwise.
 """
 
 from functools import wraps
 from flask import request, jsonify
-import time
-from collections import defaultdict
+import math
 import logging
 
+from src.utils.rate_limiter import RateLimiter, create_rate_limiter
+
 logger = logging.getLogger("ai_assistant_hub")
 
+__all__ = ['RateLimiter', 'rate_limiter', 'get_limiter', 'rate_limit']
 
-class RateLimiter:
-    """Simple in-memory rate limiter."""
-    
-    def __init__(self, max_requests=100, window_seconds=60):
-        """
-        Initialize rate limiter.
-        
-        Args:
-            max_requests: Maximum requests allowed in the time window
-            window_seconds: Time window in seconds
-        """
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.requests = defaultdict(list)
-    
-    def is_allowed(self, identifier: str) -> bool:
-        """
-        Check if request is allowed for the identifier.
-        
-        Args:
-            identifier: Unique identifier (e.g., IP address)
-        
-        Returns:
-            True if request is allowed, False otherwise
-        """
-        current_time = time.time()
-        
-        # Remove old requests outside the window
-        self.requests[identifier] = [
-            req_time for req_time in self.requests[identifier]
-            if current_time - req_time < self.window_seconds
-        ]
-        
-        # Check if limit exceeded
-        if len(self.requests[identifier]) >= self.max_requests:
-            logger.warning(f"Rate limit exceeded for {identifier}")
-            return False
-        
-        # Add current request
-        self.requests[identifier].append(current_time)
-        return True
-    
-    def get_remaining(self, identifier: str) -> int:
-        """Get remaining requests for identifier."""
-        current_time = time.time()
-        self.requests[identifier] = [
-            req_time for req_time in self.requests[identifier]
-            if current_time - req_time < self.window_seconds
-        ]
-        return max(0, self.max_requests - len(self.requests[identifier]))
+# Global rate limiter instance
+rate_limiter = create_rate_limiter(max_requests=100, window_seconds=60, key_prefix='hub:ratelimit:')
 
+# One limiter per (max_requests, window_seconds), shared by all routes using it
+_limiters = {(100, 60): rate_limiter}
 
-# Global rate limiter instance
-rate_limiter = RateLimiter(max_requests=100, window_seconds=60)
+
+def get_limiter(max_requests=None, window_seconds=None):
+    """Get the shared limiter for a limit, creating it on first use."""
+    if not (max_requests and window_seconds):
+        return rate_limiter
+    key = (max_requests, window_seconds)
+    if key not in _limiters:
+        _limiters[key] = create_rate_limiter(
+            max_requests, window_seconds,
+            key_prefix=f'hub:ratelimit:{max_requests}:{window_seconds}:'
+        )
+    return _limiters[key]
 
 
 def rate_limit(max_requests=None, window_seconds=None):
@@ -77,23 +47,27 @@ def rate_limit(max_requests=None, window_seconds=None):
         window_seconds: Override default window seconds
     """
     def decorator(f):
+        # Resolve once at decoration time so the quota persists between requests
+        limiter = get_limiter(max_requests, window_seconds)
+
         @wraps(f)
         def decorated_function(*args, **kwargs):
             # Use IP address as identifier
-            identifier = request.remote_addr
-            
-            # Use custom limiter if parameters provided
-            if max_requests and window_seconds:
-                limiter = RateLimiter(max_requests, window_seconds)
-            else:
-                limiter = rate_limiter
+            identifier = request.remote_addr or 'unknown'
             
-            if not limiter.is_allowed(identifier):
-                return jsonify({
+            allowed, remaining = limiter.is_allowed(identifier)
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for {identifier}")
+                retry_after = max(1, math.ceil(limiter.get_reset_time(identifier)))
+                response = jsonify({
                     'error': 'Rate limit exceeded',
                     'message': f'Maximum {limiter.max_requests} requests per {limiter.window_seconds} seconds',
-                    'retry_after': limiter.window_seconds
-                }), 429
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                response.headers['X-RateLimit-Limit'] = str(limiter.max_requests)
+                response.headers['X-RateLimit-Remaining'] = '0'
+                return response, 429
             
             return f(*args, **kwargs)
         return decorated_function
@@ -24,22 +24,24 @@ import requests
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Lazy import functions
+# Lazy import functions - models are kept warm by the shared model registry
+from functools import partial
+
 smart_transcribe = None
 fast_transcribe = None
 
 def get_smart_transcribe():
     global smart_transcribe
     if smart_transcribe is None:
-        from core.run_dual_smart import main as _smart
-        smart_transcribe = _smart
+        from core.services.transcription import dual_transcribe
+        smart_transcribe = partial(dual_transcribe, mode="smart")
     return smart_transcribe
 
 def get_fast_transcribe():
     global fast_transcribe
     if fast_transcribe is None:
-        from core.run_dual_fast import main as _fast
-        fast_transcribe = _fast
+        from core.services.transcription import dual_transcribe
+        fast_transcribe = partial(dual_transcribe, mode="fast")
     return fast_transcribe
 
 # Setup logging
@@ -82,6 +84,12 @@ RESULT_DIR.mkdir(parents=True, exist_ok=True)
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.on_event("startup")
+async def prewarm_transcription_models():
+    """Load Whisper/PhoWhisper in the background so the first job does not wait for them"""
+    from core.services.model_registry import prewarm_models
+    prewarm_models(default="whisper,phowhisper")
+
 # =============================================================================
 # UTILITY FUNCTIONS
 # =============================================================================
@@ -135,12 +143,12 @@ async def process_transcription(
         if model == "smart":
             # Call smart dual model
             result = await asyncio.get_event_loop().run_in_executor(
-                None, smart_transcribe, audio_path
+                None, partial(get_smart_transcribe(), language=language), audio_path
             )
         elif model == "fast":
             # Call fast dual model  
             result = await asyncio.get_event_loop().run_in_executor(
-                None, fast_transcribe, audio_path
+                None, partial(get_fast_transcribe(), language=language), audio_path
             )
         elif model == "t5":
             # Call T5 service
@@ -372,6 +380,12 @@ async def download_result(job_id: str):
     # Return result as JSON
     return status.get("result", {})
 
+@app.get("/models/stats")
+async def get_model_stats():
+    """Resident model state with load / resident / idle times"""
+    from core.services.model_registry import get_model_registry
+    return get_model_registry().get_stats()
+
 @app.get("/models")
 async def get_available_models():
     """Get list of available models with descriptions"""
@@ -5,7 +5,7 @@ Uses pyannote.audio for speaker segmentation
 """
 import os
 import time
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Union
 from dataclasses import dataclass
 import torch
 import numpy as np
@@ -120,21 +120,31 @@ class SpeakerDiarizationClient:
             print(f"      https://huggingface.co/{self.model_name}")
             raise
     
+    def unload(self):
+        """Release the diarization pipeline"""
+        if self.pipeline is not None:
+            del self.pipeline
+            self.pipeline = None
+            print("[DIARIZATION] Pipeline unloaded")
+    
     def diarize(
         self,
-        audio_path: str,
+        audio: Union[str, np.ndarray],
         min_duration: float = 1.0,
         collar: float = 0.0,
-        use_vad: bool = True
+        use_vad: bool = True,
+        sample_rate: int = 16000
     ) -> List[SpeakerSegment]:
         """
-        Perform speaker diarization on audio file
+        Perform speaker diarization on audio file or in-memory samples
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or mono float32 samples at sample_rate
+                (passed to pyannote as a waveform tensor sharing the array's memory)
             min_duration: Minimum segment duration in seconds (filter short segments)
             collar: Tolerance for segment boundaries in seconds
             use_vad: Use Voice Activity Detection to speed up processing
+            sample_rate: Sample rate of in-memory audio
             
         Returns:
             List of SpeakerSegment objects sorted by start time
@@ -142,9 +152,17 @@ class SpeakerDiarizationClient:
         if self.pipeline is None:
             raise RuntimeError("Pipeline not loaded. Call load() first.")
         
-        print(f"[DIARIZATION] Processing: {audio_path}")
+        in_memory = not isinstance(audio, str)
+        audio_path = None if in_memory else audio
+        print(f"[DIARIZATION] Processing: {'in-memory audio' if in_memory else audio_path}")
         diarize_start = time.time()
         
+        def as_input(samples: np.ndarray, sr: int) -> Dict:
+            waveform = torch.from_numpy(np.ascontiguousarray(samples, dtype=np.float32)).unsqueeze(0)
+            return {"waveform": waveform, "sample_rate": sr}
+        
+        pipeline_input = as_input(audio, sample_rate) if in_memory else audio_path
+        
         # Optional: Pre-filter with VAD for faster processing
         if use_vad:
             print(f"[DIARIZATION] Running VAD pre-filtering...")
@@ -155,23 +173,30 @@ class SpeakerDiarizationClient:
                 import os
                 
                 # Load audio
-                audio, sr = librosa.load(audio_path, sr=16000)
+                if in_memory:
+                    samples, sr = audio, sample_rate
+                else:
+                    samples, sr = librosa.load(audio_path, sr=16000)
                 
                 # Detect speech segments
                 vad = VADProcessor(method="silero", threshold=0.5)
                 speech_segments = vad.detect_speech_segments(
-                    audio, sr,
+                    samples, sr,
                     min_speech_duration=0.3,
                     min_silence_duration=0.2
                 )
                 
                 if speech_segments:
-                    # Save filtered audio temporarily
-                    filtered_audio = vad.filter_audio_by_speech(audio, sr, padding=0.3)
-                    temp_path = audio_path.replace('.wav', '_vad.wav')
-                    sf.write(temp_path, filtered_audio, sr)
-                    audio_path = temp_path
-                    print(f"[DIARIZATION] VAD filtered audio saved to: {temp_path}")
+                    filtered_audio = vad.filter_audio_by_speech(samples, sr, padding=0.3)
+                    if in_memory:
+                        pipeline_input = as_input(filtered_audio, sr)
+                        print(f"[DIARIZATION] VAD filtered audio kept in memory")
+                    else:
+                        # Save filtered audio temporarily
+                        temp_path = audio_path.replace('.wav', '_vad.wav')
+                        sf.write(temp_path, filtered_audio, sr)
+                        audio_path = pipeline_input = temp_path
+                        print(f"[DIARIZATION] VAD filtered audio saved to: {temp_path}")
             except Exception as e:
                 print(f"[DIARIZATION] VAD pre-filtering failed: {e}")
                 print(f"[DIARIZATION] Continuing without VAD...")
@@ -179,7 +204,7 @@ class SpeakerDiarizationClient:
         try:
             # Run diarization
             diarization = self.pipeline(
-                audio_path,
+                pipeline_input,
                 min_speakers=self.min_speakers,
                 max_speakers=self.max_speakers
             )
@@ -213,7 +238,7 @@ class SpeakerDiarizationClient:
             print(f"[INFO] Total speech time: {total_speech:.2f}s")
             
             # Clean up temp VAD file
-            if use_vad and '_vad.wav' in audio_path:
+            if use_vad and audio_path and '_vad.wav' in audio_path:
                 try:
                     os.remove(audio_path)
                 except:
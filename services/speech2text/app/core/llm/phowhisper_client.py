@@ -7,7 +7,7 @@ import time
 import torch
 import librosa
 import numpy as np
-from typing import Tuple, Optional, List
+from typing import Callable, Tuple, Optional, List, Union
 from pathlib import Path
 
 
@@ -74,19 +74,32 @@ class PhoWhisperClient:
         
         print(f"[PhoWhisper] Loaded in {load_time:.2f}s")
         return load_time
+    
+    def unload(self):
+        """Unload model to free GPU/CPU memory"""
+        if self.pipe is not None:
+            del self.pipe
+            self.pipe = None
+            self._is_loaded = False
+            if "cuda" in str(self.device):
+                import gc
+                gc.collect()
+                torch.cuda.empty_cache()
+            print(f"[PhoWhisper] Model unloaded")
         
     def transcribe(
         self,
-        audio_path: str,
+        audio: Union[str, np.ndarray],
         language: str = "vietnamese",
         sample_rate: int = 16000,
         **kwargs
     ) -> Tuple[str, float]:
         """
-        Transcribe audio file with chunking
+        Transcribe audio file or in-memory samples with chunking
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or mono float32 samples at sample_rate
+                (a slice of the decoded recording is used without copying)
             language: Language for transcription
             sample_rate: Target sample rate (16kHz for PhoWhisper)
             **kwargs: Additional generation parameters
@@ -97,11 +110,15 @@ class PhoWhisperClient:
         if not self._is_loaded:
             self.load()
             
-        print(f"[PhoWhisper] Transcribing: {Path(audio_path).name}")
         start_time = time.time()
         
-        # Load audio
-        audio_data, sr = librosa.load(audio_path, sr=sample_rate)
+        # Load audio (arrays are already decoded; chunks below are views)
+        if isinstance(audio, str):
+            print(f"[PhoWhisper] Transcribing: {Path(audio).name}")
+            audio_data, sr = librosa.load(audio, sr=sample_rate)
+        else:
+            print(f"[PhoWhisper] Transcribing: in-memory audio")
+            audio_data, sr = np.asarray(audio, dtype=np.float32), sample_rate
         duration = len(audio_data) / sr
         print(f"[PhoWhisper] Audio duration: {duration:.1f}s")
         
@@ -141,6 +158,70 @@ class PhoWhisperClient:
         print(f"[PhoWhisper] Completed in {processing_time:.2f}s ({len(full_transcript)} chars)")
         return full_transcript, processing_time
         
+    def transcribe_batch(
+        self,
+        segments: List[Union[str, np.ndarray]],
+        batch_size: int = 8,
+        language: str = "vietnamese",
+        sample_rate: int = 16000,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        **kwargs
+    ) -> Tuple[List[str], float]:
+        """
+        Transcribe many segments in padded batches
+        
+        Every segment is split into chunk_duration chunks (views, no copy);
+        chunks from all segments are sorted by length so each batch holds
+        similar lengths, and the pipeline pads and decodes them together.
+        
+        Args:
+            segments: Paths or mono float32 arrays at sample_rate
+            batch_size: Chunks per pipeline forward pass
+            language: Language for transcription
+            sample_rate: Sample rate of in-memory segments
+            progress_callback: Called with (chunks_done, total_chunks)
+            **kwargs: Additional generation parameters
+            
+        Returns:
+            Tuple of (per-segment transcripts in input order, processing_time)
+        """
+        if not self._is_loaded:
+            self.load()
+        start_time = time.time()
+        
+        chunk_size = self.chunk_duration * sample_rate
+        chunks = []  # (segment index, chunk index, samples)
+        for i, segment in enumerate(segments):
+            if isinstance(segment, str):
+                segment, _ = librosa.load(segment, sr=sample_rate)
+            samples = np.asarray(segment, dtype=np.float32)
+            for j, offset in enumerate(range(0, len(samples), chunk_size)):
+                chunks.append((i, j, samples[offset:offset + chunk_size]))
+        
+        # Longest first: similar lengths share a batch, so little padding
+        chunks.sort(key=lambda chunk: len(chunk[2]), reverse=True)
+        print(f"[PhoWhisper] Batched: {len(segments)} segments, {len(chunks)} chunks, batch {batch_size}")
+        
+        generate_kwargs = {
+            "language": language,
+            "task": "transcribe",
+            **kwargs
+        }
+        parts = [{} for _ in segments]
+        for b in range(0, len(chunks), batch_size):
+            batch = chunks[b:b + batch_size]
+            results = self.pipe([samples for _, _, samples in batch],
+                                batch_size=len(batch), generate_kwargs=generate_kwargs)
+            for (i, j, _), result in zip(batch, results):
+                parts[i][j] = result["text"].strip()
+            if progress_callback:
+                progress_callback(b + len(batch), len(chunks))
+        
+        transcripts = [" ".join(text for _, text in sorted(p.items()) if text) for p in parts]
+        processing_time = time.time() - start_time
+        print(f"[PhoWhisper] Batch completed in {processing_time:.2f}s")
+        return transcripts, processing_time
+        
     def save_result(self, transcript: str, output_path: str):
         """Save transcript to file"""
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
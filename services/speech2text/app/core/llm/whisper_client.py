@@ -6,13 +6,17 @@ Uses faster_whisper for optimized inference
 import time
 import torch
 import os
-from typing import Tuple, Optional
+import numpy as np
+from bisect import bisect_right
+from typing import Callable, List, Tuple, Optional, Union
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+SAMPLE_RATE = 16000
+
 
 def get_safe_device():
     """Get device with FORCE_CPU support"""
@@ -38,6 +42,13 @@ def get_safe_device():
         return "cpu"
 
 
+def clip_timestamps_in_seconds() -> bool:
+    """faster-whisper >= 1.2 takes clip_timestamps in seconds, 1.1 in samples"""
+    import faster_whisper
+    version = tuple(int(part) for part in faster_whisper.__version__.split(".")[:2])
+    return version >= (1, 2)
+
+
 def check_cudnn_available():
     """Check if cuDNN is available for CUDA operations"""
     if not torch.cuda.is_available():
@@ -66,6 +77,7 @@ class WhisperClient:
         model_name: str = "large-v3",
         device: Optional[str] = None,
         compute_type: Optional[str] = None,
+        cpu_threads: int = 0,
     ):
         """
         Initialize Whisper client
@@ -74,6 +86,7 @@ class WhisperClient:
             model_name: Model size (tiny, base, small, medium, large-v3)
             device: Device to use (cuda, cpu, or None for auto-detect)
             compute_type: Computation type (float16, int8, or None for auto)
+            cpu_threads: CTranslate2 threads on CPU (0 = library default)
         """
         self.model_name = model_name
         
@@ -85,8 +98,10 @@ class WhisperClient:
             self.compute_type = "float16" if self.device == "cuda" else "int8"
         else:
             self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
             
         self.model = None
+        self._batched = None  # faster_whisper.BatchedInferencePipeline, built on first batch
         self._is_loaded = False
         
     def load(self) -> float:
@@ -100,12 +115,14 @@ class WhisperClient:
         
         print(f"[Whisper] Loading {self.model_name} on {self.device}...")
         start_time = time.time()
+        self._batched = None
         
         try:
             self.model = WhisperModel(
                 self.model_name,
                 device=self.device,
-                compute_type=self.compute_type
+                compute_type=self.compute_type,
+                cpu_threads=self.cpu_threads
             )
         except Exception as e:
             # Handle CUDA library errors (cublas64_12.dll, cuDNN, etc.)
@@ -118,7 +135,8 @@ class WhisperClient:
                 self.model = WhisperModel(
                     self.model_name,
                     device=self.device,
-                    compute_type=self.compute_type
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads
                 )
             else:
                 raise
@@ -128,20 +146,34 @@ class WhisperClient:
         
         print(f"[Whisper] Loaded in {load_time:.2f}s")
         return load_time
+    
+    def unload(self):
+        """Unload model to free GPU/CPU memory"""
+        if self.model is not None:
+            del self.model
+            self.model = None
+            self._batched = None
+            self._is_loaded = False
+            if self.device == "cuda":
+                import gc
+                gc.collect()
+                torch.cuda.empty_cache()
+            print(f"[Whisper] Model unloaded")
         
     def transcribe(
         self,
-        audio_path: str,
+        audio: Union[str, np.ndarray],
         language: str = "vi",
         beam_size: int = 5,
         vad_filter: bool = False,
         **kwargs
     ) -> Tuple[str, float]:
         """
-        Transcribe audio file
+        Transcribe audio file or in-memory samples
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or 16kHz mono float32 samples
+                (a slice of the decoded recording is used without copying)
             language: Language code (vi for Vietnamese)
             beam_size: Beam size for decoding
             vad_filter: Enable voice activity detection
@@ -153,7 +185,11 @@ class WhisperClient:
         if not self._is_loaded:
             self.load()
             
-        print(f"[Whisper] Transcribing: {Path(audio_path).name}")
+        if isinstance(audio, str):
+            print(f"[Whisper] Transcribing: {Path(audio).name}")
+        else:
+            audio = np.asarray(audio, dtype=np.float32)
+            print(f"[Whisper] Transcribing: {len(audio) / SAMPLE_RATE:.1f}s in memory")
         start_time = time.time()
         
         # Default optimized parameters
@@ -170,7 +206,7 @@ class WhisperClient:
         
         try:
             segments, info = self.model.transcribe(
-                audio_path,
+                audio,
                 language=language,
                 beam_size=beam_size,
                 vad_filter=vad_filter,
@@ -185,21 +221,13 @@ class WhisperClient:
             return transcript, processing_time
             
         except Exception as e:
-            error_msg = str(e).lower()
             # Handle CUDA library errors (cuDNN, cublas, etc.)
-            if ("cudnn" in error_msg or "cuda" in error_msg or "cublas" in error_msg or "library" in error_msg) and self.device == "cuda":
-                print(f"[Whisper] CUDA library error during transcription: {e}")
-                print(f"[Whisper] Reloading model in CPU mode...")
-                
-                # Reload model in CPU mode
-                self.device = "cpu"
-                self.compute_type = "int8"
-                self._is_loaded = False
-                self.load()
+            if self._is_cuda_error(e):
+                self._reload_on_cpu(e)
                 
                 # Retry transcription with CPU
                 segments, info = self.model.transcribe(
-                    audio_path,
+                    audio,
                     language=language,
                     beam_size=beam_size,
                     vad_filter=vad_filter,
@@ -215,6 +243,131 @@ class WhisperClient:
             else:
                 raise
         
+    def _is_cuda_error(self, error: Exception) -> bool:
+        """CUDA library failure (cuDNN, cublas, ...) while running on the GPU"""
+        error_msg = str(error).lower()
+        return self.device == "cuda" and any(
+            keyword in error_msg for keyword in ("cudnn", "cuda", "cublas", "library")
+        )
+    
+    def _reload_on_cpu(self, error: Exception):
+        """Switch to CPU/int8 and reload after a CUDA library error"""
+        print(f"[Whisper] CUDA library error during transcription: {error}")
+        print(f"[Whisper] Reloading model in CPU mode...")
+        self.device = "cpu"
+        self.compute_type = "int8"
+        self._is_loaded = False
+        self.load()
+    
+    def transcribe_batch(
+        self,
+        segments: List[Union[str, np.ndarray]],
+        batch_size: int = 8,
+        language: str = "vi",
+        beam_size: int = 5,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        **kwargs
+    ) -> Tuple[List[str], float]:
+        """
+        Transcribe many segments with faster-whisper's batched pipeline
+        
+        Segments are concatenated and each one is split into <=30s clips
+        passed as clip_timestamps, so a batch never mixes audio across clip
+        boundaries and every decoded clip maps back to its segment. Falls
+        back to one transcribe() call per segment when batch_size is 1 or
+        BatchedInferencePipeline is unavailable (faster-whisper < 1.1). Like
+        transcribe(), a CUDA library error reloads the model on CPU and the
+        batch is decoded again there.
+        
+        Args:
+            segments: Paths or 16kHz mono float32 arrays
+            batch_size: Clips decoded per forward pass
+            language: Language code (vi for Vietnamese)
+            beam_size: Beam size for decoding
+            progress_callback: Called with (segments_done, total) in the
+                per-segment fallback, (clips_done, total) when batched
+            **kwargs: Additional transcription parameters
+            
+        Returns:
+            Tuple of (per-segment transcripts in input order, processing_time)
+        """
+        if not self._is_loaded:
+            self.load()
+        start_time = time.time()
+        
+        arrays = []
+        for segment in segments:
+            if isinstance(segment, str):
+                from faster_whisper import decode_audio
+                segment = decode_audio(segment, sampling_rate=SAMPLE_RATE)
+            arrays.append(np.asarray(segment, dtype=np.float32))
+        
+        try:
+            from faster_whisper import BatchedInferencePipeline
+        except ImportError:
+            BatchedInferencePipeline = None
+        
+        if batch_size <= 1 or BatchedInferencePipeline is None:
+            transcripts = []
+            for i, samples in enumerate(arrays):
+                text, _ = self.transcribe(samples, language=language, beam_size=beam_size, **kwargs)
+                transcripts.append(text.strip())
+                if progress_callback:
+                    progress_callback(i + 1, len(arrays))
+            return transcripts, time.time() - start_time
+        
+        # One clip per <=30s window of each segment, in sample offsets of the concatenation
+        window = 30 * SAMPLE_RATE
+        clips, owners, offset = [], [], 0
+        for i, samples in enumerate(arrays):
+            for clip_start in range(0, len(samples), window):
+                clip_end = min(clip_start + window, len(samples))
+                clips.append({"start": offset + clip_start, "end": offset + clip_end})
+                owners.append(i)
+            offset += len(samples)
+        
+        def decode_clips():
+            parts = [[] for _ in arrays]
+            if self._batched is None:
+                self._batched = BatchedInferencePipeline(model=self.model)
+            print(f"[Whisper] Batched: {len(arrays)} segments, {len(clips)} clips, batch {batch_size} on {self.device}")
+            clip_starts = [clip["start"] / SAMPLE_RATE for clip in clips]
+            scale = 1 / SAMPLE_RATE if clip_timestamps_in_seconds() else 1
+            params = {"temperature": 0.0, "without_timestamps": True, **kwargs}
+            results, _ = self._batched.transcribe(
+                np.concatenate(arrays),
+                language=language,
+                beam_size=beam_size,
+                batch_size=batch_size,
+                vad_filter=False,
+                clip_timestamps=[{k: v * scale for k, v in clip.items()} for clip in clips],
+                **params
+            )
+            # results is lazy: CUDA errors surface while iterating
+            for done, result in enumerate(results, start=1):
+                # Clip whose window contains the decoded segment's start
+                owner = owners[max(0, bisect_right(clip_starts, result.start + 1e-3) - 1)]
+                parts[owner].append(result.text.strip())
+                if progress_callback:
+                    progress_callback(min(done, len(clips)), len(clips))
+            return parts
+        
+        parts = [[] for _ in arrays]
+        if clips:
+            try:
+                parts = decode_clips()
+            except Exception as e:
+                if not self._is_cuda_error(e):
+                    raise
+                # load() drops the GPU pipeline, so decode_clips rebuilds it on CPU
+                self._reload_on_cpu(e)
+                parts = decode_clips()
+        
+        transcripts = [" ".join(p for p in segment_parts if p) for segment_parts in parts]
+        processing_time = time.time() - start_time
+        print(f"[Whisper] Batch completed in {processing_time:.2f}s")
+        return transcripts, processing_time
+        
     def save_result(self, transcript: str, output_path: str):
         """Save transcript to file"""
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,225 @@
+"""
+Concurrent Dual-ASR Scheduler for VistralS2T
+Runs Whisper and PhoWhisper side by side on disjoint CPU thread budgets
+
+The dual pipelines used to run Whisper over every segment and only then
+start PhoWhisper. On a CPU-only host neither model keeps every core busy
+(autoregressive decoding is mostly sequential), so the scheduler gives each
+model its own worker thread:
+
+- Whisper (CTranslate2) gets cpu_threads when the model is constructed
+  (see WhisperClient and the model registry factory)
+- PhoWhisper (PyTorch) runs on torch's intra-op pool, sized once at startup
+  by configure_torch_threads(); torch.set_num_threads() is process-wide, so
+  it is never changed per job
+
+In concurrent mode the two budgets are disjoint (PhoWhisper half the cores,
+Whisper the rest) so running both never asks for more threads than cores.
+The resident Whisper keeps its share for Whisper-only calls too, since
+CTranslate2 cannot resize its pool; S2T_DUAL_CONCURRENT=false gives both
+models every core.
+
+Segments are fed to each model in groups of batch_size. As soon as both
+models have produced a segment's text, on_segment(index, whisper_text,
+phowhisper_text) runs, so fusion overlaps with the remaining transcription.
+
+Environment:
+    S2T_DUAL_CONCURRENT     run both models at once (default true)
+    S2T_WHISPER_THREADS     Whisper threads (default: the cores PhoWhisper does not get)
+    S2T_PHOWHISPER_THREADS  torch threads when concurrent (default: half of the cores)
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DUAL_CONCURRENT = os.getenv("S2T_DUAL_CONCURRENT", "true").lower() == "true"
+
+# (segments) -> one transcript per segment
+BatchTranscriber = Callable[[List[Any]], List[str]]
+
+
+_torch_configured = False
+_torch_lock = threading.Lock()
+
+
+def thread_budget(total: Optional[int] = None, concurrent: Optional[bool] = None) -> Dict[str, int]:
+    """
+    Threads for Whisper and for PhoWhisper
+
+    Concurrent budgets split the cores (S2T_*_THREADS override either side,
+    the other gets the remainder); serial runs give each model every core.
+    """
+    total = total or os.cpu_count() or 1
+    concurrent = DUAL_CONCURRENT if concurrent is None else concurrent
+    whisper = int(os.getenv("S2T_WHISPER_THREADS", "0"))
+    if not concurrent:
+        return {"whisper": whisper or total, "phowhisper": total}
+    phowhisper = int(os.getenv("S2T_PHOWHISPER_THREADS", "0"))
+    if not phowhisper:
+        phowhisper = max(1, total - whisper) if whisper else max(1, total // 2)
+    if not whisper:
+        whisper = max(1, total - phowhisper)
+    return {"whisper": whisper, "phowhisper": phowhisper}
+
+
+def configure_torch_threads(concurrent: Optional[bool] = None) -> Optional[int]:
+    """
+    Size torch's intra-op pool once per process
+
+    Concurrent mode leaves PhoWhisper its thread_budget() share so it does
+    not contend with Whisper for every core; serial mode uses all of them.
+    Later calls are no-ops. Returns the thread count set (None if torch is
+    missing or it was already configured).
+    """
+    global _torch_configured
+    with _torch_lock:
+        if _torch_configured:
+            return None
+        _torch_configured = True
+        try:
+            import torch
+        except ImportError:
+            return None
+        num_threads = thread_budget(concurrent=concurrent)["phowhisper"]
+        torch.set_num_threads(num_threads)
+        logger.info(f"[DUAL] torch intra-op threads: {num_threads}")
+        return num_threads
+
+
+@dataclass
+class DualASRResult:
+    """Per-segment transcripts from both models"""
+    whisper: List[str]
+    phowhisper: List[str]
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+class _Joiner:
+    """Collects both models' texts and fires on_segment once per segment"""
+
+    def __init__(self, count: int, on_segment: Optional[Callable[[int, str, str], None]]):
+        self.texts: Dict[str, List[Optional[str]]] = {
+            "whisper": [None] * count,
+            "phowhisper": [None] * count,
+        }
+        self.fused = [False] * count
+        self.on_segment = on_segment
+        self._lock = threading.Lock()
+
+    def put(self, model: str, start: int, texts: List[str]):
+        ready = []
+        with self._lock:
+            self.texts[model][start:start + len(texts)] = texts
+            for i in range(start, start + len(texts)):
+                if not self.fused[i] and self.texts["whisper"][i] is not None \
+                        and self.texts["phowhisper"][i] is not None:
+                    self.fused[i] = True
+                    ready.append((i, self.texts["whisper"][i], self.texts["phowhisper"][i]))
+        if self.on_segment:
+            for i, whisper_text, phowhisper_text in ready:
+                self.on_segment(i, whisper_text, phowhisper_text)
+
+
+def run_dual_asr(
+    segments: Sequence[Any],
+    whisper: BatchTranscriber,
+    phowhisper: BatchTranscriber,
+    on_segment: Optional[Callable[[int, str, str], None]] = None,
+    batch_size: int = 8,
+    concurrent: Optional[bool] = None,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+) -> DualASRResult:
+    """
+    Transcribe segments with both models and join the results per segment
+
+    A Whisper failure is raised (after stopping PhoWhisper at its next
+    group); a PhoWhisper failure is recorded in errors and the Whisper text
+    is used for the segments it did not finish.
+
+    Args:
+        segments: Audio segments (arrays or paths) passed through to the models
+        whisper: Transcribes a list of segments with Whisper
+        phowhisper: Transcribes a list of segments with PhoWhisper
+        on_segment: Called with (index, whisper_text, phowhisper_text) as
+            soon as both are known; may run on either worker thread
+        batch_size: Segments handed to a model per call
+        concurrent: Run both models at once (default: S2T_DUAL_CONCURRENT)
+        progress_callback: Called with (model, segments_done, total)
+
+    Returns:
+        DualASRResult with transcripts in input order and per-model timings
+    """
+    concurrent = DUAL_CONCURRENT if concurrent is None else concurrent
+    total = len(segments)
+    joiner = _Joiner(total, on_segment)
+    stop = threading.Event()
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+
+    def run(model: str, transcribe: BatchTranscriber):
+        start = time.time()
+        try:
+            for offset in range(0, total, batch_size):
+                if stop.is_set():
+                    return
+                group = list(segments[offset:offset + batch_size])
+                texts = [text.strip() for text in transcribe(group)]
+                if len(texts) != len(group):
+                    raise RuntimeError(f"{model} returned {len(texts)} transcripts for {len(group)} segments")
+                joiner.put(model, offset, texts)
+                if progress_callback:
+                    progress_callback(model, offset + len(group), total)
+        except Exception:
+            if model == "whisper":
+                stop.set()
+            raise
+        finally:
+            timings[model] = time.time() - start
+
+    start = time.time()
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="dual-asr") as pool:
+            futures = {
+                "whisper": pool.submit(run, "whisper", whisper),
+                "phowhisper": pool.submit(run, "phowhisper", phowhisper),
+            }
+        outcome = {model: future.exception() for model, future in futures.items()}
+    else:
+        outcome = {}
+        for model, transcribe in (("whisper", whisper), ("phowhisper", phowhisper)):
+            try:
+                run(model, transcribe)
+                outcome[model] = None
+            except Exception as e:
+                outcome[model] = e
+                if model == "whisper":
+                    break
+    timings["total"] = time.time() - start
+
+    if outcome.get("whisper") is not None:
+        raise outcome["whisper"]
+    if outcome.get("phowhisper") is not None:
+        errors["phowhisper"] = str(outcome["phowhisper"])
+        logger.warning(f"[DUAL] PhoWhisper failed, using Whisper text: {outcome['phowhisper']}")
+        whisper_texts = joiner.texts["whisper"]
+        missing = [i for i, text in enumerate(joiner.texts["phowhisper"]) if text is None]
+        for i in missing:
+            joiner.put("phowhisper", i, [whisper_texts[i]])
+
+    busy = timings.get("whisper", 0.0) + timings.get("phowhisper", 0.0)
+    logger.info(f"[DUAL] {total} segments in {timings['total']:.2f}s "
+                f"({'concurrent' if concurrent else 'serial'}, model time {busy:.2f}s)")
+    return DualASRResult(
+        whisper=list(joiner.texts["whisper"]),
+        phowhisper=list(joiner.texts["phowhisper"]),
+        timings=timings,
+        errors=errors,
+    )
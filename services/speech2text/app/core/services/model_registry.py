@@ -0,0 +1,329 @@
+"""
+Resident Model Registry for VistralS2T
+Keeps diarization/Whisper/PhoWhisper loaded between requests
+
+Loading Whisper large-v3, PhoWhisper-large and the pyannote pipeline takes
+tens of seconds, and the web UI used to construct and load all three for
+every upload. The registry loads each model once per process:
+
+- use(name) leases a loaded model (reference counted); the first lease
+  loads it, concurrent leases wait for that single load
+- a RAM budget (S2T_MODEL_BUDGET_MB) bounds the declared size of resident
+  models; idle models are unloaded least-recently-used first via the
+  client's unload() (or by dropping the reference when it has none)
+- prewarm() loads models in a background thread at startup
+- get_stats() reports load / resident / idle time per model
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+LOADED = "loaded"
+
+# Approximate resident size (MB) on CPU: Whisper int8, PhoWhisper float32
+DEFAULT_MODEL_SIZES_MB = {
+    "diarization": 600,
+    "whisper": 1700,
+    "phowhisper": 6200,
+}
+
+
+@dataclass
+class _Entry:
+    name: str
+    factory: Callable[[], Any]
+    size_mb: float
+    unload: Optional[Callable[[Any], None]] = None
+    model: Any = None
+    state: str = UNLOADED
+    refs: int = 0
+    loads: int = 0
+    hits: int = 0
+    evictions: int = 0
+    load_seconds: float = 0.0
+    total_load_seconds: float = 0.0
+    loaded_at: float = 0.0
+    last_used: float = 0.0
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of heavyweight models
+
+    Models are registered with a factory returning an unloaded client; the
+    registry calls its load() method and keeps the instance until it is
+    evicted for space or unloaded explicitly.
+    """
+
+    def __init__(self, budget_mb: float = 10240):
+        """
+        Initialize registry
+
+        Args:
+            budget_mb: Total declared size of resident models, in MB
+        """
+        self.budget_mb = budget_mb
+        self._entries: Dict[str, _Entry] = {}
+        self._cond = threading.Condition()
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        size_mb: float,
+        unload: Optional[Callable[[Any], None]] = None,
+    ):
+        """
+        Register a model
+
+        Args:
+            name: Registry key (e.g. "whisper")
+            factory: Returns a client; its load() is called by the registry
+            size_mb: Approximate resident size, counted against the budget
+            unload: Releases the model (default: the client's unload() if any)
+        """
+        with self._cond:
+            if name in self._entries and self._entries[name].state != UNLOADED:
+                raise ValueError(f"Model {name} is loaded and cannot be re-registered")
+            self._entries[name] = _Entry(name=name, factory=factory, size_mb=size_mb, unload=unload)
+
+    def names(self) -> List[str]:
+        with self._cond:
+            return list(self._entries)
+
+    def _entry(self, name: str) -> _Entry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"Unknown model: {name}. Registered: {', '.join(self._entries)}") from None
+
+    def _used_mb(self, exclude: Optional[_Entry] = None) -> float:
+        return sum(e.size_mb for e in self._entries.values() if e.state != UNLOADED and e is not exclude)
+
+    def _evict(self, entry: _Entry) -> Tuple[_Entry, Any]:
+        """Mark an idle entry unloaded (caller holds the lock); returns what to release"""
+        model = entry.model
+        entry.model = None
+        entry.state = UNLOADED
+        entry.evictions += 1
+        return entry, model
+
+    def _make_room(self, size_mb: float, exclude: Optional[_Entry] = None) -> List[Tuple[_Entry, Any]]:
+        """Evict idle models, least recently used first, until size_mb fits the budget"""
+        victims = []
+        used = self._used_mb(exclude)
+        idle = sorted(
+            (e for e in self._entries.values() if e.state == LOADED and e.refs == 0 and e is not exclude),
+            key=lambda e: e.last_used,
+        )
+        while used + size_mb > self.budget_mb and idle:
+            victim = idle.pop(0)
+            used -= victim.size_mb
+            victims.append(self._evict(victim))
+        if used + size_mb > self.budget_mb:
+            logger.warning(f"[REGISTRY] Over budget: {used + size_mb:.0f}/{self.budget_mb:.0f} MB (models in use)")
+        return victims
+
+    def _release_models(self, victims: List[Tuple[_Entry, Any]]):
+        """Unload evicted models outside the lock"""
+        for entry, model in victims:
+            try:
+                if entry.unload is not None:
+                    entry.unload(model)
+                elif callable(getattr(model, "unload", None)):
+                    model.unload()
+            except Exception as e:
+                logger.warning(f"[REGISTRY] Unloading {entry.name} failed: {e}")
+            del model
+            logger.info(f"[REGISTRY] Unloaded {entry.name} ({entry.size_mb:.0f} MB)")
+        if victims:
+            gc.collect()
+
+    def acquire(self, name: str) -> Any:
+        """Lease a loaded model, loading it if needed; pair with release()"""
+        with self._cond:
+            entry = self._entry(name)
+            while entry.state == LOADING:
+                self._cond.wait()
+            entry.refs += 1
+            if entry.state == LOADED:
+                entry.hits += 1
+                entry.last_used = time.time()
+                return entry.model
+            entry.state = LOADING
+            victims = self._make_room(entry.size_mb, exclude=entry)
+
+        self._release_models(victims)
+        start = time.time()
+        try:
+            model = entry.factory()
+            load = getattr(model, "load", None)
+            if callable(load):
+                load()
+        except BaseException:
+            with self._cond:
+                entry.refs -= 1
+                entry.state = UNLOADED
+                self._cond.notify_all()
+            raise
+        elapsed = time.time() - start
+
+        with self._cond:
+            entry.model = model
+            entry.state = LOADED
+            entry.loads += 1
+            entry.load_seconds = elapsed
+            entry.total_load_seconds += elapsed
+            entry.loaded_at = entry.last_used = time.time()
+            self._cond.notify_all()
+        logger.info(f"[REGISTRY] Loaded {name} in {elapsed:.2f}s")
+        return model
+
+    def release(self, name: str):
+        """End a lease; idle models over the budget are unloaded"""
+        with self._cond:
+            entry = self._entry(name)
+            if entry.refs <= 0:
+                raise RuntimeError(f"Model {name} released more often than acquired")
+            entry.refs -= 1
+            entry.last_used = time.time()
+            victims = self._make_room(0) if entry.refs == 0 else []
+        self._release_models(victims)
+
+    @contextmanager
+    def use(self, name: str) -> Iterator[Any]:
+        """Context manager around acquire()/release()"""
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def unload(self, name: str) -> bool:
+        """Unload an idle model now; returns False if it is not loaded or in use"""
+        with self._cond:
+            entry = self._entry(name)
+            if entry.state != LOADED or entry.refs:
+                return False
+            victims = [self._evict(entry)]
+        self._release_models(victims)
+        return True
+
+    def prewarm(self, names: Optional[List[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Load models ahead of the first request
+
+        Models that would not fit the budget next to the ones already
+        resident are skipped rather than evicting anything. Failures are
+        logged; the model is then loaded on first use instead.
+        """
+        names = self.names() if names is None else names
+
+        def run():
+            for name in names:
+                with self._cond:
+                    entry = self._entries.get(name)
+                    if entry is None or entry.state != UNLOADED:
+                        continue
+                    if self._used_mb() + entry.size_mb > self.budget_mb:
+                        logger.info(f"[REGISTRY] Skipping prewarm of {name}: over budget")
+                        continue
+                try:
+                    self.acquire(name)
+                    self.release(name)
+                except Exception as e:
+                    logger.warning(f"[REGISTRY] Prewarm of {name} failed: {e}")
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="model-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-model state plus load / resident / idle seconds"""
+        now = time.time()
+        with self._cond:
+            models = {}
+            for entry in self._entries.values():
+                loaded = entry.state == LOADED
+                models[entry.name] = {
+                    "state": entry.state,
+                    "refs": entry.refs,
+                    "size_mb": entry.size_mb,
+                    "loads": entry.loads,
+                    "hits": entry.hits,
+                    "evictions": entry.evictions,
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "total_load_seconds": round(entry.total_load_seconds, 3),
+                    "resident_seconds": round(now - entry.loaded_at, 3) if loaded else 0.0,
+                    "idle_seconds": round(now - entry.last_used, 3) if loaded and not entry.refs else 0.0,
+                }
+            return {
+                "budget_mb": self.budget_mb,
+                "used_mb": self._used_mb(),
+                "models": models,
+            }
+
+
+def _diarization_factory():
+    from ..llm import SpeakerDiarizationClient
+    return SpeakerDiarizationClient(min_speakers=2, max_speakers=5)
+
+
+def _whisper_factory():
+    from ..llm import WhisperClient
+    from .dual_scheduler import thread_budget
+    # CTranslate2 fixes its thread count at construction: in concurrent mode
+    # Whisper keeps the cores PhoWhisper's torch pool does not use
+    return WhisperClient(model_name=os.getenv("S2T_WHISPER_MODEL", "large-v3"),
+                         cpu_threads=thread_budget()["whisper"])
+
+
+def _phowhisper_factory():
+    from ..llm import PhoWhisperClient
+    return PhoWhisperClient()
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Shared registry with the diarization, Whisper and PhoWhisper clients"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                # torch's pool is process-wide: size it once, before any model runs
+                from .dual_scheduler import configure_torch_threads
+                configure_torch_threads()
+                registry = ModelRegistry(budget_mb=float(os.getenv("S2T_MODEL_BUDGET_MB", "10240")))
+                for name, factory in (
+                    ("diarization", _diarization_factory),
+                    ("whisper", _whisper_factory),
+                    ("phowhisper", _phowhisper_factory),
+                ):
+                    size = float(os.getenv(f"S2T_{name.upper()}_SIZE_MB", DEFAULT_MODEL_SIZES_MB[name]))
+                    registry.register(name, factory, size)
+                _registry = registry
+    return _registry
+
+
+def prewarm_models(default: str = "whisper,phowhisper,diarization") -> Optional[threading.Thread]:
+    """Background prewarm of S2T_PREWARM_MODELS (comma separated, else ``default``; empty disables)"""
+    names = [n.strip() for n in os.getenv("S2T_PREWARM_MODELS", default).split(",") if n.strip()]
+    if not names:
+        return None
+    return get_model_registry().prewarm(names)
@@ -0,0 +1,111 @@
+"""
+Dual-model Transcription Service for VistralS2T
+Whisper + PhoWhisper on models leased from the resident registry
+
+Backs the "smart" and "fast" models of the REST API (api/main.py). The
+run_dual_smart / run_dual_fast scripts load both models at import time and
+run on AUDIO_PATH; this service reuses the registry's warm models instead
+and runs Whisper and PhoWhisper concurrently (see dual_scheduler). Results are
+cached on the decoded audio, mode and Whisper model (see utils.cache).
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from ..utils.cache import ResultCache, get_result_cache
+from .dual_scheduler import run_dual_asr
+from .model_registry import ModelRegistry, get_model_registry
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Fast mode skips PhoWhisper above this duration (same rule as run_dual_fast)
+FAST_PHOWHISPER_MAX_SECONDS = 60
+
+MODES = {
+    "smart": {"beam_size": 5, "vad_filter": False},
+    "fast": {"beam_size": 3, "vad_filter": True},
+}
+
+
+def fuse_transcripts(whisper_text: str, phowhisper_text: str) -> str:
+    """Prefer PhoWhisper (Vietnamese-tuned) unless it is empty or much shorter than Whisper"""
+    whisper_text = whisper_text.strip()
+    phowhisper_text = phowhisper_text.strip()
+    if not phowhisper_text or len(phowhisper_text) < len(whisper_text) / 2:
+        return whisper_text
+    return phowhisper_text
+
+
+def dual_transcribe(
+    audio_path: str,
+    mode: str = "smart",
+    language: str = "vi",
+    registry: Optional[ModelRegistry] = None,
+    cache: Optional[ResultCache] = None,
+) -> Dict[str, Any]:
+    """
+    Transcribe with Whisper and PhoWhisper and fuse the results
+
+    Args:
+        audio_path: Path to audio file
+        mode: "smart" (beam 5, always both models) or "fast" (beam 3, VAD,
+            PhoWhisper skipped for audio over 60s)
+        language: Language code for Whisper
+        registry: Model registry (default: the process-wide one)
+        cache: Result cache keyed by the decoded audio (default: the shared one)
+
+    Returns:
+        Dict with whisper/phowhisper/fused transcripts and timings
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}. Available: {', '.join(MODES)}")
+    registry = registry or get_model_registry()
+    cache = cache or get_result_cache()
+    timings = {}
+
+    # Decode once; both models take the in-memory samples
+    import librosa
+    start = time.time()
+    audio, sr = librosa.load(audio_path, sr=SAMPLE_RATE)
+    timings["decode"] = time.time() - start
+
+    cache_params = {**MODES[mode], "whisper_model": os.getenv("S2T_WHISPER_MODEL", "large-v3")}
+    cached = cache.get(audio, f"dual-{mode}", language=language, params=cache_params, sample_rate=sr)
+    if cached is not None:
+        return {**cached["result"], "timings": timings, "cached": True}
+
+    def transcribe_whisper(batch):
+        with registry.use("whisper") as whisper:
+            return [whisper.transcribe(samples, language=language, **MODES[mode])[0] for samples in batch]
+
+    def transcribe_phowhisper(batch):
+        with registry.use("phowhisper") as phowhisper:
+            return [phowhisper.transcribe(samples, sample_rate=sr)[0] for samples in batch]
+
+    if mode == "fast" and len(audio) / sr > FAST_PHOWHISPER_MAX_SECONDS:
+        start = time.time()
+        whisper_text = phowhisper_text = transcribe_whisper([audio])[0].strip()
+        timings["whisper"] = time.time() - start
+        timings["phowhisper"] = 0.0
+        errors = {}
+    else:
+        # Both models run at once on separate core budgets
+        asr = run_dual_asr([audio], transcribe_whisper, transcribe_phowhisper)
+        whisper_text, phowhisper_text = asr.whisper[0], asr.phowhisper[0]
+        timings.update(asr.timings)
+        timings["asr_wall"] = timings.pop("total")
+        errors = asr.errors
+
+    result = {
+        "model": mode,
+        "whisper_transcript": whisper_text.strip(),
+        "phowhisper_transcript": phowhisper_text.strip(),
+        "transcript": fuse_transcripts(whisper_text, phowhisper_text),
+    }
+    if not errors:  # never pin a Whisper fallback in place of PhoWhisper
+        cache.set(audio, f"dual-{mode}", result, language=language, params=cache_params, sample_rate=sr)
+    return {**result, "timings": timings, "cached": False}
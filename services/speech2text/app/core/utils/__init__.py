@@ -7,13 +7,15 @@ from .audio_utils import (
     split_audio_chunks,
     save_audio,
 )
-from .cache import cache_result, get_cached_result, clear_cache
+from .cache import ResultCache, get_result_cache, cache_result, get_cached_result, clear_cache
 from .logger import setup_logger, get_logger
 
 __all__ = [
     "preprocess_audio",
     "split_audio_chunks", 
     "save_audio",
+    "ResultCache",
+    "get_result_cache",
     "cache_result",
     "get_cached_result",
     "clear_cache",
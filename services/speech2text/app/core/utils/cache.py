@@ -1,136 +1,535 @@
 """
 Caching Utilities for VistralS2T
-Simple file-based caching for transcripts and results
+Content-addressed, size-bounded cache for transcripts and results
+
+Two levels share one store:
+
+- file results: keyed by a SHA-256 of the decoded audio (hashed block by
+  block while streaming, never on the file path) plus model name, language
+  and decoding parameters, so a re-uploaded copy hits and a different file
+  saved under the same name does not
+- segment transcripts: keyed by a hash of the segment's samples plus the
+  same model/language/params, so re-running with other diarization settings
+  only transcribes segments that were not seen before
+
+Entries are appended to data.jsonl; index.json maps each key to its offset
+and is kept in least-recently-used order. Once the live entries exceed
+max_bytes the oldest are dropped, and the data file is compacted when most
+of it is dead.
+
+The web UI and the API share the cache directory, so every access holds an
+exclusive flock on cache.lock and reloads the index when another process
+has changed data.jsonl since this one last saw it.
 """
 
-import json
 import hashlib
-from pathlib import Path
-from typing import Optional, Any, Dict
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per cache dir, the thread lock is enough
+    fcntl = None
+
+AudioInput = Union[str, os.PathLike, np.ndarray]
+
+# Samples hashed per update (1M float32 samples = 4 MB)
+HASH_BLOCK_SAMPLES = 1 << 20
+
+# Index writes are batched; a crash only loses LRU recency, never entries
+INDEX_FLUSH_EVERY = 50
+
+# Memoized path -> content hash entries (LRU)
+FILE_HASH_MEMO = 1024
+
+# Per-entry files of the path-keyed cache this one replaced (md5 hex names)
+LEGACY_ENTRY = re.compile(r"^[0-9a-f]{32}\.json$")
+
+FILE = "file"
+SEGMENT = "segment"
+
+
+def hash_samples(samples: np.ndarray, sample_rate: Optional[int] = None) -> str:
+    """SHA-256 of float32 samples, fed in blocks (no copy for float32 input)"""
+    digest = hashlib.sha256()
+    if sample_rate:
+        digest.update(f"sr={sample_rate};".encode())
+    samples = np.ascontiguousarray(samples, dtype=np.float32).reshape(-1)
+    for start in range(0, len(samples), HASH_BLOCK_SAMPLES):
+        digest.update(memoryview(samples[start:start + HASH_BLOCK_SAMPLES]))
+    return digest.hexdigest()
+
+
+def hash_audio_file(audio_path: Union[str, os.PathLike]) -> str:
+    """
+    SHA-256 of an audio file's decoded samples, streamed block by block
+
+    Formats soundfile cannot decode are hashed on their raw bytes instead.
+    """
+    import soundfile as sf
+
+    digest = hashlib.sha256()
+    try:
+        info = sf.info(str(audio_path))
+        digest.update(f"sr={info.samplerate};ch={info.channels};".encode())
+        for block in sf.blocks(str(audio_path), blocksize=HASH_BLOCK_SAMPLES, dtype="float32"):
+            digest.update(memoryview(np.ascontiguousarray(block)))
+        return digest.hexdigest()
+    except Exception:
+        digest = hashlib.sha256(b"raw;")
+        with open(audio_path, "rb") as f:
+            for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def make_cache_key(
+    kind: str,
+    content_hash: str,
+    model_name: str,
+    language: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Cache key from content hash, model, language and decoding params"""
+    key_data = {
+        "kind": kind,
+        "content": content_hash,
+        "model": model_name,
+        "language": language,
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
 
 
 class ResultCache:
     """
-    Simple file-based cache for storing transcription results
+    Disk cache for transcription results with an LRU index
+
+    Thread-safe, and safe across processes sharing cache_dir (flock).
     """
-    
-    def __init__(self, cache_dir: str = "app/data/cache"):
+
+    def __init__(self, cache_dir: str = "app/data/cache", max_bytes: int = 512 * 1024 * 1024):
         """
         Initialize cache
-        
+
         Args:
-            cache_dir: Directory to store cache files
+            cache_dir: Directory holding data.jsonl and index.json
+            max_bytes: Size bound of live entries in the data file
         """
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        
-    def _get_cache_key(self, audio_path: str, model_name: str) -> str:
-        """Generate cache key from audio path and model name"""
-        key_string = f"{audio_path}:{model_name}"
-        return hashlib.md5(key_string.encode()).hexdigest()
-        
-    def _get_cache_path(self, cache_key: str) -> Path:
-        """Get cache file path for given key"""
-        return self.cache_dir / f"{cache_key}.json"
-        
+        self.max_bytes = max_bytes
+        self.data_path = self.cache_dir / "data.jsonl"
+        self.index_path = self.cache_dir / "index.json"
+        self.lock_path = self.cache_dir / "cache.lock"
+
+        # key -> [offset, length, kind, model_name], least recently used first
+        self._index: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._data_state: Optional[Tuple[int, int]] = None  # (inode, size) the index describes
+        self._file_hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._live = 0  # bytes of the entries in the index
+        self._dirty = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        with self._locked():
+            self._remove_legacy_entries()
+
+    # ---------------------------------------------------------------- locking
+
+    @contextmanager
+    def _locked(self):
+        """Thread lock + exclusive flock on cache.lock (re-entrant), index synced on entry"""
+        with self._lock:
+            if self._lock_file is not None:
+                yield
+                return
+            if fcntl is None:
+                self._sync()
+                yield
+                return
+            self._lock_file = open(self.lock_path, "a")
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                self._sync()
+                yield
+            finally:
+                lock_file, self._lock_file = self._lock_file, None
+                lock_file.close()  # releases the flock
+
+    def _current_data_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.data_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def _sync(self):
+        """Reload the index if data.jsonl changed under another process"""
+        state = self._current_data_state()
+        if state != self._data_state or not self.index_path.exists():
+            self._index.clear()
+            self._live = 0
+            self._dirty = 0
+            self._load_index()
+
+    def _remove_legacy_entries(self):
+        """Delete per-entry JSON files of the old path-keyed cache (their keys cannot be trusted)"""
+        removed = 0
+        for path in self.cache_dir.glob("*.json"):
+            if LEGACY_ENTRY.match(path.name):
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            print(f"[Cache] Removed {removed} legacy cache files")
+
+    # ------------------------------------------------------------------ index
+
+    def _load_index(self):
+        """Read index.json, or rebuild it from data.jsonl if missing or stale"""
+        data_size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("data_size") == data_size:
+                self._index = OrderedDict((key, entry) for key, entry in saved["entries"])
+                self._live = sum(entry[1] for entry in self._index.values())
+                self._data_state = self._current_data_state()
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        if data_size:
+            self._rebuild_index()
+            self._evict()
+        self._flush_index()
+
+    def _rebuild_index(self):
+        """Scan data.jsonl; the last record of a key wins"""
+        self._index.clear()
+        offset = 0
+        with open(self.data_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    entry = [offset, len(line), record["kind"], record["model_name"]]
+                    self._index.pop(record["key"], None)
+                    self._index[record["key"]] = entry
+                except (ValueError, KeyError):
+                    pass  # torn write at the end of the file
+                offset += len(line)
+        self._live = sum(entry[1] for entry in self._index.values())
+        print(f"[Cache] Rebuilt index: {len(self._index)} entries")
+
+    def _flush_index(self):
+        """Write index.json atomically (caller holds the lock)"""
+        data_size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"data_size": data_size, "entries": list(self._index.items())}, f)
+        os.replace(tmp_path, self.index_path)
+        self._data_state = self._current_data_state()
+        self._dirty = 0
+
+    def flush(self):
+        """Persist LRU order now"""
+        with self._locked():
+            if self._dirty:
+                self._flush_index()
+
+    def _evict(self):
+        """Drop least recently used entries over max_bytes; compact if mostly dead"""
+        while self._live > self.max_bytes and self._index:
+            _, entry = self._index.popitem(last=False)
+            self._live -= entry[1]
+            self._evictions += 1
+        data_size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        if data_size > 2 * self._live and data_size > 1024 * 1024:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite data.jsonl with live entries only, in LRU order"""
+        tmp_path = self.data_path.with_suffix(".tmp")
+        offset = 0
+        with open(self.data_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for entry in self._index.values():
+                src.seek(entry[0])
+                line = src.read(entry[1])
+                dst.write(line)
+                entry[0] = offset
+                offset += len(line)
+        os.replace(tmp_path, self.data_path)
+        self._flush_index()
+        print(f"[Cache] Compacted data file to {offset / 1024 / 1024:.1f} MB")
+
+    # ------------------------------------------------------------ raw access
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._locked():
+            entry = self._index.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            try:
+                with open(self.data_path, "rb") as f:
+                    f.seek(entry[0])
+                    record = json.loads(f.read(entry[1]))
+                if record["key"] != key:
+                    raise ValueError("index points at another entry")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[Cache] Error reading cache: {e}")
+                self._live -= self._index.pop(key)[1]
+                self._misses += 1
+                return None
+            self._index.move_to_end(key)
+            self._hits += 1
+            self._dirty += 1
+            if self._dirty >= INDEX_FLUSH_EVERY:
+                self._flush_index()
+            return record
+
+    def _write(self, key: str, kind: str, model_name: str, record: Dict[str, Any], flush: bool = True):
+        record = {"key": key, "kind": kind, "model_name": model_name, **record}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._locked():
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            self._data_state = self._current_data_state()
+            old = self._index.pop(key, None)
+            self._live += len(line) - (old[1] if old else 0)
+            self._index[key] = [offset, len(line), kind, model_name]
+            self._evict()
+            self._dirty += 1
+            if flush:
+                self._flush_index()
+
+    # ----------------------------------------------------------- file level
+
+    def audio_hash(self, audio: AudioInput, sample_rate: Optional[int] = None) -> str:
+        """Content hash of a path (memoized per size/mtime) or of decoded samples"""
+        if isinstance(audio, np.ndarray):
+            return hash_samples(audio, sample_rate)
+        stat = os.stat(audio)
+        memo_key = (os.path.abspath(audio), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._file_hashes.get(memo_key)
+            if digest is not None:
+                self._file_hashes.move_to_end(memo_key)
+                return digest
+        digest = hash_audio_file(audio)
+        with self._lock:
+            self._file_hashes[memo_key] = digest
+            while len(self._file_hashes) > FILE_HASH_MEMO:
+                self._file_hashes.popitem(last=False)
+        return digest
+
     def get(
         self,
-        audio_path: str,
+        audio: AudioInput,
         model_name: str,
+        language: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+        sample_rate: Optional[int] = None,
     ) -> Optional[Dict[str, Any]]:
         """
         Get cached result
-        
+
         Args:
-            audio_path: Path to audio file
+            audio: Audio file path or decoded samples
             model_name: Name of model used
-            
+            language: Transcription language
+            params: Decoding parameters (beam size, VAD, ...)
+            sample_rate: Sample rate of in-memory samples
+
         Returns:
             Cached result dictionary or None if not found
         """
-        cache_key = self._get_cache_key(audio_path, model_name)
-        cache_path = self._get_cache_path(cache_key)
-        
-        if not cache_path.exists():
-            return None
-            
-        try:
-            with open(cache_path, "r", encoding="utf-8") as f:
-                cached_data = json.load(f)
-            
-            print(f"[Cache] HIT: {model_name} for {Path(audio_path).name}")
-            return cached_data
-            
-        except Exception as e:
-            print(f"[Cache] Error reading cache: {e}")
-            return None
-            
+        key = make_cache_key(FILE, self.audio_hash(audio, sample_rate), model_name, language, params)
+        record = self._read(key)
+        if record is not None:
+            name = Path(audio).name if not isinstance(audio, np.ndarray) else "in-memory audio"
+            print(f"[Cache] HIT: {model_name} for {name}")
+        return record
+
     def set(
         self,
-        audio_path: str,
+        audio: AudioInput,
         model_name: str,
-        result: str,
+        result: Any,
         metadata: Optional[Dict[str, Any]] = None,
+        language: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+        sample_rate: Optional[int] = None,
     ):
         """
         Store result in cache
-        
+
         Args:
-            audio_path: Path to audio file
+            audio: Audio file path or decoded samples
             model_name: Name of model used
-            result: Transcription result
+            result: Transcription result (JSON serializable)
             metadata: Optional metadata to store
+            language: Transcription language
+            params: Decoding parameters (beam size, VAD, ...)
+            sample_rate: Sample rate of in-memory samples
         """
-        cache_key = self._get_cache_key(audio_path, model_name)
-        cache_path = self._get_cache_path(cache_key)
-        
-        cache_data = {
-            "audio_path": audio_path,
-            "model_name": model_name,
+        key = make_cache_key(FILE, self.audio_hash(audio, sample_rate), model_name, language, params)
+        record = {
+            "audio_path": None if isinstance(audio, np.ndarray) else str(audio),
             "result": result,
             "timestamp": datetime.now().isoformat(),
             "metadata": metadata or {},
         }
-        
         try:
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"[Cache] STORED: {model_name} for {Path(audio_path).name}")
-            
+            self._write(key, FILE, model_name, record)
+            print(f"[Cache] STORED: {model_name} for {record['audio_path'] or 'in-memory audio'}")
         except Exception as e:
             print(f"[Cache] Error writing cache: {e}")
-            
+
+    # -------------------------------------------------------- segment level
+
+    def get_segment(
+        self,
+        samples: np.ndarray,
+        model_name: str,
+        language: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """Cached transcript of one segment (keyed by its samples), or None"""
+        key = make_cache_key(SEGMENT, hash_samples(samples), model_name, language, params)
+        record = self._read(key)
+        return record["text"] if record is not None else None
+
+    def set_segment(
+        self,
+        samples: np.ndarray,
+        model_name: str,
+        text: str,
+        language: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ):
+        """Store the transcript of one segment"""
+        key = make_cache_key(SEGMENT, hash_samples(samples), model_name, language, params)
+        try:
+            self._write(key, SEGMENT, model_name, {"text": text}, flush=False)
+        except Exception as e:
+            print(f"[Cache] Error writing cache: {e}")
+
+    def transcribe_segments(
+        self,
+        segments: Sequence[np.ndarray],
+        transcribe: Callable[[List[np.ndarray]], List[str]],
+        model_name: str,
+        language: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """
+        Transcribe only the segments not cached yet
+
+        Args:
+            segments: Segment samples
+            transcribe: Transcribes a list of segments (called once, with the misses)
+            model_name: Name of model used
+            language: Transcription language
+            params: Decoding parameters
+
+        Returns:
+            One transcript per segment, in input order
+        """
+        hashes = [hash_samples(samples) for samples in segments]
+        keys = [make_cache_key(SEGMENT, h, model_name, language, params) for h in hashes]
+        texts: List[Optional[str]] = []
+        for key in keys:
+            record = self._read(key)
+            texts.append(record["text"] if record is not None else None)
+
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if missing:
+            results = transcribe([segments[i] for i in missing])
+            with self._locked():
+                for i, text in zip(missing, results):
+                    texts[i] = text
+                    self._write(keys[i], SEGMENT, model_name, {"text": text}, flush=False)
+                self._flush_index()
+        if len(missing) < len(segments):
+            print(f"[Cache] {model_name}: {len(segments) - len(missing)}/{len(segments)} segments cached")
+        return texts
+
+    # ---------------------------------------------------------- maintenance
+
     def clear(self, model_name: Optional[str] = None):
         """
         Clear cache
-        
+
         Args:
             model_name: Clear only cache for specific model (None = clear all)
         """
-        if model_name is None:
-            # Clear all cache
-            for cache_file in self.cache_dir.glob("*.json"):
-                cache_file.unlink()
-            print("[Cache] Cleared all cache")
-        else:
-            # Clear cache for specific model
-            count = 0
-            for cache_file in self.cache_dir.glob("*.json"):
-                try:
-                    with open(cache_file, "r") as f:
-                        data = json.load(f)
-                    if data.get("model_name") == model_name:
-                        cache_file.unlink()
-                        count += 1
-                except:
-                    pass
-            print(f"[Cache] Cleared {count} cache files for {model_name}")
+        with self._locked():
+            if model_name is None:
+                self._index.clear()
+                self._live = 0
+                if self.data_path.exists():
+                    self.data_path.unlink()
+                self._flush_index()
+                print("[Cache] Cleared all cache")
+            else:
+                keys = [key for key, entry in self._index.items() if entry[3] == model_name]
+                for key in keys:
+                    self._live -= self._index.pop(key)[1]
+                self._evict()
+                self._flush_index()
+                print(f"[Cache] Cleared {len(keys)} entries for {model_name}")
 
+    def get_stats(self) -> Dict[str, Any]:
+        """Entry counts, live/file bytes and hit rate"""
+        with self._locked():
+            kinds: Dict[str, int] = {}
+            for entry in self._index.values():
+                kinds[entry[2]] = kinds.get(entry[2], 0) + 1
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._index),
+                "by_kind": kinds,
+                "live_bytes": self._live,
+                "file_bytes": self.data_path.stat().st_size if self.data_path.exists() else 0,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+            }
 
-# Global cache instance
-_cache = ResultCache()
+
+# Global cache instance (created on first use)
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Shared cache under S2T_CACHE_DIR, bounded by S2T_CACHE_MAX_MB"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    cache_dir=os.getenv("S2T_CACHE_DIR", "app/data/cache"),
+                    max_bytes=int(float(os.getenv("S2T_CACHE_MAX_MB", "512")) * 1024 * 1024),
+                )
+    return _cache
 
 
 # Convenience functions
@@ -139,24 +538,35 @@ def cache_result(
     model_name: str,
     result: str,
     metadata: Optional[Dict[str, Any]] = None,
+    language: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
 ):
     """Cache transcription result"""
-    _cache.set(audio_path, model_name, result, metadata)
+    get_result_cache().set(audio_path, model_name, result, metadata, language=language, params=params)
 
 
-def get_cached_result(audio_path: str, model_name: str) -> Optional[str]:
+def get_cached_result(
+    audio_path: str,
+    model_name: str,
+    language: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
     """Get cached transcription result"""
-    cached = _cache.get(audio_path, model_name)
+    cached = get_result_cache().get(audio_path, model_name, language=language, params=params)
     return cached["result"] if cached else None
 
 
 def clear_cache(model_name: Optional[str] = None):
     """Clear cache"""
-    _cache.clear(model_name)
+    get_result_cache().clear(model_name)
 
 
 __all__ = [
     "ResultCache",
+    "hash_samples",
+    "hash_audio_file",
+    "make_cache_key",
+    "get_result_cache",
     "cache_result",
     "get_cached_result",
     "clear_cache",
@@ -0,0 +1,142 @@
+"""
+Tests for the content-addressed ResultCache
+Run with: pytest app/tests/test_cache.py -v
+"""
+
+import numpy as np
+import pytest
+from app.core.utils.cache import ResultCache
+
+
+@pytest.fixture
+def audio():
+    return np.random.default_rng(0).standard_normal(16000 * 3).astype(np.float32)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(cache_dir=str(tmp_path / "cache"))
+
+
+class TestResultCache:
+    """Test suite for ResultCache"""
+
+    def test_key_follows_content_not_path(self, cache, audio, tmp_path):
+        """Test identical audio hits and different audio at the same path misses"""
+        sf = pytest.importorskip("soundfile")
+        first, copy = tmp_path / "a.wav", tmp_path / "copy.wav"
+        sf.write(first, audio, 16000)
+        sf.write(copy, audio, 16000)
+
+        cache.set(str(first), "whisper", "xin chao")
+        assert cache.get(str(copy), "whisper")["result"] == "xin chao"
+
+        sf.write(first, audio[::-1].copy(), 16000)
+        assert cache.get(str(first), "whisper") is None
+
+    def test_params_and_language_are_part_of_the_key(self, cache, audio):
+        """Test other decoding params or language miss"""
+        cache.set(audio, "whisper", "beam5", language="vi", params={"beam_size": 5}, sample_rate=16000)
+
+        assert cache.get(audio, "whisper", language="vi", params={"beam_size": 5}, sample_rate=16000)
+        assert cache.get(audio, "whisper", language="vi", params={"beam_size": 3}, sample_rate=16000) is None
+        assert cache.get(audio, "whisper", language="en", params={"beam_size": 5}, sample_rate=16000) is None
+        assert cache.get(audio, "phowhisper", language="vi", params={"beam_size": 5}, sample_rate=16000) is None
+
+    def test_only_new_segments_are_transcribed(self, cache, audio):
+        """Test a re-segmentation transcribes just the segments not seen before"""
+        calls = []
+
+        def transcribe(segments):
+            calls.append(len(segments))
+            return [f"len{len(s)}" for s in segments]
+
+        first = [audio[:16000], audio[16000:32000], audio[32000:]]
+        second = [audio[:16000], audio[16000:40000], audio[40000:]]
+        assert cache.transcribe_segments(first, transcribe, "whisper") == ["len16000"] * 3
+        assert cache.transcribe_segments(second, transcribe, "whisper") == ["len16000", "len24000", "len8000"]
+        assert calls == [3, 2]
+        assert cache.get_segment(audio[16000:40000], "whisper") == "len24000"
+
+    def test_lru_eviction_keeps_size_bound(self, tmp_path, audio):
+        """Test least recently used entries are dropped once over max_bytes"""
+        cache = ResultCache(cache_dir=str(tmp_path / "small"), max_bytes=700)
+        segments = [audio[i * 100:(i + 1) * 100] for i in range(4)]
+        cache.set_segment(segments[0], "whisper", "a" * 200)
+        cache.set_segment(segments[1], "whisper", "b" * 200)
+        assert cache.get_segment(segments[0], "whisper")  # now most recent
+        cache.set_segment(segments[2], "whisper", "c" * 200)
+
+        assert cache.get_segment(segments[1], "whisper") is None
+        assert cache.get_segment(segments[0], "whisper") == "a" * 200
+        stats = cache.get_stats()
+        assert stats["live_bytes"] <= 700 and stats["evictions"] == 1
+
+    def test_index_survives_restart_and_rebuilds(self, tmp_path, audio):
+        """Test entries persist via index.json and are recovered without it"""
+        cache_dir = tmp_path / "persist"
+        cache = ResultCache(cache_dir=str(cache_dir))
+        cache.set(audio, "whisper", {"transcript": "mot hai ba"}, sample_rate=16000)
+        cache.set_segment(audio[:800], "phowhisper", "mot")
+        cache.flush()
+        assert sorted(p.name for p in cache_dir.iterdir()) == ["cache.lock", "data.jsonl", "index.json"]
+
+        reopened = ResultCache(cache_dir=str(cache_dir))
+        assert reopened.get(audio, "whisper", sample_rate=16000)["result"] == {"transcript": "mot hai ba"}
+
+        (cache_dir / "index.json").unlink()
+        rebuilt = ResultCache(cache_dir=str(cache_dir))
+        assert rebuilt.get_segment(audio[:800], "phowhisper") == "mot"
+        assert rebuilt.get_stats()["entries"] == 2
+
+    def test_clear_by_model(self, cache, audio):
+        """Test clearing one model keeps the others"""
+        cache.set_segment(audio[:100], "whisper", "w")
+        cache.set_segment(audio[:100], "phowhisper", "p")
+        cache.clear("whisper")
+
+        assert cache.get_segment(audio[:100], "whisper") is None
+        assert cache.get_segment(audio[:100], "phowhisper") == "p"
+        cache.clear()
+        assert cache.get_stats()["entries"] == 0
+
+    def test_processes_sharing_a_directory_see_each_other(self, tmp_path, audio):
+        """Test a second instance (e.g. the API next to the web UI) follows writes and compaction"""
+        cache_dir = tmp_path / "shared"
+        web_ui = ResultCache(cache_dir=str(cache_dir), max_bytes=4096)
+        api = ResultCache(cache_dir=str(cache_dir), max_bytes=4096)
+
+        web_ui.set_segment(audio[:100], "whisper", "mot")
+        assert api.get_segment(audio[:100], "whisper") == "mot"
+        api.set_segment(audio[100:200], "whisper", "hai")
+        assert web_ui.get_segment(audio[100:200], "whisper") == "hai"
+
+        for i in range(100):  # churn past max_bytes so api evicts
+            api.set_segment(audio[200 + i:300 + i], "phowhisper", f"x{i}")
+        with api._locked():
+            api._compact()  # moves every live entry to a new offset
+        assert web_ui.get_segment(audio[299:399], "phowhisper") == "x99"
+        assert web_ui.get_segment(audio[:100], "whisper") is None  # evicted by api
+        assert web_ui.get_stats()["entries"] == api.get_stats()["entries"]
+
+    def test_file_hash_memo_is_bounded(self, cache, audio, tmp_path, monkeypatch):
+        """Test memoized path hashes stay under FILE_HASH_MEMO"""
+        sf = pytest.importorskip("soundfile")
+        from app.core.utils import cache as cache_module
+
+        monkeypatch.setattr(cache_module, "FILE_HASH_MEMO", 3)
+        for i in range(5):
+            path = tmp_path / f"clip{i}.wav"
+            sf.write(path, audio[i * 100:(i + 1) * 100], 16000)
+            cache.audio_hash(str(path))
+        assert len(cache._file_hashes) == 3
+
+    def test_legacy_entry_files_are_removed(self, tmp_path):
+        """Test per-entry JSON files of the old path-keyed cache are deleted on open"""
+        cache_dir = tmp_path / "legacy"
+        cache_dir.mkdir()
+        (cache_dir / ("0123456789abcdef" * 2 + ".json")).write_text('{"result": "old"}')
+        (cache_dir / "notes.json").write_text("{}")
+
+        ResultCache(cache_dir=str(cache_dir))
+        assert sorted(p.name for p in cache_dir.iterdir()) == ["cache.lock", "index.json", "notes.json"]
@@ -0,0 +1,119 @@
+"""
+Tests for the concurrent dual-ASR scheduler
+Run with: pytest app/tests/test_dual_scheduler.py -v
+"""
+
+import threading
+import time
+
+import pytest
+from app.core.services.dual_scheduler import run_dual_asr, thread_budget
+
+
+def fake_model(prefix, delay=0.0, fail_after=None):
+    """Batch transcriber returning '<prefix><segment>' after delay per batch"""
+    calls = []
+
+    def transcribe(batch):
+        if fail_after is not None and len(calls) >= fail_after:
+            raise RuntimeError(f"{prefix} out of memory")
+        calls.append(list(batch))
+        time.sleep(delay)
+        return [f" {prefix}{segment} " for segment in batch]
+
+    transcribe.calls = calls
+    return transcribe
+
+
+class TestDualScheduler:
+    """Test suite for run_dual_asr"""
+
+    def test_results_in_order_and_fused_once(self):
+        """Test every segment is fused exactly once with both texts"""
+        fused = {}
+        lock = threading.Lock()
+
+        def on_segment(i, whisper_text, pho_text):
+            with lock:
+                assert i not in fused
+                fused[i] = (whisper_text, pho_text)
+
+        result = run_dual_asr(list(range(7)), fake_model("w"), fake_model("p"),
+                              on_segment=on_segment, batch_size=3, concurrent=True)
+
+        assert result.whisper == [f"w{i}" for i in range(7)]
+        assert result.phowhisper == [f"p{i}" for i in range(7)]
+        assert fused == {i: (f"w{i}", f"p{i}") for i in range(7)}
+        assert not result.errors
+
+    def test_models_overlap(self):
+        """Test both models run at the same time"""
+        result = run_dual_asr(list(range(4)), fake_model("w", delay=0.1), fake_model("p", delay=0.1),
+                              batch_size=2, concurrent=True)
+        serial = run_dual_asr(list(range(4)), fake_model("w", delay=0.1), fake_model("p", delay=0.1),
+                              batch_size=2, concurrent=False)
+
+        assert result.timings["total"] < 0.35
+        assert serial.timings["total"] >= 0.4
+
+    def test_fusion_starts_before_slower_model_finishes(self):
+        """Test segments are fused while the other model is still running"""
+        fused_at = []
+        start = time.time()
+        result = run_dual_asr(list(range(4)), fake_model("w", delay=0.01), fake_model("p", delay=0.1),
+                              on_segment=lambda i, w, p: fused_at.append(time.time() - start),
+                              batch_size=1, concurrent=True)
+
+        assert len(fused_at) == 4
+        assert fused_at[0] < 0.3 <= result.timings["total"]
+
+    def test_phowhisper_failure_falls_back_to_whisper(self):
+        """Test a PhoWhisper error keeps its finished segments and fills the rest"""
+        fused = {}
+        result = run_dual_asr(list(range(4)), fake_model("w"), fake_model("p", fail_after=1),
+                              on_segment=lambda i, w, p: fused.__setitem__(i, p), batch_size=2)
+
+        assert result.phowhisper == ["p0", "p1", "w2", "w3"]
+        assert fused == {0: "p0", 1: "p1", 2: "w2", 3: "w3"}
+        assert "out of memory" in result.errors["phowhisper"]
+
+    def test_whisper_failure_raises_and_stops_phowhisper(self):
+        """Test a Whisper error is raised and PhoWhisper stops early"""
+        phowhisper = fake_model("p", delay=0.05)
+        with pytest.raises(RuntimeError, match="w out of memory"):
+            run_dual_asr(list(range(20)), fake_model("w", fail_after=0), phowhisper,
+                         batch_size=1, concurrent=True)
+        assert len(phowhisper.calls) < 20
+
+    def test_thread_budget(self, monkeypatch):
+        """Test concurrent budgets are disjoint, serial ones use every core"""
+        monkeypatch.delenv("S2T_WHISPER_THREADS", raising=False)
+        monkeypatch.delenv("S2T_PHOWHISPER_THREADS", raising=False)
+        assert thread_budget(8, concurrent=True) == {"whisper": 4, "phowhisper": 4}
+        assert thread_budget(7, concurrent=True) == {"whisper": 4, "phowhisper": 3}
+        assert thread_budget(1, concurrent=True) == {"whisper": 1, "phowhisper": 1}
+        assert thread_budget(8, concurrent=False) == {"whisper": 8, "phowhisper": 8}
+        monkeypatch.setenv("S2T_WHISPER_THREADS", "6")
+        assert thread_budget(8, concurrent=True) == {"whisper": 6, "phowhisper": 2}
+        monkeypatch.delenv("S2T_WHISPER_THREADS")
+        monkeypatch.setenv("S2T_PHOWHISPER_THREADS", "2")
+        assert thread_budget(8, concurrent=True) == {"whisper": 6, "phowhisper": 2}
+
+    def test_torch_threads_are_set_once(self, monkeypatch):
+        """Test torch is sized once per process and jobs never change it"""
+        import sys
+        import types
+
+        from app.core.services import dual_scheduler
+
+        calls = []
+        fake_torch = types.SimpleNamespace(set_num_threads=calls.append, get_num_threads=lambda: 99)
+        monkeypatch.setitem(sys.modules, "torch", fake_torch)
+        monkeypatch.setattr(dual_scheduler, "_torch_configured", False)
+        monkeypatch.setenv("S2T_PHOWHISPER_THREADS", "3")
+
+        assert dual_scheduler.configure_torch_threads(concurrent=True) == 3
+        assert dual_scheduler.configure_torch_threads(concurrent=False) is None
+        run_dual_asr(list(range(4)), fake_model("w"), fake_model("p"), batch_size=2, concurrent=True)
+        run_dual_asr(list(range(4)), fake_model("w"), fake_model("p"), batch_size=2, concurrent=False)
+        assert calls == [3]
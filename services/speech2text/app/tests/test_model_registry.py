@@ -0,0 +1,129 @@
+"""
+Tests for the resident ModelRegistry
+Run with: pytest app/tests/test_model_registry.py -v
+"""
+
+import threading
+import time
+
+import pytest
+from app.core.services.model_registry import ModelRegistry
+
+
+class FakeClient:
+    """Client with the load()/unload() shape of WhisperClient"""
+
+    def __init__(self, name, load_seconds=0.0):
+        self.name = name
+        self.load_seconds = load_seconds
+        self.loaded = False
+
+    def load(self):
+        time.sleep(self.load_seconds)
+        self.loaded = True
+        return self.load_seconds
+
+    def unload(self):
+        self.loaded = False
+
+
+@pytest.fixture
+def registry():
+    registry = ModelRegistry(budget_mb=1000)
+    for name, size in (("whisper", 400), ("phowhisper", 500), ("diarization", 300)):
+        registry.register(name, lambda name=name: FakeClient(name), size)
+    return registry
+
+
+class TestModelRegistry:
+    """Test suite for ModelRegistry"""
+
+    def test_model_stays_loaded_between_leases(self, registry):
+        """Test a second lease reuses the loaded model"""
+        with registry.use("whisper") as first:
+            assert first.loaded
+        with registry.use("whisper") as second:
+            assert second is first
+
+        stats = registry.get_stats()["models"]["whisper"]
+        assert stats["loads"] == 1 and stats["hits"] == 1
+        assert stats["state"] == "loaded" and stats["refs"] == 0
+
+    def test_concurrent_leases_share_one_load(self, registry):
+        """Test threads asking for a loading model wait for the same load"""
+        registry.register("slow", lambda: FakeClient("slow", load_seconds=0.2), 100)
+        results = []
+
+        def lease():
+            with registry.use("slow") as model:
+                results.append(model)
+
+        threads = [threading.Thread(target=lease) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 4 and len({id(m) for m in results}) == 1
+        assert registry.get_stats()["models"]["slow"]["loads"] == 1
+
+    def test_lru_eviction_within_budget(self, registry):
+        """Test the least recently used idle model is unloaded to make room"""
+        with registry.use("whisper") as whisper:
+            pass
+        with registry.use("diarization"):
+            pass
+        with registry.use("phowhisper"):
+            pass
+
+        stats = registry.get_stats()
+        assert stats["models"]["whisper"]["state"] == "unloaded"
+        assert stats["models"]["whisper"]["evictions"] == 1
+        assert not whisper.loaded
+        assert stats["used_mb"] == 800
+
+    def test_models_in_use_are_not_evicted(self, registry):
+        """Test a leased model survives loads that exceed the budget"""
+        with registry.use("whisper") as whisper:
+            with registry.use("phowhisper"):
+                with registry.use("diarization"):
+                    assert whisper.loaded
+                    assert registry.get_stats()["used_mb"] == 1200
+        assert registry.get_stats()["used_mb"] <= 1000
+
+    def test_failed_load_can_be_retried(self, registry):
+        """Test a load error leaves the model unloaded and releases the lease"""
+        attempts = []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("HF token missing")
+            return FakeClient("flaky")
+
+        registry.register("flaky", factory, 100)
+        with pytest.raises(RuntimeError):
+            registry.acquire("flaky")
+        stats = registry.get_stats()["models"]["flaky"]
+        assert stats["state"] == "unloaded" and stats["refs"] == 0
+        with registry.use("flaky") as model:
+            assert model.loaded
+
+    def test_prewarm_and_stats(self, registry):
+        """Test prewarm loads models in the background and stats report times"""
+        registry.prewarm(["whisper", "phowhisper", "diarization"]).join(5)
+
+        stats = registry.get_stats()["models"]
+        assert stats["whisper"]["state"] == "loaded" and stats["phowhisper"]["state"] == "loaded"
+        # Diarization would exceed the budget, so prewarm skips it instead of evicting
+        assert stats["diarization"]["state"] == "unloaded"
+        assert stats["whisper"]["resident_seconds"] >= 0 and stats["whisper"]["idle_seconds"] >= 0
+        assert registry.unload("whisper")
+        assert registry.get_stats()["models"]["whisper"]["state"] == "unloaded"
+
+    def test_release_without_acquire_raises(self, registry):
+        """Test unbalanced release is reported"""
+        with pytest.raises(RuntimeError):
+            registry.release("whisper")
+        with pytest.raises(KeyError):
+            registry.acquire("qwen")
@@ -77,5 +77,50 @@ class TestPhoWhisperClient:
         assert "30s" in repr_str
 
 
+
+class TestInMemoryTranscription:
+    """Test the core.llm client on decoded arrays instead of files"""
+    
+    def test_transcribe_array_without_copies(self):
+        """Test segments are chunked as views of the caller's array"""
+        import numpy as np
+        from app.core.llm.phowhisper_client import PhoWhisperClient as LLMPhoWhisperClient
+        
+        recording = np.zeros(16000 * 100, dtype=np.float32)
+        segment = recording[16000 * 10:16000 * 55]  # 45s view
+        chunks = []
+        
+        def fake_pipe(chunk, generate_kwargs=None):
+            chunks.append(chunk)
+            return {"text": f"chunk {len(chunks)}"}
+        
+        client = LLMPhoWhisperClient(device="cpu")
+        client.pipe, client._is_loaded = fake_pipe, True
+        transcript, _ = client.transcribe(segment)
+        
+        assert transcript == "chunk 1 chunk 2"
+        assert [len(c) for c in chunks] == [16000 * 30, 16000 * 15]
+        assert all(np.shares_memory(c, recording) for c in chunks)
+    
+    def test_transcribe_batch_restores_order(self):
+        """Test batches are length-sorted and texts come back per segment in input order"""
+        import numpy as np
+        from app.core.llm.phowhisper_client import PhoWhisperClient as LLMPhoWhisperClient
+        
+        sr = 16000
+        segments = [np.full(sr * s, s, dtype=np.float32) for s in (2, 40, 5, 12)]
+        batches = []
+        
+        def fake_pipe(chunks, batch_size=None, generate_kwargs=None):
+            batches.append([len(c) // sr for c in chunks])
+            return [{"text": f"{int(c[0])}s/{len(c) // sr}"} for c in chunks]
+        
+        client = LLMPhoWhisperClient(device="cpu")
+        client.pipe, client._is_loaded = fake_pipe, True
+        transcripts, _ = client.transcribe_batch(segments, batch_size=2)
+        
+        assert batches == [[30, 12], [10, 5], [2]]
+        assert transcripts == ["2s/2", "40s/30 40s/10", "5s/5", "12s/12"]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -31,7 +31,9 @@ warnings.filterwarnings('ignore', message='.*libtorchcodec.*')
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from core.llm import SpeakerDiarizationClient, WhisperClient, PhoWhisperClient, GeminiClient, MultiLLMClient
-from core.utils import preprocess_audio
+from core.utils import preprocess_audio, get_result_cache
+from core.services.model_registry import get_model_registry, prewarm_models
+from core.services.dual_scheduler import run_dual_asr
 
 # Load environment with absolute path
 env_path = Path(__file__).parent / "config" / ".env"
@@ -59,6 +61,14 @@ CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 print("[WebSocket] Using threading async mode")
 
+# Resident diarization/Whisper/PhoWhisper models shared by every upload
+model_registry = get_model_registry()
+
+# Per-segment transcripts, keyed by segment samples + model + params
+result_cache = get_result_cache()
+WHISPER_CACHE_NAME = f"whisper:{os.getenv('S2T_WHISPER_MODEL', 'large-v3')}"
+PHOWHISPER_CACHE_NAME = "phowhisper:vinai/PhoWhisper-large"
+
 # Global state for processing
 processing_state = {
     'is_processing': False,
@@ -78,6 +88,13 @@ model_selection_state = {
 # Allowed extensions
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'flac', 'ogg'}
 
+# Segments are passed to the models as slices of the decoded audio; set
+# S2T_WRITE_SEGMENTS=true to also keep preprocessed.wav and per-segment WAVs for debugging
+WRITE_SEGMENT_FILES = os.getenv('S2T_WRITE_SEGMENTS', 'false').lower() == 'true'
+
+# Segments/chunks decoded together by Whisper and PhoWhisper (1 = one call per segment)
+ASR_BATCH_SIZE = int(os.getenv('S2T_ASR_BATCH_SIZE', '8'))
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -179,11 +196,12 @@ def process_audio_with_diarization(audio_path, session_id):
         import librosa
         import soundfile as sf
         
+        # Decoded once; diarization and both ASR models read slices of this array
         audio, sr = librosa.load(audio_path, sr=16000)
         duration = len(audio) / sr
         
-        preprocessed_path = f"{SESSION_DIR}/preprocessed.wav"
-        sf.write(preprocessed_path, audio, sr)
+        if WRITE_SEGMENT_FILES:
+            sf.write(f"{SESSION_DIR}/preprocessed.wav", audio, sr)
         
         timings['preprocessing'] = time.time() - step_start
         emit_progress('preprocessing', 15, f'Audio loaded: {duration:.1f}s')
@@ -192,26 +210,14 @@ def process_audio_with_diarization(audio_path, session_id):
         step_start = time.time()
         emit_progress('diarization', 20, 'Loading diarization model...')
         
-        # Debug: Check token availability
-        hf_token = os.getenv('HF_TOKEN') or os.getenv('HF_API_TOKEN') or os.getenv('HUGGINGFACE_TOKEN')
-        print(f"[DEBUG] HF_TOKEN available: {'YES' if hf_token else 'NO'}")
-        if hf_token:
-            print(f"[DEBUG] Token preview: {hf_token[:20]}...")
-        
         try:
-            diarizer = SpeakerDiarizationClient(
-                min_speakers=2,
-                max_speakers=5,
-                hf_token=hf_token
-            )
-            diarizer.load()
-            
-            emit_progress('diarization', 30, 'Detecting speakers...')
-            segments = diarizer.diarize(preprocessed_path, min_duration=1.0)
-            
-            # Save segments
-            segments_file = f"{SESSION_DIR}/speaker_segments.txt"
-            diarizer.save_segments(segments, segments_file)
+            with model_registry.use('diarization') as diarizer:
+                emit_progress('diarization', 30, 'Detecting speakers...')
+                segments = diarizer.diarize(audio, min_duration=1.0, sample_rate=sr)
+                
+                # Save segments
+                segments_file = f"{SESSION_DIR}/speaker_segments.txt"
+                diarizer.save_segments(segments, segments_file)
             
             num_speakers = len(set(seg.speaker_id for seg in segments))
             timings['diarization'] = time.time() - step_start
@@ -234,70 +240,89 @@ def process_audio_with_diarization(audio_path, session_id):
         # ============= STEP 3: EXTRACT SEGMENTS =============
         emit_progress('segmentation', 45, 'Extracting audio segments...')
         
-        segment_dir = f"{SESSION_DIR}/audio_segments"
-        os.makedirs(segment_dir, exist_ok=True)
+        segment_dir = f"{SESSION_DIR}/audio_segments" if WRITE_SEGMENT_FILES else None
+        if segment_dir:
+            os.makedirs(segment_dir, exist_ok=True)
         
         segment_files = []
         for i, seg in enumerate(segments):
             start_sample = int(seg.start_time * sr)
             end_sample = int(seg.end_time * sr)
-            segment_audio = audio[start_sample:end_sample]
+            segment_audio = audio[start_sample:end_sample]  # view, no copy
             
-            segment_path = f"{segment_dir}/segment_{i:03d}_{seg.speaker_id}.wav"
-            sf.write(segment_path, segment_audio, sr)
-            segment_files.append((seg, segment_path))
+            segment_path = None
+            if segment_dir:
+                segment_path = f"{segment_dir}/segment_{i:03d}_{seg.speaker_id}.wav"
+                sf.write(segment_path, segment_audio, sr)
+            segment_files.append((seg, segment_audio, segment_path))
         
         emit_progress('segmentation', 50, f'Extracted {len(segment_files)} segments')
         
-        # ============= STEP 4: WHISPER TRANSCRIPTION =============
+        # ============= STEP 4-5: WHISPER + PHOWHISPER (CONCURRENT) =============
+        # Both models run at once on separate core budgets; each segment's
+        # PhoWhisper line is built as soon as both models have transcribed it
         step_start = time.time()
         emit_progress('whisper', 55, 'Loading Whisper model...')
+        emit_progress('phowhisper', 78, 'Loading PhoWhisper model...')
         
-        whisper = WhisperClient(model_name="large-v3")
-        whisper.load()
-        
-        segment_transcripts = []
         total_segments = len(segment_files)
+        pho_lines = [None] * total_segments
+        
+        def asr_progress(model, done, total):
+            if model == 'whisper':
+                emit_progress('whisper', 55 + int((done / total) * 20),  # 55-75%
+                              f'Whisper {done}/{total} ({total_segments} segments)...')
+            else:
+                emit_progress('phowhisper', 78 + int((done / total) * 10),  # 78-88%
+                              f'PhoWhisper segment {done}/{total}...')
+        
+        # Segments seen before (same samples, model and params) come from the cache;
+        # a model is only leased for the misses
+        def whisper_misses(misses):
+            with model_registry.use('whisper') as whisper:
+                return whisper.transcribe_batch(misses, batch_size=ASR_BATCH_SIZE)[0]
+        
+        def phowhisper_misses(misses):
+            with model_registry.use('phowhisper') as phowhisper:
+                return phowhisper.transcribe_batch(misses, batch_size=ASR_BATCH_SIZE, sample_rate=sr)[0]
+        
+        def transcribe_whisper(batch):
+            return result_cache.transcribe_segments(
+                batch, whisper_misses, WHISPER_CACHE_NAME,
+                language='vi', params={'beam_size': 5, 'sample_rate': sr}
+            )
         
-        for i, (seg, seg_path) in enumerate(segment_files):
-            progress = 55 + int((i / total_segments) * 20)  # 55-75%
-            emit_progress('whisper', progress, 
-                         f'Transcribing segment {i+1}/{total_segments} ({seg.speaker_id})...')
-            
-            transcript, _ = whisper.transcribe(seg_path)
-            segment_transcripts.append({
-                'segment': seg,
-                'transcript': transcript.strip(),
-                'path': seg_path
-            })
+        def transcribe_phowhisper(batch):
+            return result_cache.transcribe_segments(
+                batch, phowhisper_misses, PHOWHISPER_CACHE_NAME,
+                language='vietnamese', params={'sample_rate': sr}
+            )
         
-        timings['whisper'] = time.time() - step_start
+        def fuse_segment(i, whisper_text, pho_text):
+            seg = segment_files[i][0]
+            pho_lines[i] = f"[{seg.start_time:.2f}s - {seg.end_time:.2f}s] {seg.speaker_id}: {pho_text}\n"
+        
+        asr = run_dual_asr(
+            [seg_audio for _, seg_audio, _ in segment_files],
+            whisper=transcribe_whisper,
+            phowhisper=transcribe_phowhisper,
+            on_segment=fuse_segment,
+            batch_size=ASR_BATCH_SIZE,
+            progress_callback=asr_progress
+        )
+        segment_transcripts = [
+            {'segment': seg, 'transcript': transcript, 'path': seg_path}
+            for (seg, seg_audio, seg_path), transcript in zip(segment_files, asr.whisper)
+        ]
+        
+        timings['whisper'] = asr.timings.get('whisper', 0.0)
+        timings['phowhisper'] = asr.timings.get('phowhisper', 0.0)
+        timings['asr_wall'] = time.time() - step_start
         emit_progress('whisper', 75, 'Whisper transcription complete')
-        
-        # ============= STEP 5: PHOWHISPER TRANSCRIPTION =============
-        step_start = time.time()
-        emit_progress('phowhisper', 78, 'Loading PhoWhisper model...')
-        
-        try:
-            phowhisper = PhoWhisperClient()
-            phowhisper.load()
-            
-            pho_transcripts = []
-            for i, (seg, seg_path) in enumerate(segment_files):
-                progress = 78 + int((i / total_segments) * 10)  # 78-88%
-                emit_progress('phowhisper', progress,
-                             f'PhoWhisper segment {i+1}/{total_segments}...')
-                
-                transcript, _ = phowhisper.transcribe(seg_path)
-                pho_transcripts.append(transcript.strip())
-            
-            timings['phowhisper'] = time.time() - step_start
+        if 'phowhisper' in asr.errors:
+            emit_progress('phowhisper', 88, f"PhoWhisper skipped: {asr.errors['phowhisper']}")
+        else:
             emit_progress('phowhisper', 88, 'PhoWhisper transcription complete')
-            
-        except Exception as e:
-            timings['phowhisper'] = time.time() - step_start
-            emit_progress('phowhisper', 88, f'PhoWhisper skipped: {str(e)}')
-            pho_transcripts = [t['transcript'] for t in segment_transcripts]
         
         # ============= STEP 6: BUILD TIMELINE =============
         emit_progress('timeline', 90, 'Building timeline transcript...')
@@ -338,9 +363,7 @@ def process_audio_with_diarization(audio_path, session_id):
         # Build dual transcript for LLM (build once, use for all models)
         dual_text = f"WHISPER TRANSCRIPT:\n{timeline_text}\n\n"
         dual_text += "PHOWHISPER TRANSCRIPT:\n"
-        for i, (trans, pho) in enumerate(zip(segment_transcripts, pho_transcripts)):
-            seg = trans['segment']
-            dual_text += f"[{seg.start_time:.2f}s - {seg.end_time:.2f}s] {seg.speaker_id}: {pho}\n"
+        dual_text += "".join(pho_lines)
         
         # Define fallback chain: selected model -> grok -> deepseek -> openai
         fallback_chain = [selected_model]
@@ -554,6 +577,11 @@ def debug_info():
         'socketio_async_mode': socketio.async_mode
     })
 
+@app.route('/api/models/stats')
+def model_stats():
+    """Resident model state with load / resident / idle times"""
+    return jsonify(model_registry.get_stats())
+
 @app.route('/modern')
 def modern():
     """Modern UI (ChatBot-style)"""
@@ -760,6 +788,9 @@ if __name__ == '__main__':
     port = int(os.getenv('SPEECH2TEXT_PORT', 5001))
     host = os.getenv('FLASK_HOST', '0.0.0.0')  # Bind to all interfaces for public access
     
+    # Load models in the background so the first upload does not wait for them
+    prewarm_models()
+    
     # Run with socketio for WebSocket support
     # Use debug=False to avoid issues with reloader
     socketio.run(app, 
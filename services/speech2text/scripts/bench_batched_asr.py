@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark - batched ASR throughput on CPU
+
+Cuts --audio into diarization-like segments (2-20 s, seeded) and transcribes
+them with WhisperClient.transcribe_batch and PhoWhisperClient.transcribe_batch
+at each --batch-sizes value. Batch size 1 is the old one-call-per-segment
+path. Reports throughput as audio seconds per wall second.
+
+Usage:
+    python scripts/bench_batched_asr.py --audio meeting.wav [--minutes 5]
+        [--batch-sizes 1,4,8,16] [--whisper-model base]
+        [--phowhisper-model vinai/PhoWhisper-small]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import librosa  # noqa: E402
+
+from core.llm.phowhisper_client import PhoWhisperClient  # noqa: E402
+from core.llm.whisper_client import WhisperClient  # noqa: E402
+
+SR = 16000
+
+
+def make_segments(audio, seed=0):
+    rng = random.Random(seed)
+    segments, start = [], 0
+    while start < len(audio):
+        end = min(len(audio), start + int(rng.uniform(2, 20) * SR))
+        segments.append(audio[start:end])
+        start = end
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", required=True, help="Speech recording (any format librosa reads)")
+    parser.add_argument("--minutes", type=float, default=5, help="Use the first N minutes")
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    parser.add_argument("--whisper-model", default="base")
+    parser.add_argument("--phowhisper-model", default="vinai/PhoWhisper-small")
+    args = parser.parse_args()
+
+    audio, _ = librosa.load(args.audio, sr=SR, duration=args.minutes * 60)
+    segments = make_segments(audio)
+    audio_seconds = len(audio) / SR
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    clients = [
+        ("whisper", WhisperClient(model_name=args.whisper_model, device="cpu", compute_type="int8")),
+        ("phowhisper", PhoWhisperClient(model_name=args.phowhisper_model, device="cpu")),
+    ]
+    print(f"\n🧪 {audio_seconds:.0f}s of audio in {len(segments)} segments, CPU\n")
+    print(f"{'model':>10} | {'batch':>5} | {'wall s':>7} {'audio s/s':>9}")
+    for name, client in clients:
+        client.load()
+        client.transcribe_batch(segments[:2], batch_size=2)  # warm-up
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            client.transcribe_batch(segments, batch_size=batch_size)
+            wall = time.perf_counter() - start
+            print(f"{name:>10} | {batch_size:>5} | {wall:>7.1f} {audio_seconds / wall:>9.2f}")
+        client.unload()
+
+
+if __name__ == "__main__":
+    main()
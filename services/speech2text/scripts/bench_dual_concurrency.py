@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark - serial vs concurrent Whisper + PhoWhisper on CPU
+
+Cuts --audio into diarization-like segments (2-20 s, seeded) and runs
+run_dual_asr over them twice: serial (Whisper, then PhoWhisper, each on all
+cores) and concurrent (both at once; Whisper on thread_budget()["whisper"],
+PhoWhisper on the torch share the service sets at startup). Reports wall
+time and the speedup of concurrent over serial.
+
+Whisper's CTranslate2 thread count is fixed when the model is built, so each
+mode builds its own Whisper model. torch's thread count is process-wide; the
+service sets it once (configure_torch_threads), this script sets it between
+modes since only one run is in flight.
+
+Usage:
+    python scripts/bench_dual_concurrency.py --audio meeting.wav [--minutes 5]
+        [--batch-size 8] [--whisper-model base]
+        [--phowhisper-model vinai/PhoWhisper-small]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import librosa  # noqa: E402
+import torch  # noqa: E402
+
+from core.llm.phowhisper_client import PhoWhisperClient  # noqa: E402
+from core.llm.whisper_client import WhisperClient  # noqa: E402
+from core.services.dual_scheduler import run_dual_asr, thread_budget  # noqa: E402
+
+SR = 16000
+
+
+def make_segments(audio, seed=0):
+    rng = random.Random(seed)
+    segments, start = [], 0
+    while start < len(audio):
+        end = min(len(audio), start + int(rng.uniform(2, 20) * SR))
+        segments.append(audio[start:end])
+        start = end
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", required=True, help="Speech recording (any format librosa reads)")
+    parser.add_argument("--minutes", type=float, default=5, help="Use the first N minutes")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--whisper-model", default="base")
+    parser.add_argument("--phowhisper-model", default="vinai/PhoWhisper-small")
+    args = parser.parse_args()
+
+    audio, _ = librosa.load(args.audio, sr=SR, duration=args.minutes * 60)
+    segments = make_segments(audio)
+    audio_seconds = len(audio) / SR
+    cores = os.cpu_count() or 1
+    budget = thread_budget(cores, concurrent=True)
+
+    phowhisper = PhoWhisperClient(model_name=args.phowhisper_model, device="cpu")
+    phowhisper.load()
+    print(f"\n🧪 {audio_seconds:.0f}s of audio in {len(segments)} segments, {cores} cores\n")
+    print(f"{'mode':>10} | {'threads w/p':>11} | {'wall s':>7} {'whisper s':>9} {'pho s':>7}")
+
+    walls = {}
+    for mode, concurrent, whisper_threads, pho_threads in (
+        ("serial", False, cores, cores),
+        ("concurrent", True, budget["whisper"], budget["phowhisper"]),
+    ):
+        whisper = WhisperClient(model_name=args.whisper_model, device="cpu",
+                                compute_type="int8", cpu_threads=whisper_threads)
+        whisper.load()
+        torch.set_num_threads(pho_threads)
+        whisper.transcribe_batch(segments[:2], batch_size=2)  # warm-up
+        phowhisper.transcribe_batch(segments[:2], batch_size=2)
+
+        result = run_dual_asr(
+            segments,
+            whisper=lambda batch: whisper.transcribe_batch(batch, batch_size=args.batch_size)[0],
+            phowhisper=lambda batch: phowhisper.transcribe_batch(batch, batch_size=args.batch_size)[0],
+            batch_size=args.batch_size,
+            concurrent=concurrent,
+        )
+        walls[mode] = result.timings["total"]
+        print(f"{mode:>10} | {whisper_threads:>5}/{pho_threads:<5} | {walls[mode]:>7.1f} "
+              f"{result.timings['whisper']:>9.1f} {result.timings['phowhisper']:>7.1f}")
+        whisper.unload()
+
+    print(f"\nSpeedup (serial / concurrent): {walls['serial'] / walls['concurrent']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
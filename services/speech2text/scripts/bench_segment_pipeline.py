@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark - per-segment WAV files vs in-memory segment slices
+
+Simulates the web UI pipeline after decoding on a synthetic recording
+(--minutes of 16 kHz audio, diarized into 2-20 s segments). Two stand-in
+models read every segment (Whisper, PhoWhisper):
+
+    files  : write preprocessed.wav and one WAV per segment, each model
+             re-reads each segment file (the old pipeline)
+    memory : segments are numpy views of the decoded array (the new pipeline)
+
+Each mode runs in its own process so peak RSS is measured separately.
+Model inference is excluded; only the audio plumbing is timed.
+
+Usage:
+    python scripts/bench_segment_pipeline.py [--minutes 60]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+SR = 16000
+
+
+def make_recording(minutes):
+    rng = np.random.default_rng(0)
+    audio = rng.standard_normal(int(minutes * 60 * SR), dtype=np.float32)
+    audio *= 0.1
+    bounds, t = [], 0.0
+    duration = len(audio) / SR
+    while t < duration:
+        end = min(duration, t + rng.uniform(2, 20))
+        bounds.append((t, end))
+        t = end
+    return audio, bounds
+
+
+def fake_model(samples):
+    """Touches every sample like a feature extractor would"""
+    return float(np.dot(samples, samples))
+
+
+def run_files(audio, bounds, workdir):
+    sf.write(os.path.join(workdir, "preprocessed.wav"), audio, SR)
+    paths = []
+    for i, (start, end) in enumerate(bounds):
+        path = os.path.join(workdir, f"segment_{i:03d}.wav")
+        sf.write(path, audio[int(start * SR):int(end * SR)], SR)
+        paths.append(path)
+    for _ in ("whisper", "phowhisper"):
+        for path in paths:
+            samples, _ = sf.read(path, dtype="float32")
+            fake_model(samples)
+    return sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+
+
+def run_memory(audio, bounds, workdir):
+    views = [audio[int(start * SR):int(end * SR)] for start, end in bounds]
+    for _ in ("whisper", "phowhisper"):
+        for view in views:
+            fake_model(view)
+    return 0
+
+
+def child(mode, minutes):
+    audio, bounds = make_recording(minutes)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        written = (run_files if mode == "files" else run_memory)(audio, bounds, workdir)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "segments": len(bounds),
+        "seconds": elapsed,
+        "peak_mb": peak / 1024,
+        "extra_mb": (peak - base_rss) / 1024,
+        "disk_mb": written / 1024 / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--mode", choices=["files", "memory"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args.mode, args.minutes)
+        return
+
+    print(f"🧪 {args.minutes:g} min recording at {SR} Hz\n")
+    print(f"{'mode':>6} | {'segments':>8} {'s':>7} {'peak MB':>8} {'+MB':>7} {'disk MB':>8}")
+    for mode in ("files", "memory"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--minutes", str(args.minutes)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:>6} | {r['segments']:>8} {r['seconds']:>7.2f} {r['peak_mb']:>8.0f} {r['extra_mb']:>7.0f} {r['disk_mb']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,11 @@ from functools import wraps
 from threading import local
 from contextvars import ContextVar
 
+try:
+    from config.tracing import current_trace_id
+except ImportError:
+    current_trace_id = None
+
 # Context variable for request ID
 request_id_var: ContextVar[str] = ContextVar('request_id', default='')
 
@@ -80,6 +85,11 @@ class JSONFormatter(logging.Formatter):
         if request_id:
             log_data["request_id"] = request_id
         
+        # Add trace ID when the request is being traced
+        trace_id = current_trace_id() if current_trace_id else ''
+        if trace_id:
+            log_data["trace_id"] = trace_id
+        
         # Add location info
         log_data["location"] = {
             "file": record.filename,
@@ -4,13 +4,15 @@ Common utilities for all AI-Assistant services
 """
 
 from .cache import Cache
-from .rate_limiter import RateLimiter
+from .rate_limiter import RateLimiter, RedisRateLimiter, create_rate_limiter
 from .connection_pool import ConnectionPool, PooledConnection
 from .performance import PerformanceMonitor, TimingStats, Timer, timing_decorator, timed, get_monitor
 
 __all__ = [
     'Cache',
     'RateLimiter',
+    'RedisRateLimiter',
+    'create_rate_limiter',
     'ConnectionPool',
     'PooledConnection',
     'PerformanceMonitor',
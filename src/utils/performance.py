@@ -4,9 +4,10 @@ Timing, metrics, and performance utilities
 """
 
 import time
+import random
 import logging
 import functools
-from typing import Dict, List, Any, Callable
+from typing import ClassVar, Dict, List, Any, Callable
 from threading import Lock
 from collections import defaultdict
 from dataclasses import dataclass, field
@@ -16,12 +17,20 @@ logger = logging.getLogger(__name__)
 
 @dataclass
 class TimingStats:
-    """Statistics for timing measurements."""
+    """
+    Statistics for timing measurements.
+    
+    Percentiles come from a fixed-size uniform reservoir sample, so memory
+    stays bounded however many measurements are added.
+    """
+    RESERVOIR_SIZE: ClassVar[int] = 1024
+    
     count: int = 0
     total: float = 0.0
     min: float = float('inf')
     max: float = 0.0
     last: float = 0.0
+    samples: List[float] = field(default_factory=list, repr=False)
     
     def add(self, duration: float) -> None:
         """Add a timing measurement."""
@@ -30,6 +39,20 @@ class TimingStats:
         self.min = min(self.min, duration)
         self.max = max(self.max, duration)
         self.last = duration
+        # Reservoir sampling (algorithm R)
+        if len(self.samples) < self.RESERVOIR_SIZE:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.RESERVOIR_SIZE:
+                self.samples[slot] = duration
+    
+    def percentile(self, q: float) -> float:
+        """Estimated q-th percentile (0-100) of the durations."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
     
     @property
     def avg(self) -> float:
@@ -44,7 +67,10 @@ class TimingStats:
             'avg_ms': round(self.avg * 1000, 2),
             'min_ms': round(self.min * 1000, 2) if self.min != float('inf') else 0,
             'max_ms': round(self.max * 1000, 2),
-            'last_ms': round(self.last * 1000, 2)
+            'last_ms': round(self.last * 1000, 2),
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p95_ms': round(self.percentile(95) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2)
         }
 
 
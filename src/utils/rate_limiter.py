@@ -1,113 +1,363 @@
 """
 Rate Limiter Utility
-Simple in-memory rate limiting
+Sliding-window rate limiting, in-memory or shared across workers via Redis
 """
 
+import os
 import time
+import uuid
 import logging
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from threading import Lock
 
 logger = logging.getLogger("ai_assistant")
 
 
+class _Window:
+    """Fixed-size ring buffer of the last max_requests request times for one key."""
+
+    __slots__ = ('slots', 'head')
+
+    def __init__(self, size: int):
+        self.slots = [float('-inf')] * size
+        self.head = 0  # index of the oldest recorded request
+
+    def newest(self) -> float:
+        return self.slots[self.head - 1]
+
+    def first_in_window(self, cutoff: float) -> int:
+        """Logical index (0 = oldest) of the first request newer than cutoff."""
+        slots, head, size = self.slots, self.head, len(self.slots)
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if slots[(head + mid) % size] > cutoff:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+
 class RateLimiter:
-    """Simple in-memory rate limiter."""
-    
-    def __init__(self, max_requests: int = 100, window_seconds: int = 60):
+    """
+    In-memory sliding-window rate limiter.
+
+    Each key keeps a ring buffer of its last ``max_requests`` timestamps, so a
+    check is O(1) (plus O(log n) for the remaining count) instead of rebuilding
+    a list. Keys are spread over lock stripes and idle keys are evicted by a
+    periodic sweep. Limits are per process; use RedisRateLimiter to share them
+    between workers.
+    """
+
+    NUM_STRIPES = 16
+
+    def __init__(self, max_requests: int = 100, window_seconds: int = 60,
+                 sweep_interval: Optional[float] = None):
         """
         Initialize rate limiter.
-        
+
         Args:
             max_requests: Maximum requests allowed in window
             window_seconds: Time window in seconds
+            sweep_interval: Seconds between idle-key sweeps (default: window_seconds)
         """
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self._requests: Dict[str, list] = {}
-        self._lock = Lock()
-    
-    def _cleanup_old_requests(self, key: str, current_time: float):
-        """Remove requests outside the time window."""
-        cutoff_time = current_time - self.window_seconds
-        self._requests[key] = [
-            req_time for req_time in self._requests.get(key, [])
-            if req_time > cutoff_time
-        ]
-    
+        self.sweep_interval = sweep_interval if sweep_interval is not None else window_seconds
+        self._stripes = [({}, Lock()) for _ in range(self.NUM_STRIPES)]
+        self._next_sweep = time.time() + self.sweep_interval
+        self._sweep_lock = Lock()
+
+    def _stripe(self, key: str) -> Tuple[Dict[str, _Window], Lock]:
+        return self._stripes[hash(key) % self.NUM_STRIPES]
+
+    def _count(self, window: _Window, current_time: float) -> int:
+        return self.max_requests - window.first_in_window(current_time - self.window_seconds)
+
     def is_allowed(self, key: str) -> Tuple[bool, int]:
         """
         Check if request is allowed.
-        
+
         Args:
             key: Identifier for the request source (e.g., IP, user ID)
-        
+
         Returns:
             Tuple of (is_allowed, remaining_requests)
         """
-        with self._lock:
-            current_time = time.time()
-            
-            # Initialize or cleanup
-            if key not in self._requests:
-                self._requests[key] = []
-            else:
-                self._cleanup_old_requests(key, current_time)
-            
-            # Check limit
-            request_count = len(self._requests[key])
-            
-            if request_count >= self.max_requests:
+        current_time = time.time()
+        if current_time >= self._next_sweep:
+            self.sweep(current_time)
+
+        if self.max_requests <= 0:
+            return False, 0
+
+        windows, lock = self._stripe(key)
+        with lock:
+            window = windows.get(key)
+            if window is None:
+                window = windows[key] = _Window(self.max_requests)
+
+            # The oldest of the last max_requests requests is still in the window
+            if window.slots[window.head] > current_time - self.window_seconds:
                 return False, 0
-            
+
             # Record request
-            self._requests[key].append(current_time)
-            remaining = self.max_requests - request_count - 1
-            
-            return True, remaining
-    
+            window.slots[window.head] = current_time
+            window.head = (window.head + 1) % self.max_requests
+
+            return True, self.max_requests - self._count(window, current_time)
+
+    def sweep(self, current_time: Optional[float] = None) -> int:
+        """
+        Evict keys with no request inside the window.
+
+        Returns:
+            Number of keys evicted
+        """
+        current_time = current_time if current_time is not None else time.time()
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._next_sweep = current_time + self.sweep_interval
+            cutoff = current_time - self.window_seconds
+            evicted = 0
+            for windows, lock in self._stripes:
+                with lock:
+                    idle = [key for key, window in windows.items() if window.newest() <= cutoff]
+                    for key in idle:
+                        del windows[key]
+                    evicted += len(idle)
+            return evicted
+        finally:
+            self._sweep_lock.release()
+
     def reset(self, key: str):
         """
         Reset rate limit for a key.
-        
+
         Args:
             key: Identifier to reset
         """
-        with self._lock:
-            if key in self._requests:
-                del self._requests[key]
-    
+        windows, lock = self._stripe(key)
+        with lock:
+            windows.pop(key, None)
+
     def get_remaining(self, key: str) -> int:
         """
         Get remaining requests for a key.
-        
+
         Args:
             key: Identifier to check
-        
+
         Returns:
             Number of remaining requests
         """
-        with self._lock:
-            current_time = time.time()
-            self._cleanup_old_requests(key, current_time)
-            request_count = len(self._requests.get(key, []))
-            return max(0, self.max_requests - request_count)
-    
+        windows, lock = self._stripe(key)
+        with lock:
+            window = windows.get(key)
+            if window is None:
+                return max(0, self.max_requests)
+            return max(0, self.max_requests - self._count(window, time.time()))
+
     def get_reset_time(self, key: str) -> float:
         """
         Get time until rate limit resets.
-        
+
         Args:
             key: Identifier to check
-        
+
         Returns:
             Seconds until reset (0 if no requests)
         """
-        with self._lock:
-            requests = self._requests.get(key, [])
-            if not requests:
+        windows, lock = self._stripe(key)
+        with lock:
+            window = windows.get(key)
+            if window is None:
+                return 0
+            current_time = time.time()
+            first = window.first_in_window(current_time - self.window_seconds)
+            if first >= self.max_requests:
                 return 0
-            
-            oldest_request = min(requests)
-            reset_time = oldest_request + self.window_seconds
-            return max(0, reset_time - time.time())
+            oldest_request = window.slots[(window.head + first) % self.max_requests]
+            return max(0, oldest_request + self.window_seconds - current_time)
+
+    def __len__(self) -> int:
+        return sum(len(windows) for windows, _ in self._stripes)
+
+
+# Lua scripts run atomically on the Redis server; time comes from Redis itself
+# so every worker agrees on the clock.
+_NOW_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+SLIDING_WINDOW_LUA = _NOW_LUA + """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local consume = ARGV[3] == '1'
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+if count >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local reset = window
+    if oldest[2] then reset = tonumber(oldest[2]) + window - now end
+    return {0, 0, reset}
+end
+local reset = 0
+if consume then
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('PEXPIRE', key, window)
+    count = count + 1
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then reset = tonumber(oldest[2]) + window - now end
+return {1, limit - count, reset}
+"""
+
+GCRA_LUA = _NOW_LUA + """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local consume = ARGV[3] == '1'
+local emission = window / limit
+local tat = tonumber(redis.call('GET', key)) or now
+if tat < now then tat = now end
+local new_tat = tat
+if consume then new_tat = tat + emission end
+local allow_at = new_tat - window
+if now < allow_at then
+    return {0, 0, math.ceil(tat - now)}
+end
+if consume then
+    redis.call('SET', key, string.format('%.3f', new_tat), 'PX', math.max(1, math.ceil(new_tat - now)))
+end
+return {1, math.floor((now - allow_at) / emission), math.ceil(new_tat - now)}
+"""
+
+
+class RedisRateLimiter:
+    """
+    Redis-backed rate limiter shared by every worker process.
+
+    Each check is a single Lua script call (atomic, one round trip):
+      - 'sliding_window': exact sliding-window log in a sorted set
+      - 'gcra': generic cell rate algorithm, one key with the theoretical
+        arrival time (O(1) memory per client)
+    If Redis is unreachable the limiter degrades to the in-memory
+    RateLimiter for ``retry_interval`` seconds instead of failing requests.
+    """
+
+    ALGORITHMS = {'sliding_window': SLIDING_WINDOW_LUA, 'gcra': GCRA_LUA}
+
+    def __init__(self, client, max_requests: int = 100, window_seconds: int = 60,
+                 algorithm: str = 'sliding_window', key_prefix: str = 'ratelimit:',
+                 retry_interval: float = 30.0):
+        """
+        Initialize rate limiter.
+
+        Args:
+            client: redis.Redis client (or fakeredis)
+            max_requests: Maximum requests allowed in window
+            window_seconds: Time window in seconds
+            algorithm: 'sliding_window' or 'gcra'
+            key_prefix: Namespace for keys (use one per limit)
+            retry_interval: Seconds to use the local fallback after a Redis error
+        """
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.client = client
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.algorithm = algorithm
+        self.key_prefix = key_prefix
+        self.retry_interval = retry_interval
+        self.fallback = RateLimiter(max_requests, window_seconds)
+        self._script = client.register_script(self.ALGORITHMS[algorithm])
+        self._redis_down_until = 0.0
+
+    def _run(self, key: str, consume: bool) -> Optional[Tuple[bool, int, float]]:
+        """Run the script; returns None when Redis is unavailable."""
+        if time.time() < self._redis_down_until:
+            return None
+        if self.max_requests <= 0:
+            return False, 0, float(self.window_seconds)
+        try:
+            allowed, remaining, reset_ms = self._script(
+                keys=[self.key_prefix + key],
+                args=[self.max_requests, int(self.window_seconds * 1000), '1' if consume else '0', uuid.uuid4().hex]
+            )
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable, using in-memory fallback: {e}")
+            self._redis_down_until = time.time() + self.retry_interval
+            return None
+        return bool(allowed), int(remaining), max(0.0, float(reset_ms) / 1000)
+
+    def is_allowed(self, key: str) -> Tuple[bool, int]:
+        """
+        Check if request is allowed.
+
+        Args:
+            key: Identifier for the request source (e.g., IP, user ID)
+
+        Returns:
+            Tuple of (is_allowed, remaining_requests)
+        """
+        result = self._run(key, consume=True)
+        if result is None:
+            return self.fallback.is_allowed(key)
+        return result[0], result[1]
+
+    def reset(self, key: str):
+        """Reset rate limit for a key."""
+        self.fallback.reset(key)
+        try:
+            self.client.delete(self.key_prefix + key)
+        except Exception as e:
+            logger.warning(f"Redis rate limiter reset failed: {e}")
+
+    def get_remaining(self, key: str) -> int:
+        """Get remaining requests for a key."""
+        result = self._run(key, consume=False)
+        if result is None:
+            return self.fallback.get_remaining(key)
+        return result[1]
+
+    def get_reset_time(self, key: str) -> float:
+        """Get seconds until the next request slot frees up (0 if none used)."""
+        result = self._run(key, consume=False)
+        if result is None:
+            return self.fallback.get_reset_time(key)
+        return result[2]
+
+
+def create_rate_limiter(max_requests: int = 100, window_seconds: int = 60,
+                        key_prefix: str = 'ratelimit:', algorithm: Optional[str] = None,
+                        redis_url: Optional[str] = None):
+    """
+    Create a Redis-backed limiter when RATE_LIMIT_REDIS_URL / REDIS_URL is
+    configured and reachable, otherwise an in-memory one.
+
+    Args:
+        max_requests: Maximum requests allowed in window
+        window_seconds: Time window in seconds
+        key_prefix: Namespace for keys (use one per limit)
+        algorithm: 'sliding_window' (default) or 'gcra'; env RATE_LIMIT_ALGORITHM
+        redis_url: Override Redis URL
+    """
+    redis_url = redis_url or os.getenv('RATE_LIMIT_REDIS_URL') or os.getenv('REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_url, socket_connect_timeout=0.5, socket_timeout=0.5)
+            client.ping()
+            return RedisRateLimiter(
+                client, max_requests, window_seconds,
+                algorithm=algorithm or os.getenv('RATE_LIMIT_ALGORITHM', 'sliding_window'),
+                key_prefix=key_prefix
+            )
+        except Exception as e:
+            logger.warning(f"Redis rate limiter disabled ({e}), using in-memory limiter")
+    return RateLimiter(max_requests, window_seconds)
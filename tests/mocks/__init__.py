@@ -222,6 +222,158 @@ class MockStableDiffusionAPI:
         }
 
 
+class FakeComfyUIServer:
+    """
+    Local stand-in for ComfyUI's HTTP and /ws API (aiohttp, own thread)
+    
+    Prompts finish when complete() is called, or after ``auto_complete``
+    seconds. Prompts in ``silent`` finish without the websocket message,
+    so only /history shows them.
+    """
+    
+    MODEL = 'fake-model.safetensors'
+    
+    def __init__(self, auto_complete=None):
+        self.auto_complete = auto_complete
+        self.prompts = []
+        self.workflows = {}
+        self.history = {}
+        self.silent = set()
+        self.deleted = []
+        self.interrupted = []
+        self.calls = {'prompt': 0, 'history': 0, 'view': 0, 'ws': 0}
+        self.url = None
+        self._sockets = set()
+    
+    def start(self):
+        import asyncio
+        import threading
+        from aiohttp import web
+        
+        app = web.Application()
+        app.router.add_post('/prompt', self._post_prompt)
+        app.router.add_post('/queue', self._post_queue)
+        app.router.add_post('/interrupt', self._post_interrupt)
+        app.router.add_get('/history/{prompt_id}', self._get_history)
+        app.router.add_get('/view', self._get_view)
+        app.router.add_get('/object_info/{node}', self._get_object_info)
+        app.router.add_get('/ws', self._ws)
+        
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        
+        async def serve():
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.url = f"http://127.0.0.1:{port}"
+            ready.set()
+        
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(serve(), self.loop)
+        ready.wait(5)
+        return self
+    
+    def stop(self):
+        import asyncio
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+    
+    def complete(self, prompt_id, error=None):
+        """Finish a prompt (thread-safe)"""
+        import asyncio
+        asyncio.run_coroutine_threadsafe(self._finish(prompt_id, error), self.loop).result(5)
+    
+    def drop_connections(self):
+        """Close every websocket (clients should reconnect)"""
+        import asyncio
+        
+        async def drop():
+            for ws in list(self._sockets):
+                await ws.close()
+        asyncio.run_coroutine_threadsafe(drop(), self.loop).result(5)
+    
+    async def _broadcast(self, message):
+        for ws in list(self._sockets):
+            await ws.send_json(message)
+    
+    async def _finish(self, prompt_id, error=None):
+        if error:
+            self.history[prompt_id] = {'outputs': {}, 'status': {'status_str': 'error'}}
+            if prompt_id not in self.silent:
+                await self._broadcast({'type': 'execution_error',
+                                       'data': {'prompt_id': prompt_id, 'exception_message': error}})
+            return
+        for value in (1, 2):
+            await self._broadcast({'type': 'progress', 'data': {'value': value, 'max': 2, 'prompt_id': prompt_id}})
+        self.history[prompt_id] = {
+            'outputs': {'9': {'images': [{'filename': f'{prompt_id}.png', 'subfolder': '', 'type': 'output'}]}},
+            'status': {'status_str': 'success'}
+        }
+        if prompt_id not in self.silent:
+            await self._broadcast({'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}})
+    
+    async def _post_prompt(self, request):
+        import asyncio
+        import uuid
+        from aiohttp import web
+        
+        self.calls['prompt'] += 1
+        body = await request.json()
+        prompt_id = uuid.uuid4().hex
+        self.prompts.append(prompt_id)
+        self.workflows[prompt_id] = body['prompt']
+        await self._broadcast({'type': 'executing', 'data': {'node': '3', 'prompt_id': prompt_id}})
+        if self.auto_complete is not None:
+            self.loop.call_later(self.auto_complete,
+                                 lambda: asyncio.ensure_future(self._finish(prompt_id)))
+        return web.json_response({'prompt_id': prompt_id, 'number': len(self.prompts)})
+    
+    async def _post_queue(self, request):
+        from aiohttp import web
+        self.deleted.extend((await request.json()).get('delete', []))
+        return web.json_response({})
+    
+    async def _post_interrupt(self, request):
+        from aiohttp import web
+        self.interrupted.append((await request.json()).get('prompt_id'))
+        return web.json_response({})
+    
+    async def _get_history(self, request):
+        from aiohttp import web
+        self.calls['history'] += 1
+        prompt_id = request.match_info['prompt_id']
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry else {})
+    
+    async def _get_view(self, request):
+        from aiohttp import web
+        self.calls['view'] += 1
+        return web.Response(body=b'\x89PNG' + request.query['filename'].encode(), content_type='image/png')
+    
+    async def _get_object_info(self, request):
+        from aiohttp import web
+        node = request.match_info['node']
+        field = {'CheckpointLoaderSimple': 'ckpt_name', 'KSampler': 'sampler_name'}.get(node, 'name')
+        values = [self.MODEL] if node == 'CheckpointLoaderSimple' else ['euler']
+        return web.json_response({node: {'input': {'required': {field: [values]}}}})
+    
+    async def _ws(self, request):
+        from aiohttp import web
+        self.calls['ws'] += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+
 class MockImgBBUploader:
     """Mock ImgBB Image Uploader"""
     
@@ -223,9 +223,127 @@ class TestContextWindowManager:
             conversation,
             max_messages=5
         )
-        
+
         assert len(history) <= 5
 
+    def test_registered_tokenizer_and_cached_counts(self):
+        """Test pluggable tokenizers and per-entry cached counts"""
+        from core.base_chat import ContextWindowManager
+
+        calls = []
+
+        def word_count(text):
+            calls.append(text)
+            return len(text.split())
+
+        ContextWindowManager.register_tokenizer("test-words", "words", word_count)
+        entry = {"user": "one two three", "assistant": "four five"}
+
+        assert ContextWindowManager.count_message_tokens(entry, "test-words") == 5
+        assert entry['token_counts'] == {"words": 5}
+        assert ContextWindowManager.count_message_tokens(entry, "test-words") == 5
+        assert len(calls) == 2
+
+    def test_tokenizer_loads_are_per_model_and_failures_retry(self, monkeypatch):
+        """Test a slow load only blocks its own model and a failed load is not cached"""
+        import threading
+        from core.base_chat import ContextWindowManager
+
+        release = threading.Event()
+        attempts = []
+
+        def load(cls, model_id):
+            attempts.append(model_id)
+            if model_id == 'test-slow':
+                release.wait(5)
+            if model_id == 'test-flaky' and attempts.count('test-flaky') == 1:
+                raise OSError('hub unreachable')
+            return f"fake:{model_id}", len
+
+        monkeypatch.setattr(ContextWindowManager, '_load_tokenizer', classmethod(load))
+        slow = threading.Thread(target=ContextWindowManager.get_tokenizer, args=('test-slow',))
+        slow.start()
+        try:
+            assert wait_until(lambda: 'test-slow' in attempts)
+            heuristic = ContextWindowManager.HEURISTIC_TOKENIZER
+            assert ContextWindowManager.get_tokenizer('test-flaky')[0] == heuristic
+            # Within the retry window the failed load is not repeated
+            assert ContextWindowManager.get_tokenizer('test-flaky')[0] == heuristic
+            assert attempts.count('test-flaky') == 1
+
+            monkeypatch.setattr(ContextWindowManager, 'TOKENIZER_RETRY_SECONDS', 0)
+            assert ContextWindowManager.get_tokenizer('test-flaky')[0] == 'fake:test-flaky'
+            release.set()
+            slow.join(5)
+            assert ContextWindowManager.get_tokenizer('test-slow')[0] == 'fake:test-slow'
+        finally:
+            release.set()
+            for model_id in ('test-slow', 'test-flaky'):
+                ContextWindowManager._tokenizers.pop(model_id, None)
+                ContextWindowManager._tokenizer_failures.pop(model_id, None)
+
+    def test_split_history_uses_persisted_counts(self):
+        """Test history selection keeps the newest entries that fit the budget"""
+        from core.base_chat import ContextWindowManager
+
+        ContextWindowManager.register_tokenizer("test-budget", "budget", lambda text: 0)
+        ContextWindowManager.MODEL_CONTEXT_LIMITS["test-budget"] = 10000
+        try:
+            budget = int(10000 * ContextWindowManager.TARGET_USAGE) - 500
+            conversation = [
+                {"user": f"Msg {i}", "assistant": "", "token_counts": {"budget": budget // 3}}
+                for i in range(10)
+            ]
+
+            dropped, kept = ContextWindowManager.split_history(conversation, model_id="test-budget")
+        finally:
+            del ContextWindowManager.MODEL_CONTEXT_LIMITS["test-budget"]
+
+        assert [m['user'] for m in kept] == ["Msg 7", "Msg 8", "Msg 9"]
+        assert len(dropped) == 7
+
+    def test_dropped_messages_are_summarized(self):
+        """Test dropped history is folded into a rolling summary once"""
+        from core.base_chat import BaseModelChat, ModelConfig, ModelProvider, ChatContext, ContextWindowManager
+
+        ContextWindowManager.register_tokenizer("test-summary", "summary", lambda text: 1000)
+        summaries = []
+
+        class SummaryChat(BaseModelChat):
+            def _call_api(self, messages, temperature, max_tokens):
+                summaries.append(messages[0]['content'])
+                return "summary"
+
+            def _call_api_stream(self, messages, temperature, max_tokens):
+                yield ""
+
+        handler = SummaryChat(ModelConfig(name="s", provider=ModelProvider.LOCAL, model_id="test-summary"))
+        conversation = [{"user": f"Msg {i}", "assistant": "ok"} for i in range(4)]
+        ctx = ChatContext(message="next", conversation_history=conversation, summarize_dropped=True)
+
+        messages = handler.build_messages(ctx, "system")
+        handler.build_messages(ctx, "system")
+
+        assert ctx.history_summary == "summary"
+        assert len(summaries) == 1
+        assert messages[1]['content'].endswith("summary")
+        assert all(m.get('summarized') for m in conversation[:2])
+
+    def test_mark_summarized_restores_covered_prefix(self):
+        """Test a stored summary marker flags the turns it already covers"""
+        from core.base_chat import ContextWindowManager
+
+        conversation = [{"user": f"Msg {i}", "assistant": "ok"} for i in range(4)]
+        marker = ContextWindowManager.entry_fingerprint(conversation[1])
+
+        assert ContextWindowManager.mark_summarized(conversation, marker) == 2
+        assert [bool(m.get('summarized')) for m in conversation] == [True, True, False, False]
+
+        # The covered turn fell out of the loaded window: nothing loaded is covered
+        newer = [{"user": f"Msg {i}", "assistant": "ok"} for i in range(5, 8)]
+        assert ContextWindowManager.mark_summarized(newer, marker) == 0
+        assert not any(m.get('summarized') for m in newer)
+
 
 class TestRetryDecorator:
     """Tests for retry logic"""
@@ -278,6 +396,159 @@ class TestRetryDecorator:
             always_fail()
 
 
+class TestSingleFlight:
+    """Tests for request coalescing"""
+
+    def test_concurrent_calls_share_one_upstream_call(self):
+        """Test identical concurrent calls run fn once"""
+        from core.base_chat import SingleFlight
+        import threading
+        import time
+
+        flight = SingleFlight()
+        call_count = 0
+
+        def upstream():
+            nonlocal call_count
+            call_count += 1
+            time.sleep(0.1)
+            return "answer"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", upstream))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ["answer"] * 5
+        assert call_count == 1
+        stats = flight.get_stats()
+        assert stats['leaders'] == 1
+        assert stats['coalesced'] == 4
+        assert stats['in_flight'] == 0
+
+    def test_errors_propagate_to_waiters(self):
+        """Test followers receive the leader's exception"""
+        from core.base_chat import SingleFlight
+        import threading
+        import time
+
+        flight = SingleFlight()
+
+        def upstream():
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        errors = []
+
+        def call():
+            try:
+                flight.do("k", upstream)
+            except ValueError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errors == ["boom"] * 3
+
+    def test_stream_late_joiner_replays_chunks(self):
+        """Test a late stream subscriber replays emitted chunks"""
+        from core.base_chat import SingleFlight
+
+        flight = SingleFlight()
+        call_count = 0
+
+        def upstream():
+            nonlocal call_count
+            call_count += 1
+            yield from ["a", "b", "c"]
+
+        first = flight.stream("k", upstream)
+        assert next(first) == "a"
+        assert next(first) == "b"
+
+        late = flight.stream("k", upstream)
+        assert list(late) == ["a", "b", "c"]
+        assert list(first) == ["c"]
+        assert call_count == 1
+        assert flight.get_stats()['stream_coalesced'] == 1
+        assert flight.get_stats()['streams_in_flight'] == 0
+
+    def test_stream_closed_when_every_subscriber_leaves(self):
+        """Test abandoned streams close upstream and free the key, even if never started"""
+        import gc
+        from core.base_chat import SingleFlight
+
+        flight = SingleFlight()
+        upstreams = []
+
+        def upstream():
+            state = {'closed': False}
+            upstreams.append(state)
+            try:
+                yield from ["a", "b", "c"]
+            finally:
+                state['closed'] = True
+
+        first = flight.stream("k", upstream)
+        second = flight.stream("k", upstream)
+        assert next(first) == "a"
+        first.close()
+        assert not upstreams[0]['closed']  # second is still subscribed
+        assert list(second) == ["a", "b", "c"]
+
+        third = flight.stream("k", upstream)
+        assert next(third) == "a"
+        third.close()
+        assert upstreams[1]['closed']
+        assert flight.get_stats()['streams_in_flight'] == 0
+
+        never_read = flight.stream("k", upstream)
+        del never_read
+        gc.collect()
+        stats = flight.get_stats()
+        assert stats['streams_in_flight'] == 0 and stats['streams_abandoned'] == 2
+        assert list(flight.stream("k", upstream)) == ["a", "b", "c"]
+        assert len(upstreams) == 3  # the never-read upstream never started
+
+    def test_chat_coalesces_identical_requests(self):
+        """Test BaseModelChat.chat shares upstream calls"""
+        from core.base_chat import BaseModelChat, ModelConfig, ModelProvider, ChatContext
+        import threading
+        import time
+
+        class SlowChat(BaseModelChat):
+            calls = 0
+
+            def _call_api(self, messages, temperature, max_tokens):
+                SlowChat.calls += 1
+                time.sleep(0.1)
+                return "shared"
+
+            def _call_api_stream(self, messages, temperature, max_tokens):
+                yield "shared"
+
+        handler = SlowChat(ModelConfig(name="slow", provider=ModelProvider.LOCAL, model_id="slow-coalesce"))
+        results = []
+
+        def call():
+            results.append(handler.chat(ChatContext(message="hi"), lambda lang: {}).content)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ["shared"] * 4
+        assert SlowChat.calls == 1
+
+
 class TestModelFallbackManager:
     """Tests for ModelFallbackManager"""
     
@@ -468,6 +739,772 @@ class TestAsyncRetryHandler:
         # This is testing the pattern
 
 
+class TestHTTPPool:
+    """Tests for shared provider connection pools"""
+
+    def test_openai_client_is_shared(self):
+        """Test one pooled client per provider key"""
+        from core.http_pool import get_openai_client
+
+        a = get_openai_client('grok', 'test-key', 'https://api.x.ai/v1')
+        b = get_openai_client('grok', 'test-key', 'https://api.x.ai/v1')
+        c = get_openai_client('deepseek', 'test-key', 'https://api.deepseek.com/v1')
+
+        assert a is b
+        assert a is not c
+
+    def test_provider_slot_bounds_concurrency(self):
+        """Test per-provider concurrency limit"""
+        from core import http_pool
+        import threading
+        import time
+
+        http_pool.PROVIDER_CONCURRENCY['test-bounded'] = 2
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def call():
+            nonlocal active, peak
+            with http_pool.provider_slot('test-bounded'):
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                time.sleep(0.05)
+                with lock:
+                    active -= 1
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert peak == 2
+
+    def test_iterate_async_streams_from_background_loop(self):
+        """Test async generators are consumed incrementally from sync code"""
+        from core.http_pool import iterate_async, run_coroutine
+        import asyncio
+
+        async def numbers():
+            for i in range(3):
+                await asyncio.sleep(0.01)
+                yield i
+
+        async def answer():
+            return 42
+
+        assert list(iterate_async(numbers())) == [0, 1, 2]
+        assert run_coroutine(answer()) == 42
+
+
+class TestCompareModels:
+    """Tests for concurrent multi-model fan-out"""
+
+    @staticmethod
+    def collect(models, agent):
+        """Run the fan-out to completion, closing pooled sessions before the loop stops
+
+        Returns the events and the wall time of the fan-out itself.
+        """
+        from core.async_chat import compare_models_stream
+        from core.base_chat import ChatContext
+        from core.http_pool import close_async_clients
+        import asyncio
+        import time
+
+        async def collect():
+            try:
+                return [event async for event in compare_models_stream(
+                    models, ChatContext(message="hi"), agent, None)]
+            finally:
+                await close_async_clients()
+
+        start = time.perf_counter()
+        events = asyncio.run(collect())
+        return events, time.perf_counter() - start
+
+    def test_fan_out_is_concurrent_and_streams_as_arrived(self):
+        """Test results arrive in completion order and run concurrently"""
+        import asyncio
+
+        delays = {'slow': 0.2, 'fast': 0.05, 'mid': 0.1}
+
+        class FakeAgent:
+            async def chat_stream(self, model, ctx, prompts_getter):
+                await asyncio.sleep(delays[model])
+                yield f"{model}-1"
+                yield f"{model}-2"
+
+        events, elapsed = self.collect(list(delays), FakeAgent())
+
+        done = [e for e in events if e['type'] == 'done']
+        assert [e['model'] for e in done] == ['fast', 'mid', 'slow']
+        assert done[0]['response'] == 'fast-1fast-2'
+        assert len([e for e in events if e['type'] == 'chunk']) == 6
+        assert elapsed < sum(delays.values())
+        assert all(e['error'] is None for e in done)
+
+    def test_provider_error_is_reported_in_done_event(self):
+        """Test a failing model ends with its error while the others still complete"""
+        class FakeAgent:
+            async def chat_stream(self, model, ctx, prompts_getter):
+                yield f"{model}-1"
+                if model == 'broken':
+                    raise RuntimeError('rate limited')
+                yield f"{model}-2"
+
+        events, _ = self.collect(['broken', 'ok'], FakeAgent())
+        done = {e['model']: e for e in events if e['type'] == 'done'}
+        assert done['broken']['error'] == 'rate limited'
+        assert done['broken']['response'] == 'broken-1'
+        assert done['ok']['error'] is None and done['ok']['response'] == 'ok-1ok-2'
+
+
+class TestHistoryService:
+    """Tests for the single-query conversation history loader"""
+
+    class FakeCache:
+        """CacheManager stand-in (JSON round trip like Redis)"""
+
+        enabled = True
+
+        def __init__(self):
+            self.data = {}
+
+        def get(self, key):
+            return json.loads(self.data[key]) if key in self.data else None
+
+        def set(self, key, value, ttl=3600):
+            self.data[key] = json.dumps(value)
+            return True
+
+        def delete(self, key):
+            return self.data.pop(key, None) is not None
+
+    class FakeMessageDB:
+        listeners = []
+
+        @classmethod
+        def add_write_listener(cls, listener):
+            cls.listeners.append(listener)
+
+    @pytest.fixture
+    def conversation(self):
+        mongomock = pytest.importorskip('mongomock')
+        from bson import ObjectId
+        from datetime import datetime, timedelta
+
+        db = mongomock.MongoClient().chatbot
+        conversation_id = ObjectId()
+        start = datetime(2024, 1, 1)
+
+        def add(role, content, seconds, parent=None, **extra):
+            return db.messages.insert_one({
+                'conversation_id': conversation_id, 'role': role, 'content': content,
+                'parent_message_id': parent, 'created_at': start + timedelta(seconds=seconds),
+                'metadata': {'model': 'grok'}, **extra
+            }).inserted_id
+
+        for i in range(3):
+            user_id = add('user', f'q{i}', 10 * i)
+            add('assistant', f'a{i}', 10 * i + 1, parent=user_id)
+        # Regenerated answer for the last turn wins; edited user copies are not turns
+        add('assistant', 'a2-regenerated', 25, parent=user_id)
+        add('user', 'q2-edited', 26, parent=user_id, is_edited=True)
+        # Newest question still waiting for its reply
+        add('user', 'pending', 30)
+        return db, str(conversation_id)
+
+    def test_turns_are_joined_in_one_aggregation(self, conversation):
+        """Test turns come back paired, ordered and limited"""
+        from core.history_service import HistoryService
+
+        db, conversation_id = conversation
+        service = HistoryService(lambda: db)
+
+        turns = service.get_turns(conversation_id, limit=10)
+
+        assert [(t['user'], t['assistant']) for t in turns] == [
+            ('q0', 'a0'), ('q1', 'a1'), ('q2', 'a2-regenerated')
+        ]
+        assert turns[0]['model'] == 'grok'
+        assert [t['user'] for t in service.get_turns(conversation_id, limit=2)] == ['q1', 'q2']
+        assert service.get_stats()['queries'] == 2
+
+    def test_legacy_messages_without_parent_links(self):
+        """Test replies saved before parent_message_id still pair up"""
+        mongomock = pytest.importorskip('mongomock')
+        from bson import ObjectId
+        from datetime import datetime, timedelta
+        from core.history_service import HistoryService
+
+        db = mongomock.MongoClient().chatbot
+        conversation_id = ObjectId()
+        start = datetime(2024, 1, 1)
+
+        def add(role, content, seconds, **extra):
+            return db.messages.insert_one({
+                'conversation_id': conversation_id, 'role': role, 'content': content,
+                'created_at': start + timedelta(seconds=seconds),
+                'metadata': {'model': 'grok'}, **extra
+            }).inserted_id
+
+        # Legacy documents: no parent_message_id field at all
+        for i in range(3):
+            add('user', f'old-q{i}', 10 * i)
+            add('assistant', f'old-a{i}', 10 * i + 1)
+        # Written after the change: linked to its question
+        new_q = add('user', 'new-q', 40)
+        add('assistant', 'new-a', 41, parent_message_id=new_q)
+        add('user', 'pending', 50)
+
+        service = HistoryService(lambda: db)
+        turns = service.get_turns(str(conversation_id), limit=10)
+
+        assert [(t['user'], t['assistant']) for t in turns] == [
+            ('old-q0', 'old-a0'), ('old-q1', 'old-a1'), ('old-q2', 'old-a2'), ('new-q', 'new-a')
+        ]
+        assert turns[0]['model'] == 'grok'
+        assert service.get_stats()['legacy_loads'] == 1
+        assert [t['user'] for t in service.get_turns(str(conversation_id), limit=2)] == [
+            'old-q2', 'new-q'
+        ]
+
+    def test_pipeline_uses_lookup_on_parent(self):
+        """Test the join is done server side with $lookup"""
+        from core.history_service import HistoryService
+
+        pipeline = HistoryService.build_pipeline('conv', 5)
+        lookup = next(stage['$lookup'] for stage in pipeline if '$lookup' in stage)
+
+        assert lookup['foreignField'] == 'parent_message_id'
+        assert {'$limit': 5} in pipeline
+
+    def test_cache_hit_and_write_invalidation(self, conversation):
+        """Test cached turns skip the query and message writes invalidate them"""
+        from core.history_service import HistoryService
+
+        db, conversation_id = conversation
+        cache = self.FakeCache()
+        self.FakeMessageDB.listeners = []
+        service = HistoryService(lambda: db, self.FakeMessageDB, cache=cache)
+
+        first = service.get_turns(conversation_id, limit=2)
+        second = service.get_turns(conversation_id, limit=2)
+
+        assert first == second
+        assert service.get_stats()['queries'] == 1
+        assert service.get_stats()['hits'] == 1
+
+        for listener in self.FakeMessageDB.listeners:
+            listener(conversation_id)
+        assert HistoryService.cache_key(conversation_id) not in cache.data
+
+        service.get_turns(conversation_id, limit=2)
+        assert service.get_stats()['queries'] == 2
+
+
+class TestWriteBehindQueue:
+    """Tests for batched, journaled message persistence"""
+
+    @pytest.fixture
+    def db(self):
+        mongomock = pytest.importorskip('mongomock')
+        return mongomock.MongoClient().chatbot
+
+    @staticmethod
+    def make_message(conversation_id, content, tokens=0):
+        from bson import ObjectId
+        from datetime import datetime
+
+        return {
+            '_id': ObjectId(), 'conversation_id': conversation_id, 'role': 'user',
+            'content': content, 'metadata': {'tokens': tokens}, 'created_at': datetime.utcnow()
+        }
+
+    def test_flush_batches_inserts_and_counters(self, db, tmp_path):
+        """Test one flush inserts all messages and increments each conversation once"""
+        from bson import ObjectId
+        from core.message_queue import WriteBehindQueue
+
+        conversation_id = db.conversations.insert_one({'total_messages': 0, 'total_tokens': 0}).inserted_id
+        queue = WriteBehindQueue(lambda: db, tmp_path / 'journal.jsonl', start=False)
+        flushed = []
+        queue.add_flush_listener(flushed.append)
+
+        messages = [queue.enqueue(self.make_message(conversation_id, f'm{i}', tokens=2)) for i in range(5)]
+        assert db.messages.count_documents({}) == 0
+        assert queue.get_stats()['queue_depth'] == 5
+
+        assert queue.flush() == 5
+
+        assert db.messages.count_documents({}) == 5
+        assert db.messages.find_one({'_id': messages[0]['_id']})['content'] == 'm0'
+        conversation = db.conversations.find_one({'_id': conversation_id})
+        assert (conversation['total_messages'], conversation['total_tokens']) == (5, 10)
+        assert flushed == [str(conversation_id)]
+        assert queue.get_stats()['batches'] == 1
+
+    def test_background_flush_on_interval(self, db, tmp_path):
+        """Test queued messages are written without an explicit flush"""
+        import time
+        from bson import ObjectId
+        from core.message_queue import WriteBehindQueue
+
+        queue = WriteBehindQueue(lambda: db, tmp_path / 'journal.jsonl', flush_interval=0.05)
+        try:
+            queue.enqueue(self.make_message(ObjectId(), 'hi'))
+            deadline = time.monotonic() + 2
+            while db.messages.count_documents({}) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert db.messages.count_documents({}) == 1
+            assert queue.get_stats()['flush_latency_ms']['max'] > 0
+        finally:
+            queue.close()
+
+    def test_outage_is_journaled_and_replayed_once(self, db, tmp_path):
+        """Test messages survive a MongoDB outage and replay is idempotent"""
+        from core.message_queue import WriteBehindQueue
+
+        conversation_id = db.conversations.insert_one({'total_messages': 0, 'total_tokens': 0}).inserted_id
+        state = {'down': True}
+
+        def get_db():
+            if state['down']:
+                raise ConnectionError('mongo down')
+            return db
+
+        journal = tmp_path / 'journal.jsonl'
+        queue = WriteBehindQueue(get_db, journal, retry_interval=0, start=False)
+        messages = [queue.enqueue(self.make_message(conversation_id, f'm{i}')) for i in range(3)]
+        queue.flush()
+
+        assert journal.exists()
+        assert queue.get_stats()['journaled'] == 3
+        assert db.messages.count_documents({}) == 0
+
+        # First message made it before the outage was detected: must not be duplicated
+        db.messages.insert_one(messages[0])
+        state['down'] = False
+        queue.flush()
+
+        assert not queue.has_journal()
+        assert db.messages.count_documents({}) == 3
+        assert db.conversations.find_one({'_id': conversation_id})['total_messages'] == 2
+        assert queue.get_stats()['duplicates_skipped'] == 1
+
+    def test_shared_journal_is_replayed_by_one_worker(self, db, tmp_path):
+        """Test two workers replaying one journal apply its counters once"""
+        import threading
+        import time
+        from core.message_queue import WriteBehindQueue
+
+        conversation_id = db.conversations.insert_one({'total_messages': 0, 'total_tokens': 0}).inserted_id
+        journal = tmp_path / 'journal.jsonl'
+
+        def slow_db():
+            time.sleep(0.2)  # keeps the first replay in flight while the second worker starts
+            return db
+
+        workers = [WriteBehindQueue(slow_db, journal, start=False) for _ in range(2)]
+        workers[0]._journal([{'inc': {'conversation_id': conversation_id, 'messages': 1, 'tokens': 3}}] * 20)
+
+        barrier = threading.Barrier(2)
+
+        def replay(worker):
+            barrier.wait()
+            worker._replay_journal()
+
+        threads = [threading.Thread(target=replay, args=(w,)) for w in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        conversation = db.conversations.find_one({'_id': conversation_id})
+        assert (conversation['total_messages'], conversation['total_tokens']) == (20, 60)
+        assert not workers[0].has_journal()
+
+    def test_backpressure_spills_to_journal(self, db, tmp_path):
+        """Test a full queue blocks briefly, then journals instead of dropping"""
+        from bson import ObjectId
+        from core.message_queue import WriteBehindQueue
+
+        journal = tmp_path / 'journal.jsonl'
+        queue = WriteBehindQueue(lambda: db, journal, max_depth=2, block_timeout=0.05, start=False)
+        for i in range(3):
+            queue.enqueue(self.make_message(ObjectId(), f'm{i}'))
+
+        stats = queue.get_stats()
+        assert stats['queue_depth'] == 2
+        assert stats['backpressure_waits'] == 1
+        assert stats['overflowed'] == 1
+        assert len(journal.read_text().splitlines()) == 1
+
+        queue.flush()
+        assert db.messages.count_documents({}) == 3
+
+
+@pytest.fixture
+def make_cache():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    import importlib.util
+
+    # Root src/ shadows the chatbot's src package: load the module by path
+    spec = importlib.util.spec_from_file_location(
+        'chatbot_cache_manager', CHATBOT_DIR / 'src' / 'utils' / 'cache_manager.py')
+    cache_manager = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cache_manager)
+
+    server = fakeredis.FakeServer()
+    created = []
+
+    def from_url(url, decode_responses=False, **kwargs):
+        return fakeredis.FakeRedis(server=server, decode_responses=decode_responses)
+
+    def make_cache(**kwargs):
+        with patch.object(cache_manager.redis, 'from_url', from_url):
+            created.append(cache_manager.CacheManager('redis://fake', **kwargs))
+        return created[-1]
+
+    yield make_cache
+    for cache in created:
+        cache.close()
+
+
+@pytest.fixture
+def cache(make_cache):
+    return make_cache()
+
+
+class TestCacheInvalidation:
+    """Tests for tag-indexed and SCAN-based cache invalidation"""
+
+    def test_invalidate_tags_removes_only_tagged_keys(self, cache):
+        """Test tag invalidation deletes every member and the tag set itself"""
+        cache.DELETE_CHUNK = 3
+        for i in range(10):
+            cache.set(f'a:{i}', i, tags=cache.make_tags(user_id='u1', model='grok'))
+        cache.set('b:0', 0, tags=cache.make_tags(user_id='u2', model='grok'))
+
+        assert cache.invalidate_tags('user:u1') == 10
+        assert cache.get('a:0') is None
+        assert cache.get('b:0') == 0
+        assert not cache.redis_client.exists('tag:user:u1')
+        assert cache.invalidate_tags('user:u1') == 0
+        # Stale members in other tag sets are harmless
+        assert cache.invalidate_model('grok') == 1
+
+    def test_tag_set_outlives_members(self, cache):
+        """Test tag set TTL only ever grows"""
+        cache.set('long', 1, ttl=600, tags=['conv:c1'])
+        cache.set('short', 1, ttl=10, tags=['conv:c1'])
+        assert cache.redis_client.ttl('tag:conv:c1') > 500
+
+    def test_tag_sets_drop_expired_members(self, cache):
+        """Test writes and prune_tags remove members whose keys expired"""
+        for i in range(40):
+            cache.set(f'old:{i}', i, tags=['model:grok'])
+        for i in range(40):
+            cache.redis_client.delete(f'old:{i}')  # as if expired
+        for i in range(40):
+            cache.set(f'new:{i}', i, tags=['model:grok'])
+        members = cache.redis_client.smembers('tag:model:grok')
+        assert {f'new:{i}' for i in range(40)} <= members
+        assert len(members) < 60
+
+        assert cache.prune_tags('model:grok') == len(members) - 40
+        assert cache.redis_client.scard('tag:model:grok') == 40
+        assert cache.prune_tags('model:grok', 'missing') == 0
+
+    def test_delete_pattern_uses_scan(self, cache):
+        """Test pattern deletion never calls KEYS"""
+        for i in range(25):
+            cache.set(f'session:s1:{i}', i)
+        cache.set('session:s2:0', 0)
+        cache.redis_client.keys = Mock(side_effect=AssertionError('KEYS used'))
+
+        assert cache.delete_pattern('session:s1:*') == 25
+        assert cache.get('session:s2:0') == 0
+
+    def test_invalidate_session(self, cache):
+        """Test session invalidation drops history and untagged session keys"""
+        cache.cache_session_history('s1', [{'user': 'hi'}])
+        cache.set('session:s1:draft', 'x')
+        cache.set('session:s2:draft', 'y')
+        cache.cache_ai_response('grok', 'hi', 'casual', 'hello', user_id='u1')
+
+        assert cache.invalidate_session('s1') == 2
+        assert cache.get_session_history('s1') is None
+        assert cache.get('session:s1:draft') is None
+        assert cache.get('session:s2:draft') == 'y'
+        assert cache.get_ai_response('grok', 'hi', 'casual') == 'hello'
+        assert cache.invalidate_user('u1') == 1
+
+
+class TestCacheInvalidator:
+    """Tests for database/utils CacheInvalidator on a raw Redis client"""
+
+    @pytest.fixture
+    def invalidator(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        import importlib.util
+
+        spec = importlib.util.spec_from_file_location(
+            'chatbot_cache_optimizer', CHATBOT_DIR / 'database' / 'utils' / 'cache_optimizer.py')
+        cache_optimizer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cache_optimizer)
+        client = fakeredis.FakeRedis(decode_responses=True)
+        return cache_optimizer, cache_optimizer.CacheInvalidator(client)
+
+    def test_invalidate_user_sweeps_untagged_keys(self, invalidator):
+        """Test user keys written without tags are still invalidated"""
+        module, inv = invalidator
+        keys = module.CacheKeyBuilder
+        inv.cache.set(keys.user_conversations('u1'), '[]')
+        inv.cache.set(keys.build('user', 'u1', 'prefs'), '{}')
+        inv.cache.set(keys.build('user', 'u2', 'prefs'), '{}')
+        inv.cache.set('resp:1', 'x')
+        inv.tag('resp:1', keys.tag('user', 'u1'))
+
+        assert inv.invalidate_user('u1') == 3
+        assert not inv.cache.exists(keys.build('user', 'u1', 'prefs'), 'resp:1')
+        assert inv.cache.exists(keys.build('user', 'u2', 'prefs'))
+        assert inv.invalidate_user('u1') == 0
+
+    def test_keys_tagged_during_invalidation_survive(self, invalidator):
+        """Test the tag set is renamed before its members are swept"""
+        module, inv = invalidator
+        tag = module.CacheKeyBuilder.tag('model', 'grok')
+        for i in range(5):
+            inv.cache.set(f'old:{i}', i)
+            inv.tag(f'old:{i}', tag)
+        sscan_iter = inv.cache.sscan_iter
+
+        def tag_during_sweep(name, **kwargs):
+            inv.cache.set('new:0', 0)
+            inv.tag('new:0', tag)
+            return sscan_iter(name, **kwargs)
+
+        with patch.object(inv.cache, 'sscan_iter', side_effect=tag_during_sweep):
+            assert inv.invalidate_tags(tag) == 5
+        assert inv.cache.smembers(tag) == {'new:0'}
+        assert inv.cache.keys('*invalidating*') == []
+
+
+class TestTwoTierCache:
+    """Tests for the in-process L1 in front of Redis"""
+
+    def test_l1_serves_hot_keys_without_redis(self, cache):
+        """Test repeated reads are answered in process"""
+        cache.cache_sd_models(['a', 'b'])
+        assert cache.get_sd_models() == ['a', 'b']
+
+        cache.value_client.get = Mock(side_effect=AssertionError('Redis round trip'))
+        assert cache.get_sd_models() == ['a', 'b']
+
+        stats = cache.get_tier_stats()
+        assert (stats['l1_hits'], stats['l2_hits']) == (1, 1)
+        assert stats['l1_hit_rate'] == 50.0
+        assert stats['l2_hit_rate'] == 100.0
+
+    def test_l1_values_are_private_copies(self, cache):
+        """Test mutating a returned value does not change what L1 serves next"""
+        turns = [{'role': 'user', 'content': 'hi'}]
+        cache.set('turns', turns)
+        turns[0]['token_counts'] = {'m': 1}
+
+        first = cache.get('turns')
+        first[0]['summarized'] = True
+        assert cache.get('turns') == [{'role': 'user', 'content': 'hi'}]
+        assert cache.get_tier_stats()['l1_hits'] >= 1
+
+    def test_l1_expires(self, make_cache):
+        """Test L1 entries live at most l1_ttl"""
+        import time
+
+        cache = make_cache(l1_ttl=0.05)
+        cache.set('k', 1)
+        cache.get('k')
+        time.sleep(0.06)
+        cache.get('k')
+        assert cache.get_tier_stats()['l2_hits'] == 2
+
+    def test_writes_invalidate_other_workers(self, make_cache):
+        """Test pub/sub keeps every worker's L1 coherent"""
+        import time
+
+        reader, writer = make_cache(), make_cache()
+        time.sleep(0.1)  # let both listeners subscribe
+        writer.set('k', 'old')
+        assert reader.get('k') == 'old'
+
+        def wait_for(expected):
+            deadline = time.monotonic() + 2
+            while reader.get('k') != expected and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return reader.get('k')
+
+        writer.set('k', 'new')
+        assert wait_for('new') == 'new'
+        writer.delete('k')
+        assert wait_for(None) is None
+
+    def test_large_values_are_compressed(self, cache):
+        """Test values over the threshold are stored zlib-compressed"""
+        history = [{'user': 'question ' * 50, 'assistant': 'answer ' * 50}] * 10
+        cache.cache_session_history('s1', history)
+
+        raw = cache.value_client.get('session:s1:history')
+        assert raw.startswith(b'ZLIB:')
+        assert len(raw) < len(json.dumps(history))
+        cache.near_cache.clear()
+        assert cache.get_session_history('s1') == history
+        assert cache.get_tier_stats()['compressed_writes'] == 1
+
+    def test_get_many_and_set_many(self, cache):
+        """Test batched reads hit L1 first and fetch the rest with one MGET"""
+        assert cache.set_many({'a': 1, 'b': {'x': 'y' * 2000}, 'c': [3]}, ttl=60)
+        assert cache.get('a') == 1
+
+        cache.value_client.get = Mock(side_effect=AssertionError('per-key GET'))
+        assert cache.get_many(['a', 'b', 'c', 'missing']) == {'a': 1, 'b': {'x': 'y' * 2000}, 'c': [3]}
+        stats = cache.get_tier_stats()
+        assert (stats['l1_hits'], stats['l2_hits'], stats['misses']) == (1, 3, 1)
+
+
+class TestShardedMetrics:
+    """Tests for per-thread sharded metrics and quantile sketches"""
+
+    @staticmethod
+    def run_threads(target, count):
+        import threading
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_histogram_merges_thread_shards(self):
+        """Test observations from many (finished) threads are all counted"""
+        from utils.metrics import Histogram
+
+        histogram = Histogram('test_seconds', buckets=(1, 2, 5))
+        self.run_threads(lambda: [histogram.observe(v) for v in (0.5, 1, 1.5, 2, 3, 10)], 8)
+        histogram.observe(1)
+
+        data = histogram.get()
+        assert data['count'] == 49
+        assert data['sum'] == 8 * 18.0 + 1
+        # le is inclusive: 1 lands in the 1 bucket
+        assert data['buckets'] == {1: 17, 2: 33, 5: 41, float('inf'): 49}
+        # Shards of exited threads are folded into one
+        assert len(histogram._shards.all()) == 2
+
+    def test_counter_and_reset(self):
+        """Test sharded counter totals and reset"""
+        from utils.metrics import Counter
+
+        counter = Counter('test_total')
+        self.run_threads(lambda: [counter.inc() for _ in range(1000)], 4)
+        assert counter.get() == 4000
+        counter.reset()
+        assert counter.get() == 0
+
+    def test_quantile_sketch_accuracy(self):
+        """Test p50/p95/p99 stay within the relative accuracy"""
+        import random
+        from utils.metrics import QuantileSketch, Summary
+
+        rng = random.Random(7)
+        values = [rng.lognormvariate(0, 2) for _ in range(20000)]
+        summary = Summary('test_latency')
+        for v in values:
+            summary.observe(v)
+
+        values.sort()
+        quantiles = summary.get()['quantiles']
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert abs(quantiles[q] - exact) <= 0.011 * exact
+
+        sketch = QuantileSketch(max_bins=64)
+        for v in values:
+            sketch.add(v)
+        # Bounded: only the lowest bins are collapsed, the top stays accurate
+        assert len(sketch.bins) <= 64
+        assert abs(sketch.quantile(1.0) - values[-1]) <= 0.011 * values[-1]
+
+    def test_labels_in_prometheus_format(self):
+        """Test labeled series are exported with their label sets"""
+        from utils.metrics import Histogram, MetricsRegistry, Summary
+
+        registry = MetricsRegistry()
+        latency = Summary('test_model_latency_seconds', 'latency', labelnames=('model', 'provider'))
+        routes = Histogram('test_route_seconds', 'route', buckets=(1,), labelnames=('route',))
+        registry.register(latency)
+        registry.register(routes)
+        try:
+            latency.labels(model='grok', provider='xai').observe(0.25)
+            routes.labels(route='/chat').observe(0.5)
+            assert latency.labels(model='grok', provider='xai') is latency.labels(provider='xai', model='grok')
+            with pytest.raises(ValueError):
+                latency.labels(model='grok')
+
+            text = registry.prometheus_format()
+            assert '# TYPE test_model_latency_seconds summary' in text
+            assert 'test_model_latency_seconds{model="grok",provider="xai",quantile="0.5"}' in text
+            assert 'test_model_latency_seconds_count{model="grok",provider="xai"} 1' in text
+            assert 'test_route_seconds_bucket{route="/chat",le="+Inf"} 1' in text
+            assert registry.all()['test_route_seconds']['series'][0]['labels'] == {'route': '/chat'}
+        finally:
+            registry._metrics.pop(latency.name)
+            registry._metrics.pop(routes.name)
+
+    def test_dead_shards_are_retired_without_a_scrape(self):
+        """Test a new thread folds the shards of exited threads on registration"""
+        from utils.metrics import Counter
+
+        counter = Counter('test_churn_total')
+        for _ in range(20):
+            self.run_threads(counter.inc, 1)
+        # Only the last thread's shard can still be live
+        assert len(counter._shards._live) <= 1
+        assert counter.get() == 20
+
+    def test_route_and_model_latency_are_observed(self):
+        """Test the Flask hook and provider calls feed the labeled metrics"""
+        from flask import Flask
+        from core.base_chat import BaseModelChat, ModelConfig, ModelProvider
+        from utils.metrics import model_latency, register_route_metrics, route_response_time
+
+        app = Flask(__name__)
+        register_route_metrics(app)
+        app.add_url_rule('/items/<int:item_id>', 'item', lambda item_id: 'ok')
+        before = route_response_time.labels(route='/items/<int:item_id>').get()['count']
+        with app.test_client() as client:
+            client.get('/items/1')
+            client.get('/items/2')
+        assert route_response_time.labels(route='/items/<int:item_id>').get()['count'] == before + 2
+
+        class EchoChat(BaseModelChat):
+            def _call_api(self, messages, temperature, max_tokens):
+                return 'echo'
+
+            def _call_api_stream(self, messages, temperature, max_tokens):
+                yield 'echo'
+
+        chat = EchoChat(ModelConfig(name='latency-unit', provider=ModelProvider.OPENAI, api_key='x',
+                                    model_id='m', coalesce_requests=False))
+        assert chat._request_api([{'role': 'user', 'content': 'hi'}], 0.5, 10) == 'echo'
+        assert model_latency.labels(model='latency-unit', provider='openai').get()['count'] == 1
+
+
 # ============================================================================
 # Integration Tests
 # ============================================================================
@@ -491,6 +1528,54 @@ class TestChatbotIntegration:
         assert ctx.deep_thinking is True
         assert len(ctx.memories) == 1
     
+    def test_history_summary_persists_with_conversation(self):
+        """Test the rolling summary is stored on the conversation and restored on load"""
+        import core.chatbot_v2 as chatbot_v2
+        from core.base_chat import BaseModelChat, ModelConfig, ModelProvider, ContextWindowManager
+
+        ContextWindowManager.register_tokenizer("test-persist", "persist", lambda text: 1000)
+        summaries = []
+
+        class SummaryChat(BaseModelChat):
+            def _call_api(self, messages, temperature, max_tokens):
+                summaries.append(messages[0]['content'])
+                return "summary"
+
+            def _call_api_stream(self, messages, temperature, max_tokens):
+                yield ""
+
+        handler = SummaryChat(ModelConfig(name="s", provider=ModelProvider.LOCAL, model_id="test-persist"))
+        turns = [{"user": f"Msg {i}", "assistant": "ok"} for i in range(4)]
+        stored = {}
+
+        def save(conversation_id, summary, through=None):
+            stored[conversation_id] = {'text': summary, 'through': through}
+            return True
+
+        with patch.object(chatbot_v2, 'MONGODB_ENABLED', True), \
+             patch.object(chatbot_v2, 'HISTORY_SUMMARY_ENABLED', True), \
+             patch.object(chatbot_v2, 'load_conversation_history', lambda cid: [dict(t) for t in turns]), \
+             patch.object(chatbot_v2, 'load_history_summary', lambda cid: stored.get(cid)), \
+             patch.object(chatbot_v2, 'save_history_summary', save):
+            agent = chatbot_v2.ChatbotAgent('conv1')
+            ctx = agent._build_context("next")
+            handler.build_messages(ctx, "system")
+            agent._update_summary(ctx)
+            folded = [bool(m.get('summarized')) for m in agent.conversation_history]
+
+            # A new worker loads the conversation and does not fold the same turns again
+            restored = chatbot_v2.ChatbotAgent('conv1')
+            covered = [bool(m.get('summarized')) for m in restored.conversation_history]
+            ctx = restored._build_context("again")
+            messages = handler.build_messages(ctx, "system")
+
+        assert stored['conv1']['text'] == "summary"
+        assert restored.history_summary == "summary"
+        assert folded == [True, True, True, False]
+        assert covered == folded
+        assert len(summaries) == 1
+        assert messages[1]['content'].endswith("summary")
+
     def test_fallback_chain_configuration(self):
         """Test fallback chain is properly configured"""
         from core.base_chat import DEFAULT_FALLBACK_CHAIN
@@ -530,6 +1615,609 @@ class TestStreamingRoutes:
                 assert parsed['index'] == 1
 
 
+class TestStreamingEngine:
+    """Tests for coalesced, resumable SSE streams"""
+
+    @staticmethod
+    def parse(frames):
+        events = []
+        for frame in frames:
+            fields = dict(line.split(': ', 1) for line in frame.strip().split('\n') if ': ' in line)
+            if 'data' in fields:
+                events.append((fields.get('id'), fields.get('event', 'message'), json.loads(fields['data'])))
+        return events
+
+    def test_deltas_are_coalesced(self):
+        """Test the first delta goes out alone and the rest are merged by size"""
+        from core.streaming import StreamRegistry, StreamingChatHandler
+
+        deltas = ['tok%d ' % i for i in range(200)]
+        session = StreamingChatHandler.start_stream(iter(deltas), model='unit', registry=StreamRegistry(),
+                                                    metadata={'model': 'unit'})
+        events = self.parse(session.events())
+
+        kinds = [kind for _, kind, _ in events]
+        chunks = [data['content'] for _, kind, data in events if kind == 'chunk']
+        assert kinds[0] == 'metadata' and kinds[-1] == 'complete'
+        assert chunks[0] == 'tok0 '
+        assert len(chunks) < len(deltas) / 5
+        assert ''.join(chunks) == ''.join(deltas)
+        complete = events[-1][2]
+        assert complete['total_chunks'] == len(chunks)
+        assert complete['length'] == len(''.join(deltas))
+        assert 'response' not in complete
+
+    def test_reader_flushes_stalled_buffer(self):
+        """Test buffered text is sent after the delay budget even if the provider stalls"""
+        import time
+        from core.streaming import StreamSession
+
+        session = StreamSession('s1', max_chars=1000, max_delay_ms=20)
+        session.push('first')
+        session.push('second')
+        reader = session.events()
+
+        assert json.loads(next(reader).split('data: ')[1])['content'] == 'first'
+        start = time.monotonic()
+        frame = next(reader)
+        assert json.loads(frame.split('data: ')[1])['content'] == 'second'
+        assert time.monotonic() - start < 1
+        assert 'id: s1-2' in frame
+
+    def test_resume_from_last_event_id(self):
+        """Test a reconnecting client gets exactly the events after Last-Event-ID"""
+        from flask import Flask, request
+        from core.streaming import StreamRegistry, StreamingChatHandler, parse_event_id
+
+        registry = StreamRegistry()
+        app = Flask(__name__)
+
+        @app.route('/stream')
+        def stream():
+            session = StreamingChatHandler.start_stream(iter(['a' * 100, 'b' * 100, 'c']), model='unit',
+                                                        registry=registry)
+            return StreamingChatHandler.sse_response(session.events())
+
+        @app.route('/resume')
+        def resume():
+            return StreamingChatHandler.resume_response(request.headers.get('Last-Event-ID'), registry=registry)
+
+        client = app.test_client()
+        first = self.parse(client.get('/stream').get_data(as_text=True).split('\n\n'))
+        assert [kind for _, kind, _ in first] == ['metadata', 'chunk', 'chunk', 'chunk', 'complete']
+
+        last_seen = first[1][0]
+        assert parse_event_id(last_seen) == (first[0][2]['stream_id'], 2)
+        resumed = self.parse(client.get('/resume', headers={'Last-Event-ID': last_seen})
+                             .get_data(as_text=True).split('\n\n'))
+        assert resumed == first[2:]
+
+        missing = client.get('/resume', headers={'Last-Event-ID': 'nope-1'})
+        assert missing.status_code == 404
+
+    def test_finished_streams_expire(self):
+        """Test finished sessions are dropped after the replay TTL"""
+        from core.streaming import StreamRegistry
+
+        registry = StreamRegistry(ttl_seconds=0)
+        session = registry.create()
+        session.finish('complete', {})
+        session.finished_at -= 1
+        assert registry.get(session.stream_id) is None
+
+    def test_latency_metrics_recorded(self):
+        """Test TTFT and inter-token gaps are observed per model"""
+        from core.streaming import StreamRegistry, StreamingChatHandler
+        from utils.metrics import stream_inter_token, stream_ttft
+
+        session = StreamingChatHandler.start_stream(iter(['a', 'b', 'c']), model='metrics-unit',
+                                                    registry=StreamRegistry())
+        list(session.events())
+
+        assert stream_ttft.labels(model='metrics-unit').get()['count'] == 1
+        assert stream_inter_token.labels(model='metrics-unit').get()['count'] == 2
+
+
+@pytest.fixture
+def comfy():
+    pytest.importorskip('aiohttp')
+    from tests.mocks import FakeComfyUIServer
+
+    server = FakeComfyUIServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_job_queue(comfy):
+    import importlib.util
+    from core.image_jobs import ImageJobQueue
+
+    spec = importlib.util.spec_from_file_location(
+        'chatbot_comfyui_client', CHATBOT_DIR / 'src' / 'utils' / 'comfyui_client.py')
+    comfyui_client = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(comfyui_client)
+    created = []
+
+    def make_job_queue(**kwargs):
+        created.append(ImageJobQueue(comfyui_client.ComfyUIClient(comfy.url), **kwargs))
+        return created[-1]
+
+    yield make_job_queue
+    for queue in created:
+        queue.close()
+
+
+def wait_until(predicate, timeout=5.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestImageJobs:
+    """Tests for the ComfyUI job queue against a fake ComfyUI server"""
+
+    def test_submit_returns_immediately_and_completes_over_websocket(self, comfy, make_job_queue):
+        """Test a job is queued at once and finished by the websocket event, without polling"""
+        queue = make_job_queue()
+        job = queue.submit('alice', {'prompt': 'a cat', 'seed': 7})
+        assert job.state in ('queued', 'running')
+
+        assert wait_until(lambda: comfy.prompts)
+        prompt_id = comfy.prompts[0]
+        assert comfy.workflows[prompt_id]['6']['inputs']['text'] == 'a cat'
+        assert comfy.workflows[prompt_id]['4']['inputs']['ckpt_name'] == comfy.MODEL
+
+        comfy.complete(prompt_id)
+        done = queue.wait(job.id, timeout=5)
+        assert done.state == 'done'
+        assert done.image == b'\x89PNG' + f'{prompt_id}.png'.encode()
+        assert done.progress == 1.0
+        assert comfy.calls['history'] == 1 and comfy.calls['ws'] == 1
+
+    def test_per_user_limit_and_priority_lanes(self, comfy, make_job_queue):
+        """Test one user cannot take every slot and interactive jobs overtake batch jobs"""
+        queue = make_job_queue(max_running=2, per_user_running=1)
+        a1 = queue.submit('alice', {'prompt': 'a1'})
+        a2 = queue.submit('alice', {'prompt': 'a2'})
+        b1 = queue.submit('bob', {'prompt': 'b1'}, lane='batch')
+        assert wait_until(lambda: len(comfy.prompts) == 2)
+        assert a2.state == 'queued'
+        assert b1.state == 'running'
+
+        c1 = queue.submit('carol', {'prompt': 'c1'}, lane='batch')
+        d1 = queue.submit('dave', {'prompt': 'd1'})
+        assert queue.position(d1) == 1 and queue.position(c1) == 2
+
+        # bob's slot frees up: alice is still at her limit, so dave (interactive) goes next
+        assert wait_until(lambda: b1.prompt_id)
+        comfy.complete(b1.prompt_id)
+        assert wait_until(lambda: len(comfy.prompts) == 3)
+        assert d1.state == 'running' and c1.state == 'queued' and a2.state == 'queued'
+
+    def test_pending_limit_per_user(self, comfy, make_job_queue):
+        """Test submit is refused once a user has too many unfinished jobs"""
+        from core.image_jobs import JobLimitError
+
+        queue = make_job_queue(max_queued_per_user=2)
+        queue.submit('alice', {'prompt': 'x'})
+        queue.submit('alice', {'prompt': 'y'})
+        with pytest.raises(JobLimitError):
+            queue.submit('alice', {'prompt': 'z'})
+        queue.submit('bob', {'prompt': 'z'})
+
+    def test_missed_completion_is_reconciled(self, comfy, make_job_queue):
+        """Test a prompt whose finish message was lost completes from /history"""
+        queue = make_job_queue(poll_interval=0.2)
+        job = queue.submit('alice', {'prompt': 'quiet'})
+        assert wait_until(lambda: job.prompt_id)
+        comfy.silent.add(job.prompt_id)
+        comfy.complete(job.prompt_id)
+
+        assert queue.wait(job.id, timeout=5).state == 'done'
+        assert queue.get_stats()['reconciled'] == 1
+
+    def test_reconnects_after_socket_drop(self, comfy, make_job_queue):
+        """Test the listener reconnects and later jobs still complete"""
+        queue = make_job_queue()
+        assert wait_until(lambda: comfy.calls['ws'] == 1)
+        comfy.drop_connections()
+        assert wait_until(lambda: comfy.calls['ws'] == 2)
+
+        job = queue.submit('alice', {'prompt': 'again'})
+        assert wait_until(lambda: job.prompt_id)
+        comfy.complete(job.prompt_id)
+        assert queue.wait(job.id, timeout=5).state == 'done'
+
+    def test_execution_error_and_cancel(self, comfy, make_job_queue):
+        """Test ComfyUI errors fail the job and cancel removes queued/running jobs"""
+        queue = make_job_queue(max_running=1)
+        failing = queue.submit('alice', {'prompt': 'bad'})
+        queued = queue.submit('bob', {'prompt': 'later'})
+        assert wait_until(lambda: failing.prompt_id)
+
+        assert queue.cancel(queued.id)
+        assert queued.state == 'cancelled'
+        comfy.complete(failing.prompt_id, error='CUDA out of memory')
+        assert queue.wait(failing.id, timeout=5).error == 'CUDA out of memory'
+
+        running = queue.submit('carol', {'prompt': 'stop me'})
+        assert wait_until(lambda: running.prompt_id)
+        assert queue.cancel(running.id)
+        assert running.state == 'cancelled'
+        assert running.prompt_id in comfy.deleted
+
+    def test_timeout_removes_prompt_from_comfyui(self, comfy, make_job_queue):
+        """Test a timed-out job is deleted and interrupted in ComfyUI, not just released"""
+        queue = make_job_queue(job_timeout=0.3, poll_interval=0.1)
+        assert wait_until(lambda: comfy.calls['ws'] == 1)
+        job = queue.submit('alice', {'prompt': 'stuck'})
+        assert wait_until(lambda: job.prompt_id)
+
+        assert queue.wait(job.id, timeout=5).error == 'Generation timeout'
+        assert job.prompt_id in comfy.deleted
+        assert comfy.interrupted == [job.prompt_id]
+
+    def test_events_stream_progress_until_complete(self, comfy, make_job_queue):
+        """Test the SSE stream reports state changes and ends with the result"""
+        queue = make_job_queue()
+        job = queue.submit('alice', {'prompt': 'sse'})
+        assert wait_until(lambda: job.prompt_id)
+        events = queue.events(job.id)
+        first = next(events)
+        comfy.complete(job.prompt_id)
+        frames = [first] + list(events)
+
+        assert 'event: complete' in frames[-1]
+        final = json.loads(frames[-1].split('data: ')[1])
+        assert final['state'] == 'done' and final['has_image']
+
+
+class RecordingSink:
+    """Image sink with configurable latency and failures"""
+
+    def __init__(self, name, stage='record', latency=0.0, failures=0, timeout=5.0, retries=2):
+        self.name = name
+        self.stage = stage
+        self.latency = latency
+        self.failures = failures
+        self.timeout = timeout
+        self.retries = retries
+        self.records = []
+
+    def put(self, record):
+        import time
+
+        time.sleep(self.latency)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError(f"{self.name} unavailable")
+        self.records.append(record)
+        return f"https://{self.name}/{record['sha256'][:8]}" if self.stage == 'blob' else f"{self.name}-id"
+
+
+class TestContentAddressedImageStore:
+    """Tests for local-first, deduplicated image replication"""
+
+    PNG = b'\x89PNG\r\n' + b'pixels' * 100
+
+    @staticmethod
+    def make_store(tmp_path, sinks, **kwargs):
+        from core.image_storage import ContentAddressedImageStore
+        return ContentAddressedImageStore(tmp_path / 'cas', sinks, backoff=0.01, **kwargs)
+
+    def test_put_returns_before_replication(self, tmp_path):
+        """Test the image is on disk at once and the URL reaches the record sinks"""
+        import base64
+        import hashlib
+        import time
+
+        imgbb = RecordingSink('imgbb', stage='blob', latency=0.3)
+        mongo = RecordingSink('mongodb')
+        store = self.make_store(tmp_path, [imgbb, mongo])
+
+        start = time.monotonic()
+        result = store.put(base64.b64encode(self.PNG).decode(), {'prompt': 'cat'})
+        assert time.monotonic() - start < 0.2
+        assert result['replication'] == 'pending'
+        assert result['sha256'] == hashlib.sha256(self.PNG).hexdigest()
+        assert open(result['local_path'], 'rb').read() == self.PNG
+
+        manifest = store.wait(result['sha256'], timeout=5)
+        assert manifest['url'] == manifest['imgbb_ref'] == f"https://imgbb/{result['sha256'][:8]}"
+        assert mongo.records[0]['url'] == manifest['url']
+        assert mongo.records[0]['metadata'] == {'prompt': 'cat'}
+        store.close()
+
+    def test_repeat_upload_short_circuits(self, tmp_path):
+        """Test identical bytes are neither rewritten nor re-uploaded"""
+        imgbb = RecordingSink('imgbb', stage='blob')
+        store = self.make_store(tmp_path, [imgbb])
+        first = store.put(self.PNG)
+        store.wait(first['sha256'], timeout=5)
+
+        replicated = []
+        second = store.put(self.PNG, on_replicated=replicated.append)
+        assert second['deduplicated'] and second['replication'] == 'complete'
+        assert second['imgbb_ref'] == f"https://imgbb/{first['sha256'][:8]}"
+        assert len(imgbb.records) == 1
+        assert replicated[0]['sha256'] == first['sha256']
+        assert store.get_stats()['deduplicated'] == 1
+        store.close()
+
+    def test_record_sinks_run_concurrently(self, tmp_path):
+        """Test MongoDB and Firebase writes overlap instead of running back to back"""
+        import time
+
+        sinks = [RecordingSink('mongodb', latency=0.3), RecordingSink('firebase', latency=0.3)]
+        store = self.make_store(tmp_path, sinks)
+        start = time.monotonic()
+        store.wait(store.put(self.PNG)['sha256'], timeout=5)
+        assert time.monotonic() - start < 0.5
+        assert all(len(sink.records) == 1 for sink in sinks)
+        store.close()
+
+    def test_retries_timeouts_and_resume(self, tmp_path):
+        """Test flaky sinks are retried, slow ones time out, and only failed sinks run again"""
+        flaky = RecordingSink('mongodb', failures=2)
+        slow = RecordingSink('firebase', latency=0.5, timeout=0.1, retries=0)
+        store = self.make_store(tmp_path, [flaky, slow])
+
+        manifest = store.wait(store.put(self.PNG)['sha256'], timeout=5)
+        assert manifest['sinks']['mongodb'] == {'status': 'ok', 'ref': 'mongodb-id', 'attempts': 3}
+        assert manifest['sinks']['firebase']['status'] == 'error'
+        assert 'timeout' in manifest['sinks']['firebase']['error']
+
+        slow.latency = 0
+        retried = store.put(self.PNG)
+        assert retried['replication'] == 'pending'
+        manifest = store.wait(retried['sha256'], timeout=5)
+        assert manifest['sinks']['firebase']['status'] == 'ok'
+        assert len(flaky.records) == 1
+        store.close()
+
+    def test_records_wait_for_blob_url(self, tmp_path):
+        """Test a failed blob upload leaves record sinks pending instead of storing url=None"""
+        imgbb = RecordingSink('imgbb', stage='blob', failures=1, retries=0)
+        mongo = RecordingSink('mongodb')
+        store = self.make_store(tmp_path, [imgbb, mongo])
+
+        manifest = store.wait(store.put(self.PNG)['sha256'], timeout=5)
+        assert manifest['sinks']['imgbb']['status'] == 'error'
+        assert manifest['sinks']['mongodb']['status'] == 'waiting' and mongo.records == []
+
+        manifest = store.wait(store.put(self.PNG)['sha256'], timeout=5)
+        assert manifest['url'] == f"https://imgbb/{manifest['sha256'][:8]}"
+        assert manifest['sinks']['mongodb']['status'] == 'ok'
+        assert [r['url'] for r in mongo.records] == [manifest['url']]
+        assert store.put(self.PNG)['replication'] == 'complete'
+        store.close()
+
+    def test_stale_records_are_rewritten_with_url(self, tmp_path):
+        """Test records stored with url=None by older versions are written again"""
+        import json
+
+        mongo = RecordingSink('mongodb')
+        store = self.make_store(tmp_path, [RecordingSink('imgbb', stage='blob'), mongo])
+        digest = store.put(self.PNG)['sha256']
+        store.wait(digest, timeout=5)
+        _, manifest_path = store._paths(digest)
+        manifest = json.loads(manifest_path.read_text())
+        manifest['sinks']['mongodb'] = {'status': 'ok', 'ref': 'mongodb-id', 'attempts': 1}
+        manifest_path.write_text(json.dumps(manifest))
+
+        assert store.put(self.PNG)['replication'] == 'pending'
+        store.wait(digest, timeout=5)
+        assert len(mongo.records) == 2 and mongo.records[-1]['url'] == manifest['url']
+        store.close()
+
+    def test_deduplicated_puts_record_every_owner(self, tmp_path):
+        """Test a second session uploading the same bytes is added to the records"""
+        mongo = RecordingSink('mongodb')
+        store = self.make_store(tmp_path, [mongo])
+        digest = store.put(self.PNG, {'session_id': 's1', 'prompt': 'cat'})['sha256']
+        store.wait(digest, timeout=5)
+
+        again = store.put(self.PNG, {'session_id': 's2', 'prompt': 'dog'})
+        assert again['replication'] == 'pending'
+        manifest = store.wait(digest, timeout=5)
+        assert manifest['owners'] == ['s1', 's2']
+        assert manifest['metadata']['prompt'] == 'cat'
+        assert [r['owners'] for r in mongo.records] == [['s1'], ['s1', 's2']]
+        assert store.put(self.PNG, {'session_id': 's1'})['replication'] == 'complete'
+        store.close()
+
+    def test_firebase_sets_created_at_once(self):
+        """Test retried or repeated Firebase writes keep the original created_at"""
+        from core import image_storage
+
+        db = MagicMock()
+        doc_ref = db.collection.return_value.document.return_value
+        record = {'sha256': 'abc', 'url': 'https://imgbb/x', 'metadata': {}, 'owners': ['s1']}
+        with patch.object(image_storage, 'firebase_db', db), \
+                patch.object(image_storage, 'firestore', MagicMock(), create=True):
+            doc_ref.get.return_value.exists = False
+            image_storage.FirebaseSink().put(record)
+            doc_ref.get.return_value.exists = True
+            image_storage.FirebaseSink().put(record)
+
+        first, second = (c.args[0] for c in doc_ref.set.call_args_list)
+        assert 'created_at' in first and 'created_at' not in second
+        assert all(c.kwargs == {'merge': True} for c in doc_ref.set.call_args_list)
+
+    def test_save_image_route_keeps_cloud_url_from_early_callback(self, tmp_path):
+        """Test a replication callback that fires before the route returns is not lost"""
+        import base64
+        from flask import Flask
+        from core import image_storage
+        from routes import images
+
+        def store_now(image_base64, prompt, negative_prompt='', metadata=None, on_replicated=None):
+            on_replicated({'imgbb_ref': 'https://imgbb/early'})
+            return {'success': True, 'imgbb_url': None}
+
+        app = Flask(__name__)
+        app.secret_key = 'test'
+        app.register_blueprint(images.images_bp)
+        with patch.object(images, 'IMAGE_STORAGE_DIR', tmp_path), \
+                patch.object(image_storage, 'store_generated_image', store_now):
+            response = app.test_client().post('/api/save-image', json={
+                'image': base64.b64encode(self.PNG).decode(), 'metadata': {'prompt': 'cat'}})
+
+        assert response.status_code == 200
+        saved = json.loads((tmp_path / response.get_json()['filename']).with_suffix('.json').read_text())
+        assert saved['cloud_url'] == 'https://imgbb/early'
+        assert saved['session_id']
+
+    def test_store_generated_image_keeps_result_shape(self, tmp_path):
+        """Test the legacy entry point returns at once with the same keys"""
+        import base64
+        from core import image_storage
+
+        store = self.make_store(tmp_path, [RecordingSink('imgbb', stage='blob', latency=0.2)])
+        with patch.object(image_storage, '_store', store):
+            result = image_storage.store_generated_image(
+                base64.b64encode(self.PNG).decode(), 'a prompt', metadata={'model': 'x'})
+        assert result['success'] and result['imgbb_url'] is None
+        assert {'mongodb_id', 'firebase_id', 'sha256', 'local_path'} <= set(result)
+        manifest = store.wait(result['sha256'], timeout=5)
+        assert manifest['metadata']['prompt'] == 'a prompt' and manifest['metadata']['model'] == 'x'
+        store.close()
+
+
+class TestUploadProcessor:
+    """Tests for spooled, concurrent and cached upload extraction"""
+
+    @staticmethod
+    def upload(data, filename='doc.pdf'):
+        import io
+        from werkzeug.datastructures import FileStorage
+        return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+    @staticmethod
+    def make_processor(tmp_path, extract, **kwargs):
+        from core.uploads import UploadProcessor
+        return UploadProcessor(extract, spool_dir=str(tmp_path), **kwargs)
+
+    def test_spool_hashes_while_copying(self, tmp_path):
+        """Test uploads are copied in chunks with the SHA-256 computed on the way"""
+        import hashlib
+        import io
+        from core.uploads import spool_upload
+
+        data = b'%PDF-1.4 ' * 5000
+        spooled = spool_upload(io.BytesIO(data), 'Report.PDF', str(tmp_path), chunk_size=4096)
+        assert spooled.sha256 == hashlib.sha256(data).hexdigest()
+        assert spooled.size == len(data) and spooled.suffix == '.pdf'
+        assert spooled.path.read_bytes() == data
+
+    def test_extractions_run_concurrently(self, tmp_path):
+        """Test three slow extractions overlap and the spool files are removed"""
+        import time
+
+        def extract(data, filename):
+            time.sleep(0.3)
+            return True, f"{filename}: {len(data)} bytes"
+
+        processor = self.make_processor(tmp_path, extract, max_workers=3)
+        start = time.monotonic()
+        results = processor.process([self.upload(bytes([i]) * 1000, f"f{i}.pdf") for i in range(3)])
+        assert time.monotonic() - start < 0.8
+        assert [r.content for r in results] == ['f0.pdf: 1000 bytes', 'f1.pdf: 1000 bytes', 'f2.pdf: 1000 bytes']
+        assert all(r.status == 'done' for r in results)
+        assert list(tmp_path.iterdir()) == []
+        processor.close()
+
+    def test_same_content_is_extracted_once(self, tmp_path):
+        """Test duplicates in one request join the running extraction and later ones hit the cache"""
+        calls = []
+
+        def extract(data, filename):
+            calls.append(filename)
+            return True, 'text'
+
+        processor = self.make_processor(tmp_path, extract)
+        first = processor.process([self.upload(b'same', 'a.pdf'), self.upload(b'same', 'b.pdf')])
+        second = processor.process([self.upload(b'same', 'renamed.pdf')])
+        assert [r.content for r in first + second] == ['text'] * 3
+        assert len(calls) == 1
+        assert second[0].cached
+        stats = processor.get_stats()
+        assert stats['extractions'] == 1 and stats['cache_hits'] + stats['joined'] == 2
+        assert list(tmp_path.iterdir()) == []
+        processor.close()
+
+    def test_budget_returns_partial_results(self, tmp_path):
+        """Test slow files come back pending and are cached once they finish"""
+        import threading
+
+        release = threading.Event()
+
+        def extract(data, filename):
+            if filename == 'scan.png':
+                release.wait(5)
+            return True, f"text of {filename}"
+
+        processor = self.make_processor(tmp_path, extract)
+        results = processor.process([self.upload(b'fast', 'notes.txt'), self.upload(b'slow', 'scan.png')],
+                                    budget=0.2)
+        assert [(r.filename, r.status) for r in results] == [('notes.txt', 'done'), ('scan.png', 'pending')]
+        assert processor.get_stats()['pending_at_budget'] == 1
+
+        release.set()
+        wait_until(lambda: processor.get_stats()['inflight'] == 0)
+        [again] = processor.process([self.upload(b'slow', 'scan.png')], budget=0)
+        assert again.status == 'done' and again.cached and again.content == 'text of scan.png'
+        processor.close()
+
+    def test_pending_uploads_are_handed_to_the_next_message(self, tmp_path):
+        """Test a file that missed the budget is returned once to its owner after it finishes"""
+        import threading
+
+        release = threading.Event()
+
+        def extract(data, filename):
+            release.wait(5)
+            return True, f"text of {filename}"
+
+        processor = self.make_processor(tmp_path, extract)
+        [pending] = processor.process([self.upload(b'slow', 'scan.png')], budget=0.1, owner='conv-1')
+        assert pending.status == 'pending'
+        assert processor.take_finished('conv-1') == []  # still running: stays deferred
+        assert processor.get_stats()['deferred'] == 1
+
+        release.set()
+        wait_until(lambda: processor.get_stats()['inflight'] == 0)
+        assert processor.take_finished('conv-2') == []
+        [finished] = processor.take_finished('conv-1')
+        assert (finished.filename, finished.status, finished.content) == ('scan.png', 'done', 'text of scan.png')
+        assert pending.status == 'pending'
+        assert processor.take_finished('conv-1') == []
+        assert processor.get_stats()['deferred_delivered'] == 1
+        processor.close()
+
+    def test_failures_are_not_cached(self, tmp_path):
+        """Test failed or raising extractions are reported and retried next time"""
+        outcomes = [RuntimeError('ocr down'), (False, ''), (True, 'recovered')]
+
+        def extract(data, filename):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        processor = self.make_processor(tmp_path, extract)
+        statuses = [processor.process([self.upload(b'img', 'a.jpg')])[0].status for _ in range(3)]
+        assert statuses == ['failed', 'failed', 'done']
+        assert processor.get_stats()['failures'] == 2
+        processor.close()
+
+
 class TestErrorHandlingConsistency:
     """Tests for consistent error handling"""
     
@@ -0,0 +1,127 @@
+"""
+Tests for the ring-buffer and Redis-backed sliding-window rate limiters
+"""
+
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class TestRingBufferRateLimiter:
+    """Tests for the in-memory RateLimiter internals."""
+
+    def test_window_slides(self):
+        """Test that slots free up as requests age out of the window."""
+        from src.utils.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=2, window_seconds=0.2)
+        assert limiter.is_allowed("k") == (True, 1)
+        assert limiter.is_allowed("k") == (True, 0)
+        assert limiter.is_allowed("k") == (False, 0)
+        assert 0 < limiter.get_reset_time("k") <= 0.2
+
+        time.sleep(0.25)
+
+        assert limiter.get_remaining("k") == 2
+        assert limiter.is_allowed("k") == (True, 1)
+
+    def test_sweep_evicts_idle_keys(self):
+        """Test that idle keys are dropped by the periodic sweep."""
+        from src.utils.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=5, window_seconds=0.05, sweep_interval=0.05)
+        for i in range(100):
+            limiter.is_allowed(f"client-{i}")
+        assert len(limiter) == 100
+
+        time.sleep(0.1)
+        limiter.is_allowed("fresh")
+
+        assert len(limiter) == 1
+
+    def test_concurrent_requests_never_exceed_limit(self):
+        """Test that striped locking keeps the count exact under threads."""
+        from src.utils.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=50, window_seconds=60)
+        allowed = []
+
+        def worker():
+            for _ in range(20):
+                allowed.append(limiter.is_allowed("shared")[0])
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert allowed.count(True) == 50
+
+
+class TestRedisRateLimiter:
+    """Tests for RedisRateLimiter against fakeredis."""
+
+    @pytest.mark.parametrize("algorithm", ["sliding_window", "gcra"])
+    def test_limit_is_shared_between_instances(self, algorithm):
+        """Test that two workers with their own limiter share one quota."""
+        from src.utils.rate_limiter import RedisRateLimiter
+
+        server = fakeredis.FakeServer()
+        worker_a = RedisRateLimiter(fakeredis.FakeRedis(server=server), 3, 60, algorithm=algorithm)
+        worker_b = RedisRateLimiter(fakeredis.FakeRedis(server=server), 3, 60, algorithm=algorithm)
+
+        results = [worker_a.is_allowed("ip"), worker_b.is_allowed("ip"), worker_a.is_allowed("ip")]
+
+        assert [r[0] for r in results] == [True, True, True]
+        assert worker_b.is_allowed("ip") == (False, 0)
+        assert worker_a.get_remaining("ip") == 0
+        assert worker_b.get_reset_time("ip") > 0
+        assert worker_a.is_allowed("other")[0] is True
+
+    @pytest.mark.parametrize("algorithm", ["sliding_window", "gcra"])
+    def test_reset_and_expiry(self, algorithm):
+        """Test reset and that requests age out of the window."""
+        from src.utils.rate_limiter import RedisRateLimiter
+
+        limiter = RedisRateLimiter(fakeredis.FakeRedis(), 2, 0.2, algorithm=algorithm)
+        limiter.is_allowed("k")
+        limiter.is_allowed("k")
+        assert limiter.is_allowed("k")[0] is False
+
+        limiter.reset("k")
+        assert limiter.is_allowed("k")[0] is True
+
+        time.sleep(0.25)
+        assert limiter.get_remaining("k") == 2
+
+    def test_falls_back_when_redis_is_down(self):
+        """Test that Redis errors degrade to the in-memory limiter."""
+        from src.utils.rate_limiter import RedisRateLimiter
+
+        server = fakeredis.FakeServer()
+        limiter = RedisRateLimiter(fakeredis.FakeRedis(server=server), 2, 60)
+        server.connected = False
+
+        assert limiter.is_allowed("k") == (True, 1)
+        assert limiter.is_allowed("k") == (True, 0)
+        assert limiter.is_allowed("k") == (False, 0)
+
+    def test_unknown_algorithm(self):
+        """Test that an unknown algorithm is rejected."""
+        from src.utils.rate_limiter import RedisRateLimiter
+
+        with pytest.raises(ValueError):
+            RedisRateLimiter(fakeredis.FakeRedis(), algorithm="leaky")
+
+    def test_create_rate_limiter_without_redis(self, monkeypatch):
+        """Test the factory falls back to in-memory without a reachable Redis."""
+        from src.utils.rate_limiter import RateLimiter, create_rate_limiter
+
+        monkeypatch.delenv("RATE_LIMIT_REDIS_URL", raising=False)
+        monkeypatch.delenv("REDIS_URL", raising=False)
+        assert isinstance(create_rate_limiter(5, 60), RateLimiter)
+        assert isinstance(create_rate_limiter(5, 60, redis_url="redis://127.0.0.1:1/0"), RateLimiter)
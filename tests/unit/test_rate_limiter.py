@@ -0,0 +1,127 @@
+"""
+Tests for token-bucket Rate Limiter
+"""
+
+import asyncio
+import threading
+import time
+
+
+class TestRateLimiter:
+    """Tests for the token-bucket RateLimiter."""
+
+    def test_try_acquire_is_non_blocking(self):
+        """Test that try_acquire never waits and respects capacity."""
+        from config.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=3, time_window=60)
+
+        start = time.monotonic()
+        results = [limiter.try_acquire() for _ in range(5)]
+
+        assert results == [True, True, True, False, False]
+        assert time.monotonic() - start < 0.05
+        assert limiter.get_stats()['available_requests'] == 0
+
+    def test_wait_if_needed_refills(self):
+        """Test that waiting returns once a token is refilled."""
+        from config.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=2, time_window=0.2)
+        limiter.wait_if_needed()
+        limiter.wait_if_needed()
+
+        waited = limiter.wait_if_needed()
+
+        assert 0.05 < waited < 0.3
+        assert limiter.get_stats()['throttled'] == 1
+
+    def test_async_acquire(self):
+        """Test the asyncio-compatible acquire."""
+        from config.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=1, time_window=0.1)
+
+        async def run():
+            await limiter.acquire()
+            return await limiter.acquire()
+
+        assert asyncio.run(run()) > 0
+
+    def test_retry_after_blocks_and_backs_off(self):
+        """Test that a 429 with Retry-After blocks the bucket and halves the rate."""
+        from config.rate_limiter import RateLimiter
+
+        limiter = RateLimiter(max_requests=10, time_window=1)
+        limiter.update_from_response(429, {'Retry-After': '2'})
+
+        stats = limiter.get_stats()
+        assert limiter.try_acquire() is False
+        assert stats['blocked_for'] > 1.5
+        assert stats['rate_per_minute'] == 300
+        assert stats['rate_limited'] == 1
+
+    def test_parse_retry_after(self):
+        """Test Retry-After in seconds and as an HTTP date."""
+        from email.utils import formatdate
+        from config.rate_limiter import parse_retry_after
+
+        assert parse_retry_after('5') == 5.0
+        assert parse_retry_after(None) is None
+        assert 8 < parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+class TestMultiKeyRateLimiter:
+    """Tests for MultiKeyRateLimiter key selection."""
+
+    def test_spreads_load_across_keys(self):
+        """Test that the least used key is picked first."""
+        from config.rate_limiter import MultiKeyRateLimiter
+
+        limiter = MultiKeyRateLimiter(num_keys=3, max_requests_per_key=2, time_window=60)
+
+        keys = [limiter.try_acquire_key() for _ in range(7)]
+
+        assert sorted(keys[:6]) == [0, 0, 1, 1, 2, 2]
+        assert keys[6] is None
+
+    def test_rate_limited_key_is_skipped(self):
+        """Test that a key reported as 429 is not selected while blocked."""
+        from config.rate_limiter import MultiKeyRateLimiter
+
+        limiter = MultiKeyRateLimiter(num_keys=2, max_requests_per_key=5, time_window=60)
+        limiter.report_rate_limited(0, retry_after=30)
+
+        assert [limiter.try_acquire_key() for _ in range(3)] == [1, 1, 1]
+
+    def test_no_head_of_line_blocking(self):
+        """Test that threads waiting on an exhausted key do not delay other keys."""
+        from config.rate_limiter import RateLimiter
+
+        slow = RateLimiter(max_requests=1, time_window=0.25)
+        fast = RateLimiter(max_requests=1000, time_window=1)
+        slow.wait_if_needed()
+
+        waiters = [threading.Thread(target=slow.wait_if_needed) for _ in range(4)]
+        for t in waiters:
+            t.start()
+        time.sleep(0.05)
+
+        latencies = []
+
+        def use_fast():
+            for _ in range(50):
+                start = time.monotonic()
+                fast.wait_if_needed()
+                slow.get_stats()
+                latencies.append(time.monotonic() - start)
+
+        workers = [threading.Thread(target=use_fast) for _ in range(4)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        for t in waiters:
+            t.join()
+
+        assert max(latencies) < 0.1
@@ -0,0 +1,155 @@
+"""
+Tests for LLM Response Cache
+"""
+
+import threading
+import time
+
+
+class TestResponseCache:
+    """Tests for the sharded LRU ResponseCache."""
+
+    def test_set_get(self):
+        """Test basic set and get."""
+        from config.response_cache import ResponseCache
+
+        cache = ResponseCache(max_size=10)
+        cache.set("What is AI?", "grok-3", "AI is artificial intelligence", temperature=0.7)
+
+        assert cache.get("What is AI?", "grok-3", temperature=0.7) == "AI is artificial intelligence"
+        assert cache.get("What is AI?", "grok-3", temperature=0.2) is None
+
+    def test_lru_eviction(self):
+        """Test that the least recently used item is evicted."""
+        from config.response_cache import ResponseCache
+
+        cache = ResponseCache(max_size=2, num_shards=1)
+        cache.set("a", "m", "A")
+        cache.set("b", "m", "B")
+        cache.get("a", "m")  # "b" is now least recently used
+        cache.set("c", "m", "C")
+
+        assert cache.get("a", "m") == "A"
+        assert cache.get("b", "m") is None
+        assert cache.get_stats()['evictions'] == 1
+
+    def test_max_bytes_bound(self):
+        """Test that the byte bound evicts and rejects oversized responses."""
+        from config.response_cache import ResponseCache
+
+        overhead = ResponseCache.ENTRY_OVERHEAD_BYTES
+        cache = ResponseCache(max_size=100, max_bytes=2 * (1000 + overhead), num_shards=1)
+        for i in range(5):
+            cache.set(f"p{i}", "m", "x" * 1000)
+        cache.set("huge", "m", "x" * 10000)
+
+        stats = cache.get_stats()
+        assert stats['size'] == 2
+        assert stats['bytes'] <= cache.max_bytes
+        assert cache.get("huge", "m") is None
+
+    def test_ttl_expiration(self):
+        """Test that expired items are not returned."""
+        from config.response_cache import ResponseCache
+
+        cache = ResponseCache(max_size=10, ttl_seconds=0.05)
+        cache.set("p", "m", "r")
+        time.sleep(0.1)
+
+        assert cache.get("p", "m") is None
+        assert cache.get_stats()['expirations'] == 1
+
+    def test_concurrent_access(self):
+        """Test that concurrent get/set keep size and byte accounting consistent."""
+        from config.response_cache import ResponseCache
+
+        cache = ResponseCache(max_size=64, num_shards=4)
+
+        def worker(seed):
+            for i in range(500):
+                key = f"p{(seed * 31 + i) % 200}"
+                if cache.get(key, "m") is None:
+                    cache.set(key, "m", key * 3)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = cache.get_stats()
+        assert stats['hits'] + stats['misses'] == 8 * 500
+        assert stats['size'] <= 64
+        assert stats['bytes'] == sum(item['size'] for _, item in cache._entries())
+
+
+class TestFileBasedCache:
+    """Tests for WAL persistence of FileBasedCache."""
+
+    def test_reload_replays_wal(self, tmp_path):
+        """Test that sets and deletes survive a restart via the WAL."""
+        from config.response_cache import FileBasedCache
+
+        cache = FileBasedCache(cache_dir=str(tmp_path), max_size=100)
+        cache.set("a", "m", "A")
+        cache.set("b", "m", "B")
+        cache.delete("a", "m")
+
+        reloaded = FileBasedCache(cache_dir=str(tmp_path), max_size=100)
+        assert reloaded.get("a", "m") is None
+        assert reloaded.get("b", "m") == "B"
+
+    def test_compaction_truncates_wal(self, tmp_path):
+        """Test that compaction writes a snapshot and empties the WAL."""
+        from config.response_cache import FileBasedCache
+
+        cache = FileBasedCache(cache_dir=str(tmp_path), max_size=100, compact_min_records=5)
+        for i in range(12):
+            cache.set(f"p{i % 3}", "m", f"r{i}")
+
+        assert cache.snapshot_file.exists()
+        assert cache._wal_records == 2
+
+        reloaded = FileBasedCache(cache_dir=str(tmp_path), max_size=100)
+        assert len(reloaded) == 3
+        assert reloaded.get("p0", "m") == "r9"
+
+    def test_torn_wal_record_is_skipped(self, tmp_path):
+        """Test that a partially written last record does not break loading."""
+        from config.response_cache import FileBasedCache
+
+        cache = FileBasedCache(cache_dir=str(tmp_path), max_size=100)
+        cache.set("a", "m", "A")
+        cache.close()
+        with open(tmp_path / FileBasedCache.WAL_FILE, 'a', encoding='utf-8') as f:
+            f.write('{"op": "set", "k": "tor')
+
+        reloaded = FileBasedCache(cache_dir=str(tmp_path), max_size=100)
+        assert reloaded.get("a", "m") == "A"
+
+    def test_migrates_legacy_json(self, tmp_path):
+        """Test that the old llm_responses.json is loaded and converted."""
+        import json
+        import time
+        from config.response_cache import FileBasedCache
+
+        probe = FileBasedCache(cache_dir=str(tmp_path / "probe"))
+        key = probe._make_key("a", "m")
+        legacy = {'cache': {key: {'response': 'A', 'timestamp': time.time(), 'model': 'm'}}, 'hits': 3}
+        (tmp_path / FileBasedCache.LEGACY_FILE).write_text(json.dumps(legacy), encoding='utf-8')
+
+        cache = FileBasedCache(cache_dir=str(tmp_path))
+        assert cache.get("a", "m") == "A"
+        assert not (tmp_path / FileBasedCache.LEGACY_FILE).exists()
+
+    def test_wal_is_opened_on_first_write(self, tmp_path):
+        """Test constructing the cache (e.g. on import) writes nothing to disk"""
+        from config.response_cache import FileBasedCache
+
+        cache_dir = tmp_path / "lazy"
+        cache = FileBasedCache(cache_dir=str(cache_dir), max_size=100)
+        assert not cache_dir.exists()
+
+        cache.set("p", "m", "r")
+        assert (cache_dir / FileBasedCache.WAL_FILE).exists()
+        assert FileBasedCache(cache_dir=str(cache_dir), max_size=100).get("p", "m") == "r"
@@ -0,0 +1,87 @@
+"""
+Tests for the Semantic Response Cache tier
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+VOCAB = ['what', 'is', 'ai', 'artificial', 'intelligence', 'python', 'weather', 'today', 'define']
+
+
+def bag_of_words(text):
+    """Tiny deterministic embedder for tests."""
+    vec = np.zeros(len(VOCAB), dtype=np.float32)
+    for word in text.split():
+        if word in VOCAB:
+            vec[VOCAB.index(word)] += 1
+    return vec
+
+
+@pytest.fixture
+def cache():
+    from config.semantic_cache import SemanticCache
+    return SemanticCache(embed_fn=bag_of_words, threshold=0.8)
+
+
+class TestSemanticCache:
+    """Tests for SemanticCache."""
+
+    def test_normalize_prompt(self):
+        """Test punctuation and case are normalized."""
+        from config.semantic_cache import normalize_prompt
+
+        assert normalize_prompt("  What IS   AI?? ") == "what is ai"
+
+    def test_paraphrase_hits(self, cache):
+        """Test that a close paraphrase is served from the cache."""
+        cache.set("What is AI?", "grok|casual", "AI is artificial intelligence")
+
+        assert cache.get("what is AI", "grok|casual") == "AI is artificial intelligence"
+        assert cache.get("python weather today", "grok|casual") is None
+
+        stats = cache.get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_namespaces_are_isolated(self, cache):
+        """Test that entries do not leak across model/context namespaces."""
+        cache.set("What is AI?", "grok|casual", "answer")
+
+        assert cache.get("What is AI?", "openai|casual") is None
+        assert cache.get("What is AI?", "grok|programming") is None
+
+    def test_make_namespace_is_order_independent(self):
+        """Test namespace keys do not depend on kwarg order."""
+        from config.semantic_cache import make_namespace
+
+        assert make_namespace('grok', context='casual', language='vi') == \
+            make_namespace('grok', language='vi', context='casual')
+
+    def test_ring_buffer_bound(self):
+        """Test that a namespace never holds more than its max entries."""
+        from config.semantic_cache import SemanticCache
+
+        cache = SemanticCache(embed_fn=bag_of_words, max_entries_per_namespace=2)
+        for prompt in ["what is ai", "python", "weather today"]:
+            cache.set(prompt, "ns", prompt.upper())
+
+        assert cache.get_stats()['size'] == 2
+        assert cache.get("what is ai", "ns") is None
+        assert cache.get("weather today", "ns") == "WEATHER TODAY"
+
+    def test_shadow_mode_counts_false_hits(self):
+        """Test that shadow mode never serves and flags mismatched answers."""
+        from config.semantic_cache import SemanticCache
+
+        cache = SemanticCache(embed_fn=bag_of_words, threshold=0.8, shadow=True, answer_threshold=0.9)
+        cache.set("what is ai", "ns", "artificial intelligence")
+
+        assert cache.get("what is ai", "ns") is None
+        assert cache.shadow_check("what is ai", "ns", "python weather") is True
+
+        stats = cache.get_stats()
+        assert stats['shadow_hits'] == 1
+        assert stats['shadow_false_hits'] == 1
+        assert stats['shadow_false_hit_rate_percentage'] == 100.0
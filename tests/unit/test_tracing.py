@@ -0,0 +1,170 @@
+"""
+Tests for request tracing (config.tracing)
+"""
+
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+
+
+@pytest.fixture
+def tracer():
+    from config import tracing
+
+    previous = tracing.get_tracer()
+    yield tracing.set_tracer(tracing.Tracer(sample_rate=1.0, buffer_size=10))
+    tracing.set_tracer(previous)
+
+
+class TestTracing:
+    """Tests for spans, sampling and export."""
+
+    def test_sampling_off_returns_noop(self):
+        """Test spans cost nothing and record nothing when sampling is off."""
+        from config import tracing
+
+        previous = tracing.set_tracer(tracing.Tracer(sample_rate=0.0))
+        try:
+            with tracing.span('request') as root:
+                with tracing.span('child') as child:
+                    child.set_attribute('k', 'v')
+            assert root is tracing.NOOP_SPAN and child is tracing.NOOP_SPAN
+            assert tracing.get_tracer().recent() == []
+        finally:
+            tracing.set_tracer(previous)
+
+    def test_nested_spans_form_one_trace(self, tracer):
+        """Test children get the root's trace and their parent's span id."""
+        from config.tracing import span, traced
+
+        @traced('db.save')
+        def save():
+            return 'ok'
+
+        with span('POST /chat', path='/chat'):
+            with span('cache.lookup') as lookup:
+                lookup.set_attribute('hit', False)
+            assert save() == 'ok'
+            with pytest.raises(ValueError):
+                with span('provider.call'):
+                    raise ValueError('boom')
+
+        [trace] = tracer.recent()
+        spans = {s['name']: s for s in trace['spans']}
+        root = spans['POST /chat']
+        assert trace['name'] == 'POST /chat'
+        assert root['parent_id'] is None
+        assert {spans[n]['parent_id'] for n in ('cache.lookup', 'db.save', 'provider.call')} == {root['span_id']}
+        assert spans['cache.lookup']['attributes'] == {'hit': False}
+        assert spans['provider.call']['error'] == 'ValueError: boom'
+
+    def test_unsampled_root_suppresses_children(self, tracer):
+        """Test children of an unsampled request do not start their own traces."""
+        from config.tracing import NOOP_SPAN, span
+
+        tracer.sample_rate = 0.5
+        with patch('config.tracing.random.random', side_effect=[0.9, 0.1]):
+            with span('request'):
+                assert span('child') is NOOP_SPAN
+        assert tracer.recent() == []
+
+    def test_context_propagates_to_threads_and_tasks(self, tracer):
+        """Test wrap_context carries the trace into threads; asyncio tasks inherit it."""
+        from config.tracing import span, wrap_context
+
+        def work():
+            with span('thread.work'):
+                pass
+
+        async def task():
+            with span('task.work'):
+                pass
+
+        async def run_tasks():
+            await asyncio.gather(task(), task())
+
+        with span('request'):
+            thread = threading.Thread(target=wrap_context(work))
+            thread.start()
+            thread.join()
+            asyncio.run(run_tasks())
+
+        [trace] = tracer.recent()
+        assert sorted(s['name'] for s in trace['spans']) == ['request', 'task.work', 'task.work', 'thread.work']
+
+    def test_ring_buffer_is_bounded(self, tracer):
+        """Test only the most recent traces are kept."""
+        from config.tracing import span
+
+        for i in range(15):
+            with span(f'request-{i}'):
+                pass
+
+        traces = tracer.recent(limit=100)
+        assert len(traces) == 10
+        assert traces[0]['name'] == 'request-14'
+
+    def test_otlp_file_export(self, tmp_path):
+        """Test finished traces are written as OTLP/JSON lines."""
+        import time
+        from config import tracing
+
+        path = tmp_path / 'traces.jsonl'
+        previous = tracing.set_tracer(tracing.Tracer(sample_rate=1.0, export_path=str(path)))
+        try:
+            with tracing.span('request', route='/chat'):
+                with tracing.span('child', tokens=3):
+                    pass
+            deadline = time.monotonic() + 2
+            while not path.exists() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            tracing.set_tracer(previous)
+
+        record = json.loads(path.read_text().splitlines()[0])
+        spans = record['resourceSpans'][0]['scopeSpans'][0]['spans']
+        assert len(spans) == 2
+        child = next(s for s in spans if s['name'] == 'child')
+        assert len(child['traceId']) == 32 and len(child['spanId']) == 16
+        assert child['attributes'] == [{'key': 'tokens', 'value': {'intValue': '3'}}]
+        assert child['parentSpanId'] == next(s for s in spans if s['name'] == 'request')['spanId']
+
+    def test_response_cache_get_is_traced(self, tracer):
+        """Test ResponseCache.get records a span with the hit flag."""
+        from config.response_cache import ResponseCache
+        from config.tracing import span
+
+        cache = ResponseCache(max_size=10)
+        cache.set('hi', 'grok', 'hello')
+        with span('request'):
+            cache.get('hi', 'grok')
+
+        [trace] = tracer.recent()
+        [lookup] = [s for s in trace['spans'] if s['name'] == 'cache.response.get']
+        assert lookup['attributes'] == {'model': 'grok', 'hit': True}
+
+    def test_debug_traces_endpoint(self, tracer):
+        """Test every request gets a root span and /debug/traces lists them."""
+        from flask import Flask
+        from config.tracing import register_tracing, span
+
+        app = Flask(__name__)
+        register_tracing(app)
+
+        @app.route('/chat')
+        def chat():
+            with span('provider.call'):
+                return 'ok'
+
+        client = app.test_client()
+        assert client.get('/chat').data == b'ok'
+
+        data = client.get('/debug/traces?limit=5').get_json()
+        names = [t['name'] for t in data['traces']]
+        assert names[-1] == 'GET /chat'
+        chat_trace = data['traces'][-1]
+        assert [s['name'] for s in chat_trace['spans']] == ['GET /chat', 'provider.call']
+        assert data['stats']['sampled'] >= 1
@@ -191,6 +191,21 @@ class TestPerformanceMonitor:
         assert stats.max == 0.3
         assert abs(stats.avg - 0.2) < 0.001
     
+    def test_timing_stats_percentiles(self):
+        """Test percentiles use a bounded reservoir."""
+        import random
+        from src.utils.performance import TimingStats
+        
+        random.seed(0)
+        stats = TimingStats()
+        for i in range(10000):
+            stats.add(i / 10000)
+        
+        assert len(stats.samples) == TimingStats.RESERVOIR_SIZE
+        assert abs(stats.percentile(50) - 0.5) < 0.05
+        assert abs(stats.percentile(99) - 0.99) < 0.02
+        assert {'p50_ms', 'p95_ms', 'p99_ms'} <= set(stats.to_dict())
+    
     def test_performance_monitor_timing(self):
         """Test performance monitor timing."""
         from src.utils.performance import PerformanceMonitor